@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+bench_rules.py — rules.rule_matches vs rule_engine.CompiledRuleSet on real invoices.
+
+Loads the rules table and the most recent parsed invoices from Supabase
+(SUPABASE_URL / SUPABASE_SERVICE_ROLE_KEY), or from JSON dumps, evaluates
+every rule against every invoice both ways, fails if any result differs,
+and prints timings.
+
+  python bench_rules.py --invoices 2000
+  python bench_rules.py --rules-json rules.json --invoices-json invoices.json --repeat 5
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+from rule_engine import CompiledRuleSet
+from rules import rule_matches
+
+RULES_TABLE = os.getenv("RULES_TABLE", "invoice_alert_rules")
+PARSED_TABLE = os.getenv("PARSED_TABLE", "parsed_invoices")
+
+
+def _line_items(raw: Any) -> List[Dict[str, Any]]:
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except Exception:
+            return []
+    return [x for x in raw if isinstance(x, dict)] if isinstance(raw, list) else []
+
+
+def _load(args: argparse.Namespace):
+    if args.rules_json and args.invoices_json:
+        with open(args.rules_json) as f:
+            rules = json.load(f)
+        with open(args.invoices_json) as f:
+            invoices = json.load(f)
+    else:
+        from supa import safe_select_many
+
+        rules = safe_select_many(RULES_TABLE, "*", limit=2000)
+        invoices = []
+        last_id = None
+        while len(invoices) < args.invoices:
+            page = safe_select_many(
+                PARSED_TABLE,
+                "id, document_id, vendor_name, vendor_normalized, invoice_number, airport_code, "
+                "tail_number, doc_type, review_required, total, line_items",
+                gt={"id": last_id} if last_id else None,
+                order="id",
+                limit=min(1000, args.invoices - len(invoices)),
+            )
+            invoices.extend(page)
+            if len(page) < 1000:
+                break
+            last_id = page[-1]["id"]
+    for inv in invoices:
+        inv["line_items"] = _line_items(inv.get("line_items"))
+    return rules, invoices
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--invoices", type=int, default=1000, help="parsed invoices to load from Supabase")
+    ap.add_argument("--rules-json")
+    ap.add_argument("--invoices-json")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    rules, invoices = _load(args)
+    enabled = [r for r in rules if r.get("is_enabled") or (r.get("is_enabled") is None and r.get("enabled"))]
+    line_items = sum(len(inv["line_items"]) for inv in invoices)
+    print(f"{len(rules)} rules ({len(enabled)} enabled), {len(invoices)} invoices, {line_items} line items")
+
+    t0 = time.perf_counter()
+    ruleset = CompiledRuleSet(rules)
+    compile_ms = (time.perf_counter() - t0) * 1000
+    print(f"compile: {compile_ms:.1f} ms, {len(ruleset.automaton.keywords)} distinct keywords")
+
+    # Differential check (every rule, enabled or not).
+    mismatches = 0
+    matched = 0
+    for inv in invoices:
+        got = {id(r): res for r, res in ruleset.match_all(inv, include_disabled=True)}
+        for rule in rules:
+            want = rule_matches(rule, inv)
+            matched += want.matched
+            if got[id(rule)] != want:
+                mismatches += 1
+                if mismatches <= 5:
+                    print(f"MISMATCH rule={rule.get('id')} doc={inv.get('document_id')}\n  want={want}\n  got={got[id(rule)]}")
+    print(f"checked {len(invoices) * len(rules)} rule/invoice pairs, {matched} matches, {mismatches} mismatches")
+
+    def bench(label: str, fn) -> float:
+        best = float("inf")
+        for _ in range(args.repeat):
+            t = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - t)
+        per_inv = best / max(1, len(invoices)) * 1e6
+        print(f"{label:>14}: {best * 1000:8.1f} ms  ({per_inv:7.1f} us/invoice)")
+        return best
+
+    base = bench("rule_matches", lambda: [rule_matches(r, inv) for inv in invoices for r in enabled])
+    fast = bench("compiled", lambda: [ruleset.match_all(inv) for inv in invoices])
+    print(f"speedup: {base / fast:.1f}x")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+fake_slack.py — a local Slack incoming webhook for flush_alerts load tests.
+
+Accepts POSTs on any path, enforces Slack's webhook limit (token bucket,
+--rate per second with --burst) and answers 429 + Retry-After beyond it.
+Optional latency and 5xx failures.  Any GET returns what it received,
+including messages posted more than once (should always be 0).
+
+  python fake_slack.py --port 8099 --rate 1 --burst 4
+  SLACK_WEBHOOK_URL=http://127.0.0.1:8099/hook  ... run invoice-alerts, POST /jobs/flush_alerts
+
+  python fake_slack.py --load 40 --workers 8 --rate 5
+      starts the server in-process and pushes 40 messages through
+      slack_delivery.SlackSender, then prints throughput and the server's view
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Tuple
+
+
+class FakeSlack:
+    """Server-side state: the limiter and what was received.  Thread-safe."""
+
+    def __init__(self, rate: float, burst: int, latency_ms: int = 0, fail_rate: float = 0.0) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.latency_ms = latency_ms
+        self.fail_rate = fail_rate
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._seen: Dict[str, int] = {}
+        self.stats: Dict[str, Any] = {"received": 0, "accepted": 0, "rate_limited": 0, "failed": 0, "duplicates": 0}
+        self.started = time.monotonic()
+
+    def handle(self, body: bytes) -> Tuple[int, Dict[str, str], bytes]:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        with self._lock:
+            self.stats["received"] += 1
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                self.stats["rate_limited"] += 1
+                retry_after = max(1, int((1 - self._tokens) / self.rate + 0.999))
+                return 429, {"Retry-After": str(retry_after)}, b"rate_limited"
+            self._tokens -= 1
+
+            if self.fail_rate and random.random() < self.fail_rate:
+                self.stats["failed"] += 1
+                return 500, {}, b"internal_error"
+
+            try:
+                json.loads(body or b"{}")
+            except ValueError:
+                return 400, {}, b"invalid_payload"
+            digest = hashlib.sha1(body).hexdigest()
+            self._seen[digest] = self._seen.get(digest, 0) + 1
+            if self._seen[digest] > 1:
+                self.stats["duplicates"] += 1
+            self.stats["accepted"] += 1
+            return 200, {}, b"ok"
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            return {**self.stats, "elapsed_s": round(elapsed, 2), "accepted_per_s": round(self.stats["accepted"] / max(elapsed, 1e-9), 2)}
+
+
+def make_server(fake: FakeSlack, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:  # noqa: N802
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            status, headers, out = fake.handle(body)
+            self.send_response(status)
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+
+        def do_GET(self) -> None:  # noqa: N802
+            out = json.dumps(fake.snapshot()).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def _load_test(url: str, args: argparse.Namespace) -> Dict[str, Any]:
+    from slack_delivery import SlackSender
+
+    sender = SlackSender(url, rate_per_s=args.sender_rate or args.rate, burst=args.sender_burst or args.burst)
+    payloads = [{"text": f"load test alert {i}"} for i in range(args.load)]
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        results = list(pool.map(sender.post, payloads))
+    elapsed = time.perf_counter() - t0
+    return {
+        "messages": args.load,
+        "ok": sum(1 for r in results if r.get("ok")),
+        "rate_limited": sum(1 for r in results if r.get("rate_limited")),
+        "errors": sum(1 for r in results if not r.get("ok") and not r.get("rate_limited")),
+        "elapsed_s": round(elapsed, 2),
+        "sent_per_s": round(args.load / elapsed, 2),
+        "sender": sender.stats(),
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8099)
+    ap.add_argument("--rate", type=float, default=1.0, help="accepted messages per second")
+    ap.add_argument("--burst", type=int, default=4)
+    ap.add_argument("--latency-ms", type=int, default=0)
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="fraction of accepted posts answered 500")
+    ap.add_argument("--load", type=int, default=0, help="run an in-process load test with this many messages")
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--sender-rate", type=float, default=0.0, help="SlackSender rate (default: --rate)")
+    ap.add_argument("--sender-burst", type=int, default=0, help="SlackSender burst (default: --burst)")
+    args = ap.parse_args()
+
+    fake = FakeSlack(args.rate, args.burst, args.latency_ms, args.fail_rate)
+    server = make_server(fake, args.host, 0 if args.load else args.port)
+
+    if not args.load:
+        print(f"fake slack webhook on http://{args.host}:{server.server_port}/hook (GET / for stats)", flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    report = _load_test(f"http://{args.host}:{server.server_port}/hook", args)
+    report["server"] = fake.snapshot()
+    server.shutdown()
+    print(json.dumps(report, indent=2))
+    return 1 if report["server"]["duplicates"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
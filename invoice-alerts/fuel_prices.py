@@ -7,13 +7,17 @@
 # Heuristic: a line item is "per-gallon" if its quantity matches the fuel
 # line's gallon count (±1% tolerance). Flat fees (qty=1, UOM=EACH) are
 # excluded from the effective price.
+#
+# Batch callers (backfill) compare against price_index.FuelPriceIndex
+# instead of querying per invoice, and write with store_fuel_prices() in one
+# upsert.  Store listeners (the index) see every row written here.
 
 import json
 import logging
 import re
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional
 
-from supa import safe_insert, safe_select_many, safe_select_one, safe_upsert
+from supa import safe_insert, safe_select_many, safe_select_one, safe_upsert, safe_upsert_many
 
 log = logging.getLogger(__name__)
 
@@ -236,29 +240,17 @@ def extract_fuel_price(invoice: Dict[str, Any]) -> Optional[Dict[str, Any]]:
 
 # ── Price comparison ─────────────────────────────────────────────────────────
 
+# Columns check_price_increase() compares against.
+_HISTORY_COLS = "effective_price_per_gallon, invoice_date, vendor_name, document_id"
+_HISTORY_DEPTH = 5
 
-def check_price_increase(
-    airport_code: str,
+
+def _compare_to_previous(
+    rows: List[Dict[str, Any]],
     effective_price: float,
-    document_id: Optional[str] = None,
+    document_id: Optional[str],
 ) -> Optional[Dict[str, Any]]:
-    """
-    Compare against the most recent fuel price at the same airport.
-    Returns increase details if >= PRICE_INCREASE_PCT, else None.
-    """
-    airport_code = _normalize_airport(airport_code)
-    if not airport_code:
-        return None
-
-    rows = safe_select_many(
-        FUEL_PRICES_TABLE,
-        "effective_price_per_gallon, invoice_date, vendor_name, document_id",
-        eq={"airport_code": airport_code},
-        order="invoice_date",
-        desc=True,
-        limit=5,
-    )
-
+    """rows: recent prices at the airport, newest invoice_date first."""
     # Filter out the current document if it was already stored
     rows = [r for r in rows if str(r.get("document_id")) != str(document_id)]
 
@@ -285,20 +277,54 @@ def check_price_increase(
     return None
 
 
+def check_price_increase(
+    airport_code: str,
+    effective_price: float,
+    document_id: Optional[str] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Compare against the most recent fuel price at the same airport.
+    Returns increase details if >= PRICE_INCREASE_PCT, else None.
+    """
+    airport_code = _normalize_airport(airport_code)
+    if not airport_code:
+        return None
+
+    rows = safe_select_many(
+        FUEL_PRICES_TABLE,
+        _HISTORY_COLS,
+        eq={"airport_code": airport_code},
+        order="invoice_date",
+        desc=True,
+        limit=_HISTORY_DEPTH,
+    )
+    return _compare_to_previous(rows, effective_price, document_id)
+
+
 # ── Storage ──────────────────────────────────────────────────────────────────
 
+_store_listeners: List[Callable[[List[Dict[str, Any]]], None]] = []
 
-def store_fuel_price(
+
+def add_store_listener(fn: Callable[[List[Dict[str, Any]]], None]) -> None:
+    """Call fn(rows) with the fuel_price_row()s after each successful write."""
+    _store_listeners.append(fn)
+
+
+def _notify_stored(rows: List[Dict[str, Any]]) -> None:
+    for fn in _store_listeners:
+        try:
+            fn(rows)
+        except Exception as e:
+            log.warning("fuel_prices store listener failed: %s", e)
+
+
+def fuel_price_row(
     data: Dict[str, Any],
     increase: Optional[Dict[str, Any]] = None,
-) -> Optional[Dict[str, Any]]:
-    """Upsert a fuel price record.
-
-    Uses ON CONFLICT (document_id) DO UPDATE so re-parsed invoices refresh
-    the fuel_prices row instead of being silently skipped.
-    Returns the upserted row, or None on unexpected failure.
-    """
-    row = {
+) -> Dict[str, Any]:
+    """The fuel_prices row for extracted data (same keys for every row, as bulk upserts need)."""
+    return {
         "document_id": data["document_id"],
         "parsed_invoice_id": data.get("parsed_invoice_id"),
         "airport_code": data.get("airport_code"),
@@ -320,7 +346,49 @@ def store_fuel_price(
         "alert_sent": bool(increase),
     }
 
-    return safe_upsert(FUEL_PRICES_TABLE, row, on_conflict="document_id")
+
+def store_fuel_price(
+    data: Dict[str, Any],
+    increase: Optional[Dict[str, Any]] = None,
+) -> Optional[Dict[str, Any]]:
+    """Upsert a fuel price record.
+
+    Uses ON CONFLICT (document_id) DO UPDATE so re-parsed invoices refresh
+    the fuel_prices row instead of being silently skipped.
+    Returns the upserted row, or None on unexpected failure.
+    """
+    row = fuel_price_row(data, increase)
+    stored = safe_upsert(FUEL_PRICES_TABLE, row, on_conflict="document_id")
+    if stored is not None:
+        _notify_stored([row])
+    return stored
+
+
+def store_fuel_prices(rows: List[Dict[str, Any]]) -> List[str]:
+    """
+    Upsert fuel_price_row() rows in one request (one document_id each).
+    If the batch is rejected, falls back to one upsert per row so a single
+    bad row doesn't sink the rest.  Returns the document_ids that failed.
+    """
+    if not rows:
+        return []
+    try:
+        safe_upsert_many(FUEL_PRICES_TABLE, rows, on_conflict="document_id")
+        _notify_stored(rows)
+        return []
+    except Exception as e:
+        log.warning("fuel_prices bulk upsert of %d rows failed, retrying per row: %s", len(rows), e)
+    failed: List[str] = []
+    for row in rows:
+        try:
+            if safe_upsert(FUEL_PRICES_TABLE, row, on_conflict="document_id") is None:
+                failed.append(str(row["document_id"]))
+        except Exception as e:
+            log.warning("fuel_prices upsert failed for %s: %s", row["document_id"], e)
+            failed.append(str(row["document_id"]))
+    failed_ids = set(failed)
+    _notify_stored([r for r in rows if str(r["document_id"]) not in failed_ids])
+    return failed
 
 
 # ── Audit / diagnostics ──────────────────────────────────────────────────────
@@ -0,0 +1,295 @@
+"""
+Shared Postgres-backed job queue client and consumer loop.
+
+Backed by the job_queue table and its RPCs (invoice-dashboard migration
+20261016_job_queue.sql): enqueue_job, claim_jobs (FOR UPDATE SKIP LOCKED),
+ack_job, fail_job (retry with exponential backoff, dead-letter after
+max_attempts) and extend_jobs (lease heartbeat).  Talks to PostgREST with
+plain requests so it has no dependency on a service's own Supabase client.
+
+The pipeline queues:
+
+    invoice-ingest  --"parse"-->  invoice-parser  --"alerts"-->  invoice-alerts
+
+Usage in each service's main.py:
+
+    from job_queue import JobQueue, Consumer
+    parse_queue = JobQueue("parse")
+    parse_queue.enqueue({"document_id": did}, dedupe_key=did)
+
+    consumer = Consumer(parse_queue, handle_parse_job)   # handler(payload) -> None, raises to retry
+    consumer.start()                                     # background thread, runs until process exit
+    consumer.drain(max_jobs=20, max_seconds=240)         # or: one bounded pass (scheduler fallback)
+
+Env:
+  SUPABASE_URL / SUPABASE_SERVICE_ROLE_KEY
+  JOB_QUEUE_CONCURRENCY     jobs handled at once per consumer (default 2)
+  JOB_QUEUE_VISIBILITY_S    lease per claim, renewed every third of it (default 300)
+  JOB_QUEUE_IDLE_S          longest sleep between empty polls (default 10)
+  JOB_QUEUE_RETRY_BASE_S    first retry delay, doubled per attempt (default 30)
+  JOB_QUEUE_DONE_RETENTION_S  how long done jobs are kept (default 7 days)
+  JOB_QUEUE_PRUNE_INTERVAL_S  how often a consumer prunes older ones (default 3600)
+"""
+
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+
+JOB_QUEUE_CONCURRENCY = max(1, int(os.getenv("JOB_QUEUE_CONCURRENCY", "2")))
+JOB_QUEUE_VISIBILITY_S = int(os.getenv("JOB_QUEUE_VISIBILITY_S", "300"))
+JOB_QUEUE_IDLE_S = float(os.getenv("JOB_QUEUE_IDLE_S", "10"))
+JOB_QUEUE_RETRY_BASE_S = int(os.getenv("JOB_QUEUE_RETRY_BASE_S", "30"))
+JOB_QUEUE_DONE_RETENTION_S = int(os.getenv("JOB_QUEUE_DONE_RETENTION_S", str(7 * 86400)))
+JOB_QUEUE_PRUNE_INTERVAL_S = float(os.getenv("JOB_QUEUE_PRUNE_INTERVAL_S", "3600"))
+
+_MIN_POLL_S = 0.5
+
+
+def worker_id() -> str:
+    """host:pid:random -- unique per consumer, shown in job_queue.locked_by."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class JobQueue:
+    """One named queue.  Thread-safe (one pooled requests.Session)."""
+
+    def __init__(self, name: str, *, url: Optional[str] = None, key: Optional[str] = None, timeout: float = 20) -> None:
+        url = (url or os.environ.get("SUPABASE_URL", "")).strip().rstrip("/")
+        key = (key or os.environ.get("SUPABASE_SERVICE_ROLE_KEY", "")).strip()
+        if not url or not key:
+            raise RuntimeError("Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY env var")
+        self.name = name
+        self.rpc_base = f"{url}/rest/v1/rpc"
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({
+            "apikey": key,
+            "Authorization": f"Bearer {key}",
+            "Content-Type": "application/json",
+        })
+
+    def _rpc(self, fn: str, body: Dict[str, Any]) -> Any:
+        r = self.session.post(f"{self.rpc_base}/{fn}", json=body, timeout=self.timeout)
+        if r.status_code >= 300:
+            raise RuntimeError(f"job_queue {fn} failed {r.status_code}: {(r.text or '')[:500]}")
+        return r.json() if r.content else None
+
+    def enqueue(
+        self,
+        payload: Dict[str, Any],
+        *,
+        dedupe_key: Optional[str] = None,
+        delay_s: int = 0,
+        max_attempts: int = 5,
+    ) -> Optional[int]:
+        """Returns the job id (the existing one when dedupe_key is already queued/running)."""
+        return self._rpc("enqueue_job", {
+            "p_queue": self.name, "p_payload": payload, "p_dedupe_key": dedupe_key,
+            "p_delay_seconds": delay_s, "p_max_attempts": max_attempts,
+        })
+
+    def claim(self, worker: str, limit: int = 1, visibility_s: int = JOB_QUEUE_VISIBILITY_S) -> List[Dict[str, Any]]:
+        return self._rpc("claim_jobs", {
+            "p_queue": self.name, "p_worker": worker, "p_limit": limit, "p_visibility_seconds": visibility_s,
+        }) or []
+
+    def ack(self, job_id: int, worker: str) -> bool:
+        return bool(self._rpc("ack_job", {"p_id": job_id, "p_worker": worker}))
+
+    def fail(self, job_id: int, worker: str, error: str, base_s: int = JOB_QUEUE_RETRY_BASE_S) -> Optional[str]:
+        """Returns 'queued' (will retry), 'dead', or None if the lease was already lost."""
+        return self._rpc("fail_job", {"p_id": job_id, "p_worker": worker, "p_error": error, "p_base_seconds": base_s})
+
+    def extend(self, job_ids: List[int], worker: str, visibility_s: int = JOB_QUEUE_VISIBILITY_S) -> List[int]:
+        return self._rpc("extend_jobs", {
+            "p_ids": job_ids, "p_worker": worker, "p_visibility_seconds": visibility_s,
+        }) or []
+
+    def requeue_dead(self, limit: int = 100) -> int:
+        return int(self._rpc("requeue_dead_jobs", {"p_queue": self.name, "p_limit": limit}) or 0)
+
+    def prune_done(self, older_than_s: int = JOB_QUEUE_DONE_RETENTION_S, limit: int = 1000) -> int:
+        return int(self._rpc("prune_done_jobs", {
+            "p_queue": self.name, "p_older_than_seconds": older_than_s, "p_limit": limit,
+        }) or 0)
+
+    def stats(self) -> Dict[str, int]:
+        return self._rpc("job_queue_stats", {"p_queue": self.name}) or {}
+
+
+class Consumer:
+    """
+    Claims jobs as handler slots free up and runs handler(payload) on a
+    bounded pool: return = ack, raise = fail (retry/dead-letter).  Leases of
+    in-flight jobs are extended every visibility_s / 3, and old done jobs
+    are pruned every JOB_QUEUE_PRUNE_INTERVAL_S.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        handler: Callable[[Dict[str, Any]], Any],
+        *,
+        concurrency: int = JOB_QUEUE_CONCURRENCY,
+        visibility_s: int = JOB_QUEUE_VISIBILITY_S,
+        idle_s: float = JOB_QUEUE_IDLE_S,
+    ) -> None:
+        self.queue = queue
+        self.handler = handler
+        self.concurrency = concurrency
+        self.visibility_s = visibility_s
+        self.idle_s = idle_s
+        self.worker = worker_id()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"queue-{queue.name}")
+        self._lock = threading.Lock()
+        self._in_flight: Dict[int, Future] = {}
+        self._last_extend = 0.0
+        self._last_prune = 0.0
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"claimed": 0, "acked": 0, "retried": 0, "dead": 0, "pruned": 0, "errors": 0}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._stats, "queue": self.queue.name, "in_flight": len(self._in_flight),
+                "running": self._thread is not None and self._thread.is_alive(), "worker": self.worker,
+            }
+
+    def _bump(self, key: str) -> None:
+        with self._lock:
+            self._stats[key] += 1
+
+    def _run_job(self, job: Dict[str, Any]) -> None:
+        job_id = job["id"]
+        try:
+            self.handler(job.get("payload") or {})
+        except Exception as e:
+            try:
+                outcome = self.queue.fail(job_id, self.worker, repr(e))
+                self._bump("dead" if outcome == "dead" else "retried")
+            except Exception as fail_err:
+                self._bump("errors")
+                print(f"[job_queue:{self.queue.name}] fail({job_id}) error: {fail_err}", flush=True)
+            print(f"[job_queue:{self.queue.name}] job {job_id} failed: {e!r}", flush=True)
+            return
+        try:
+            self.queue.ack(job_id, self.worker)
+            self._bump("acked")
+        except Exception as ack_err:
+            # The lease lapses and the job runs again: handlers must be idempotent.
+            self._bump("errors")
+            print(f"[job_queue:{self.queue.name}] ack({job_id}) error: {ack_err}", flush=True)
+
+    def _reap(self) -> None:
+        with self._lock:
+            for job_id in [j for j, f in self._in_flight.items() if f.done()]:
+                del self._in_flight[job_id]
+
+    def _heartbeat(self) -> None:
+        now = time.monotonic()
+        if now - self._last_extend < self.visibility_s / 3.0:
+            return
+        self._last_extend = now
+        with self._lock:
+            ids = list(self._in_flight)
+        if ids:
+            try:
+                self.queue.extend(ids, self.worker, self.visibility_s)
+            except Exception as e:
+                self._bump("errors")
+                print(f"[job_queue:{self.queue.name}] extend error: {e}", flush=True)
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        if self._last_prune and now - self._last_prune < JOB_QUEUE_PRUNE_INTERVAL_S:
+            return
+        self._last_prune = now
+        try:
+            pruned = self.queue.prune_done()
+        except Exception as e:
+            self._bump("errors")
+            print(f"[job_queue:{self.queue.name}] prune error: {e}", flush=True)
+            return
+        with self._lock:
+            self._stats["pruned"] += pruned
+
+    def _fill(self, max_new: int) -> int:
+        """Claim up to max_new jobs into free slots; returns how many were claimed."""
+        with self._lock:
+            free = min(max_new, self.concurrency - len(self._in_flight))
+        if free <= 0:
+            return 0
+        jobs = self.queue.claim(self.worker, limit=free, visibility_s=self.visibility_s)
+        for job in jobs:
+            fut = self._executor.submit(self._run_job, job)
+            with self._lock:
+                self._in_flight[job["id"]] = fut
+                self._stats["claimed"] += 1
+        return len(jobs)
+
+    def _wait_any(self, timeout: float) -> None:
+        with self._lock:
+            futures = list(self._in_flight.values())
+        if futures:
+            wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+        else:
+            time.sleep(timeout)
+
+    def drain(self, max_jobs: int = 50, max_seconds: float = 240.0) -> Dict[str, Any]:
+        """Run until the queue is empty, max_jobs were claimed or max_seconds passed; waits for in-flight jobs."""
+        deadline = time.monotonic() + max_seconds
+        claimed = 0
+        self._prune()
+        while claimed < max_jobs and time.monotonic() < deadline:
+            self._reap()
+            self._heartbeat()
+            got = self._fill(max_jobs - claimed)
+            claimed += got
+            with self._lock:
+                busy = len(self._in_flight)
+            if not got and not busy:
+                break
+            self._wait_any(_MIN_POLL_S if got else 5.0)
+        while True:
+            self._reap()
+            with self._lock:
+                if not self._in_flight:
+                    break
+            self._heartbeat()
+            self._wait_any(5.0)
+        return {"claimed": claimed, **self.stats()}
+
+    def run_forever(self) -> None:
+        """Poll loop: back off to idle_s while the queue is empty, reset as soon as a job arrives."""
+        sleep_s = _MIN_POLL_S
+        while True:
+            try:
+                self._reap()
+                self._heartbeat()
+                self._prune()
+                got = self._fill(self.concurrency)
+            except Exception as e:
+                self._bump("errors")
+                print(f"[job_queue:{self.queue.name}] poll error: {e}", flush=True)
+                got = 0
+            if got:
+                sleep_s = _MIN_POLL_S
+            else:
+                sleep_s = min(self.idle_s, sleep_s * 2)
+            self._wait_any(sleep_s)
+
+    def start(self) -> None:
+        """Run run_forever() on a daemon thread (idempotent)."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self.run_forever, name=f"queue-consumer-{self.queue.name}", daemon=True,
+            )
+            self._thread.start()
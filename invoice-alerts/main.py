@@ -1,7 +1,9 @@
 # main.py — invoice-alerts
 # Clean, production-lean FastAPI service for:
-#  - creating alert rows from parsed invoices (/jobs/run_alerts, /jobs/run_alerts_next)
-#  - flushing actionable alerts to Slack exactly once (/jobs/flush_alerts)
+#  - creating alert rows from parsed invoices (/jobs/run_alerts, /jobs/run_alerts_next,
+#    /jobs/run_alerts_batch)
+#  - flushing actionable alerts to Slack exactly once (/jobs/flush_alerts, rate limited:
+#    slack_delivery.py, fake_slack.py for load tests)
 #  - browsing actionable alerts/invoices via API (/api/alerts, /api/invoices)
 #
 # Key guarantees:
@@ -14,10 +16,14 @@
 # Anti-spam guarantee:
 #  - flush_alerts uses a CLAIM step (pending->sending) so only 1 runner can send an alert.
 
+import base64
 import json
 import os
 import re
+import threading
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from typing import Any, Dict, List, Optional, Set, Tuple
 
@@ -33,17 +39,34 @@ from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 from slowapi.util import get_remote_address
 
-from rules import rule_matches, _norm
-from supa import safe_insert, safe_select_many, safe_select_one, safe_update, safe_update_where, log_pipeline_run
+from rules import RuleMatchResult, rule_matches, _norm
+from rule_engine import CompiledRuleSet
+from supa import (
+    safe_insert,
+    safe_insert_many,
+    safe_select_in,
+    safe_select_many,
+    safe_select_one,
+    safe_rpc,
+    safe_update,
+    safe_update_where,
+    log_pipeline_run,
+)
 from fuel_prices import (
     extract_fuel_price,
     check_price_increase,
     store_fuel_price,
+    store_fuel_prices,
+    fuel_price_row,
+    _normalize_airport,
     build_fuel_price_slack_payload,
     audit_fuel_extraction,
     FUEL_PRICES_TABLE,
 )
+from price_index import FuelPriceIndex, get_price_index, index_stats
 from auth_middleware import add_auth_middleware
+from job_queue import Consumer, JobQueue
+from slack_delivery import sender_stats, slack_sender
 
 app = FastAPI()
 add_auth_middleware(app)
@@ -57,6 +80,8 @@ app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
 # Tables
 RULES_TABLE = os.getenv("RULES_TABLE", "invoice_alert_rules")
+# Rules are served from memory this long before a version check (rules cache)
+RULES_CACHE_TTL_SEC = int(os.getenv("RULES_CACHE_TTL_SEC", "30"))
 ALERTS_TABLE = os.getenv("ALERTS_TABLE", "invoice_alerts")
 EVENTS_TABLE = os.getenv("EVENTS_TABLE", "invoice_alert_events")
 PARSED_TABLE = os.getenv("PARSED_TABLE", "parsed_invoices")
@@ -66,6 +91,13 @@ DOCS_TABLE = os.getenv("DOCS_TABLE", "documents")
 
 # Slack
 SLACK_WEBHOOK_URL = os.getenv("SLACK_WEBHOOK_URL")
+# flush_alerts: threads rendering payloads (signed URLs) and posting to Slack
+# per call; the send rate itself is capped by slack_delivery's token bucket.
+SLACK_RENDER_WORKERS = max(1, int(os.getenv("SLACK_RENDER_WORKERS", "8")))
+SLACK_SEND_WORKERS = max(1, int(os.getenv("SLACK_SEND_WORKERS", "4")))
+# A 'sending' claim older than this is treated as abandoned (runner crashed
+# mid-batch) and claimed again; keep it well above one flush_alerts call.
+SLACK_CLAIM_LEASE_S = int(os.getenv("SLACK_CLAIM_LEASE_S", "900"))
 
 # Debug
 DEBUG_ERRORS = os.getenv("DEBUG_ERRORS", "0").strip().lower() in ("1", "true", "yes")
@@ -79,6 +111,20 @@ SIGNING_SERVICE_ACCOUNT_EMAIL = os.getenv("SIGNING_SERVICE_ACCOUNT_EMAIL", "").s
 # Documents lookup cache (per Cloud Run instance)
 _DOC_CACHE_TTL_SEC = int(os.getenv("DOC_CACHE_TTL_SEC", "300"))
 _doc_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+_DOC_LOOKUP_COLS = (
+    "id, attachment_filename, gcs_bucket, gcs_path, storage_provider, storage_bucket, "
+    "storage_path, raw_file_url, created_at"
+)
+
+# Fuel price backfill: parsed_invoices per keyset page, and the wall-clock
+# budget for one /jobs/backfill_fuel_prices call (resume with next_cursor).
+FUEL_BACKFILL_PAGE_SIZE = int(os.getenv("FUEL_BACKFILL_PAGE_SIZE", "500"))
+FUEL_BACKFILL_MAX_SECONDS = int(os.getenv("FUEL_BACKFILL_MAX_SECONDS", "240"))
+
+# Most invoices one /jobs/run_alerts_batch call evaluates, and how many ids
+# go into each IN (...) load (keeps the GET URL short)
+ALERTS_BATCH_MAX = int(os.getenv("ALERTS_BATCH_MAX", "200"))
+ALERTS_SELECT_IN_CHUNK = int(os.getenv("ALERTS_SELECT_IN_CHUNK", "100"))
 
 # ---------------------------------------------------------------------
 # Utilities
@@ -165,14 +211,14 @@ def _slack_post(payload: Dict[str, Any]) -> Dict[str, Any]:
         return {"ok": False, "error": "slack_post_failed"}
 
 
-def _record_event(
+def _event_row(
     event_type: str,
     document_id: str,
     payload: Dict[str, Any],
     rule_id: Optional[str] = None,
     parsed_invoice_id: Optional[str] = None,
     slack_ts: Optional[str] = None,
-) -> None:
+) -> Dict[str, Any]:
     row: Dict[str, Any] = {
         "document_id": document_id,
         "fired_at": _utc_now(),
@@ -184,9 +230,27 @@ def _record_event(
         row["parsed_invoice_id"] = parsed_invoice_id
     if slack_ts:
         row["slack_ts"] = slack_ts
+    return row
+
+
+def _record_event(
+    event_type: str,
+    document_id: str,
+    payload: Dict[str, Any],
+    rule_id: Optional[str] = None,
+    parsed_invoice_id: Optional[str] = None,
+    slack_ts: Optional[str] = None,
+) -> None:
+    try:
+        safe_insert(EVENTS_TABLE, _event_row(event_type, document_id, payload, rule_id, parsed_invoice_id, slack_ts))
+    except Exception:
+        return
+
 
+def _record_events(rows: List[Dict[str, Any]]) -> None:
+    """Several _event_row()s in one insert; best-effort like _record_event."""
     try:
-        safe_insert(EVENTS_TABLE, row)
+        safe_insert_many(EVENTS_TABLE, rows, returning=False)
     except Exception:
         return
 
@@ -217,14 +281,7 @@ def _fetch_document_row(document_id: str) -> Dict[str, Any]:
         _doc_cache.pop(document_id, None)
 
     try:
-        doc = (
-            safe_select_one(
-                DOCS_TABLE,
-                "id, attachment_filename, gcs_bucket, gcs_path, storage_provider, storage_bucket, storage_path, raw_file_url, created_at",
-                eq={"id": document_id},
-            )
-            or {}
-        )
+        doc = safe_select_one(DOCS_TABLE, _DOC_LOOKUP_COLS, eq={"id": document_id}) or {}
         _doc_cache[document_id] = (now, doc)
         return doc
     except Exception as e:
@@ -234,6 +291,37 @@ def _fetch_document_row(document_id: str) -> Dict[str, Any]:
         return {}
 
 
+def _fetch_document_rows(document_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    _fetch_document_row for a batch: cached ids are served from the cache,
+    the rest come from one `in` query.  Never throws; misses map to {}.
+    """
+    now = time.time()
+    out: Dict[str, Dict[str, Any]] = {}
+    missing: List[str] = []
+    for did in dict.fromkeys(d for d in document_ids if d):
+        cached = _doc_cache.get(did)
+        if cached and now - cached[0] < _DOC_CACHE_TTL_SEC:
+            out[did] = cached[1] or {}
+        else:
+            missing.append(did)
+    if not missing:
+        return out
+
+    try:
+        rows = safe_select_in(DOCS_TABLE, _DOC_LOOKUP_COLS, "id", missing)
+    except Exception as e:
+        if DEBUG_ERRORS:
+            _record_event("documents_lookup_error", "n/a", {"error": repr(e), "count": len(missing)})
+        rows = []
+    found = {str(r.get("id")): r for r in rows}
+    for did in missing:
+        doc = found.get(did, {})
+        _doc_cache[did] = (now, doc)
+        out[did] = doc
+    return out
+
+
 def _get_runtime_service_account_email() -> Optional[str]:
     """
     Gets the service account email for the Cloud Run revision.
@@ -497,13 +585,18 @@ def _build_slack_alert_payload(
 # ---------------------------------------------------------------------
 
 
+_INVOICE_COLS = (
+    "id, vendor_name, vendor_normalized, airport_code, doc_type, "
+    "tail_number, currency, total, handling_fee, service_fee, surcharge, "
+    "risk_score, review_required, line_items, "
+    "invoice_date, invoice_number"
+)
+
+
 def _fetch_invoice(document_id: str) -> Dict[str, Any]:
     invoice = safe_select_one(
         PARSED_TABLE,
-        "id, vendor_name, vendor_normalized, airport_code, doc_type, "
-        "tail_number, currency, total, handling_fee, service_fee, surcharge, "
-        "risk_score, review_required, line_items, "
-        "invoice_date, invoice_number",
+        _INVOICE_COLS,
         eq={"document_id": document_id},
     )
     if not invoice:
@@ -513,19 +606,90 @@ def _fetch_invoice(document_id: str) -> Dict[str, Any]:
     return invoice
 
 
+_RULES_COLS = (
+    "id, name, is_enabled, enabled, keywords, "
+    "min_handling_fee, min_service_fee, min_surcharge, "
+    "min_total, min_risk_score, require_charged_line_items, "
+    "vendor_normalized_in, doc_type_in, airport_code_in, "
+    "require_review_required, slack_channel, slack_channel_id, slack_channel_name, created_at"
+)
+
+
+class _RulesCache:
+    """
+    Process-wide copy of the rules table and the CompiledRuleSet built from it.
+
+    Served from memory for RULES_CACHE_TTL_SEC; after that one
+    invoice_alert_rules_version() call decides whether to re-download (rule
+    added, edited or deleted) or keep the copy for another TTL.  Without the
+    version RPC (migration not applied) it re-downloads every TTL.  Callers
+    must not mutate the returned rules.
+    """
+
+    def __init__(self, ttl_sec: int) -> None:
+        self.ttl_sec = ttl_sec
+        self._lock = threading.Lock()
+        self._rules: Optional[List[Dict[str, Any]]] = None
+        self._ruleset: Optional[CompiledRuleSet] = None
+        self._version: Optional[str] = None
+        self._checked_at = 0.0
+        self._stats = {"hits": 0, "version_checks": 0, "unchanged": 0, "fetches": 0, "errors": 0}
+
+    def _read_version(self) -> Optional[str]:
+        try:
+            v = safe_rpc("invoice_alert_rules_version")
+            return None if v is None else str(v)
+        except Exception as e:
+            self._stats["errors"] += 1
+            if DEBUG_ERRORS:
+                _record_event("rules_version_error", "n/a", {"error": repr(e)})
+            return None
+
+    def get(self) -> Tuple[List[Dict[str, Any]], CompiledRuleSet]:
+        with self._lock:
+            now = time.time()
+            if self._rules is not None and now - self._checked_at < self.ttl_sec:
+                self._stats["hits"] += 1
+                return self._rules, self._ruleset  # type: ignore[return-value]
+
+            version = self._read_version()
+            if self._rules is not None:
+                self._stats["version_checks"] += 1
+                if version is not None and version == self._version:
+                    self._stats["unchanged"] += 1
+                    self._checked_at = now
+                    return self._rules, self._ruleset  # type: ignore[return-value]
+
+            rules = safe_select_many(RULES_TABLE, _RULES_COLS, limit=2000) or []
+            self._stats["fetches"] += 1
+            self._rules, self._ruleset = rules, CompiledRuleSet(rules)
+            self._version, self._checked_at = version, time.time()
+            return self._rules, self._ruleset
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._rules, self._ruleset, self._version = None, None, None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._stats,
+                "rules": len(self._rules) if self._rules is not None else None,
+                "version": self._version,
+                "age_s": int(time.time() - self._checked_at) if self._rules is not None else None,
+                "ttl_s": self.ttl_sec,
+            }
+
+
+_rules_cache = _RulesCache(RULES_CACHE_TTL_SEC)
+
+
 def _fetch_rules() -> List[Dict[str, Any]]:
-    return (
-        safe_select_many(
-            RULES_TABLE,
-            "id, name, is_enabled, enabled, keywords, "
-            "min_handling_fee, min_service_fee, min_surcharge, "
-            "min_total, min_risk_score, require_charged_line_items, "
-            "vendor_normalized_in, doc_type_in, airport_code_in, "
-            "require_review_required, slack_channel, slack_channel_id, slack_channel_name, created_at",
-            limit=2000,
-        )
-        or []
-    )
+    return _rules_cache.get()[0]
+
+
+def _compiled_rules() -> CompiledRuleSet:
+    return _rules_cache.get()[1]
 
 
 # ---------------------------------------------------------------------
@@ -541,6 +705,10 @@ def health() -> Dict[str, Any]:
         "ts": _utc_now(),
         "debug": DEBUG_ERRORS,
         "slack_configured": bool(SLACK_WEBHOOK_URL),
+        "alerts_queue": alerts_consumer.stats(),
+        "fuel_price_index": index_stats(),
+        "rules_cache": _rules_cache.stats(),
+        "slack_senders": sender_stats(),
     }
 
 
@@ -600,213 +768,332 @@ def debug_alerts(document_id: str) -> Dict[str, Any]:
 # Jobs
 # ---------------------------------------------------------------------
 
+# The "Fee Overcharge" rule is evaluated exclusively by the TypeScript
+# check-overcharges route (compares charged vs published FBO rates).  Skip
+# it here so the Python runner doesn't match every invoice with zero filter
+# criteria.
+TS_ONLY_RULE_IDS = {
+    "3ed2d1a9-7fb1-4a5a-9fba-5b4e7ae41dd8",  # Fee Overcharge
+}
 
-@app.post("/jobs/run_alerts")
-def run_alerts(document_id: str) -> Dict[str, Any]:
+def _evaluate_alerts(
+    document_id: str,
+    invoice: Dict[str, Any],
+    ruleset: CompiledRuleSet,
+) -> Tuple[List[Tuple[Dict[str, Any], RuleMatchResult, Dict[str, Any]]], int]:
     """
-    Runs all enabled rules against a single parsed invoice.
+    The actionable alerts for one invoice, without writing anything:
+    ([(rule, result, alert_row)], number of rules evaluated).
+    """
+    alerts: List[Tuple[Dict[str, Any], RuleMatchResult, Dict[str, Any]]] = []
+    evaluated = 0
 
-    Idempotent: unique(rule_id, parsed_invoice_id)
+    # Track line items already covered by a prior rule to prevent
+    # overlapping rules (e.g. "De-ice", "De-icing", "De-icing related")
+    # from each creating a separate alert for the same line item.
+    claimed_line_items: Set[str] = set()
 
-    Creates ONLY actionable alerts (fee_name present AND fee_amount > 0).
-    If a legacy duplicate exists, upgrades it in-place instead of skipping forever.
-    """
-    try:
-        invoice = _fetch_invoice(document_id)
-        rules = _fetch_rules()
+    # One keyword scan of the invoice for all enabled rules (rule_engine.py).
+    for rule, result in ruleset.match_all(invoice):
+        if rule.get("id") in TS_ONLY_RULE_IDS:
+            continue
 
-        matched_alerts = 0
-        evaluated = 0
-        matched_rules: List[Dict[str, Any]] = []
+        evaluated += 1
 
-        # Track line items already covered by a prior rule to prevent
-        # overlapping rules (e.g. "De-ice", "De-icing", "De-icing related")
-        # from each creating a separate alert for the same line item.
-        claimed_line_items: Set[str] = set()
-
-        # The "Fee Overcharge" rule is evaluated exclusively by the
-        # TypeScript check-overcharges route (compares charged vs published
-        # FBO rates).  Skip it here so the Python runner doesn't match every
-        # invoice with zero filter criteria.
-        TS_ONLY_RULE_IDS = {
-            "3ed2d1a9-7fb1-4a5a-9fba-5b4e7ae41dd8",  # Fee Overcharge
-        }
+        if not result.matched:
+            continue
 
-        for rule in rules:
-            if not _is_rule_enabled(rule):
-                continue
+        # Determine actionable fee using matched line items
+        fee_probe = _pick_fee_details(
+            result.matched_line_items or [],
+            fallback_fee_name=rule.get("name"),
+            invoice=invoice,
+            rule_name=rule.get("name"),
+            charged_only=True,
+        )
 
-            if rule.get("id") in TS_ONLY_RULE_IDS:
-                continue
+        fee_name = (fee_probe.get("fee_name") or "").strip() or None
+        fee_amount = _to_float(fee_probe.get("fee_amount"))
 
-            evaluated += 1
+        # ACTIONABLE ONLY
+        if not fee_name or fee_amount is None or fee_amount <= 0:
+            continue
 
-            result = rule_matches(rule, invoice)
-            if not result.matched:
-                continue
+        # NET WAIVERS: if a waiver/credit line item offsets this fee, skip
+        all_line_items = invoice.get("line_items") or []
+        fee_amount = _net_after_waivers(
+            fee_amount, result.matched_line_items or [], all_line_items
+        )
+        if fee_amount <= 0:
+            continue
 
-            # Determine actionable fee using matched line items
-            fee_probe = _pick_fee_details(
-                result.matched_line_items or [],
-                fallback_fee_name=rule.get("name"),
-                invoice=invoice,
-                rule_name=rule.get("name"),
-                charged_only=True,
-            )
+        # DEDUP: skip if all matched line items were already claimed
+        # by a prior rule (prevents overlapping rules like "De-ice" /
+        # "De-icing" / "De-icing related" from each alerting).
+        li_keys = set()
+        for li in (result.matched_line_items or []):
+            desc = _norm(li.get("description") or li.get("name") or "")
+            amt = str(_to_float(li.get("total")) or 0)
+            li_keys.add(f"{desc}|{amt}")
 
-            fee_name = (fee_probe.get("fee_name") or "").strip() or None
-            fee_amount = _to_float(fee_probe.get("fee_amount"))
+        if li_keys and li_keys.issubset(claimed_line_items):
+            continue
 
-            # ACTIONABLE ONLY
-            if not fee_name or fee_amount is None or fee_amount <= 0:
-                continue
+        # Claim these line items for future dedup
+        claimed_line_items.update(li_keys)
 
-            # NET WAIVERS: if a waiver/credit line item offsets this fee, skip
-            all_line_items = invoice.get("line_items") or []
-            fee_amount = _net_after_waivers(
-                fee_amount, result.matched_line_items or [], all_line_items
-            )
-            if fee_amount <= 0:
-                continue
+        alert_row = {
+            "created_at": _utc_now(),
+            "document_id": document_id,
+            "rule_id": rule.get("id"),
+            "parsed_invoice_id": invoice.get("id"),
+            "status": "pending",
+            "match_reason": result.reason,
+            "match_payload": {
+                "matched_keywords": result.matched_keywords,
+                "matched_line_items": result.matched_line_items,
+                "rule_name": rule.get("name"),
+            },
+            "slack_status": "pending",
+        }
+        alerts.append((rule, result, alert_row))
 
-            # DEDUP: skip if all matched line items were already claimed
-            # by a prior rule (prevents overlapping rules like "De-ice" /
-            # "De-icing" / "De-icing related" from each alerting).
-            li_keys = set()
-            for li in (result.matched_line_items or []):
-                desc = _norm(li.get("description") or li.get("name") or "")
-                amt = str(_to_float(li.get("total")) or 0)
-                li_keys.add(f"{desc}|{amt}")
+    return alerts, evaluated
 
-            if li_keys and li_keys.issubset(claimed_line_items):
-                continue
 
-            # Claim these line items for future dedup
-            claimed_line_items.update(li_keys)
+def _upgrade_alert(
+    document_id: str,
+    invoice: Dict[str, Any],
+    rule: Dict[str, Any],
+    result: RuleMatchResult,
+) -> Optional[Dict[str, Any]]:
+    """
+    An alert for (rule, document) already exists: refresh its match details
+    in place, re-queueing it for Slack only if it hasn't been processed yet.
+    Returns the event row to record (None if the row vanished meanwhile).
+    """
+    try:
+        existing = safe_select_one(
+            ALERTS_TABLE,
+            "id, slack_status, slack_error, match_payload",
+            eq={"rule_id": rule.get("id"), "parsed_invoice_id": invoice.get("id")},
+        ) or {}
 
-            alert_row = {
-                "created_at": _utc_now(),
-                "document_id": document_id,
-                "rule_id": rule.get("id"),
-                "parsed_invoice_id": invoice.get("id"),
-                "status": "pending",
-                "match_reason": result.reason,
-                "match_payload": {
-                    "matched_keywords": result.matched_keywords,
-                    "matched_line_items": result.matched_line_items,
-                    "rule_name": rule.get("name"),
-                },
-                "slack_status": "pending",
+        if not existing.get("id"):
+            return None
+
+        existing_payload = _safe_json_loads(existing.get("match_payload")) or {}
+
+        existing_payload.update(
+            {
+                "rule_name": rule.get("name"),
+                "matched_keywords": result.matched_keywords,
+                "matched_line_items": result.matched_line_items,
             }
+        )
 
-            try:
-                inserted = safe_insert(ALERTS_TABLE, alert_row)
-                if inserted:
-                    matched_alerts += 1
+        fee_probe2 = _pick_fee_details(
+            result.matched_line_items or [],
+            fallback_fee_name=rule.get("name"),
+            invoice=invoice,
+            rule_name=rule.get("name"),
+            charged_only=True,
+        )
 
-                    if DEBUG_ERRORS:
-                        matched_rules.append(
-                            {
-                                "rule_id": rule.get("id"),
-                                "rule_name": rule.get("name"),
-                                "reason": result.reason,
-                                "matched_keywords": result.matched_keywords,
-                                "matched_line_items_count": len(result.matched_line_items or []),
-                            }
-                        )
-
-                    _record_event(
-                        "alert_created",
-                        document_id,
-                        {"rule_id": rule.get("id"), "rule_name": rule.get("name")},
-                        rule_id=rule.get("id"),
-                        parsed_invoice_id=invoice.get("id"),
-                    )
+        fee_name2 = (fee_probe2.get("fee_name") or "").strip() or None
+        fee_amount2 = _to_float(fee_probe2.get("fee_amount"))
+        is_actionable = bool(fee_name2) and fee_amount2 is not None and fee_amount2 > 0
 
-            except Exception as e:
-                msg = repr(e)
-
-                # DUPLICATE → UPGRADE IN PLACE
-                if "23505" in msg or "duplicate key value violates unique constraint" in msg:
-                    try:
-                        existing = safe_select_one(
-                            ALERTS_TABLE,
-                            "id, slack_status, slack_error, match_payload",
-                            eq={"rule_id": rule.get("id"), "parsed_invoice_id": invoice.get("id")},
-                        ) or {}
-
-                        if existing.get("id"):
-                            existing_payload = _safe_json_loads(existing.get("match_payload")) or {}
-
-                            existing_payload.update(
-                                {
-                                    "rule_name": rule.get("name"),
-                                    "matched_keywords": result.matched_keywords,
-                                    "matched_line_items": result.matched_line_items,
-                                }
-                            )
-
-                            fee_probe2 = _pick_fee_details(
-                                result.matched_line_items or [],
-                                fallback_fee_name=rule.get("name"),
-                                invoice=invoice,
-                                rule_name=rule.get("name"),
-                                charged_only=True,
-                            )
-
-                            fee_name2 = (fee_probe2.get("fee_name") or "").strip() or None
-                            fee_amount2 = _to_float(fee_probe2.get("fee_amount"))
-                            is_actionable = bool(fee_name2) and fee_amount2 is not None and fee_amount2 > 0
-
-                            existing_ss = (existing.get("slack_status") or "").strip().lower()
-                            _TERMINAL = {"sent", "ok", "success", "skipped", "error", "sending"}
-                            if existing_ss in _TERMINAL:
-                                # Already processed — don't re-queue or it will send again
-                                new_ss = existing_ss
-                                new_err = existing.get("slack_error")
-                            else:
-                                new_ss = "pending" if is_actionable else existing_ss
-                                new_err = None if is_actionable else existing.get("slack_error")
-
-                            safe_update(
-                                ALERTS_TABLE,
-                                existing["id"],
-                                {
-                                    "match_payload": existing_payload,
-                                    "match_reason": result.reason,
-                                    "slack_status": new_ss,
-                                    "slack_error": new_err,
-                                },
-                            )
-
-                            _record_event(
-                                "alert_upgraded",
-                                document_id,
-                                {"rule_id": rule.get("id"), "rule_name": rule.get("name"), "actionable": is_actionable},
-                                rule_id=rule.get("id"),
-                                parsed_invoice_id=invoice.get("id"),
-                            )
-
-                    except Exception as upgrade_err:
-                        _record_event(
-                            "alert_upgrade_failed",
-                            document_id,
-                            {"rule_id": rule.get("id"), "error": repr(upgrade_err)},
-                            rule_id=rule.get("id"),
-                            parsed_invoice_id=invoice.get("id"),
-                        )
+        existing_ss = (existing.get("slack_status") or "").strip().lower()
+        _TERMINAL = {"sent", "ok", "success", "skipped", "error", "sending"}
+        if existing_ss in _TERMINAL:
+            # Already processed — don't re-queue or it will send again
+            new_ss = existing_ss
+            new_err = existing.get("slack_error")
+        else:
+            new_ss = "pending" if is_actionable else existing_ss
+            new_err = None if is_actionable else existing.get("slack_error")
 
-                    continue
+        safe_update(
+            ALERTS_TABLE,
+            existing["id"],
+            {
+                "match_payload": existing_payload,
+                "match_reason": result.reason,
+                "slack_status": new_ss,
+                "slack_error": new_err,
+            },
+        )
 
-                raise
+        return _event_row(
+            "alert_upgraded",
+            document_id,
+            {"rule_id": rule.get("id"), "rule_name": rule.get("name"), "actionable": is_actionable},
+            rule_id=rule.get("id"),
+            parsed_invoice_id=invoice.get("id"),
+        )
 
-        _record_event(
-            "run_alerts",
+    except Exception as upgrade_err:
+        return _event_row(
+            "alert_upgrade_failed",
             document_id,
-            {"matched_alerts": matched_alerts, "evaluated_rules": evaluated},
+            {"rule_id": rule.get("id"), "error": repr(upgrade_err)},
+            rule_id=rule.get("id"),
             parsed_invoice_id=invoice.get("id"),
         )
 
+
+def _alert_created_event(document_id: str, rule: Dict[str, Any], alert_row: Dict[str, Any]) -> Dict[str, Any]:
+    return _event_row(
+        "alert_created",
+        document_id,
+        {"rule_id": rule.get("id"), "rule_name": rule.get("name")},
+        rule_id=rule.get("id"),
+        parsed_invoice_id=alert_row.get("parsed_invoice_id"),
+    )
+
+
+def _insert_alert(
+    document_id: str,
+    invoice: Dict[str, Any],
+    rule: Dict[str, Any],
+    result: RuleMatchResult,
+    alert_row: Dict[str, Any],
+) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """
+    Insert one alert; a duplicate upgrades the existing row in place.
+    Returns ("created" | "upgraded" | None, event row to record).
+    """
+    try:
+        inserted = safe_insert(ALERTS_TABLE, alert_row)
+    except Exception as e:
+        msg = repr(e)
+
+        # DUPLICATE → UPGRADE IN PLACE
+        if "23505" in msg or "duplicate key value violates unique constraint" in msg:
+            return "upgraded", _upgrade_alert(document_id, invoice, rule, result)
+        raise
+
+    if not inserted:
+        return None, None
+    return "created", _alert_created_event(document_id, rule, alert_row)
+
+
+_AlertCandidate = Tuple[str, Dict[str, Any], Dict[str, Any], RuleMatchResult, Dict[str, Any]]
+
+
+def _write_alerts_rowwise(
+    candidates: List[_AlertCandidate],
+) -> Tuple[List[Optional[str]], List[Dict[str, Any]]]:
+    outcomes: List[Optional[str]] = []
+    events: List[Dict[str, Any]] = []
+    for doc_id, inv, rule, result, row in candidates:
+        try:
+            outcome, event = _insert_alert(doc_id, inv, rule, result, row)
+        except Exception as row_err:
+            outcome, event = None, _event_row(
+                "run_alerts_error", doc_id, {"error": repr(row_err)}, parsed_invoice_id=inv.get("id")
+            )
+        outcomes.append(outcome)
+        if event:
+            events.append(event)
+    return outcomes, events
+
+
+def _write_alerts(
+    candidates: List[_AlertCandidate],
+) -> Tuple[List[Optional[str]], List[Dict[str, Any]]]:
+    """
+    Insert-or-upgrade every (document_id, invoice, rule, result, alert_row)
+    in one upsert_invoice_alerts call; the "don't re-queue a claimed or sent
+    alert" rule is applied in SQL.  Returns the outcome per candidate
+    ("created" | "upgraded" | None) and the events to record.
+
+    If the RPC fails (e.g. the migration isn't applied yet) the alerts go
+    through _insert_alert one at a time instead.
+    """
+    if not candidates:
+        return [], []
+    try:
+        written = safe_rpc("upsert_invoice_alerts", {"p_alerts": [c[4] for c in candidates]}, timeout=60) or []
+    except Exception as e:
+        _record_event("upsert_invoice_alerts_error", candidates[0][0], {"error": repr(e), "alerts": len(candidates)})
+        return _write_alerts_rowwise(candidates)
+
+    by_key = {(str(w.get("rule_id")), str(w.get("document_id"))): w for w in written}
+    outcomes: List[Optional[str]] = []
+    events: List[Dict[str, Any]] = []
+    for doc_id, inv, rule, result, row in candidates:
+        w = by_key.get((str(row.get("rule_id")), doc_id))
+        if w is None:
+            outcomes.append(None)
+        elif w.get("inserted"):
+            outcomes.append("created")
+            events.append(_alert_created_event(doc_id, rule, row))
+        else:
+            outcomes.append("upgraded")
+            events.append(
+                _event_row(
+                    "alert_upgraded",
+                    doc_id,
+                    {
+                        "rule_id": rule.get("id"),
+                        "rule_name": rule.get("name"),
+                        "actionable": True,
+                        "slack_status": w.get("slack_status"),
+                    },
+                    rule_id=rule.get("id"),
+                    parsed_invoice_id=inv.get("id"),
+                )
+            )
+    return outcomes, events
+
+
+@app.post("/jobs/run_alerts")
+def run_alerts(document_id: str) -> Dict[str, Any]:
+    """
+    Runs all enabled rules against a single parsed invoice.
+
+    Idempotent: unique(rule_id, document_id), one upsert_invoice_alerts call
+
+    Creates ONLY actionable alerts (fee_name present AND fee_amount > 0).
+    If a legacy duplicate exists, upgrades it in-place instead of skipping forever.
+    """
+    try:
+        invoice = _fetch_invoice(document_id)
+        ruleset = _compiled_rules()
+
+        matched_alerts = 0
+        matched_rules: List[Dict[str, Any]] = []
+
+        alerts, evaluated = _evaluate_alerts(document_id, invoice, ruleset)
+        outcomes, events = _write_alerts([(document_id, invoice, rule, result, row) for rule, result, row in alerts])
+        for (rule, result, _row), outcome in zip(alerts, outcomes):
+            if outcome != "created":
+                continue
+
+            matched_alerts += 1
+            if DEBUG_ERRORS:
+                matched_rules.append(
+                    {
+                        "rule_id": rule.get("id"),
+                        "rule_name": rule.get("name"),
+                        "reason": result.reason,
+                        "matched_keywords": result.matched_keywords,
+                        "matched_line_items_count": len(result.matched_line_items or []),
+                    }
+                )
+
+        events.append(
+            _event_row(
+                "run_alerts",
+                document_id,
+                {"matched_alerts": matched_alerts, "evaluated_rules": evaluated},
+                parsed_invoice_id=invoice.get("id"),
+            )
+        )
+        _record_events(events)
+
         # --- Fuel price extraction (piggybacks on the same invoice fetch) ---
         fuel_result = None
         try:
@@ -885,219 +1172,426 @@ def run_alerts_next(limit: int = 5, lookback_minutes: int = 240) -> Dict[str, An
         raise HTTPException(status_code=500, detail="run_alerts_next failed")
 
 
-@app.post("/jobs/flush_alerts")
-def flush_alerts(limit: int = 25) -> Dict[str, Any]:
+@app.post("/jobs/run_alerts_batch")
+def run_alerts_batch(
+    limit: int = Query(50, ge=1, le=500),
+    lookback_minutes: int = 240,
+    document_ids: Optional[str] = None,
+) -> Dict[str, Any]:
     """
-    Sends Slack exactly once per alert row by transitioning slack_status:
-      pending -> sending -> sent OR pending -> sending -> error OR pending -> sending -> skipped
+    run_alerts for many invoices at once: the most recent parsed invoices
+    (like /jobs/run_alerts_next), or the comma-separated document_ids.
 
-    The key is the CLAIM step (pending->sending) so only ONE runner can send each alert.
+    One parsed_invoices load, every invoice evaluated in memory against the
+    compiled rules, one upsert_invoice_alerts call, one events insert, one
+    fuel_prices upsert.  Same alerts as run_alerts; reports per-phase timings.
+
+    Safe alongside run_alerts / run_alerts_next: the alert upsert is a
+    single INSERT ... ON CONFLICT (rule_id, document_id), so whichever runner
+    writes first inserts and the other upgrades the row in place (never
+    re-queueing an alert already claimed or sent).
     """
+    started = time.time()
+    timings: Dict[str, int] = {}
+
+    def _phase(name: str, t0: float) -> float:
+        now = time.time()
+        timings[f"{name}_ms"] = int((now - t0) * 1000)
+        return now
+
     try:
-        limit = max(1, min(int(limit), 100))
+        limit = max(1, min(int(limit), ALERTS_BATCH_MAX))
 
-        # Load rules once (needed to self-heal legacy rows)
-        rules = _fetch_rules()
-        rules_by_id: Dict[str, Dict[str, Any]] = {str(r.get("id")): r for r in (rules or [])}
+        t = time.time()
+        if document_ids:
+            ids = list(dict.fromkeys(_csv_values(document_ids)))[:limit]
+        else:
+            since = datetime.now(timezone.utc) - timedelta(minutes=lookback_minutes)
+            rows = safe_select_many(
+                PARSED_TABLE,
+                "document_id, created_at",
+                gte={"created_at": since.strftime("%Y-%m-%dT%H:%M:%SZ")},
+                order="created_at",
+                desc=True,
+                limit=limit,
+            ) or []
+            ids = list(dict.fromkeys(str(r["document_id"]) for r in rows if r.get("document_id")))
+        t = _phase("select", t)
+
+        # One row per document, as _fetch_invoice does.
+        invoices: Dict[str, Dict[str, Any]] = {}
+        for i in range(0, len(ids), ALERTS_SELECT_IN_CHUNK):
+            chunk = ids[i:i + ALERTS_SELECT_IN_CHUNK]
+            for inv in safe_select_in(PARSED_TABLE, f"{_INVOICE_COLS}, document_id, created_at", "document_id", chunk):
+                doc_id = str(inv.get("document_id"))
+                if doc_id not in invoices:
+                    inv["line_items"] = _parse_line_items(inv.get("line_items"))
+                    invoices[doc_id] = inv
+        missing = [d for d in ids if d not in invoices]
+        t = _phase("load", t)
+
+        ruleset = _compiled_rules()
+        t = _phase("rules", t)
+
+        candidates: List[_AlertCandidate] = []
+        evaluated: Dict[str, int] = {}
+        for doc_id, inv in invoices.items():
+            alerts, evaluated[doc_id] = _evaluate_alerts(doc_id, inv, ruleset)
+            candidates.extend((doc_id, inv, rule, result, row) for rule, result, row in alerts)
+        t = _phase("evaluate", t)
+
+        outcomes, events = _write_alerts(candidates)
+        created: Dict[str, int] = {doc_id: 0 for doc_id in invoices}
+        for c, outcome in zip(candidates, outcomes):
+            if outcome == "created":
+                created[c[0]] += 1
+        upgraded = outcomes.count("upgraded")
+        t = _phase("write_alerts", t)
+
+        for doc_id, inv in invoices.items():
+            events.append(
+                _event_row(
+                    "run_alerts",
+                    doc_id,
+                    {"matched_alerts": created[doc_id], "evaluated_rules": evaluated[doc_id], "batch": True},
+                    parsed_invoice_id=inv.get("id"),
+                )
+            )
+        _record_events(events)
+        t = _phase("write_events", t)
 
-        rows = safe_select_many(
-            ALERTS_TABLE,
-            "id, created_at, rule_id, document_id, parsed_invoice_id, status, slack_status, slack_error, match_payload",
-            not_in={"slack_status": ["sent", "sending", "error", "skipped"]},
-            limit=500,
-        ) or []
+        # --- Fuel price extraction (same invoices, one upsert) ---
+        fuel: Dict[str, Any] = {}
+        try:
+            fuel_invoices = [{**inv, "document_id": doc_id} for doc_id, inv in invoices.items()]
+            out = _process_fuel_prices(fuel_invoices, get_price_index())
+            fuel = {
+                "stored": sum(1 for r in out["results"] if r.get("status") == "stored"),
+                "upsert_failed": sum(1 for r in out["results"] if r.get("status") == "upsert_failed"),
+                "no_fuel": out["no_fuel"],
+            }
+        except Exception as fuel_err:
+            # Never let fuel extraction failure break the alerts pipeline
+            _record_event("fuel_extraction_error", "n/a", {"error": repr(fuel_err), "batch": True})
+            fuel = {"error": repr(fuel_err) if DEBUG_ERRORS else "fuel extraction failed"}
+        _phase("fuel", t)
+
+        alerts_created = sum(created.values())
+        timings["total_ms"] = int((time.time() - started) * 1000)
+        log_pipeline_run(
+            "alert-generation",
+            items=alerts_created,
+            message=f"batch ran={len(invoices)} alerts={alerts_created} upgraded={upgraded}",
+            duration_ms=timings["total_ms"],
+        )
+        return {
+            "ok": True,
+            "ran": len(invoices),
+            "missing": missing,
+            "alerts_created": alerts_created,
+            "alerts_upgraded": upgraded,
+            "evaluated_rules": sum(evaluated.values()),
+            "fuel_prices": fuel,
+            "timings": timings,
+        }
 
-        rows = sorted(rows, key=lambda r: str(r.get("created_at") or ""))  # oldest first
+    except HTTPException:
+        raise
+    except Exception as e:
+        _record_event("run_alerts_batch_error", "n/a", {"error": repr(e)})
+        log_pipeline_run("alert-generation", status="error", message=str(e)[:200])
+        if DEBUG_ERRORS:
+            raise HTTPException(status_code=500, detail=f"run_alerts_batch failed: {repr(e)}")
+        raise HTTPException(status_code=500, detail="run_alerts_batch failed")
 
-        sent = 0
-        errored = 0
-        skipped = 0
-        processed: List[Dict[str, Any]] = []
 
-        for a in rows:
-            if sent + errored >= limit:
-                break
+# ---------------------------------------------------------------------
+# Job queue consumer ("alerts" jobs enqueued by invoice-parser, see job_queue.py)
+# ---------------------------------------------------------------------
 
-            alert_id = a.get("id")
-            if not alert_id:
-                continue
+QUEUE_CONSUMER = os.getenv("QUEUE_CONSUMER", "0").strip().lower() in ("1", "true", "yes")
 
-            # --- fast skip ---
-            slack_status = (a.get("slack_status") or "").strip().lower()
-            if slack_status in ("sent", "ok", "success"):
-                continue
-            if slack_status not in ("", "pending", "null"):
-                # includes "error", "skipped", "sending"
-                continue
+alerts_queue = JobQueue("alerts")
 
-            # Normalize legacy null/empty rows to "pending" so the claim step
-            # can match them (claim uses eq slack_status="pending").
-            if slack_status in ("", "null"):
-                try:
-                    safe_update(ALERTS_TABLE, alert_id, {"slack_status": "pending"})
-                    slack_status = "pending"
-                except Exception:
-                    continue
 
-            # ------------------------------------------------------------------
-            # AUTO-HEAL: status says sent, but slack_status is still pending
-            # (this exact mismatch is what causes repeated sends)
-            # ------------------------------------------------------------------
-            if str(a.get("status") or "").lower() == "sent" and slack_status in ("", "pending", "null"):
-                try:
-                    safe_update(ALERTS_TABLE, alert_id, {"slack_status": "sent", "slack_error": None})
-                except Exception:
-                    pass
-                continue
+def handle_alerts_job(payload: Dict[str, Any]) -> None:
+    """run_alerts for one freshly parsed document; raising retries with backoff."""
+    run_alerts(str(payload["document_id"]))
 
-            # ------------------------------------------------------------------
-            # CLAIM: atomically move pending -> sending
-            # If another worker already claimed it, updated will be 0 and we skip.
-            # ------------------------------------------------------------------
-            claimed = 0
-            try:
-                claimed = int(
-                    safe_update_where(
-                        ALERTS_TABLE,
-                        {"slack_status": "sending", "slack_error": None},
-                        eq={"id": alert_id, "slack_status": "pending"},
-                    )
-                )
-            except Exception as e:
-                if DEBUG_ERRORS:
-                    _record_event("flush_claim_error", str(a.get("document_id") or "n/a"), {"error": repr(e), "alert_id": alert_id})
-                continue
 
-            if claimed != 1:
-                continue  # someone else is processing or it changed
+alerts_consumer = Consumer(alerts_queue, handle_alerts_job)
 
-            document_id = a.get("document_id")
-            if not document_id:
-                skipped += 1
-                try:
-                    safe_update(ALERTS_TABLE, alert_id, {"slack_status": "skipped", "slack_error": "missing_document_id"})
-                except Exception:
-                    pass
-                continue
 
-            invoice = _fetch_invoice(document_id)
-            doc = _fetch_document_row(document_id)
+@app.on_event("startup")
+def _start_queue_consumer() -> None:
+    # Long-running consumer; needs an instance that keeps CPU outside
+    # requests (Cloud Run --no-cpu-throttling, min instances >= 1).
+    if QUEUE_CONSUMER:
+        alerts_consumer.start()
 
-            signed_pdf_url = None
-            if doc:
-                signed_pdf_url = _get_gcs_signed_url(doc.get("gcs_bucket") or "", doc.get("gcs_path") or "")
 
-            mp = _safe_json_loads(a.get("match_payload")) or {}
+@app.post("/jobs/drain_queue")
+def drain_queue(
+    max_jobs: int = Query(50, ge=1, le=500),
+    max_seconds: int = Query(240, ge=10, le=3000),
+) -> Dict[str, Any]:
+    """One bounded pass over the "alerts" queue (scheduler-driven fallback to QUEUE_CONSUMER=1)."""
+    return alerts_consumer.drain(max_jobs=max_jobs, max_seconds=max_seconds)
 
-            rule_id = str(a.get("rule_id") or "")
-            rule = rules_by_id.get(rule_id) if rule_id else None
-            rule_name = (mp.get("rule_name") or (rule or {}).get("name") or "Fee")
-            charged_only = bool((rule or {}).get("require_charged_line_items"))
 
-            matched_line_items = mp.get("matched_line_items")
-            if isinstance(matched_line_items, str):
-                matched_line_items = _safe_json_loads(matched_line_items)
-            if not isinstance(matched_line_items, list) or len(matched_line_items) == 0:
-                # Legacy self-heal via rule_matches
-                if rule:
-                    try:
-                        res = rule_matches(rule, invoice)
-                        if res.matched:
-                            matched_line_items = res.matched_line_items or []
-                            try:
-                                new_mp = {**(mp or {})}
-                                new_mp["rule_name"] = rule_name
-                                new_mp["matched_keywords"] = res.matched_keywords
-                                new_mp["matched_line_items"] = matched_line_items
-                                safe_update(ALERTS_TABLE, alert_id, {"match_payload": new_mp})
-                                mp = new_mp
-                            except Exception:
-                                pass
-                        else:
-                            matched_line_items = []
-                    except Exception:
-                        matched_line_items = []
-                else:
-                    matched_line_items = []
+def _render_alert(
+    a: Dict[str, Any],
+    invoice: Optional[Dict[str, Any]],
+    doc: Optional[Dict[str, Any]],
+    rules_by_id: Dict[str, Dict[str, Any]],
+) -> Dict[str, Any]:
+    """
+    Everything flush_alerts does for one claimed alert short of posting it.
 
-            fee = _pick_fee_details(
-                matched_line_items or [],
-                fallback_fee_name=rule_name,
-                invoice=invoice,
-                rule_name=rule_name,
-                charged_only=charged_only,
-            )
-            fee_name = (fee.get("fee_name") or "").strip() or None
-            fee_amount = _to_float(fee.get("fee_amount"))
+    Returns {"id", "document_id", "payload"} ready to send, or a final
+    {"slack_status": "skipped", "slack_error"} for alerts that can't be sent.
+    "match_payload" is set when a legacy row's match was recomputed.
+    """
+    alert_id = a.get("id")
+    document_id = a.get("document_id")
+    out: Dict[str, Any] = {"id": alert_id, "document_id": document_id, "status": a.get("status")}
+    if not document_id:
+        return {**out, "slack_status": "skipped", "slack_error": "missing_document_id"}
+    if not invoice:
+        return {**out, "slack_status": "skipped", "slack_error": "missing_parsed_invoice"}
 
-            # ACTIONABLE ONLY
-            if not fee_name or fee_amount is None or fee_amount <= 0:
-                safe_update(
-                    ALERTS_TABLE,
-                    alert_id,
-                    {
-                        "slack_status": "skipped",
-                        "slack_error": "non_actionable_missing_fee",
-                        "status": a.get("status") or "pending",
-                    },
-                )
-                skipped += 1
-                if DEBUG_ERRORS:
-                    processed.append({"id": alert_id, "document_id": document_id, "slack_status": "skipped"})
-                continue
+    signed_pdf_url = None
+    if doc:
+        signed_pdf_url = _get_gcs_signed_url(doc.get("gcs_bucket") or "", doc.get("gcs_path") or "")
 
-            fbo = invoice.get("vendor_name") or "—"
-            airport = _infer_airport_code(invoice, doc) or "—"
-            tail = invoice.get("tail_number") or "—"
-            currency = invoice.get("currency") or ""
+    mp = _safe_json_loads(a.get("match_payload")) or {}
 
-            slack_payload = _build_slack_alert_payload(
-                document_id=document_id,
-                rule_name=rule_name,
-                fbo=fbo,
-                airport_code=airport,
-                tail_number=tail,
-                fee_name=fee_name,
-                fee_amount=fee_amount,
-                currency=currency,
-                signed_pdf_url=signed_pdf_url,
-            )
+    rule_id = str(a.get("rule_id") or "")
+    rule = rules_by_id.get(rule_id) if rule_id else None
+    rule_name = (mp.get("rule_name") or (rule or {}).get("name") or "Fee")
+    charged_only = bool((rule or {}).get("require_charged_line_items"))
 
-            slack_res = _slack_post(slack_payload)
+    matched_line_items = mp.get("matched_line_items")
+    if isinstance(matched_line_items, str):
+        matched_line_items = _safe_json_loads(matched_line_items)
+    if not isinstance(matched_line_items, list) or len(matched_line_items) == 0:
+        # Legacy self-heal via rule_matches
+        matched_line_items = []
+        if rule:
+            try:
+                res = rule_matches(rule, invoice)
+                if res.matched:
+                    matched_line_items = res.matched_line_items or []
+                    mp = {**(mp or {})}
+                    mp["rule_name"] = rule_name
+                    mp["matched_keywords"] = res.matched_keywords
+                    mp["matched_line_items"] = matched_line_items
+                    out["match_payload"] = mp
+            except Exception:
+                matched_line_items = []
 
-            if slack_res.get("ok"):
-                safe_update(
-                    ALERTS_TABLE,
-                    alert_id,
-                    {"slack_status": "sent", "slack_error": None, "status": a.get("status") or "pending"},
-                )
-                sent += 1
-                if DEBUG_ERRORS:
-                    processed.append({"id": alert_id, "document_id": document_id, "slack_status": "sent"})
-                _record_event("alert_slack_sent", document_id, {"alert_id": alert_id, "slack_result": slack_res})
-            else:
-                safe_update(
+    fee = _pick_fee_details(
+        matched_line_items or [],
+        fallback_fee_name=rule_name,
+        invoice=invoice,
+        rule_name=rule_name,
+        charged_only=charged_only,
+    )
+    fee_name = (fee.get("fee_name") or "").strip() or None
+    fee_amount = _to_float(fee.get("fee_amount"))
+
+    # ACTIONABLE ONLY
+    if not fee_name or fee_amount is None or fee_amount <= 0:
+        return {**out, "slack_status": "skipped", "slack_error": "non_actionable_missing_fee"}
+
+    out["payload"] = _build_slack_alert_payload(
+        document_id=document_id,
+        rule_name=rule_name,
+        fbo=invoice.get("vendor_name") or "—",
+        airport_code=_infer_airport_code(invoice, doc) or "—",
+        tail_number=invoice.get("tail_number") or "—",
+        fee_name=fee_name,
+        fee_amount=fee_amount,
+        currency=invoice.get("currency") or "",
+        signed_pdf_url=signed_pdf_url,
+    )
+    return out
+
+
+def _settle_alert(item: Dict[str, Any], slack_res: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """A sent alert's final status row and event: sent, error, or back to pending if rate limited."""
+    if not DEBUG_ERRORS:
+        slack_res.pop("response_text", None)
+    if slack_res.get("ok"):
+        status, err, event = "sent", None, "alert_slack_sent"
+    elif slack_res.get("rate_limited"):
+        # Slack refused it (429), so it wasn't delivered: release for the next run.
+        status, err, event = "pending", None, "alert_slack_deferred"
+    else:
+        status, err, event = "error", json.dumps(slack_res)[:1000], "alert_slack_error"
+    final = {"id": item["id"], "slack_status": status, "slack_error": err}
+    if item.get("match_payload") is not None:
+        final["match_payload"] = item["match_payload"]
+    return final, _event_row(event, str(item["document_id"]), {"alert_id": item["id"], "slack_result": slack_res})
+
+
+def _finish_alerts(finals: List[Dict[str, Any]], statuses: Dict[str, Any], worker: str) -> int:
+    """
+    Write final slack statuses in one finish_slack_alerts call (only rows
+    still 'sending' under this worker's claim change).  Falls back to one
+    conditional update per row.
+    """
+    if not finals:
+        return 0
+    try:
+        return int(safe_rpc("finish_slack_alerts", {"p_results": finals, "p_worker": worker}, timeout=30) or 0)
+    except Exception as e:
+        _record_event("finish_slack_alerts_error", "n/a", {"error": repr(e), "alerts": len(finals)})
+    done = 0
+    for f in finals:
+        patch = {k: v for k, v in f.items() if k != "id"}
+        patch["status"] = statuses.get(str(f["id"])) or "pending"
+        try:
+            done += int(
+                safe_update_where(
                     ALERTS_TABLE,
-                    alert_id,
-                    {
-                        "slack_status": "error",
-                        "slack_error": json.dumps(slack_res)[:1000],
-                        "status": a.get("status") or "pending",
-                    },
+                    patch,
+                    eq={"id": f["id"], "slack_status": "sending", "slack_claimed_by": worker},
                 )
-                errored += 1
-                if DEBUG_ERRORS:
-                    processed.append({"id": alert_id, "document_id": document_id, "slack_status": "error"})
-                _record_event("alert_slack_error", document_id, {"alert_id": alert_id, "slack_result": slack_res})
+            )
+        except Exception:
+            pass
+    return done
+
+
+@app.post("/jobs/flush_alerts")
+def flush_alerts(limit: int = 25) -> Dict[str, Any]:
+    """
+    Sends Slack exactly once per alert row by transitioning slack_status:
+      pending -> sending -> sent OR pending -> sending -> error OR pending -> sending -> skipped
+      (pending -> sending -> pending when Slack rate-limits it, or this call fails
+       before posting it: not delivered, retried next run)
+
+    The key is the CLAIM step (pending->sending) so only ONE runner can send each alert.
+    One claim_slack_alerts call claims the whole batch; invoices and documents
+    are loaded in one query each, payloads (signed URLs) are rendered in
+    parallel, sends go through the shared rate limiter (slack_delivery.py)
+    and final statuses are written with one finish_slack_alerts call.
+    """
+    started = time.time()
+    timings: Dict[str, int] = {}
+
+    def _phase(name: str, t0: float) -> float:
+        now = time.time()
+        timings[f"{name}_ms"] = int((now - t0) * 1000)
+        return now
+
+    try:
+        limit = max(1, min(int(limit), 100))
+
+        # Load rules once (needed to self-heal legacy rows) -- before claiming,
+        # so a rules failure can't leave a claimed batch behind.
+        rules = _fetch_rules()
+        rules_by_id: Dict[str, Dict[str, Any]] = {str(r.get("id")): r for r in (rules or [])}
 
-        log_pipeline_run("slack-flush", items=sent, message=f"sent={sent} errored={errored} skipped={skipped}")
+        t = time.time()
+        worker = uuid.uuid4().hex
+        try:
+            claim = safe_rpc(
+                "claim_slack_alerts",
+                {"p_limit": limit, "p_worker": worker, "p_lease_seconds": SLACK_CLAIM_LEASE_S},
+            ) or {}
+        except Exception as e:
+            _record_event("claim_slack_alerts_error", "n/a", {"error": repr(e)})
+            return _flush_alerts_serial(limit)
+        claimed: List[Dict[str, Any]] = [a for a in (claim.get("alerts") or []) if a.get("id")]
+        t = _phase("claim", t)
+
+        # Every claimed alert gets a final row here as soon as its outcome is
+        # known; whatever has none when this call ends (an exception below)
+        # was never posted and goes back to pending.
+        finals: Dict[str, Dict[str, Any]] = {}
+        events: List[Dict[str, Any]] = []
+        finals_lock = threading.Lock()
+        finished = 0
+        try:
+            doc_ids = list(dict.fromkeys(str(a["document_id"]) for a in claimed if a.get("document_id")))
+            invoices: Dict[str, Dict[str, Any]] = {}
+            for inv in safe_select_in(PARSED_TABLE, f"{_INVOICE_COLS}, document_id", "document_id", doc_ids):
+                did = str(inv.get("document_id"))
+                if did not in invoices:
+                    inv["line_items"] = _parse_line_items(inv.get("line_items"))
+                    invoices[did] = inv
+            docs = _fetch_document_rows(doc_ids)
+            t = _phase("load", t)
+
+            def _render(a: Dict[str, Any]) -> Dict[str, Any]:
+                did = str(a.get("document_id") or "")
+                try:
+                    return _render_alert(a, invoices.get(did), docs.get(did), rules_by_id)
+                except Exception as e:
+                    return {"id": a["id"], "document_id": did, "slack_status": "error", "slack_error": f"render_failed: {e!r}"[:1000]}
+
+            with ThreadPoolExecutor(max_workers=SLACK_RENDER_WORKERS) as pool:
+                rendered = list(pool.map(_render, claimed))
+            t = _phase("render", t)
+
+            for item in rendered:
+                if "payload" in item:
+                    continue
+                final = {"id": item["id"], "slack_status": item["slack_status"], "slack_error": item["slack_error"]}
+                if item.get("match_payload") is not None:
+                    final["match_payload"] = item["match_payload"]
+                finals[str(item["id"])] = final
+
+            to_send = [r for r in rendered if "payload" in r]
+            sender = slack_sender(SLACK_WEBHOOK_URL) if SLACK_WEBHOOK_URL else None
+
+            def _send(item: Dict[str, Any]) -> None:
+                slack_res = sender.post(item["payload"]) if sender else _slack_post(item["payload"])
+                final, event = _settle_alert(item, slack_res)
+                with finals_lock:
+                    finals[str(item["id"])] = final
+                    events.append(event)
+
+            with ThreadPoolExecutor(max_workers=SLACK_SEND_WORKERS) as pool:
+                list(pool.map(_send, to_send))
+            t = _phase("send", t)
+        finally:
+            with finals_lock:
+                for a in claimed:
+                    finals.setdefault(str(a["id"]), {"id": a["id"], "slack_status": "pending", "slack_error": None})
+                rows = list(finals.values())
+            statuses = {str(a["id"]): a.get("status") for a in claimed}
+            finished = _finish_alerts(rows, statuses, worker)
+            _record_events(events)
+            _phase("finish", t)
+
+        counts = {"sent": 0, "error": 0, "skipped": 0, "pending": 0}
+        for f in rows:
+            counts[f["slack_status"]] += 1
+
+        timings["total_ms"] = int((time.time() - started) * 1000)
+        log_pipeline_run(
+            "slack-flush",
+            items=counts["sent"],
+            message=f"sent={counts['sent']} errored={counts['error']} skipped={counts['skipped']} deferred={counts['pending']}",
+            duration_ms=timings["total_ms"],
+        )
         return {
             "ok": True,
             "limit": limit,
-            "sent": sent,
-            "errored": errored,
-            "skipped": skipped,
-            "processed": processed if DEBUG_ERRORS else None,
+            "claimed": len(claimed),
+            "healed": claim.get("healed") or 0,
+            "sent": counts["sent"],
+            "errored": counts["error"],
+            "skipped": counts["skipped"],
+            "deferred": counts["pending"],
+            "finished": finished,
+            "timings": timings,
+            "processed": [
+                {"id": f["id"], "slack_status": f["slack_status"]} for f in rows
+            ] if DEBUG_ERRORS else None,
         }
 
     except HTTPException:
@@ -1110,6 +1604,128 @@ def flush_alerts(limit: int = 25) -> Dict[str, Any]:
         raise HTTPException(status_code=500, detail="flush_alerts failed")
 
 
+def _flush_alerts_serial(limit: int) -> Dict[str, Any]:
+    """
+    flush_alerts one row at a time (claim by conditional update), used when
+    claim_slack_alerts isn't available.
+    """
+    # Load rules once (needed to self-heal legacy rows)
+    rules = _fetch_rules()
+    rules_by_id: Dict[str, Dict[str, Any]] = {str(r.get("id")): r for r in (rules or [])}
+
+    rows = safe_select_many(
+        ALERTS_TABLE,
+        "id, created_at, rule_id, document_id, parsed_invoice_id, status, slack_status, slack_error, match_payload",
+        not_in={"slack_status": ["sent", "sending", "error", "skipped"]},
+        limit=500,
+    ) or []
+
+    rows = sorted(rows, key=lambda r: str(r.get("created_at") or ""))  # oldest first
+
+    sent = 0
+    errored = 0
+    skipped = 0
+    processed: List[Dict[str, Any]] = []
+
+    for a in rows:
+        if sent + errored >= limit:
+            break
+
+        alert_id = a.get("id")
+        if not alert_id:
+            continue
+
+        # --- fast skip ---
+        slack_status = (a.get("slack_status") or "").strip().lower()
+        if slack_status in ("sent", "ok", "success"):
+            continue
+        if slack_status not in ("", "pending", "null"):
+            # includes "error", "skipped", "sending"
+            continue
+
+        # Normalize legacy null/empty rows to "pending" so the claim step
+        # can match them (claim uses eq slack_status="pending").
+        if slack_status in ("", "null"):
+            try:
+                safe_update(ALERTS_TABLE, alert_id, {"slack_status": "pending"})
+                slack_status = "pending"
+            except Exception:
+                continue
+
+        # ------------------------------------------------------------------
+        # AUTO-HEAL: status says sent, but slack_status is still pending
+        # (this exact mismatch is what causes repeated sends)
+        # ------------------------------------------------------------------
+        if str(a.get("status") or "").lower() == "sent" and slack_status in ("", "pending", "null"):
+            try:
+                safe_update(ALERTS_TABLE, alert_id, {"slack_status": "sent", "slack_error": None})
+            except Exception:
+                pass
+            continue
+
+        # ------------------------------------------------------------------
+        # CLAIM: atomically move pending -> sending
+        # If another worker already claimed it, updated will be 0 and we skip.
+        # ------------------------------------------------------------------
+        claimed = 0
+        try:
+            claimed = int(
+                safe_update_where(
+                    ALERTS_TABLE,
+                    {"slack_status": "sending", "slack_error": None},
+                    eq={"id": alert_id, "slack_status": "pending"},
+                )
+            )
+        except Exception as e:
+            if DEBUG_ERRORS:
+                _record_event("flush_claim_error", str(a.get("document_id") or "n/a"), {"error": repr(e), "alert_id": alert_id})
+            continue
+
+        if claimed != 1:
+            continue  # someone else is processing or it changed
+
+        document_id = a.get("document_id")
+        invoice = None
+        if document_id:
+            try:
+                invoice = _fetch_invoice(document_id)
+            except HTTPException:
+                invoice = None
+        item = _render_alert(a, invoice, _fetch_document_row(document_id), rules_by_id)
+
+        if "payload" not in item:
+            final, event = {"id": alert_id, "slack_status": "skipped", "slack_error": item["slack_error"]}, None
+            skipped += 1
+        else:
+            final, event = _settle_alert(item, _slack_post(item["payload"]))
+            if final["slack_status"] == "sent":
+                sent += 1
+            else:
+                errored += 1
+        if item.get("match_payload") is not None:
+            final["match_payload"] = item["match_payload"]
+
+        safe_update(
+            ALERTS_TABLE,
+            alert_id,
+            {**{k: v for k, v in final.items() if k != "id"}, "status": a.get("status") or "pending"},
+        )
+        if event:
+            _record_events([event])
+        if DEBUG_ERRORS:
+            processed.append({"id": alert_id, "document_id": document_id, "slack_status": final["slack_status"]})
+
+    log_pipeline_run("slack-flush", items=sent, message=f"sent={sent} errored={errored} skipped={skipped}")
+    return {
+        "ok": True,
+        "limit": limit,
+        "sent": sent,
+        "errored": errored,
+        "skipped": skipped,
+        "processed": processed if DEBUG_ERRORS else None,
+    }
+
+
 @app.post("/jobs/send_alert")
 def send_alert(alert_id: str) -> Dict[str, Any]:
     """
@@ -1263,10 +1879,156 @@ def debug_rule_match(document_id: str, rule_id: Optional[str] = None, rule_name:
     }
 
 
+# ---------------------------------------------------------------------
+# Listing helpers: server-side filters + keyset cursors
+# ---------------------------------------------------------------------
+
+# Listings page newest invoice first on (invoice_date, id); undated rows last.
+_KEYSET_ORDER = "invoice_date.desc.nullslast,id.desc"
+
+# Characters with meaning inside PostgREST filter values / logic trees.
+_POSTGREST_RESERVED_RE = re.compile(r"[,()*:%\\\"']")
+_ISO_DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+def _ilike_term(s: Optional[str]) -> Optional[str]:
+    """User text -> `*term*` for ilike, or None if nothing searchable is left."""
+    term = " ".join(_POSTGREST_RESERVED_RE.sub(" ", s or "").split())
+    return f"*{term}*" if term else None
+
+
+def _csv_values(s: Optional[str], *, upper: bool = False) -> List[str]:
+    vals = [_POSTGREST_RESERVED_RE.sub("", v).strip() for v in (s or "").split(",")]
+    return [v.upper() if upper else v for v in vals if v]
+
+
+def _encode_cursor(row: Dict[str, Any]) -> str:
+    raw = json.dumps({"d": row.get("invoice_date"), "i": str(row.get("id"))}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Tuple[Optional[str], str]:
+    """Opaque cursor -> (invoice_date, id) of the last row seen.  400 on garbage."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        d, i = data.get("d"), str(data["i"])
+        if d is not None:
+            d = str(d)[:10]
+            if not _ISO_DATE_RE.fullmatch(d):
+                raise ValueError("bad cursor date")
+        if not i or _POSTGREST_RESERVED_RE.search(i):
+            raise ValueError("bad cursor id")
+        return d, i
+    except Exception:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+
+
+def _keyset_clause(cursor: str) -> str:
+    """Rows after the cursor in _KEYSET_ORDER, as a PostgREST logic clause."""
+    d, i = _decode_cursor(cursor)
+    if d is None:
+        return f"and(invoice_date.is.null,id.lt.{i})"
+    return f"or(invoice_date.lt.{d},and(invoice_date.eq.{d},id.lt.{i}),invoice_date.is.null)"
+
+
+def _date_range(
+    filters: Dict[str, str],
+    clauses: List[str],
+    col: str,
+    date_from: Optional[str],
+    date_to: Optional[str],
+) -> None:
+    """Inclusive YYYY-MM-DD range on col (a clause when both ends are set: one param per column)."""
+    for v in (date_from, date_to):
+        if v and not _ISO_DATE_RE.fullmatch(v):
+            raise HTTPException(status_code=400, detail="date_from / date_to must be YYYY-MM-DD")
+    if date_from and date_to:
+        clauses.append(f"and({col}.gte.{date_from},{col}.lte.{date_to})")
+    elif date_from:
+        filters[col] = f"gte.{date_from}"
+    elif date_to:
+        filters[col] = f"lte.{date_to}"
+
+
+def _ilike_any(
+    columns: Tuple[str, ...],
+    q: Optional[str],
+    *,
+    id_columns: Tuple[str, ...] = (),
+) -> Optional[str]:
+    """
+    or(...) of `col ilike *q*` over text columns.  id_columns (uuid, where
+    ilike is an error) are matched with eq, and only when q is an id.
+    """
+    term = _ilike_term(q)
+    if not term:
+        return None
+    conds = [f"{c}.ilike.{term}" for c in columns]
+    try:
+        as_id = str(uuid.UUID((q or "").strip()))
+    except ValueError:
+        as_id = None
+    if as_id:
+        conds.extend(f"{c}.eq.{as_id}" for c in id_columns)
+    return "or(" + ",".join(conds) + ")"
+
+
+def _keyset_page(
+    table: str,
+    columns: str,
+    *,
+    limit: int,
+    cursor: Optional[str],
+    filters: Dict[str, str],
+    clauses: List[str],
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    One page in _KEYSET_ORDER plus the cursor for the next (None on the last
+    page).  `clauses` are PostgREST logic clauses (or(...), and(...)) ANDed
+    with each other and the keyset condition.
+    """
+    clauses = list(clauses)
+    if cursor:
+        clauses.append(_keyset_clause(cursor))
+    params = dict(filters)
+    params["order"] = _KEYSET_ORDER
+    if clauses:
+        params["and"] = f"({','.join(clauses)})"
+    rows = safe_select_many(table, columns, limit=limit + 1, filters=params) or []
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, _encode_cursor(rows[-1])
+
+
 # ---------------------------------------------------------------------
 # API: Invoices
 # ---------------------------------------------------------------------
 
+# line_items->0 instead of the whole array: enough for has_line_items.
+# Legacy rows hold line_items as a JSON string, where ->0 is null; see
+# _fill_has_line_items.
+_INVOICE_LIST_COLS = (
+    "id, document_id, created_at, vendor_name, invoice_number, "
+    "invoice_date, airport_code, tail_number, currency, total, "
+    "doc_type, review_required, risk_score, first_line_item:line_items->0"
+)
+
+
+def _fill_has_line_items(rows: List[Dict[str, Any]]) -> None:
+    """Set has_line_items from first_line_item, loading line_items only for rows without one."""
+    unknown = [r["id"] for r in rows if r.get("first_line_item") is None and r.get("id")]
+    legacy: Dict[Any, bool] = {}
+    if unknown:
+        try:
+            for li in safe_select_in(PARSED_TABLE, "id, line_items", "id", unknown):
+                legacy[li.get("id")] = bool(_parse_line_items(li.get("line_items")))
+        except Exception as e:
+            print(f"[api_invoices] line_items fallback failed: {e}", flush=True)
+    for r in rows:
+        first = r.pop("first_line_item", None)
+        r["has_line_items"] = first is not None or legacy.get(r.get("id"), False)
+
 
 @app.get("/api/invoices")
 def api_invoices(
@@ -1274,33 +2036,45 @@ def api_invoices(
     vendor: Optional[str] = None,
     doc_type: Optional[str] = None,
     review_required: Optional[bool] = None,
+    airport: Optional[str] = None,
+    q: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    cursor: Optional[str] = None,
 ) -> Dict[str, Any]:
     """
-    Returns ALL parsed invoices.
+    Parsed invoices, newest invoice_date first, filtered in PostgREST:
+      vendor (substring), doc_type / airport (comma-separated lists),
+      review_required, q (vendor, invoice number, tail, airport; document id when q is one),
+      date_from / date_to (invoice_date, inclusive).
+    Pass next_cursor back as `cursor` for the following page.
     Line items excluded here (detail view only).
     """
-    rows = safe_select_many(
-        PARSED_TABLE,
-        "id, document_id, created_at, vendor_name, invoice_number, "
-        "invoice_date, airport_code, tail_number, currency, total, "
-        "doc_type, review_required, risk_score, line_items",
-        limit=1000,
-    ) or []
-
-    if vendor:
-        rows = [r for r in rows if vendor.lower() in (r.get("vendor_name") or "").lower()]
-    if doc_type:
-        rows = [r for r in rows if (r.get("doc_type") or "") == doc_type]
+    filters: Dict[str, str] = {}
+    clauses: List[str] = []
+    vendor_term = _ilike_term(vendor)
+    if vendor_term:
+        filters["vendor_name"] = f"ilike.{vendor_term}"
+    doc_types = _csv_values(doc_type)
+    if doc_types:
+        filters["doc_type"] = f"in.({','.join(doc_types)})"
+    airports = _csv_values(airport, upper=True)
+    if airports:
+        filters["airport_code"] = f"in.({','.join(airports)})"
     if review_required is not None:
-        rows = [r for r in rows if bool(r.get("review_required")) == review_required]
-
-    rows = sorted(rows, key=lambda r: str(r.get("created_at") or ""), reverse=True)[: int(limit)]
+        filters["review_required"] = "is.true" if review_required else "not.is.true"
+    search = _ilike_any(("vendor_name", "invoice_number", "tail_number", "airport_code"), q, id_columns=("document_id",))
+    if search:
+        clauses.append(search)
+    _date_range(filters, clauses, "invoice_date", date_from, date_to)
+
+    rows, next_cursor = _keyset_page(
+        PARSED_TABLE, _INVOICE_LIST_COLS, limit=int(limit), cursor=cursor, filters=filters, clauses=clauses,
+    )
 
-    for r in rows:
-        r["has_line_items"] = bool(_parse_line_items(r.get("line_items")))
-        r.pop("line_items", None)
+    _fill_has_line_items(rows)
 
-    return {"ok": True, "count": len(rows), "invoices": rows}
+    return {"ok": True, "count": len(rows), "invoices": rows, "next_cursor": next_cursor}
 
 
 @app.get("/api/invoices/{document_id}")
@@ -1532,11 +2306,20 @@ def _process_fuel_price(invoice: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     # Check for price increase BEFORE storing (so comparison is clean)
     increase = None
     if data.get("airport_code"):
-        increase = check_price_increase(
-            data["airport_code"],
-            data["effective_price_per_gallon"],
-            document_id=doc_id,
-        )
+        try:
+            increase = get_price_index().check(
+                data["airport_code"],
+                data["effective_price_per_gallon"],
+                document_id=doc_id,
+                invoice_date=data.get("invoice_date"),
+            )
+        except Exception as e:
+            _record_event("fuel_price_index_error", str(doc_id), {"error": repr(e)})
+            increase = check_price_increase(
+                data["airport_code"],
+                data["effective_price_per_gallon"],
+                document_id=doc_id,
+            )
 
     stored = store_fuel_price(data, increase)
     if stored is None:
@@ -1559,6 +2342,78 @@ def _process_fuel_price(invoice: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     }
 
 
+def _process_fuel_prices(
+    invoices: List[Dict[str, Any]],
+    index: FuelPriceIndex,
+) -> Dict[str, Any]:
+    """
+    _process_fuel_price for a batch: one documents lookup for invoices whose
+    airport can't be inferred from the invoice itself, increases compared
+    against `index` (updated as rows are added, so later invoices in the
+    batch see earlier ones), and one fuel_prices upsert.
+
+    Returns {"results": [...], "no_fuel": n, "duplicates": n}; a document
+    seen twice in the batch (re-parsed invoice) keeps its last row.
+    """
+    extracted: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+    no_fuel = 0
+    for inv in invoices:
+        if not inv.get("document_id"):
+            continue
+        inv["line_items"] = _parse_line_items(inv.get("line_items"))
+        data = extract_fuel_price(inv)
+        if not data:
+            no_fuel += 1
+            continue
+        if not data.get("airport_code"):
+            data["airport_code"] = _infer_airport_code(inv)
+        extracted.append((inv, data))
+
+    docs = _fetch_document_rows([str(d["document_id"]) for _, d in extracted if not d.get("airport_code")])
+
+    rows: Dict[str, Dict[str, Any]] = {}
+    results: Dict[str, Dict[str, Any]] = {}
+    for inv, data in extracted:
+        doc_id = str(data["document_id"])
+        if not data.get("airport_code"):
+            data["airport_code"] = _infer_airport_code(inv, docs.get(doc_id))
+
+        increase = None
+        if data.get("airport_code"):
+            increase = index.check(
+                data["airport_code"],
+                data["effective_price_per_gallon"],
+                document_id=doc_id,
+                invoice_date=data.get("invoice_date"),
+            )
+
+        row = fuel_price_row(data, increase)
+        index.add(row)
+        rows.pop(doc_id, None)
+        rows[doc_id] = row
+        results.pop(doc_id, None)
+        results[doc_id] = {
+            "document_id": doc_id,
+            "status": "stored",
+            "airport_code": data.get("airport_code"),
+            "vendor": data.get("vendor_name"),
+            "base_price": data["base_price_per_gallon"],
+            "effective_price": data["effective_price_per_gallon"],
+            "gallons": data["gallons"],
+            "increase": increase,
+            "slack_sent": False,
+        }
+
+    for doc_id in store_fuel_prices(list(rows.values())):
+        results[doc_id] = {"document_id": doc_id, "status": "upsert_failed"}
+
+    return {
+        "results": list(results.values()),
+        "no_fuel": no_fuel,
+        "duplicates": len(extracted) - len(rows),
+    }
+
+
 @app.post("/jobs/extract_fuel_prices_next")
 def extract_fuel_prices_next(
     limit: int = 10,
@@ -1581,21 +2436,12 @@ def extract_fuel_prices_next(
             desc=True,
             limit=max(limit, 100),
         ) or []
+        batch = [inv for inv in rows if inv.get("document_id")][:limit]
+        processed = len(batch)
 
-        processed = 0
-        results: List[Dict[str, Any]] = []
-
-        for inv in rows:
-            if processed >= limit:
-                break
-            doc_id = inv.get("document_id")
-            if not doc_id:
-                continue
-
-            result = _process_fuel_price(inv)
-            if result:
-                results.append(result)
-            processed += 1
+        # Oldest first, as if each had been processed when it was parsed.
+        out = _process_fuel_prices(list(reversed(batch)), get_price_index())
+        results = out["results"]
 
         log_pipeline_run("fuel-price-extract", items=len(results), message=f"processed={processed} extracted={len(results)}")
         return {"ok": True, "processed": processed, "fuel_prices": results}
@@ -1609,57 +2455,98 @@ def extract_fuel_prices_next(
 
 
 @app.post("/jobs/backfill_fuel_prices")
-def backfill_fuel_prices(limit: int = 50) -> Dict[str, Any]:
+def backfill_fuel_prices(
+    limit: int = 100000,
+    page_size: int = FUEL_BACKFILL_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    max_seconds: int = FUEL_BACKFILL_MAX_SECONDS,
+) -> Dict[str, Any]:
     """
     Backfill fuel prices from ALL parsed invoices.
-    Skips documents that already have a fuel_prices row (via UNIQUE constraint).
-    Safe to run multiple times.
+
+    Pages through parsed_invoices by id (keyset, `id > cursor`), extracts
+    each page in memory, compares against the instance's FuelPriceIndex
+    (price_index.py), and writes each page with one bulk upsert
+    (ON CONFLICT document_id, so safe to run multiple times).
+
+    Stops after `limit` invoices or `max_seconds`; if `done` is false, call
+    again with cursor=next_cursor to carry on.
     """
     try:
-        limit = max(1, min(int(limit), 500))
+        limit = max(1, int(limit))
+        page_size = max(1, min(int(page_size), 1000))
+        started = time.time()
 
-        rows = safe_select_many(
-            PARSED_TABLE,
-            _FUEL_INVOICE_COLS,
-            order="created_at",
-            desc=True,
-            limit=limit,
-        ) or []
+        index = get_price_index()
+        index_ms = int((time.time() - started) * 1000)
 
+        scanned = 0
         stored = 0
         skipped = 0
         no_fuel = 0
         increases = 0
+        failed = 0
+        pages = 0
+        done = False
         results: List[Dict[str, Any]] = []
 
-        for inv in rows:
-            doc_id = inv.get("document_id")
-            if not doc_id:
-                continue
-
-            result = _process_fuel_price(inv)
-            if result is None:
-                no_fuel += 1
-            elif result.get("status") == "duplicate":
-                skipped += 1
-            else:
+        while scanned < limit and time.time() - started < max_seconds:
+            want = min(page_size, limit - scanned)
+            rows = safe_select_many(
+                PARSED_TABLE,
+                _FUEL_INVOICE_COLS,
+                gt={"id": cursor} if cursor else None,
+                order="id",
+                limit=want,
+            ) or []
+            if not rows:
+                done = True
+                break
+            pages += 1
+            scanned += len(rows)
+            cursor = str(rows[-1]["id"])
+
+            out = _process_fuel_prices(rows, index)
+            no_fuel += out["no_fuel"]
+            skipped += out["duplicates"]
+            for result in out["results"]:
+                if result.get("status") != "stored":
+                    failed += 1
+                    continue
                 stored += 1
                 if result.get("increase"):
                     increases += 1
-                results.append(result)
+                if len(results) < 50:
+                    results.append(result)
+
+            if len(rows) < want:
+                done = True
+                break
 
+        elapsed_ms = int((time.time() - started) * 1000)
+        log_pipeline_run(
+            "fuel-price-backfill",
+            items=stored,
+            message=f"scanned={scanned} stored={stored} pages={pages} done={done}",
+            duration_ms=elapsed_ms,
+        )
         return {
             "ok": True,
-            "total_scanned": len(rows),
+            "total_scanned": scanned,
             "stored": stored,
             "skipped_duplicate": skipped,
             "no_fuel_line": no_fuel,
             "increases_detected": increases,
-            "results": results[:50],
+            "upsert_failed": failed,
+            "pages": pages,
+            "done": done,
+            "next_cursor": None if done else cursor,
+            "timings": {"index_ms": index_ms, "total_ms": elapsed_ms, "indexed_documents": len(index)},
+            "results": results,
         }
 
     except Exception as e:
-        _record_event("backfill_fuel_prices_error", "n/a", {"error": repr(e)})
+        _record_event("backfill_fuel_prices_error", "n/a", {"error": repr(e), "cursor": cursor})
         if DEBUG_ERRORS:
             raise HTTPException(status_code=500, detail=f"backfill failed: {repr(e)}")
         raise HTTPException(status_code=500, detail="backfill_fuel_prices failed")
@@ -1701,50 +2588,96 @@ def debug_fuel_audit(limit: int = 50) -> Dict[str, Any]:
         raise HTTPException(status_code=500, detail=f"fuel_audit failed: {repr(e)}")
 
 
+_FUEL_LIST_COLS = (
+    "id, document_id, airport_code, vendor_name, "
+    "base_price_per_gallon, effective_price_per_gallon, "
+    "gallons, fuel_total, invoice_date, tail_number, currency, "
+    "price_change_pct, previous_price, alert_sent, created_at"
+)
+
+
 @app.get("/api/fuel-prices")
 def api_fuel_prices(
     limit: int = Query(100, ge=1, le=500),
     airport: Optional[str] = None,
     vendor: Optional[str] = None,
     q: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    cursor: Optional[str] = None,
 ) -> Dict[str, Any]:
-    """List fuel price records, newest first."""
+    """
+    List fuel price records, newest invoice_date first, filtered in PostgREST:
+      airport (comma-separated list), vendor (substring), q (airport, vendor,
+      tail, document), date_from / date_to (invoice_date, inclusive),
+      min_price / max_price (effective price per gallon).
+    Pass next_cursor back as `cursor` for the following page.
+    """
+    filters: Dict[str, str] = {}
+    clauses: List[str] = []
+    airports = [_normalize_airport(a) for a in _csv_values(airport, upper=True)]
+    if airports:
+        filters["airport_code"] = f"in.({','.join(airports)})"
+    vendor_term = _ilike_term(vendor)
+    if vendor_term:
+        filters["vendor_name"] = f"ilike.{vendor_term}"
+    search = _ilike_any(("airport_code", "vendor_name", "tail_number", "document_id"), q)
+    if search:
+        clauses.append(search)
+    _date_range(filters, clauses, "invoice_date", date_from, date_to)
+    if min_price is not None and max_price is not None:
+        clauses.append(f"and(effective_price_per_gallon.gte.{min_price},effective_price_per_gallon.lte.{max_price})")
+    elif min_price is not None:
+        filters["effective_price_per_gallon"] = f"gte.{min_price}"
+    elif max_price is not None:
+        filters["effective_price_per_gallon"] = f"lte.{max_price}"
+    if cursor:
+        _decode_cursor(cursor)  # a bad cursor is a 400, not an empty list
+
     try:
-        eq: Dict[str, Any] = {}
-        if airport:
-            eq["airport_code"] = airport.strip().upper()
+        rows, next_cursor = _keyset_page(
+            FUEL_PRICES_TABLE, _FUEL_LIST_COLS, limit=int(limit), cursor=cursor, filters=filters, clauses=clauses,
+        )
+        return {"ok": True, "count": len(rows), "fuel_prices": rows, "next_cursor": next_cursor}
 
-        rows = safe_select_many(
-            FUEL_PRICES_TABLE,
-            "id, document_id, airport_code, vendor_name, "
-            "base_price_per_gallon, effective_price_per_gallon, "
-            "gallons, fuel_total, invoice_date, tail_number, currency, "
-            "price_change_pct, previous_price, alert_sent, created_at",
-            eq=eq if eq else None,
-            order="invoice_date",
-            desc=True,
-            limit=limit,
-        ) or []
+    except Exception as e:
+        if DEBUG_ERRORS:
+            _record_event("api_fuel_prices_error", "n/a", {"error": repr(e)})
+        return {"ok": True, "count": 0, "fuel_prices": [], "next_cursor": None}
 
-        # Optional text search
-        if q:
-            ql = q.strip().lower()
-            rows = [
-                r for r in rows
-                if ql in " ".join(
-                    str(r.get(f) or "") for f in
-                    ("airport_code", "vendor_name", "tail_number", "document_id")
-                ).lower()
-            ]
 
-        # Optional vendor filter (ilike)
-        if vendor:
-            vl = vendor.strip().lower()
-            rows = [r for r in rows if vl in (str(r.get("vendor_name") or "")).lower()]
+@app.get("/api/fuel-prices/stats")
+def api_fuel_price_stats(
+    airport: Optional[str] = None,
+    vendor: Optional[str] = None,
+    days: int = Query(90, ge=1, le=3650),
+    as_of: Optional[str] = None,
+    price: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Rolling fuel price statistics from the in-memory index (price_index.py):
+    median, p10-p90 bands, mean/std, trend, and the z-score of `price`.
 
-        return {"ok": True, "count": len(rows), "fuel_prices": rows}
+      no airport   -> one summary row per airport
+      airport      -> that airport (window ending at as_of or its latest
+                      price) plus a row per vendor
+      + vendor     -> that vendor at the airport only
+    """
+    try:
+        idx = get_price_index()
+        if not airport:
+            rows = idx.airports(days=days)
+            return {"ok": True, "window_days": days, "count": len(rows), "airports": rows}
+
+        stats = idx.stats(airport, vendor=vendor, days=days, as_of=as_of, price=price)
+        out: Dict[str, Any] = {"ok": True, "window_days": days, "stats": stats}
+        if not vendor:
+            out["vendors"] = idx.vendors(airport, days=days)
+        return out
 
     except Exception as e:
         if DEBUG_ERRORS:
-            _record_event("api_fuel_prices_error", "n/a", {"error": repr(e)})
-        return {"ok": True, "count": 0, "fuel_prices": []}
\ No newline at end of file
+            _record_event("api_fuel_price_stats_error", "n/a", {"error": repr(e)})
+        return {"ok": True, "window_days": days, "stats": None}
\ No newline at end of file
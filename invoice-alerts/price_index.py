@@ -0,0 +1,436 @@
+# price_index.py — In-memory fuel price time series per airport and vendor.
+#
+# Loads fuel_prices once per instance and keeps one series per airport (all
+# vendors) and per (airport, vendor), ordered by invoice_date.  Each series
+# keeps prefix sums of price, price², day and day×price, so for any date
+# window (located with bisect, O(log n)):
+#   - count / mean / std / outlier z-score are O(1)
+#   - least-squares trend (slope per day) is O(1)
+#   - median and percentile bands sort only the k prices inside the window
+#
+# The increase detector (check) compares against the latest earlier-or-equal
+# dated price at the airport, the same row check_price_increase() would
+# pick, minus rows without an invoice_date (they can't be placed in a
+# series).  fuel_prices.store_fuel_price()/store_fuel_prices() feed new rows
+# in as they are written (rows stored while a reload is running are
+# replayed into the new index before it replaces the old one); other
+# instances' writes are picked up by a full reload every FUEL_INDEX_TTL_S.
+#
+#   idx = get_price_index()
+#   idx.check("BOS", 6.42, document_id)
+#   idx.stats("BOS", vendor="Signature", days=90)
+#
+# Env:
+#   FUEL_INDEX_TTL_S       full reload interval (default 900)
+#   FUEL_INDEX_WINDOW_DAYS default stats window (default 90)
+
+import bisect
+import logging
+import math
+import os
+import threading
+import time
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+import fuel_prices
+from fuel_prices import (
+    FUEL_PRICES_TABLE,
+    _compare_to_previous,
+    _normalize_airport,
+    _to_float,
+)
+from supa import safe_select_many
+
+log = logging.getLogger(__name__)
+
+FUEL_INDEX_TTL_S = int(os.getenv("FUEL_INDEX_TTL_S", "900"))
+FUEL_INDEX_WINDOW_DAYS = int(os.getenv("FUEL_INDEX_WINDOW_DAYS", "90"))
+
+_INDEX_COLS = "id, document_id, airport_code, vendor_name, effective_price_per_gallon, invoice_date"
+
+PERCENTILES = (10, 25, 50, 75, 90)
+
+
+def _vendor_key(v: Any) -> str:
+    return " ".join(str(v or "").lower().split())
+
+
+def _day(v: Any) -> Optional[int]:
+    """invoice_date (ISO date or timestamp) -> date ordinal."""
+    if not v:
+        return None
+    try:
+        return date.fromisoformat(str(v)[:10]).toordinal()
+    except ValueError:
+        return None
+
+
+def _percentile(sorted_vals: List[float], p: float) -> float:
+    """Linear interpolation between closest ranks (numpy's default)."""
+    if len(sorted_vals) == 1:
+        return sorted_vals[0]
+    pos = (len(sorted_vals) - 1) * p / 100.0
+    lo = int(math.floor(pos))
+    hi = min(lo + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (pos - lo)
+
+
+class _Series:
+    """Prices for one key, ordered by (day, document_id)."""
+
+    __slots__ = ("keys", "points", "_sums", "_base")
+
+    def __init__(self) -> None:
+        self.keys: List[Tuple[int, str]] = []
+        self.points: List[Dict[str, Any]] = []
+        self._sums: Optional[List[Tuple[float, float, float, float, float]]] = None
+        self._base = 0
+
+    def insert(self, day: int, doc_id: str, point: Dict[str, Any]) -> None:
+        i = bisect.bisect_left(self.keys, (day, doc_id))
+        self.keys.insert(i, (day, doc_id))
+        self.points.insert(i, point)
+        self._sums = None
+
+    def remove(self, day: int, doc_id: str) -> None:
+        i = bisect.bisect_left(self.keys, (day, doc_id))
+        if i < len(self.keys) and self.keys[i] == (day, doc_id):
+            del self.keys[i]
+            del self.points[i]
+            self._sums = None
+
+    def _prefix(self) -> List[Tuple[float, float, float, float, float]]:
+        # Rebuilt on the first query after a write: (Σy, Σy², Σt, Σt², Σty)
+        # with t in days from the series start (keeps the sums small).
+        if self._sums is None:
+            self._base = self.keys[0][0] if self.keys else 0
+            sums = [(0.0, 0.0, 0.0, 0.0, 0.0)]
+            sy = syy = st = stt = sty = 0.0
+            for (day, _), p in zip(self.keys, self.points):
+                y = p["price"]
+                t = float(day - self._base)
+                sy += y
+                syy += y * y
+                st += t
+                stt += t * t
+                sty += t * y
+                sums.append((sy, syy, st, stt, sty))
+            self._sums = sums
+        return self._sums
+
+    def window(self, start_day: int, end_day: int) -> Tuple[int, int]:
+        """Index range [lo, hi) of points dated start_day..end_day."""
+        lo = bisect.bisect_left(self.keys, (start_day, ""))
+        hi = bisect.bisect_left(self.keys, (end_day + 1, ""))
+        return lo, hi
+
+    def moments(self, lo: int, hi: int) -> Dict[str, Any]:
+        n = hi - lo
+        if n <= 0:
+            return {"count": 0}
+        sums = self._prefix()
+        sy, syy, st, stt, sty = (b - a for a, b in zip(sums[lo], sums[hi]))
+        mean = sy / n
+        var = max(0.0, syy / n - mean * mean)
+        out: Dict[str, Any] = {"count": n, "mean": mean, "std": math.sqrt(var)}
+        # Least-squares slope of price over days.
+        denom = n * stt - st * st
+        out["slope_per_day"] = (n * sty - st * sy) / denom if denom > 0 else None
+        return out
+
+    def latest_before(self, day: int, exclude_doc: Optional[str]) -> Optional[Dict[str, Any]]:
+        i = bisect.bisect_left(self.keys, (day + 1, "")) - 1
+        while i >= 0:
+            p = self.points[i]
+            if exclude_doc is None or p["document_id"] != exclude_doc:
+                return p
+            i -= 1
+        return None
+
+    def latest(self, exclude_doc: Optional[str]) -> Optional[Dict[str, Any]]:
+        for p in reversed(self.points):
+            if exclude_doc is None or p["document_id"] != exclude_doc:
+                return p
+        return None
+
+
+class FuelPriceIndex:
+    """Per-airport / per-vendor fuel price series.  Thread-safe."""
+
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self._series: Dict[Tuple[str, str], _Series] = {}
+        self._docs: Dict[str, Tuple[str, str, int]] = {}  # document_id -> (airport, vendor_key, day)
+        self.loaded_at = 0.0
+
+    @classmethod
+    def load(cls, page_size: int = 1000) -> "FuelPriceIndex":
+        """Read all of fuel_prices (keyset pages by id)."""
+        index = cls()
+        last_id: Optional[str] = None
+        while True:
+            page = safe_select_many(
+                FUEL_PRICES_TABLE,
+                _INDEX_COLS,
+                gt={"id": last_id} if last_id else None,
+                order="id",
+                limit=page_size,
+            )
+            for row in page:
+                index.add(row)
+            if len(page) < page_size:
+                break
+            last_id = page[-1]["id"]
+        index.loaded_at = time.time()
+        return index
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._docs)
+
+    def _get(self, airport: str, vendor: str = "") -> Optional[_Series]:
+        return self._series.get((airport, vendor))
+
+    def add(self, row: Dict[str, Any]) -> None:
+        """Record a fuel_prices row (as stored): replaces any earlier row for its document."""
+        doc_id = str(row.get("document_id"))
+        airport = _normalize_airport(row.get("airport_code"))
+        price = _to_float(row.get("effective_price_per_gallon"))
+        day = _day(row.get("invoice_date"))
+        vendor = _vendor_key(row.get("vendor_name"))
+        with self._lock:
+            old = self._docs.pop(doc_id, None)
+            if old is not None:
+                o_airport, o_vendor, o_day = old
+                for key in ((o_airport, ""), (o_airport, o_vendor)):
+                    s = self._series.get(key)
+                    if s is not None:
+                        s.remove(o_day, doc_id)
+            if not airport or day is None or not price or price <= 0:
+                return
+            point = {
+                "document_id": doc_id,
+                "price": price,
+                "invoice_date": str(row.get("invoice_date"))[:10],
+                "vendor_name": row.get("vendor_name"),
+            }
+            keys = [(airport, "")] + ([(airport, vendor)] if vendor else [])
+            for key in keys:
+                self._series.setdefault(key, _Series()).insert(day, doc_id, point)
+            self._docs[doc_id] = (airport, vendor, day)
+
+    # ── Increase detection ────────────────────────────────────────────────
+
+    def check(
+        self,
+        airport_code: str,
+        effective_price: float,
+        document_id: Optional[str] = None,
+        invoice_date: Optional[str] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        check_price_increase() against the index.  With invoice_date, the
+        comparison is with the latest price dated on or before it (so a
+        backfilled old invoice isn't compared with next month's price).
+        Increases carry the rolling median and z-score for context.
+        """
+        airport = _normalize_airport(airport_code)
+        if not airport:
+            return None
+        doc_id = str(document_id) if document_id is not None else None
+        day = _day(invoice_date)
+        with self._lock:
+            s = self._get(airport)
+            if s is None:
+                return None
+            prev = s.latest_before(day, doc_id) if day is not None else s.latest(doc_id)
+            if prev is None:
+                return None
+            increase = _compare_to_previous(
+                [{
+                    "effective_price_per_gallon": prev["price"],
+                    "invoice_date": prev["invoice_date"],
+                    "vendor_name": prev["vendor_name"],
+                    "document_id": prev["document_id"],
+                }],
+                effective_price,
+                doc_id,
+            )
+            if increase:
+                ctx = self._window_stats(s, day, FUEL_INDEX_WINDOW_DAYS, bands=(50,))
+                median = ctx.get("median")
+                increase["rolling_median"] = round(median, 5) if median is not None else None
+                increase["zscore"] = self._z(ctx, effective_price)
+        return increase
+
+    # ── Statistics ────────────────────────────────────────────────────────
+
+    def _end_day(self, s: _Series, as_of: Optional[int]) -> int:
+        if as_of is not None:
+            return as_of
+        return s.keys[-1][0] if s.keys else date.today().toordinal()
+
+    def _window_stats(
+        self,
+        s: _Series,
+        as_of: Optional[int],
+        days: int,
+        bands: Tuple[int, ...] = PERCENTILES,
+    ) -> Dict[str, Any]:
+        end = self._end_day(s, as_of)
+        start = end - max(1, days) + 1
+        lo, hi = s.window(start, end)
+        out = s.moments(lo, hi)
+        out["from"] = date.fromordinal(start).isoformat()
+        out["to"] = date.fromordinal(end).isoformat()
+        if out["count"] == 0:
+            return out
+        prices = sorted(p["price"] for p in s.points[lo:hi])
+        for p in bands:
+            out["median" if p == 50 else f"p{p}"] = _percentile(prices, p)
+        out["min"], out["max"] = prices[0], prices[-1]
+        last = s.points[hi - 1]
+        out["latest"] = {"price": last["price"], "invoice_date": last["invoice_date"],
+                         "vendor_name": last["vendor_name"], "document_id": last["document_id"]}
+        return out
+
+    @staticmethod
+    def _z(stats: Dict[str, Any], price: float) -> Optional[float]:
+        std = stats.get("std")
+        if not std or stats.get("count", 0) < 2:
+            return None
+        return round((price - stats["mean"]) / std, 3)
+
+    @staticmethod
+    def _rounded(stats: Dict[str, Any]) -> Dict[str, Any]:
+        out = dict(stats)
+        for k in ("mean", "std", "median", "min", "max") + tuple(f"p{p}" for p in PERCENTILES if p != 50):
+            if out.get(k) is not None:
+                out[k] = round(out[k], 5)
+        slope = out.pop("slope_per_day", None)
+        out["trend"] = None if slope is None else {
+            "slope_per_day": round(slope, 6),
+            "change_per_30d": round(slope * 30, 5),
+            "pct_per_30d": round(slope * 30 / out["mean"] * 100, 2) if out.get("mean") else None,
+        }
+        return out
+
+    def stats(
+        self,
+        airport_code: str,
+        *,
+        vendor: Optional[str] = None,
+        days: int = FUEL_INDEX_WINDOW_DAYS,
+        as_of: Optional[str] = None,
+        price: Optional[float] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """Rolling stats for the airport (or one vendor there) over `days` ending at as_of / the latest price."""
+        airport = _normalize_airport(airport_code)
+        if not airport:
+            return None
+        with self._lock:
+            s = self._get(airport, _vendor_key(vendor))
+            if s is None or not s.keys:
+                return None
+            out = self._window_stats(s, _day(as_of), days)
+        if price is not None:
+            out["price"] = price
+            out["zscore"] = self._z(out, price)
+        out = self._rounded(out)
+        return {"airport_code": airport, "vendor": vendor or None, "window_days": days, **out}
+
+    def vendors(self, airport_code: str, *, days: int = FUEL_INDEX_WINDOW_DAYS) -> List[Dict[str, Any]]:
+        """stats() for each vendor at the airport with a price in the window."""
+        airport = _normalize_airport(airport_code)
+        with self._lock:
+            series = [(v, s) for (a, v), s in self._series.items() if a == airport and v and s.keys]
+            end = self._end_day(self._get(airport) or _Series(), None)
+            rows = []
+            for _, s in series:
+                st = self._window_stats(s, end, days)
+                if st["count"]:
+                    name = st["latest"]["vendor_name"]
+                    rows.append({"vendor": name, **self._rounded(st)})
+        rows.sort(key=lambda r: r.get("median") or 0)
+        return rows
+
+    def airports(self, *, days: int = FUEL_INDEX_WINDOW_DAYS) -> List[Dict[str, Any]]:
+        """Per-airport summary (window ending at each airport's latest price)."""
+        with self._lock:
+            keys = [a for (a, v), s in self._series.items() if not v and s.keys]
+            rows = [{"airport_code": a, **self._rounded(self._window_stats(self._series[(a, "")], None, days))} for a in keys]
+        rows.sort(key=lambda r: r["airport_code"])
+        return rows
+
+
+# ── Process-wide index ───────────────────────────────────────────────────────
+
+_index: Optional[FuelPriceIndex] = None
+_index_lock = threading.Lock()
+_stats = {"loads": 0, "load_errors": 0, "rows_added": 0, "last_load_ms": None}
+
+# Rows stored while a load runs (None when none is running), and the lock
+# that orders them against swapping the new index in.
+_pending: Optional[List[Dict[str, Any]]] = None
+_pending_lock = threading.Lock()
+
+
+def _on_stored(rows: List[Dict[str, Any]]) -> None:
+    with _pending_lock:
+        if _pending is not None:
+            _pending.extend(rows)
+        idx = _index
+    if idx is None:
+        return
+    for row in rows:
+        idx.add(row)
+    _stats["rows_added"] += len(rows)
+
+
+fuel_prices.add_store_listener(_on_stored)
+
+
+def get_price_index(max_age_s: int = FUEL_INDEX_TTL_S) -> FuelPriceIndex:
+    """The instance's index, loaded on first use and reloaded after max_age_s."""
+    global _index, _pending
+    idx = _index
+    if idx is not None and time.time() - idx.loaded_at < max_age_s:
+        return idx
+    with _index_lock:
+        idx = _index
+        if idx is not None and time.time() - idx.loaded_at < max_age_s:
+            return idx
+        started = time.time()
+        with _pending_lock:
+            _pending = []
+        try:
+            fresh = FuelPriceIndex.load()
+        except Exception as e:
+            with _pending_lock:
+                _pending = None
+            _stats["load_errors"] += 1
+            if idx is None:
+                raise
+            # Keep serving the stale index; retry on the next call.
+            log.warning("fuel price index reload failed: %s", e)
+            return idx
+        with _pending_lock:
+            # The load may have read some of these already; add() replaces by document.
+            for row in _pending or []:
+                fresh.add(row)
+            _pending = None
+            _index = fresh
+        _stats["loads"] += 1
+        _stats["last_load_ms"] = int((time.time() - started) * 1000)
+        return fresh
+
+
+def index_stats() -> Dict[str, Any]:
+    idx = _index
+    return {
+        **_stats,
+        "loaded": idx is not None,
+        "documents": len(idx) if idx is not None else 0,
+        "age_s": int(time.time() - idx.loaded_at) if idx is not None else None,
+    }
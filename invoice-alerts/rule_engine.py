@@ -0,0 +1,264 @@
+# rule_engine.py — Compiled rule set: every enabled rule against an invoice in one pass.
+#
+# rules.rule_matches() re-normalizes a rule's keywords and allow-lists on
+# every call and scans each line item once per keyword per rule, rebuilding
+# the invoice text each time.  CompiledRuleSet does that work once per rule
+# table:
+#   - vendor / doc_type / airport allow-lists become frozensets
+#   - the keywords of all rules go into one Aho-Corasick automaton, so the
+#     invoice text and each line-item description are scanned once and
+#     yield the keywords they contain; each rule then intersects that with
+#     its own keyword ids
+#
+# Results are the same RuleMatchResult rule_matches() returns (reasons,
+# matched_line_items order, sorted keywords) — test_rule_engine.py checks
+# that differentially, bench_rules.py times both on real invoices.
+#
+#   ruleset = CompiledRuleSet(_fetch_rules())
+#   for rule, result in ruleset.match_all(invoice):   # enabled rules, table order
+#       ...
+
+from collections import deque
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+from rules import (
+    RuleMatchResult,
+    _is_rule_enabled,
+    _line_item_is_charged,
+    _listify,
+    _norm,
+    _to_float,
+    rule_matches,
+)
+
+
+class KeywordAutomaton:
+    """Aho-Corasick over a fixed keyword list; find() returns the ids of keywords occurring in a text."""
+
+    def __init__(self, keywords: Sequence[str]) -> None:
+        self.keywords = list(keywords)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[FrozenSet[int]] = [frozenset()]
+
+        own: List[set] = [set()]
+        for kid, kw in enumerate(self.keywords):
+            state = 0
+            for ch in kw:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    own.append(set())
+                state = nxt
+            own[state].add(kid)
+
+        # BFS: failure links, and each state's output = own ∪ output(fail).
+        out: List[FrozenSet[int]] = [frozenset(own[0])] * len(self._goto)
+        queue = deque()
+        for nxt in self._goto[0].values():
+            out[nxt] = frozenset(own[nxt])
+            queue.append(nxt)
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                f = self._goto[f].get(ch, 0)
+                self._fail[nxt] = f if f != nxt else 0
+                out[nxt] = frozenset(own[nxt]) | out[self._fail[nxt]]
+                queue.append(nxt)
+        self._out = out
+
+    def find(self, text: str) -> FrozenSet[int]:
+        if not text or not self.keywords:
+            return frozenset()
+        goto, fail, out = self._goto, self._fail, self._out
+        found: set = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return frozenset(found)
+
+
+def _allowed(v: Any) -> Optional[FrozenSet[str]]:
+    """None: no filter.  Otherwise the normalized allow-set (possibly empty: nothing passes)."""
+    vals = _listify(v)
+    if not vals:
+        return None
+    return frozenset(n for n in (_norm(x) for x in vals) if n)
+
+
+class CompiledRule:
+    """One rule's filters and thresholds, pre-normalized."""
+
+    __slots__ = (
+        "rule", "enabled", "vendor_allowed", "doc_type_allowed", "airport_allowed",
+        "require_review_required", "min_total", "has_keywords", "keyword_ids",
+        "require_charged_line_items", "min_line_item_amount",
+    )
+
+    def __init__(self, rule: Dict[str, Any], keyword_ids: FrozenSet[int]) -> None:
+        self.rule = rule
+        self.enabled = _is_rule_enabled(rule)
+        self.vendor_allowed = _allowed(rule.get("vendor_normalized_in"))
+        self.doc_type_allowed = _allowed(rule.get("doc_type_in"))
+        self.airport_allowed = _allowed(rule.get("airport_code_in"))
+        self.require_review_required = rule.get("require_review_required") is True
+        self.min_total = _to_float(rule.get("min_total"))
+        self.has_keywords = any(str(k) for k in _listify(rule.get("keywords")) if k)
+        self.keyword_ids = keyword_ids
+        self.require_charged_line_items = bool(rule.get("require_charged_line_items"))
+        self.min_line_item_amount = _to_float(rule.get("min_line_item_amount"))
+
+
+def _rule_keywords(rule: Dict[str, Any]) -> List[str]:
+    return [k for k in (_norm(str(k)) for k in _listify(rule.get("keywords")) if k) if k]
+
+
+class InvoiceScan:
+    """An invoice's normalized filter fields and keyword hits, computed once for all rules."""
+
+    __slots__ = ("invoice", "vendor", "doc_type", "airport", "line_items", "all_hits", "items_by_keyword")
+
+    def __init__(self, invoice: Dict[str, Any], automaton: KeywordAutomaton) -> None:
+        self.invoice = invoice
+        self.vendor = _norm(invoice.get("vendor_normalized") or invoice.get("vendor_name"))
+        self.doc_type = _norm(invoice.get("doc_type"))
+        self.airport = _norm(invoice.get("airport_code"))
+        self.line_items: List[Dict[str, Any]] = invoice.get("line_items") or []
+
+        invoice_text = " ".join(
+            [
+                _norm(invoice.get("vendor_name")),
+                _norm(invoice.get("vendor_normalized")),
+                _norm(invoice.get("invoice_number")),
+                _norm(invoice.get("airport_code")),
+                _norm(invoice.get("tail_number")),
+                _norm(invoice.get("doc_type")),
+            ]
+        )
+        all_hits = set(automaton.find(invoice_text))
+
+        # keyword id -> indexes of the line items whose description contains it
+        by_desc: Dict[str, FrozenSet[int]] = {}
+        self.items_by_keyword: Dict[int, List[int]] = {}
+        for i, li in enumerate(self.line_items):
+            desc = _norm(li.get("description") or li.get("name") or li.get("desc"))
+            hits = by_desc.get(desc)
+            if hits is None:
+                hits = by_desc[desc] = automaton.find(desc)
+            for kid in hits:
+                self.items_by_keyword.setdefault(kid, []).append(i)
+            all_hits.update(hits)
+        self.all_hits = frozenset(all_hits)
+
+
+class CompiledRuleSet:
+    """Rules compiled once (per rules-table version); evaluate any number of invoices."""
+
+    def __init__(self, rules: List[Dict[str, Any]]) -> None:
+        self.rules = list(rules)
+        kw_index: Dict[str, int] = {}
+        per_rule: List[FrozenSet[int]] = []
+        for rule in self.rules:
+            ids = set()
+            for kw in _rule_keywords(rule):
+                ids.add(kw_index.setdefault(kw, len(kw_index)))
+            per_rule.append(frozenset(ids))
+        self.automaton = KeywordAutomaton(list(kw_index))
+        self.compiled = [CompiledRule(rule, ids) for rule, ids in zip(self.rules, per_rule)]
+        self._by_identity = {id(c.rule): c for c in self.compiled}
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def scan(self, invoice: Dict[str, Any]) -> InvoiceScan:
+        return InvoiceScan(invoice, self.automaton)
+
+    def evaluate(self, c: CompiledRule, scan: InvoiceScan) -> RuleMatchResult:
+        """rule_matches(c.rule, scan.invoice), from the precomputed scan."""
+        if not c.enabled:
+            return RuleMatchResult(False, "rule disabled", [], [])
+
+        if c.vendor_allowed is not None and scan.vendor not in c.vendor_allowed:
+            return RuleMatchResult(False, "vendor filter mismatch", [], [])
+        if c.doc_type_allowed is not None and scan.doc_type not in c.doc_type_allowed:
+            return RuleMatchResult(False, "doc_type filter mismatch", [], [])
+        if c.airport_allowed is not None and scan.airport not in c.airport_allowed:
+            return RuleMatchResult(False, "airport filter mismatch", [], [])
+        if c.require_review_required and not bool(scan.invoice.get("review_required")):
+            return RuleMatchResult(False, "invoice not review_required", [], [])
+
+        if c.min_total is not None:
+            inv_total = _to_float(scan.invoice.get("total"))
+            if inv_total is not None and inv_total < c.min_total:
+                return RuleMatchResult(False, "total below min_total", [], [])
+
+        # Keywords: hit anywhere in the invoice text or any description;
+        # line items count when their own description hits.
+        hit_ids = c.keyword_ids & scan.all_hits
+        matched_kws: List[str] = []
+        matched_items: List[Dict[str, Any]] = []
+        if hit_ids:
+            keywords = self.automaton.keywords
+            matched_kws = sorted(keywords[i] for i in hit_ids)
+            item_idx: set = set()
+            for kid in hit_ids:
+                item_idx.update(scan.items_by_keyword.get(kid, ()))
+            for i in sorted(item_idx):
+                li = scan.line_items[i]
+                if c.require_charged_line_items and not _line_item_is_charged(li):
+                    continue
+                matched_items.append(li)
+
+        if c.has_keywords and not matched_kws:
+            return RuleMatchResult(False, "no keyword match", [], [])
+
+        if c.require_charged_line_items and not matched_items:
+            return RuleMatchResult(False, "no charged line item matches", [], matched_kws)
+
+        if c.min_line_item_amount is not None:
+            qualifying = [li for li in matched_items if (_to_float(li.get("total")) or 0.0) >= c.min_line_item_amount]
+            if not qualifying:
+                return RuleMatchResult(
+                    False,
+                    f"no line items >= {c.min_line_item_amount}",
+                    matched_items,
+                    matched_kws,
+                )
+            matched_items = qualifying
+
+        reason = "matched"
+        if matched_kws:
+            reason = f"keyword match: {', '.join(matched_kws)}"
+
+        return RuleMatchResult(True, reason, matched_items, matched_kws)
+
+    def match_all(
+        self,
+        invoice: Dict[str, Any],
+        *,
+        include_disabled: bool = False,
+    ) -> List[Tuple[Dict[str, Any], RuleMatchResult]]:
+        """(rule, result) for every enabled rule (all rules with include_disabled), in table order."""
+        scan = self.scan(invoice)
+        return [
+            (c.rule, self.evaluate(c, scan))
+            for c in self.compiled
+            if c.enabled or include_disabled
+        ]
+
+    def match_rule(self, rule: Dict[str, Any], invoice: Dict[str, Any]) -> RuleMatchResult:
+        """One rule from this set against an invoice; a rule dict from elsewhere goes through rule_matches()."""
+        c = self._by_identity.get(id(rule))
+        if c is None:
+            return rule_matches(rule, invoice)
+        return self.evaluate(c, self.scan(invoice))
@@ -0,0 +1,179 @@
+# slack_delivery.py — Rate-limited, concurrent Slack webhook sender for flush_alerts.
+#
+# Slack incoming webhooks allow about one message per second per webhook,
+# with short bursts, and answer 429 + Retry-After beyond that.  SlackSender
+# posts through one pooled requests.Session from any number of threads;
+# every attempt first takes a token from a shared TokenBucket, and a 429
+# pauses the whole bucket for Retry-After before that message is retried.
+#
+# Only 429s are retried: Slack didn't accept the message, so a retry can't
+# double-post.  Timeouts and 5xx are reported as errors, as _slack_post
+# always did (the message may have gone through).  A message still rate
+# limited after SLACK_MAX_RETRIES, or whose Retry-After exceeds
+# SLACK_MAX_RETRY_AFTER_S, comes back with rate_limited=True so the caller
+# can put the alert back to pending.
+#
+#   sender = slack_sender(SLACK_WEBHOOK_URL)      # process-wide per webhook
+#   res = sender.post(payload)                    # {"ok", "status_code", "attempts", ...}
+#
+# Env:
+#   SLACK_RATE_PER_S          sustained sends per second (default 1)
+#   SLACK_BURST               bucket size (default 4)
+#   SLACK_MAX_RETRIES         429 retries per message (default 3)
+#   SLACK_MAX_RETRY_AFTER_S   longest Retry-After to wait out (default 30)
+#
+# fake_slack.py is a local webhook with the same limits, for load tests.
+
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import requests
+
+SLACK_RATE_PER_S = float(os.getenv("SLACK_RATE_PER_S", "1"))
+SLACK_BURST = int(os.getenv("SLACK_BURST", "4"))
+SLACK_MAX_RETRIES = int(os.getenv("SLACK_MAX_RETRIES", "3"))
+SLACK_MAX_RETRY_AFTER_S = float(os.getenv("SLACK_MAX_RETRY_AFTER_S", "30"))
+
+_DEFAULT_RETRY_AFTER_S = 1.0
+
+
+class TokenBucket:
+    """rate tokens/s up to burst; acquire() blocks for the next token.  Thread-safe."""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = max(0.001, float(rate))
+        self.burst = max(1, int(burst))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Take one token; False if that would take longer than timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait_s = self._paused_until - now
+                else:
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return True
+                    wait_s = (1 - self._tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait_s > deadline:
+                return False
+            time.sleep(wait_s)
+
+    def pause(self, seconds: float) -> None:
+        """Hand out nothing for `seconds` (Retry-After), then restart from an empty bucket."""
+        with self._lock:
+            until = time.monotonic() + max(0.0, seconds)
+            if until > self._paused_until:
+                self._paused_until = until
+                self._tokens = 0.0
+                self._updated = until
+
+
+def _retry_after_s(r: requests.Response) -> float:
+    try:
+        return max(0.0, float(r.headers.get("Retry-After", "")))
+    except ValueError:
+        return _DEFAULT_RETRY_AFTER_S
+
+
+class SlackSender:
+    """One webhook: pooled connection, shared rate limit.  Thread-safe."""
+
+    def __init__(
+        self,
+        webhook_url: str,
+        *,
+        rate_per_s: float = SLACK_RATE_PER_S,
+        burst: int = SLACK_BURST,
+        max_retries: int = SLACK_MAX_RETRIES,
+        max_retry_after_s: float = SLACK_MAX_RETRY_AFTER_S,
+        timeout: float = 10,
+    ) -> None:
+        self.webhook_url = webhook_url
+        self.bucket = TokenBucket(rate_per_s, burst)
+        self.max_retries = max_retries
+        self.max_retry_after_s = max_retry_after_s
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=16)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._lock = threading.Lock()
+        self._stats = {"sent": 0, "errors": 0, "rate_limited": 0, "retries": 0}
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._stats[key] += 1
+
+    def post(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Post one message.  Never raises; returns diagnostic info (safe to log)."""
+        attempts = 0
+        while True:
+            if not self.bucket.acquire(timeout=self.max_retry_after_s):
+                self._count("rate_limited")
+                return {"ok": False, "rate_limited": True, "attempts": attempts, "error": "local_rate_limit_wait"}
+            attempts += 1
+            try:
+                r = self.session.post(self.webhook_url, json=payload, timeout=self.timeout)
+            except Exception as e:
+                self._count("errors")
+                return {"ok": False, "attempts": attempts, "error": type(e).__name__}
+
+            if r.status_code != 429:
+                ok = 200 <= r.status_code < 300
+                self._count("sent" if ok else "errors")
+                out: Dict[str, Any] = {"ok": ok, "status_code": r.status_code, "attempts": attempts}
+                if not ok:
+                    out["response_text"] = (r.text or "")[:500]
+                return out
+
+            retry_after = _retry_after_s(r)
+            self.bucket.pause(retry_after)
+            if attempts > self.max_retries or retry_after > self.max_retry_after_s:
+                self._count("rate_limited")
+                return {
+                    "ok": False,
+                    "status_code": 429,
+                    "rate_limited": True,
+                    "retry_after_s": retry_after,
+                    "attempts": attempts,
+                }
+            self._count("retries")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats)
+
+
+_senders: Dict[str, SlackSender] = {}
+_senders_lock = threading.Lock()
+
+
+def slack_sender(webhook_url: str) -> SlackSender:
+    """The process-wide sender (and so the shared rate limit) for this webhook."""
+    with _senders_lock:
+        sender = _senders.get(webhook_url)
+        if sender is None:
+            sender = _senders[webhook_url] = SlackSender(webhook_url)
+        return sender
+
+
+def sender_stats() -> Dict[str, Dict[str, Any]]:
+    """stats() for every webhook sender in this process, for /health (URLs not exposed)."""
+    with _senders_lock:
+        senders = list(_senders.values())
+    return {f"webhook_{i}": s.stats() for i, s in enumerate(senders)}
@@ -130,17 +130,27 @@ def safe_select_many(
     *,
     eq: Optional[Dict[str, Any]] = None,
     gte: Optional[Dict[str, Any]] = None,
+    gt: Optional[Dict[str, Any]] = None,
     not_in: Optional[Dict[str, List[Any]]] = None,
     limit: int = 100,
     order: Optional[str] = None,
     desc: bool = False,
+    filters: Optional[Dict[str, str]] = None,
 ) -> List[Dict[str, Any]]:
+    """
+    filters: raw PostgREST params applied last, for what the keyword
+    arguments don't cover (ilike, in, lte, and/or trees, multi-column order).
+    """
     url = f"{REST_BASE}/{table}"
     params: Dict[str, str] = {"select": columns, "limit": str(int(limit))}
     params.update(_build_eq_params(eq))
     if gte:
         for k, v in gte.items():
             params[k] = f"gte.{v}"
+    if gt:
+        # Keyset pagination: gt={"id": last_id} with order="id"
+        for k, v in gt.items():
+            params[k] = f"gt.{v}"
     if not_in:
         for k, values in not_in.items():
             in_vals = ",".join(str(v) for v in values)
@@ -148,6 +158,8 @@ def safe_select_many(
     if order:
         direction = "desc" if desc else "asc"
         params["order"] = f"{order}.{direction}"
+    if filters:
+        params.update(filters)
     r = _request_with_retry("GET", url, headers=_DEFAULT_HEADERS, params=params)
     _raise_for_status(r)
     data = r.json() or []
@@ -190,6 +202,43 @@ def safe_insert(
     return data[0]
 
 
+def safe_insert_many(
+    table: str,
+    rows: List[Dict[str, Any]],
+    *,
+    on_conflict: Optional[str] = None,
+    returning: bool = True,
+) -> List[Dict[str, Any]]:
+    """Bulk INSERT in one request.
+
+    With on_conflict, rows hitting that unique key are skipped
+    (ON CONFLICT DO NOTHING) instead of failing the whole batch, and only
+    the rows actually inserted come back.  Rows are padded to the same
+    keys (missing -> null), as PostgREST requires for a bulk insert.
+    Returns [] when returning=False.
+    """
+    if not rows:
+        return []
+    keys: List[str] = []
+    for row in rows:
+        keys.extend(k for k in row if k not in keys)
+    body = [{k: row.get(k) for k in keys} for row in rows]
+
+    url = f"{REST_BASE}/{table}"
+    headers = dict(_DEFAULT_HEADERS)
+    prefer = ["return=representation" if returning else "return=minimal"]
+    params: Dict[str, str] = {}
+    if on_conflict:
+        prefer.append("resolution=ignore-duplicates")
+        params["on_conflict"] = on_conflict
+    headers["Prefer"] = ",".join(prefer)
+    r = _request_with_retry("POST", url, headers=headers, params=params, json_body=body, timeout=60)
+    _raise_for_status(r)
+    if not returning:
+        return []
+    return list(r.json() or [])
+
+
 def safe_upsert(
     table: str,
     row: Dict[str, Any],
@@ -213,6 +262,29 @@ def safe_upsert(
     return data[0]
 
 
+def safe_upsert_many(
+    table: str,
+    rows: List[Dict[str, Any]],
+    *,
+    on_conflict: str = "document_id",
+) -> int:
+    """Bulk INSERT … ON CONFLICT (on_conflict) DO UPDATE in one request.
+
+    Every row must carry the same keys, and no two rows may share the
+    conflict key (Postgres rejects updating a row twice in one statement).
+    Returns the number of rows sent.
+    """
+    if not rows:
+        return 0
+    url = f"{REST_BASE}/{table}"
+    headers = dict(_DEFAULT_HEADERS)
+    headers["Prefer"] = "return=minimal,resolution=merge-duplicates"
+    params: Dict[str, str] = {"on_conflict": on_conflict}
+    r = _request_with_retry("POST", url, headers=headers, params=params, json_body=rows, timeout=60)
+    _raise_for_status(r)
+    return len(rows)
+
+
 def safe_update(
     table: str,
     row_id: str,
@@ -255,6 +327,21 @@ def safe_update_where(
     return len(data)
 
 
+def safe_rpc(
+    fn: str,
+    args: Optional[Dict[str, Any]] = None,
+    *,
+    timeout: int = 15,
+) -> Any:
+    """POST /rpc/{fn} and return the decoded result (None for void functions)."""
+    url = f"{REST_BASE}/rpc/{fn}"
+    r = _request_with_retry("POST", url, headers=_DEFAULT_HEADERS, json_body=args or {}, timeout=timeout)
+    _raise_for_status(r)
+    if not r.content:
+        return None
+    return r.json()
+
+
 def log_pipeline_run(
     pipeline: str,
     *,
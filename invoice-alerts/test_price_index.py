@@ -0,0 +1,117 @@
+import os
+import random
+from datetime import date, timedelta
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "test")
+
+import price_index  # noqa: E402
+from fuel_prices import _compare_to_previous  # noqa: E402
+from price_index import FuelPriceIndex  # noqa: E402
+
+# FuelPriceIndex.check must agree with check_price_increase(), i.e.
+# _compare_to_previous over the airport's rows newest invoice_date first.
+
+AIRPORTS = ["BOS", "TEB", "VNY"]
+VENDORS = ["Signature", "Atlantic Aviation", "Jet Aviation"]
+START = date(2026, 1, 1)
+
+
+def _row(i: int, airport: str, vendor: str, day: int, price: float) -> dict:
+    return {
+        "id": f"f{i}",
+        "document_id": f"d{i}",
+        "airport_code": airport,
+        "vendor_name": vendor,
+        "effective_price_per_gallon": price,
+        "invoice_date": (START + timedelta(days=day)).isoformat(),
+    }
+
+
+def _random_rows(rng: random.Random, n: int) -> list:
+    # Distinct dates per airport, so "newest" is never a tie.
+    days = {a: rng.sample(range(365), n) for a in AIRPORTS}
+    return [
+        _row(i, AIRPORTS[i % 3], rng.choice(VENDORS), days[AIRPORTS[i % 3]][i], round(rng.uniform(4, 9), 3))
+        for i in range(n)
+    ]
+
+
+def _index(rows: list) -> FuelPriceIndex:
+    idx = FuelPriceIndex()
+    for r in rows:
+        idx.add(r)
+    return idx
+
+
+def test_check_matches_compare_to_previous():
+    rng = random.Random(7)
+    for _ in range(50):
+        rows = _random_rows(rng, rng.randint(1, 30))
+        idx = _index(rows)
+        for _ in range(10):
+            airport = rng.choice(AIRPORTS)
+            price = round(rng.uniform(4, 10), 3)
+            doc_id = rng.choice([None, rng.choice(rows)["document_id"]])
+            history = sorted((r for r in rows if r["airport_code"] == airport),
+                             key=lambda r: r["invoice_date"], reverse=True)
+            expected = _compare_to_previous(history, price, doc_id)
+            got = idx.check(airport.lower(), price, doc_id)
+            if expected is None:
+                assert got is None
+            else:
+                assert {k: got[k] for k in expected} == expected
+
+
+def test_check_as_of_invoice_date_ignores_later_prices():
+    idx = _index([_row(1, "BOS", "Signature", 0, 5.0), _row(2, "BOS", "Signature", 30, 4.0)])
+    as_of = (START + timedelta(days=10)).isoformat()
+    assert idx.check("BOS", 5.5, "d3", invoice_date=as_of)["previous_document_id"] == "d1"
+    assert idx.check("BOS", 5.5, "d3")["previous_document_id"] == "d2"
+
+
+def test_stats_window():
+    rows = [_row(i, "BOS", VENDORS[i % 2], i * 10, 5.0 + i) for i in range(10)]  # days 0..90
+    idx = _index(rows)
+
+    st = idx.stats("BOS", days=31)  # days 60..90
+    assert st["count"] == 4
+    assert st["mean"] == 12.5
+    assert st["median"] == 12.5
+    assert (st["min"], st["max"]) == (11.0, 14.0)
+    assert st["latest"]["document_id"] == "d9"
+    assert st["trend"]["slope_per_day"] == 0.1
+
+    as_of = (START + timedelta(days=25)).isoformat()
+    st = idx.stats("BOS", days=30, as_of=as_of)  # days -4..25
+    assert st["count"] == 3 and st["max"] == 7.0
+
+    st = idx.stats("BOS", vendor="signature", days=365)
+    assert st["count"] == 5 and st["min"] == 5.0
+
+    assert idx.stats("SFO") is None
+
+
+def test_add_replaces_document():
+    idx = _index([_row(1, "BOS", "Signature", 0, 5.0)])
+    idx.add(_row(1, "TEB", "Signature", 0, 6.0))
+    assert idx.stats("BOS") is None
+    assert idx.stats("TEB")["count"] == 1
+    assert len(idx) == 1
+
+
+def test_rows_stored_during_reload_reach_new_index(monkeypatch):
+    stored_mid_load = _row(2, "BOS", "Signature", 5, 7.0)
+
+    def load():
+        fresh = _index([_row(1, "BOS", "Signature", 0, 5.0)])
+        price_index._on_stored([stored_mid_load])  # a write racing the reload
+        return fresh
+
+    monkeypatch.setattr(price_index, "_index", None)
+    monkeypatch.setattr(FuelPriceIndex, "load", staticmethod(load))
+    idx = price_index.get_price_index(max_age_s=0)
+    assert price_index._index is idx
+    assert len(idx) == 2
+    assert idx.stats("BOS", days=365)["latest"]["document_id"] == "d2"
+    assert price_index._pending is None
@@ -0,0 +1,95 @@
+import random
+
+from rule_engine import CompiledRuleSet, KeywordAutomaton
+from rules import rule_matches
+
+# Differential test: CompiledRuleSet must return exactly what rule_matches does.
+
+VOCAB = [
+    "handling", "handling fee", "de-ice", "de-icing", "deice", "fsii", "jet a",
+    "ramp", "ramp fee", "overtime", "call out", "callout", "gpu", "lav", "catering",
+    "security", "infrastructure", "facility fee", "landing", "parking", "hangar",
+    "a", "fee", "é", "  Handling  ", "",
+]
+DESCRIPTIONS = [
+    "Handling Fee", "De-Icing Type I", "DEICE FLUID", "Jet A w/ FSII", "Ramp fee waived",
+    "Overtime / Call Out", "GPU", "Lav service", "Catering - crew", "Security Fee",
+    "Infrastructure fee", "Facility Fee", "Landing", "Hangar overnight", "Parking",
+    "Café", "", None,
+]
+VENDORS = ["Signature", "Atlantic Aviation", "Jet Aviation", "Million Air", None, ""]
+AIRPORTS = ["BOS", "teb", "KVNY", None, ""]
+DOC_TYPES = ["fbo_fee", "fuel", "invoice", None]
+
+
+def _random_rule(rng: random.Random, i: int) -> dict:
+    rule = {"id": f"r{i}", "name": f"Rule {i}", "is_enabled": rng.random() > 0.1}
+    if rng.random() < 0.1:
+        rule.pop("is_enabled")
+        rule["enabled"] = rng.random() > 0.5
+    if rng.random() < 0.8:
+        kws = rng.sample(VOCAB, rng.randint(0, 4))
+        rule["keywords"] = kws[0] if (kws and rng.random() < 0.1) else kws
+    if rng.random() < 0.2:
+        rule["vendor_normalized_in"] = rng.sample(["signature", " Atlantic Aviation ", "", "jet aviation"], 2)
+    if rng.random() < 0.2:
+        rule["doc_type_in"] = rng.sample(["fbo_fee", "FUEL", "invoice", ""], 2)
+    if rng.random() < 0.2:
+        rule["airport_code_in"] = rng.choice([["bos"], ["TEB", "KVNY"], [""], "BOS"])
+    if rng.random() < 0.15:
+        rule["require_review_required"] = rng.choice([True, False, None])
+    if rng.random() < 0.2:
+        rule["min_total"] = rng.choice([100, "250.00", "$1,000", None, ""])
+    if rng.random() < 0.4:
+        rule["require_charged_line_items"] = rng.choice([True, False])
+    if rng.random() < 0.2:
+        rule["min_line_item_amount"] = rng.choice([50, "75", 0, None])
+    return rule
+
+
+def _random_invoice(rng: random.Random) -> dict:
+    items = []
+    for _ in range(rng.randint(0, 8)):
+        li = {rng.choice(["description", "name", "desc"]): rng.choice(DESCRIPTIONS)}
+        li["total"] = rng.choice([0, 0.01, -25, 40, 80, "125.50", None])
+        if rng.random() < 0.3:
+            li["unit_price"] = rng.choice([0, "0", 12.5, None])
+        items.append(li)
+    return {
+        "vendor_name": rng.choice(VENDORS),
+        "vendor_normalized": rng.choice(VENDORS),
+        "invoice_number": rng.choice(["INV-1", "handling-22", None]),
+        "airport_code": rng.choice(AIRPORTS),
+        "tail_number": rng.choice(["N123AB", "N1FSII", None]),
+        "doc_type": rng.choice(DOC_TYPES),
+        "review_required": rng.choice([True, False, None]),
+        "total": rng.choice([50, "300", "$2,000.00", None]),
+        "line_items": items if rng.random() > 0.05 else None,
+    }
+
+
+def test_automaton_finds_overlapping_keywords():
+    ac = KeywordAutomaton(["he", "she", "his", "hers", "e"])
+    found = {ac.keywords[i] for i in ac.find("ushers")}
+    assert found == {"she", "he", "hers", "e"}
+    assert ac.find("") == frozenset()
+
+
+def test_compiled_matches_rule_matches():
+    rng = random.Random(20261016)
+    for _ in range(40):
+        rules = [_random_rule(rng, i) for i in range(rng.randint(1, 25))]
+        ruleset = CompiledRuleSet(rules)
+        for _ in range(25):
+            invoice = _random_invoice(rng)
+            got = dict((id(r), res) for r, res in ruleset.match_all(invoice, include_disabled=True))
+            for rule in rules:
+                assert got[id(rule)] == rule_matches(rule, invoice), (rule, invoice)
+
+
+def test_match_all_skips_disabled_rules():
+    rules = [{"id": "a", "is_enabled": True, "keywords": ["gpu"]}, {"id": "b", "is_enabled": False, "keywords": ["gpu"]}]
+    invoice = {"line_items": [{"description": "GPU", "total": 40}]}
+    out = CompiledRuleSet(rules).match_all(invoice)
+    assert [r["id"] for r, _ in out] == ["a"]
+    assert out[0][1].matched and out[0][1].matched_keywords == ["gpu"]
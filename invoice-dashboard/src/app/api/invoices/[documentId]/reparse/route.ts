@@ -77,8 +77,10 @@ export async function POST(
     // Reset document status so parse_document will process it
     await supa
       .from("documents")
-      .update({ status: "uploaded", parse_error: null })
-      .eq("id", documentId);
+      .update({ status: "uploaded", parse_error: null, claim_attempts: 0 })
+      .eq("id", documentId)
+      // leased to a parser or reserved by a batch extraction: leave it be
+      .not("status", "in", "(processing,batch_pending)");
 
     // Fire-and-forget: trigger the parser without waiting for it to finish.
     // Parsing can take 30-120s (OpenAI extraction + validation) which exceeds
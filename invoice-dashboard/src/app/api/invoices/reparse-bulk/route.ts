@@ -81,8 +81,10 @@ export async function POST(req: NextRequest) {
 
         await supa
           .from("documents")
-          .update({ status: "uploaded", parse_error: null })
-          .eq("id", documentId);
+          .update({ status: "uploaded", parse_error: null, claim_attempts: 0 })
+          .eq("id", documentId)
+          // leased to a parser or reserved by a batch extraction: leave it be
+          .not("status", "in", "(processing,batch_pending)");
       } catch {
         // DB cleanup failed — skip this doc
         results.push({ id: documentId, status: "error" });
@@ -0,0 +1,141 @@
+-- Leased claims for invoice-parser /jobs/parse_next.
+--
+-- claim_documents() claims a batch of documents in one statement
+-- (FOR UPDATE SKIP LOCKED, so concurrent instances never claim the same
+-- row) and stamps each with the claiming worker and a lease expiry.
+-- Workers extend their leases with heartbeat_document_leases() while a
+-- document is being parsed.  A lease that is not renewed (instance crashed,
+-- request killed) goes stale: release_stale_document_leases() puts the
+-- document back to 'uploaded', or 'failed' once it has been claimed
+-- p_max_attempts times.  claim_documents() runs it first, so stale rows are
+-- recovered by the next claim without a separate job.
+--
+-- claim_document() leases one named document (the parse queue,
+-- /jobs/parse_document, reparses) and counts the claim the same way.
+-- claim_attempts goes back to 0 when a parse finishes.
+
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS lease_owner TEXT;
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMPTZ;
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS claim_attempts INT NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS idx_documents_status_created
+  ON documents (status, created_at);
+
+CREATE INDEX IF NOT EXISTS idx_documents_processing_lease
+  ON documents (lease_expires_at)
+  WHERE status = 'processing';
+
+
+CREATE OR REPLACE FUNCTION release_stale_document_leases(p_max_attempts INT DEFAULT 3)
+RETURNS SETOF documents.id%TYPE AS $$
+  UPDATE documents
+     SET status = CASE WHEN claim_attempts >= p_max_attempts THEN 'failed' ELSE 'uploaded' END,
+         parse_error = CASE WHEN claim_attempts >= p_max_attempts
+                            THEN 'lease expired after ' || claim_attempts || ' claims (worker lost)'
+                            ELSE parse_error END,
+         lease_owner = NULL,
+         lease_expires_at = NULL
+   WHERE status = 'processing'
+     AND lease_expires_at IS NOT NULL
+     AND lease_expires_at < now()
+  RETURNING id;
+$$ LANGUAGE sql;
+
+
+-- Returns the claimed rows (id, gcs_bucket, gcs_path) oldest first.
+CREATE OR REPLACE FUNCTION claim_documents(
+  p_owner          TEXT,
+  p_limit          INT DEFAULT 10,
+  p_status         TEXT DEFAULT 'uploaded',
+  p_lease_seconds  INT DEFAULT 600,
+  p_max_attempts   INT DEFAULT 3
+)
+RETURNS TABLE (id documents.id%TYPE, gcs_bucket TEXT, gcs_path TEXT) AS $$
+#variable_conflict use_column
+BEGIN
+  PERFORM release_stale_document_leases(p_max_attempts);
+
+  RETURN QUERY
+  WITH picked AS (
+    SELECT d.id
+      FROM documents d
+     WHERE d.status = p_status
+     ORDER BY d.created_at
+     LIMIT p_limit
+       FOR UPDATE SKIP LOCKED
+  ),
+  claimed AS (
+    UPDATE documents d
+       SET status = 'processing',
+           lease_owner = p_owner,
+           lease_expires_at = now() + make_interval(secs => p_lease_seconds),
+           claim_attempts = d.claim_attempts + 1
+      FROM picked
+     WHERE d.id = picked.id
+    RETURNING d.id, d.created_at, d.gcs_bucket::TEXT AS gcs_bucket, d.gcs_path::TEXT AS gcs_path
+  )
+  -- UPDATE ... RETURNING comes back in no particular order.
+  SELECT c.id, c.gcs_bucket, c.gcs_path
+    FROM claimed c
+   ORDER BY c.created_at;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Leases document p_id if its status is in p_from_status; returns the row
+-- (id, gcs_bucket, gcs_path), or nothing.  A document already claimed
+-- p_max_attempts times without finishing (it keeps killing its worker) is
+-- marked failed instead.
+CREATE OR REPLACE FUNCTION claim_document(
+  p_id             TEXT,
+  p_owner          TEXT,
+  p_from_status    TEXT[] DEFAULT ARRAY['uploaded', 'failed'],
+  p_lease_seconds  INT DEFAULT 600,
+  p_max_attempts   INT DEFAULT 3
+)
+RETURNS TABLE (id documents.id%TYPE, gcs_bucket TEXT, gcs_path TEXT) AS $$
+#variable_conflict use_column
+DECLARE
+  v_id documents.id%TYPE := p_id;
+BEGIN
+  PERFORM release_stale_document_leases(p_max_attempts);
+
+  UPDATE documents d
+     SET status = 'failed',
+         parse_error = 'gave up after ' || d.claim_attempts || ' claims',
+         lease_owner = NULL,
+         lease_expires_at = NULL
+   WHERE d.id = v_id
+     AND d.status = ANY (p_from_status)
+     AND d.status <> 'failed'
+     AND d.claim_attempts >= p_max_attempts;
+
+  RETURN QUERY
+  UPDATE documents d
+     SET status = 'processing',
+         lease_owner = p_owner,
+         lease_expires_at = now() + make_interval(secs => p_lease_seconds),
+         claim_attempts = d.claim_attempts + 1
+   WHERE d.id = v_id
+     AND d.status = ANY (p_from_status)
+     AND d.claim_attempts < p_max_attempts
+  RETURNING d.id, d.gcs_bucket::TEXT, d.gcs_path::TEXT;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Extends the leases p_owner still holds; returns the ids it still holds.
+-- An id missing from the result was released (stale) or finished elsewhere.
+CREATE OR REPLACE FUNCTION heartbeat_document_leases(
+  p_owner          TEXT,
+  p_ids            TEXT[],
+  p_lease_seconds  INT DEFAULT 600
+)
+RETURNS SETOF documents.id%TYPE AS $$
+  UPDATE documents
+     SET lease_expires_at = now() + make_interval(secs => p_lease_seconds)
+   WHERE id::TEXT = ANY (p_ids)
+     AND lease_owner = p_owner
+     AND status = 'processing'
+  RETURNING id;
+$$ LANGUAGE sql;
@@ -0,0 +1,47 @@
+-- Content-hash dedupe at ingest (invoice-ingest /jobs/pull_mailbox).
+--
+-- The same PDF under another filename, or forwarded twice, used to become a
+-- new document and be extracted again.  Ingest now hashes the attachment and
+-- asks find_parsed_document_by_hash() whether that content was already
+-- parsed successfully.  If so the new document is stored with
+-- status = 'duplicate' and duplicate_of_document_id pointing at the parsed
+-- one (whose parsed_invoices it shares) and never enters the parse queue.
+--
+-- llm_calls_avoided is a lower bound: one first-pass extraction per invoice
+-- the original produced (rescue passes and vision batches not counted).
+-- document_dedupe_stats totals it for the dashboard.
+
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS duplicate_of_document_id TEXT;  -- documents.id, as text like fuel_prices.document_id
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS llm_calls_avoided INT NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS idx_documents_hash_parsed
+  ON documents (document_hash)
+  WHERE status IN ('parsed', 'done');
+
+CREATE INDEX IF NOT EXISTS idx_documents_duplicate_of
+  ON documents (duplicate_of_document_id)
+  WHERE duplicate_of_document_id IS NOT NULL;
+
+
+-- The most recently parsed document with this content, and how many
+-- current parsed_invoices it has.  No row when the hash is new.
+CREATE OR REPLACE FUNCTION find_parsed_document_by_hash(p_hash TEXT)
+RETURNS TABLE (document_id documents.id%TYPE, invoice_count INT) AS $$
+  SELECT d.id,
+         (SELECT count(*)::INT
+            FROM parsed_invoices pi
+           WHERE pi.document_id = d.id AND pi.is_latest = true)
+    FROM documents d
+   WHERE d.document_hash = p_hash
+     AND d.status IN ('parsed', 'done')
+   ORDER BY d.parsed_at DESC NULLS LAST
+   LIMIT 1;
+$$ LANGUAGE sql STABLE;
+
+
+CREATE OR REPLACE VIEW document_dedupe_stats AS
+SELECT count(*)::INT                           AS duplicate_documents,
+       COALESCE(sum(llm_calls_avoided), 0)::INT AS llm_calls_avoided,
+       max(created_at)                         AS last_duplicate_at
+  FROM documents
+ WHERE duplicate_of_document_id IS NOT NULL;
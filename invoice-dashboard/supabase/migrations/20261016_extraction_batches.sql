@@ -0,0 +1,35 @@
+-- Offline batch extraction runs (invoice-parser /jobs/batch_extract/*).
+-- submitted -> loaded (results in extraction_cache) -> reconciled (documents re-parsed).
+-- documents: [{document_id, gcs_bucket, gcs_path, request_count, prior_status, ...}] in reconcile order.
+-- Submitted documents sit in documents.status = 'batch_pending' (which the
+-- claim paths skip) until reconcile re-parses them; a failed batch puts them
+-- back to prior_status.
+
+CREATE TABLE IF NOT EXISTS extraction_batches (
+  id                UUID DEFAULT gen_random_uuid() PRIMARY KEY,
+  backend           TEXT NOT NULL,            -- openai | local
+  backend_batch_id  TEXT,                     -- NULL when every prompt was already cached
+  status            TEXT NOT NULL DEFAULT 'submitted',
+  model             TEXT,
+  prompt_version    TEXT,
+  request_count     INT NOT NULL DEFAULT 0,
+  loaded_count      INT,
+  failed_count      INT,
+  documents         JSONB NOT NULL DEFAULT '[]'::jsonb,
+  reconciled_count  INT NOT NULL DEFAULT 0,
+  created_at        TIMESTAMPTZ DEFAULT now() NOT NULL,
+  completed_at      TIMESTAMPTZ,
+  reconciled_at     TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS idx_extraction_batches_open
+  ON extraction_batches (created_at)
+  WHERE status IN ('submitted', 'loaded');
+
+ALTER TABLE extraction_batches ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY extraction_batches_read ON extraction_batches
+  FOR SELECT TO authenticated USING (true);
+
+CREATE POLICY extraction_batches_service ON extraction_batches
+  FOR ALL TO service_role USING (true) WITH CHECK (true);
@@ -0,0 +1,39 @@
+-- Content-addressed cache of raw LLM invoice extractions (invoice-parser).
+-- cache_key = sha256(prompt_version | kind | model | schema hash | normalized text hash [| extra]).
+-- Written and read by the parser service only; safe to truncate at any time.
+
+CREATE TABLE IF NOT EXISTS extraction_cache (
+  cache_key       TEXT PRIMARY KEY,
+  kind            TEXT NOT NULL,            -- normal | rescue | vision
+  model           TEXT NOT NULL,
+  prompt_version  TEXT NOT NULL,
+  response        JSONB NOT NULL,
+  created_at      TIMESTAMPTZ DEFAULT now() NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_extraction_cache_created
+  ON extraction_cache (created_at);
+
+ALTER TABLE extraction_cache ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY extraction_cache_service ON extraction_cache
+  FOR ALL TO service_role USING (true) WITH CHECK (true);
+
+-- Size bound: keep the newest max_rows entries, drop the rest.
+-- Called periodically by the parser after cache writes.
+
+CREATE OR REPLACE FUNCTION prune_extraction_cache(max_rows INT)
+RETURNS INT AS $$
+DECLARE
+  removed INT;
+BEGIN
+  DELETE FROM extraction_cache
+  WHERE cache_key IN (
+    SELECT cache_key FROM extraction_cache
+    ORDER BY created_at DESC
+    OFFSET GREATEST(max_rows, 0)
+  );
+  GET DIAGNOSTICS removed = ROW_COUNT;
+  RETURN removed;
+END;
+$$ LANGUAGE plpgsql;
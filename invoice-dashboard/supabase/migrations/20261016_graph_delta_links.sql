@@ -0,0 +1,20 @@
+-- Microsoft Graph delta-query state for shared/mailbox_sync.py.
+--
+-- One row per (mailbox, folder, consumer): the @odata.deltaLink from the
+-- last completed sync, or the @odata.nextLink when a sync stopped at its
+-- message cap and will continue from there.  Deleting a row forces a full
+-- resync (from the caller's initial window) on the next run.
+--
+-- Consumers: invoice-ingest (pull_mailbox), job-ingest (pull_applicants),
+-- ops-monitor (pull_edct), invoice-parser/pull_outlook_receipts.py.
+
+CREATE TABLE IF NOT EXISTS graph_delta_links (
+  mailbox     TEXT NOT NULL,
+  folder      TEXT NOT NULL DEFAULT 'Inbox',
+  consumer    TEXT NOT NULL,
+  delta_link  TEXT NOT NULL,
+  updated_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (mailbox, folder, consumer)
+);
+
+ALTER TABLE graph_delta_links ENABLE ROW LEVEL SECURITY;
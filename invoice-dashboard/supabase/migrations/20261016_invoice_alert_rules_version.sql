@@ -0,0 +1,29 @@
+-- Change detection for the invoice-alerts rules cache.
+--
+-- invoice-alerts keeps the rules table (and the keyword automaton compiled
+-- from it) in memory.  Once its TTL lapses it calls
+-- invoice_alert_rules_version() and only re-downloads the rules when the
+-- value differs from the one it loaded.  The row count is part of the
+-- version so a deleted rule is noticed too.
+
+ALTER TABLE invoice_alert_rules ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+CREATE OR REPLACE FUNCTION update_invoice_alert_rules_timestamp()
+RETURNS TRIGGER AS $$
+BEGIN
+  NEW.updated_at = now();
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_invoice_alert_rules_timestamp ON invoice_alert_rules;
+CREATE TRIGGER trg_invoice_alert_rules_timestamp
+  BEFORE UPDATE ON invoice_alert_rules
+  FOR EACH ROW
+  EXECUTE FUNCTION update_invoice_alert_rules_timestamp();
+
+CREATE OR REPLACE FUNCTION invoice_alert_rules_version()
+RETURNS TEXT AS $$
+  SELECT count(*)::TEXT || ':' || COALESCE(max(updated_at)::TEXT, '')
+    FROM invoice_alert_rules;
+$$ LANGUAGE sql STABLE;
@@ -0,0 +1,237 @@
+-- Durable job queue shared by invoice-ingest -> invoice-parser -> invoice-alerts
+-- (client: shared/job_queue.py, copied into each service).
+--
+-- queued --claim_jobs--> running --ack_job--> done
+--                           |
+--                           +--fail_job--> queued (run_after = now() + backoff)
+--                           |              or dead once attempts = max_attempts
+--                           +--lease (locked_until) lapses--> claimable again
+--
+-- enqueue_job() is idempotent per (queue, dedupe_key) while a job is queued
+-- or running, so a producer can re-enqueue safely.  Dead jobs stay in the
+-- table (status = 'dead', last_error) as the dead-letter list; requeue them
+-- with requeue_dead_jobs().  Done jobs are deleted once they are older than
+-- the retention period by prune_done_jobs(), which consumers call
+-- periodically, so the table stays the size of the live and dead jobs.
+
+CREATE TABLE IF NOT EXISTS job_queue (
+  id             BIGSERIAL PRIMARY KEY,
+  queue          TEXT NOT NULL,
+  payload        JSONB NOT NULL DEFAULT '{}'::jsonb,
+  dedupe_key     TEXT,
+  status         TEXT NOT NULL DEFAULT 'queued',   -- queued | running | done | dead
+  attempts       INT NOT NULL DEFAULT 0,
+  max_attempts   INT NOT NULL DEFAULT 5,
+  run_after      TIMESTAMPTZ NOT NULL DEFAULT now(),
+  locked_by      TEXT,
+  locked_until   TIMESTAMPTZ,
+  last_error     TEXT,
+  created_at     TIMESTAMPTZ NOT NULL DEFAULT now(),
+  updated_at     TIMESTAMPTZ NOT NULL DEFAULT now(),
+  finished_at    TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS idx_job_queue_ready
+  ON job_queue (queue, run_after, id)
+  WHERE status = 'queued';
+
+CREATE INDEX IF NOT EXISTS idx_job_queue_running
+  ON job_queue (queue, locked_until)
+  WHERE status = 'running';
+
+CREATE INDEX IF NOT EXISTS idx_job_queue_done
+  ON job_queue (queue, finished_at)
+  WHERE status = 'done';
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_job_queue_pending_dedupe
+  ON job_queue (queue, dedupe_key)
+  WHERE dedupe_key IS NOT NULL AND status IN ('queued', 'running');
+
+ALTER TABLE job_queue ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY job_queue_read ON job_queue
+  FOR SELECT TO authenticated USING (true);
+
+
+CREATE OR REPLACE FUNCTION enqueue_job(
+  p_queue          TEXT,
+  p_payload        JSONB DEFAULT '{}'::jsonb,
+  p_dedupe_key     TEXT DEFAULT NULL,
+  p_delay_seconds  INT DEFAULT 0,
+  p_max_attempts   INT DEFAULT 5
+)
+RETURNS BIGINT AS $$
+DECLARE
+  v_id BIGINT;
+BEGIN
+  INSERT INTO job_queue (queue, payload, dedupe_key, run_after, max_attempts)
+  VALUES (p_queue, p_payload, p_dedupe_key, now() + make_interval(secs => p_delay_seconds), p_max_attempts)
+  ON CONFLICT (queue, dedupe_key) WHERE dedupe_key IS NOT NULL AND status IN ('queued', 'running')
+  DO NOTHING
+  RETURNING id INTO v_id;
+
+  IF v_id IS NULL THEN
+    SELECT id INTO v_id
+      FROM job_queue
+     WHERE queue = p_queue AND dedupe_key = p_dedupe_key AND status IN ('queued', 'running')
+     LIMIT 1;
+  END IF;
+  RETURN v_id;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Claims up to p_limit ready jobs (queued and due, or running with a lapsed
+-- lease) for p_worker.  A lapsed job that already used all its attempts is
+-- dead-lettered instead of claimed.
+CREATE OR REPLACE FUNCTION claim_jobs(
+  p_queue               TEXT,
+  p_worker              TEXT,
+  p_limit               INT DEFAULT 1,
+  p_visibility_seconds  INT DEFAULT 300
+)
+RETURNS SETOF job_queue AS $$
+BEGIN
+  UPDATE job_queue
+     SET status = 'dead',
+         last_error = COALESCE(last_error, 'lease expired (worker lost)'),
+         locked_by = NULL, locked_until = NULL,
+         finished_at = now(), updated_at = now()
+   WHERE queue = p_queue
+     AND status = 'running'
+     AND locked_until < now()
+     AND attempts >= max_attempts;
+
+  RETURN QUERY
+  WITH picked AS (
+    SELECT j.id
+      FROM job_queue j
+     WHERE j.queue = p_queue
+       AND ((j.status = 'queued' AND j.run_after <= now())
+            OR (j.status = 'running' AND j.locked_until < now()))
+     ORDER BY j.run_after, j.id
+     LIMIT p_limit
+       FOR UPDATE SKIP LOCKED
+  )
+  UPDATE job_queue j
+     SET status = 'running',
+         attempts = j.attempts + 1,
+         locked_by = p_worker,
+         locked_until = now() + make_interval(secs => p_visibility_seconds),
+         updated_at = now()
+    FROM picked
+   WHERE j.id = picked.id
+  RETURNING j.*;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION ack_job(p_id BIGINT, p_worker TEXT)
+RETURNS BOOLEAN AS $$
+  WITH done AS (
+    UPDATE job_queue
+       SET status = 'done', locked_by = NULL, locked_until = NULL,
+           finished_at = now(), updated_at = now()
+     WHERE id = p_id AND locked_by = p_worker AND status = 'running'
+    RETURNING 1
+  )
+  SELECT EXISTS (SELECT 1 FROM done);
+$$ LANGUAGE sql;
+
+
+-- Retry with exponential backoff (p_base_seconds * 2^(attempts-1), capped),
+-- or dead-letter when the job has used its attempts.  Returns the new status.
+CREATE OR REPLACE FUNCTION fail_job(
+  p_id            BIGINT,
+  p_worker        TEXT,
+  p_error         TEXT,
+  p_base_seconds  INT DEFAULT 30,
+  p_max_seconds   INT DEFAULT 3600
+)
+RETURNS TEXT AS $$
+  UPDATE job_queue
+     SET status = CASE WHEN attempts >= max_attempts THEN 'dead' ELSE 'queued' END,
+         run_after = now() + make_interval(secs => LEAST(p_max_seconds, p_base_seconds * power(2, GREATEST(attempts - 1, 0)))),
+         finished_at = CASE WHEN attempts >= max_attempts THEN now() ELSE NULL END,
+         last_error = left(p_error, 4000),
+         locked_by = NULL, locked_until = NULL,
+         updated_at = now()
+   WHERE id = p_id AND locked_by = p_worker AND status = 'running'
+  RETURNING status;
+$$ LANGUAGE sql;
+
+
+-- Heartbeat: extends p_worker's leases; returns the ids it still holds.
+CREATE OR REPLACE FUNCTION extend_jobs(
+  p_ids                 BIGINT[],
+  p_worker              TEXT,
+  p_visibility_seconds  INT DEFAULT 300
+)
+RETURNS SETOF BIGINT AS $$
+  UPDATE job_queue
+     SET locked_until = now() + make_interval(secs => p_visibility_seconds),
+         updated_at = now()
+   WHERE id = ANY (p_ids) AND locked_by = p_worker AND status = 'running'
+  RETURNING id;
+$$ LANGUAGE sql;
+
+
+-- Only the newest dead job per dedupe_key is requeued (jobs without a key
+-- all are), so the requeue can't put two jobs under one pending key.
+CREATE OR REPLACE FUNCTION requeue_dead_jobs(p_queue TEXT, p_limit INT DEFAULT 100)
+RETURNS INT AS $$
+  WITH candidates AS (
+    SELECT DISTINCT ON (d.dedupe_key, CASE WHEN d.dedupe_key IS NULL THEN d.id END) d.id
+      FROM job_queue d
+     WHERE d.queue = p_queue AND d.status = 'dead'
+       AND NOT EXISTS (
+         SELECT 1 FROM job_queue q
+          WHERE q.queue = d.queue AND q.dedupe_key = d.dedupe_key AND q.status IN ('queued', 'running')
+       )
+     ORDER BY d.dedupe_key, CASE WHEN d.dedupe_key IS NULL THEN d.id END, d.id DESC
+  ), picked AS (
+    SELECT j.id FROM job_queue j
+     WHERE j.id IN (SELECT id FROM candidates) AND j.status = 'dead'
+     ORDER BY j.id
+     LIMIT p_limit
+       FOR UPDATE SKIP LOCKED
+  ), requeued AS (
+    UPDATE job_queue j
+       SET status = 'queued', attempts = 0, run_after = now(), finished_at = NULL, updated_at = now()
+      FROM picked
+     WHERE j.id = picked.id
+    RETURNING 1
+  )
+  SELECT count(*)::INT FROM requeued;
+$$ LANGUAGE sql;
+
+
+-- Deletes up to p_limit of p_queue's done jobs finished more than
+-- p_older_than_seconds ago; returns how many.
+CREATE OR REPLACE FUNCTION prune_done_jobs(
+  p_queue               TEXT,
+  p_older_than_seconds  INT DEFAULT 604800,
+  p_limit               INT DEFAULT 1000
+)
+RETURNS INT AS $$
+  WITH old AS (
+    SELECT id FROM job_queue
+     WHERE queue = p_queue AND status = 'done'
+       AND finished_at < now() - make_interval(secs => p_older_than_seconds)
+     ORDER BY finished_at
+     LIMIT p_limit
+       FOR UPDATE SKIP LOCKED
+  ), pruned AS (
+    DELETE FROM job_queue j USING old WHERE j.id = old.id
+    RETURNING 1
+  )
+  SELECT count(*)::INT FROM pruned;
+$$ LANGUAGE sql;
+
+
+-- Counts per status for /health and the dashboard.
+CREATE OR REPLACE FUNCTION job_queue_stats(p_queue TEXT)
+RETURNS JSONB AS $$
+  SELECT COALESCE(jsonb_object_agg(status, n), '{}'::jsonb)
+    FROM (SELECT status, count(*) AS n FROM job_queue WHERE queue = p_queue GROUP BY status) s;
+$$ LANGUAGE sql STABLE;
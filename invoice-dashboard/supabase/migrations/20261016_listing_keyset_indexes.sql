@@ -0,0 +1,21 @@
+-- Keyset pagination and server-side search for the invoice-alerts listing
+-- endpoints (/api/invoices, /api/fuel-prices).
+--
+-- Both page on ORDER BY invoice_date DESC NULLS LAST, id DESC with a
+-- cursor on the last (invoice_date, id), so each page is an index range
+-- scan however deep the caller has paged.  Vendor / free-text search uses
+-- ilike '%term%', which trigram indexes can serve.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_parsed_invoices_keyset
+  ON parsed_invoices (invoice_date DESC NULLS LAST, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_fuel_prices_keyset
+  ON fuel_prices (invoice_date DESC NULLS LAST, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_parsed_invoices_vendor_trgm
+  ON parsed_invoices USING gin (vendor_name gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_fuel_prices_vendor_trgm
+  ON fuel_prices USING gin (vendor_name gin_trgm_ops);
@@ -0,0 +1,114 @@
+-- Transactional persistence for the invoice parser.
+--
+-- persist_parsed_invoices(p_invoices) takes a JSON array of
+--   {"invoice": {...parsed_invoices row...}, "line_items": [{...}, ...]}
+-- and, for each entry in order, inside one transaction:
+--   1. clears is_latest for the logical invoice (document_id, source_invoice_id)
+--   2. upserts the parsed_invoices row on (document_id, source_invoice_id, parser_version)
+--   3. replaces its parsed_line_items
+--
+-- A parsed_invoices_business_unique violation is not an error: that entry
+-- comes back with business_duplicate = true and no id.  When the alerts
+-- trigger on parsed_invoices hits invoice_alerts_unique_rule_doc (several
+-- invoices per document), the document's alerts are cleared and the upsert
+-- is retried once.
+--
+-- Returns a JSON array aligned with the input:
+--   [{"id": <parsed_invoice_id or null>, "business_duplicate": bool}, ...]
+
+CREATE OR REPLACE FUNCTION persist_parsed_invoices(p_invoices JSONB)
+RETURNS JSONB AS $$
+DECLARE
+  v_item        JSONB;
+  v_row         parsed_invoices%ROWTYPE;
+  v_id          parsed_invoices.id%TYPE;
+  v_dup         BOOLEAN;
+  v_retried     BOOLEAN;
+  v_constraint  TEXT;
+  v_out         JSONB := '[]'::jsonb;
+BEGIN
+  FOR v_item IN SELECT value FROM jsonb_array_elements(p_invoices) LOOP
+    v_row := jsonb_populate_record(NULL::parsed_invoices, v_item->'invoice');
+    v_id := NULL;
+    v_dup := false;
+    v_retried := false;
+
+    UPDATE parsed_invoices
+       SET is_latest = false
+     WHERE document_id = v_row.document_id
+       AND source_invoice_id = v_row.source_invoice_id
+       AND is_latest = true;
+
+    LOOP
+      BEGIN
+        INSERT INTO parsed_invoices (
+          document_id, source_invoice_id, parser_version, doc_type,
+          vendor_name, fuel_vendor, invoice_number, invoice_date, currency,
+          tail_number, airport_code, subtotal, tax, total, total_amount,
+          line_items, raw_extracted, raw_json, validation_pass, review_required,
+          recon_mode, delta, extraction_model, extraction_version,
+          invoice_key, dedupe_key, is_latest
+        ) VALUES (
+          v_row.document_id, v_row.source_invoice_id, v_row.parser_version, v_row.doc_type,
+          v_row.vendor_name, v_row.fuel_vendor, v_row.invoice_number, v_row.invoice_date, v_row.currency,
+          v_row.tail_number, v_row.airport_code, v_row.subtotal, v_row.tax, v_row.total, v_row.total_amount,
+          v_row.line_items, v_row.raw_extracted, v_row.raw_json, v_row.validation_pass, v_row.review_required,
+          v_row.recon_mode, v_row.delta, v_row.extraction_model, v_row.extraction_version,
+          v_row.invoice_key, v_row.dedupe_key, v_row.is_latest
+        )
+        ON CONFLICT (document_id, source_invoice_id, parser_version) DO UPDATE SET
+          doc_type = EXCLUDED.doc_type,
+          vendor_name = EXCLUDED.vendor_name,
+          fuel_vendor = EXCLUDED.fuel_vendor,
+          invoice_number = EXCLUDED.invoice_number,
+          invoice_date = EXCLUDED.invoice_date,
+          currency = EXCLUDED.currency,
+          tail_number = EXCLUDED.tail_number,
+          airport_code = EXCLUDED.airport_code,
+          subtotal = EXCLUDED.subtotal,
+          tax = EXCLUDED.tax,
+          total = EXCLUDED.total,
+          total_amount = EXCLUDED.total_amount,
+          line_items = EXCLUDED.line_items,
+          raw_extracted = EXCLUDED.raw_extracted,
+          raw_json = EXCLUDED.raw_json,
+          validation_pass = EXCLUDED.validation_pass,
+          review_required = EXCLUDED.review_required,
+          recon_mode = EXCLUDED.recon_mode,
+          delta = EXCLUDED.delta,
+          extraction_model = EXCLUDED.extraction_model,
+          extraction_version = EXCLUDED.extraction_version,
+          invoice_key = EXCLUDED.invoice_key,
+          dedupe_key = EXCLUDED.dedupe_key,
+          is_latest = EXCLUDED.is_latest
+        RETURNING id INTO v_id;
+        EXIT;
+      EXCEPTION WHEN unique_violation THEN
+        GET STACKED DIAGNOSTICS v_constraint = CONSTRAINT_NAME;
+        IF v_constraint = 'parsed_invoices_business_unique' THEN
+          v_dup := true;
+          EXIT;
+        ELSIF v_constraint = 'invoice_alerts_unique_rule_doc' AND NOT v_retried THEN
+          DELETE FROM invoice_alerts WHERE document_id = v_row.document_id;
+          v_retried := true;
+        ELSE
+          RAISE;
+        END IF;
+      END;
+    END LOOP;
+
+    IF v_id IS NOT NULL THEN
+      DELETE FROM parsed_line_items WHERE parsed_invoice_id = v_id;
+      INSERT INTO parsed_line_items (
+        parsed_invoice_id, category, description_raw, quantity, unit, unit_price, amount
+      )
+      SELECT v_id, li.category, li.description_raw, li.quantity, li.unit, li.unit_price, li.amount
+        FROM jsonb_populate_recordset(NULL::parsed_line_items, COALESCE(v_item->'line_items', '[]'::jsonb)) li;
+    END IF;
+
+    v_out := v_out || jsonb_build_array(jsonb_build_object('id', v_id, 'business_duplicate', v_dup));
+  END LOOP;
+
+  RETURN v_out;
+END;
+$$ LANGUAGE plpgsql;
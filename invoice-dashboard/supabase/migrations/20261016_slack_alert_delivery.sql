@@ -0,0 +1,112 @@
+-- Batched Slack delivery for invoice-alerts /jobs/flush_alerts.
+--
+-- slack_status state machine (exactly-once, short of a runner crashing between
+-- posting an alert and finishing it; see the lease below):
+--
+--   pending --claim_slack_alerts--> sending --finish_slack_alerts--> sent | error | skipped
+--                                      |
+--                                      +--finish_slack_alerts--> pending   (not delivered: rate limited,
+--                                      |                                    or the runner failed before posting)
+--                                      +--lease lapses--> claimable again  (runner crashed)
+--
+-- claim_slack_alerts(p_limit, p_worker, p_lease_seconds) moves up to
+-- p_limit of the oldest pending alerts (NULL / '' / 'null' count as
+-- pending, as for legacy rows) to 'sending' in one statement, stamped with
+-- slack_claimed_by / slack_claimed_at.  FOR UPDATE SKIP LOCKED lets
+-- concurrent runners claim disjoint batches.  A 'sending' row whose claim
+-- is older than p_lease_seconds belongs to a runner that died mid-batch
+-- and is claimed again (a crash between posting and finishing can then
+-- post that alert twice; rows claimed by the old per-row flush have no
+-- slack_claimed_at and are left alone).  Alerts whose status already says
+-- 'sent' are healed to slack_status = 'sent' instead of being claimed.
+--
+-- finish_slack_alerts(p_results, p_worker) writes the outcome of a batch.
+-- Only rows still 'sending' under p_worker's claim are touched, so a row is
+-- finished at most once, and not by a runner whose lease was taken over.
+
+ALTER TABLE invoice_alerts ADD COLUMN IF NOT EXISTS slack_claimed_at TIMESTAMPTZ;
+ALTER TABLE invoice_alerts ADD COLUMN IF NOT EXISTS slack_claimed_by TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_alerts_slack_pending
+  ON invoice_alerts (created_at)
+  WHERE slack_status IS NULL OR slack_status IN ('pending', '', 'null');
+
+CREATE INDEX IF NOT EXISTS idx_alerts_slack_sending
+  ON invoice_alerts (slack_claimed_at)
+  WHERE slack_status = 'sending';
+
+
+CREATE OR REPLACE FUNCTION claim_slack_alerts(
+  p_limit          INT DEFAULT 25,
+  p_worker         TEXT DEFAULT NULL,
+  p_lease_seconds  INT DEFAULT 900
+)
+RETURNS JSONB AS $$
+DECLARE
+  v_healed INT;
+  v_alerts JSONB;
+BEGIN
+  WITH healed AS (
+    UPDATE invoice_alerts a
+       SET slack_status = 'sent', slack_error = NULL
+     WHERE a.id IN (
+       SELECT id FROM invoice_alerts
+        WHERE (slack_status IS NULL OR slack_status IN ('pending', '', 'null'))
+          AND lower(COALESCE(status, '')) = 'sent'
+        ORDER BY created_at
+        LIMIT 500
+        FOR UPDATE SKIP LOCKED
+     )
+    RETURNING 1
+  )
+  SELECT count(*) INTO v_healed FROM healed;
+
+  WITH picked AS (
+    SELECT id FROM invoice_alerts
+     WHERE (
+             (slack_status IS NULL OR slack_status IN ('pending', '', 'null'))
+             AND lower(COALESCE(status, '')) <> 'sent'
+           )
+        OR (
+             slack_status = 'sending'
+             AND slack_claimed_at < now() - make_interval(secs => p_lease_seconds)
+           )
+     ORDER BY created_at
+     LIMIT GREATEST(p_limit, 0)
+     FOR UPDATE SKIP LOCKED
+  ),
+  claimed AS (
+    UPDATE invoice_alerts a
+       SET slack_status = 'sending', slack_error = NULL,
+           slack_claimed_at = now(), slack_claimed_by = p_worker
+      FROM picked
+     WHERE a.id = picked.id
+    RETURNING a.id, a.created_at, a.rule_id, a.document_id, a.parsed_invoice_id, a.status, a.match_payload
+  )
+  SELECT COALESCE(jsonb_agg(to_jsonb(c) ORDER BY c.created_at), '[]'::jsonb) INTO v_alerts FROM claimed c;
+
+  RETURN jsonb_build_object('healed', v_healed, 'alerts', v_alerts);
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- p_results: [{"id", "slack_status": sent|error|skipped|pending, "slack_error",
+--              "match_payload" (optional, replaces the stored one)}, ...]
+-- Returns the number of alerts updated.
+CREATE OR REPLACE FUNCTION finish_slack_alerts(p_results JSONB, p_worker TEXT DEFAULT NULL)
+RETURNS INT AS $$
+  WITH done AS (
+    UPDATE invoice_alerts a
+       SET slack_status = r.slack_status,
+           slack_error = r.slack_error,
+           status = COALESCE(NULLIF(a.status, ''), 'pending'),
+           match_payload = COALESCE(r.match_payload, a.match_payload)
+      FROM jsonb_populate_recordset(NULL::invoice_alerts, COALESCE(p_results, '[]'::jsonb)) r
+     WHERE a.id = r.id
+       AND a.slack_status = 'sending'
+       AND a.slack_claimed_by IS NOT DISTINCT FROM p_worker
+       AND r.slack_status IN ('sent', 'error', 'skipped', 'pending')
+    RETURNING 1
+  )
+  SELECT count(*)::INT FROM done;
+$$ LANGUAGE sql;
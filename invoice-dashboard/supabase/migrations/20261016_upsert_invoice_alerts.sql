@@ -0,0 +1,51 @@
+-- Set-based alert writes for invoice-alerts.
+--
+-- upsert_invoice_alerts(p_alerts) takes a JSON array of invoice_alerts rows
+-- (one per (rule_id, document_id)) and, in one statement:
+--   - inserts the new ones as pending
+--   - upgrades existing ones in place: match_payload is merged with the new
+--     match details and match_reason replaced; slack_status goes back to
+--     'pending' (clearing slack_error) unless the alert was already claimed
+--     or processed, in which case slack_status / slack_error are kept so
+--     the alert is never sent twice
+--
+-- This replaces insert -> 23505 -> select -> update per rule in run_alerts.
+--
+-- Returns a JSON array with one entry per row written:
+--   [{"id", "rule_id", "document_id", "slack_status", "inserted": bool}, ...]
+
+CREATE OR REPLACE FUNCTION upsert_invoice_alerts(p_alerts JSONB)
+RETURNS JSONB AS $$
+  WITH incoming AS (
+    SELECT * FROM jsonb_populate_recordset(NULL::invoice_alerts, COALESCE(p_alerts, '[]'::jsonb))
+  ),
+  written AS (
+    INSERT INTO invoice_alerts AS a (
+      created_at, document_id, rule_id, parsed_invoice_id, status,
+      match_reason, match_payload, slack_status
+    )
+    SELECT COALESCE(i.created_at, now()), i.document_id, i.rule_id, i.parsed_invoice_id,
+           COALESCE(i.status, 'pending'), i.match_reason, i.match_payload,
+           COALESCE(i.slack_status, 'pending')
+      FROM incoming i
+    ON CONFLICT ON CONSTRAINT invoice_alerts_unique_rule_doc DO UPDATE SET
+      match_payload = CASE
+        WHEN jsonb_typeof(a.match_payload::jsonb) = 'object'
+          THEN a.match_payload::jsonb || EXCLUDED.match_payload::jsonb
+        ELSE EXCLUDED.match_payload::jsonb
+      END,
+      match_reason = EXCLUDED.match_reason,
+      slack_status = CASE
+        WHEN lower(btrim(COALESCE(a.slack_status, ''))) IN ('sent', 'ok', 'success', 'skipped', 'error', 'sending')
+          THEN a.slack_status
+        ELSE 'pending'
+      END,
+      slack_error = CASE
+        WHEN lower(btrim(COALESCE(a.slack_status, ''))) IN ('sent', 'ok', 'success', 'skipped', 'error', 'sending')
+          THEN a.slack_error
+        ELSE NULL
+      END
+    RETURNING a.id, a.rule_id, a.document_id, a.slack_status, (a.xmax = 0) AS inserted
+  )
+  SELECT COALESCE(jsonb_agg(to_jsonb(w)), '[]'::jsonb) FROM written w;
+$$ LANGUAGE sql;
@@ -2,10 +2,14 @@
 import os
 import json
 import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
 from typing import Any, Dict, List, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
 from fastapi import FastAPI, HTTPException, Query
 from google.cloud import storage
 from slowapi import Limiter, _rate_limit_exceeded_handler
@@ -13,6 +17,9 @@ from slowapi.errors import RateLimitExceeded
 from slowapi.util import get_remote_address
 
 from supa import sb, log_pipeline_run
+from job_queue import JobQueue
+from mailbox_sync import MailboxSync
+from token_cache import all_stats as token_cache_stats, graph_token_cache
 from auth_middleware import add_auth_middleware
 
 app = FastAPI()
@@ -44,6 +51,20 @@ MS_CLIENT_SECRET = os.getenv("MS_CLIENT_SECRET")
 # Where attachments are stored under bucket
 DEFAULT_PREFIX = os.environ.get("DEFAULT_PREFIX", "invoices")
 
+# Attachments downloaded from Graph + uploaded to GCS at once in pull_mailbox
+INGEST_WORKERS = max(1, int(os.getenv("INGEST_WORKERS", "8")))
+
+# Job queue (see job_queue.py): new documents go to invoice-parser's "parse" queue.
+# Created lazily so the service still starts without Supabase env (healthz reports it).
+_parse_queue: Optional[JobQueue] = None
+
+
+def _get_parse_queue() -> JobQueue:
+    global _parse_queue
+    if _parse_queue is None:
+        _parse_queue = JobQueue("parse")
+    return _parse_queue
+
 
 # -------------------------
 # Helpers
@@ -66,27 +87,23 @@ def _require_env(name: str) -> str:
 
 def _get_graph_token() -> str:
     """
-    App-only token for Microsoft Graph.
+    App-only token for Microsoft Graph, cached and refreshed ahead of
+    expiry (token_cache.py).
     Requires MS_TENANT_ID / MS_CLIENT_ID / MS_CLIENT_SECRET.
     """
     tenant = _require_env("MS_TENANT_ID")
     client_id = _require_env("MS_CLIENT_ID")
     client_secret = _require_env("MS_CLIENT_SECRET")
+    return graph_token_cache(tenant, client_id, client_secret).get()
 
-    url = f"https://login.microsoftonline.com/{tenant}/oauth2/v2.0/token"
-    data = {
-        "client_id": client_id,
-        "client_secret": client_secret,
-        "grant_type": "client_credentials",
-        "scope": "https://graph.microsoft.com/.default",
-    }
-    r = requests.post(url, data=data, timeout=20)
-    r.raise_for_status()
-    return r.json()["access_token"]
+
+# Pooled connections for Graph, sized for the attachment workers.
+_http = requests.Session()
+_http.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=INGEST_WORKERS))
 
 
 def _graph_get(url: str, token: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-    r = requests.get(
+    r = _http.get(
         url,
         headers={"Authorization": f"Bearer {token}"},
         params=params or {},
@@ -97,14 +114,27 @@ def _graph_get(url: str, token: str, params: Optional[Dict[str, Any]] = None) ->
 
 
 def _graph_get_bytes(url: str, token: str) -> bytes:
-    r = requests.get(url, headers={"Authorization": f"Bearer {token}"}, timeout=60)
+    r = _http.get(url, headers={"Authorization": f"Bearer {token}"}, timeout=60)
     r.raise_for_status()
     return r.content
 
 
+_storage_client: Optional[storage.Client] = None
+_storage_lock = threading.Lock()
+
+
+def _get_storage_client() -> storage.Client:
+    """One client per instance (credential lookup and connection pool are reused)."""
+    global _storage_client
+    if _storage_client is None:
+        with _storage_lock:
+            if _storage_client is None:
+                _storage_client = storage.Client()
+    return _storage_client
+
+
 def _upload_to_gcs(bucket_name: str, object_name: str, data: bytes, content_type: str = "application/pdf") -> None:
-    client = storage.Client()
-    bucket = client.bucket(bucket_name)
+    bucket = _get_storage_client().bucket(bucket_name)
     blob = bucket.blob(object_name)
     blob.upload_from_string(data, content_type=content_type)
 
@@ -165,6 +195,34 @@ def _claim_documents_for_parse(limit: int, status: str) -> List[Dict[str, Any]]:
     return res2.data or []
 
 
+def _find_parsed_duplicate(supa, digest: str) -> Optional[Dict[str, Any]]:
+    """
+    The already-parsed document with this content hash, as
+    {"document_id", "invoice_count"}, or None.  Best effort: a failed lookup
+    just means the attachment is parsed normally.
+    """
+    try:
+        res = supa.rpc("find_parsed_document_by_hash", {"p_hash": digest}).execute()
+    except Exception as e:
+        print(f"dedupe lookup failed for {digest}: {e}", flush=True)
+        return None
+    return (res.data or [None])[0]
+
+
+def _enqueue_parse(document_id: Optional[str]) -> None:
+    """
+    Hand a new document to invoice-parser's "parse" queue.  Best effort: if
+    the enqueue fails the row is still status=uploaded and parse_next picks
+    it up on the scheduler's next run.
+    """
+    if not document_id:
+        return
+    try:
+        _get_parse_queue().enqueue({"document_id": document_id}, dedupe_key=str(document_id))
+    except Exception as e:
+        print(f"enqueue parse failed for {document_id}: {e}", flush=True)
+
+
 # -------------------------
 # Health
 # -------------------------
@@ -180,9 +238,17 @@ def healthz():
     return {
         "ok": supa_ok, "service": "invoice-ingest", "ts": _utc_now(),
         "supabase_ok": supa_ok,
+        "token_cache": token_cache_stats(),
     }
 
 
+@app.get("/stats/dedupe")
+def dedupe_stats():
+    """Attachments linked to an already-parsed document instead of re-extracted (all time)."""
+    res = sb().table("document_dedupe_stats").select("*").limit(1).execute()
+    return (res.data or [{}])[0]
+
+
 if os.getenv("DEBUG_ENDPOINTS", "").lower() in ("1", "true", "yes"):
     @app.get("/debug/env")
     def debug_env():
@@ -197,6 +263,133 @@ if os.getenv("DEBUG_ENDPOINTS", "").lower() in ("1", "true", "yes"):
 # Mailbox Pull
 # -------------------------
 
+def _ms_since(t0: float) -> int:
+    return int((time.monotonic() - t0) * 1000)
+
+
+def _list_attachments(mailbox: str, token: str, msg_id: str) -> List[Dict[str, Any]]:
+    """Attachment metadata for one message (no contentBytes)."""
+    att_url = f"https://graph.microsoft.com/v1.0/users/{mailbox}/messages/{msg_id}/attachments"
+    return _graph_get(att_url, token, params={"$top": "50", "$select": "id,name,contentType,size"}).get("value", [])
+
+
+def _already_ingested(supa, msg_ids: List[str]) -> set:
+    """
+    (message id, attachment filename) pairs that already have documents rows
+    (delta re-sends messages whose flags changed).  Keyed per attachment so
+    an attachment that failed while another in the same message was stored
+    is still fetched on the next run.
+    """
+    if not msg_ids:
+        return set()
+    res = (
+        supa.table(DOCS_TABLE)
+        .select("source_message_id, attachment_filename")
+        .in_("source_message_id", msg_ids)
+        .execute()
+    )
+    return {
+        (r["source_message_id"], r.get("attachment_filename") or "attachment")
+        for r in (res.data or [])
+        if r.get("source_message_id")
+    }
+
+
+def _is_pdf(att: Dict[str, Any]) -> bool:
+    name = (att.get("name") or "attachment").lower()
+    content_type = (att.get("contentType") or "").lower()
+    return name.endswith(".pdf") or "pdf" in content_type
+
+
+def _store_attachment(supa, mailbox: str, token: str, msg_id: str, att: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Download one PDF attachment, upload it to GCS and build its documents
+    row.  Runs on the ingest pool; returns {"doc": row or None, "timings": {...}}.
+    """
+    name = att.get("name") or "attachment"
+    timings: Dict[str, int] = {}
+
+    # This endpoint returns raw bytes:
+    bytes_url = f"https://graph.microsoft.com/v1.0/users/{mailbox}/messages/{msg_id}/attachments/{att['id']}/$value"
+    t0 = time.monotonic()
+    data = _graph_get_bytes(bytes_url, token)
+    timings["download_ms"] = _ms_since(t0)
+    if not data:
+        return {"doc": None, "timings": timings}
+
+    digest = _sha256_hex(data)
+    object_name = f"{DEFAULT_PREFIX}/{digest}/{name}"
+
+    bucket = GCS_BUCKET
+    if not bucket:
+        raise RuntimeError("Missing GCS_BUCKET env var")
+
+    t0 = time.monotonic()
+    _upload_to_gcs(bucket, object_name, data, content_type="application/pdf")
+    timings["upload_ms"] = _ms_since(t0)
+
+    # Same bytes already parsed (other filename, forwarded twice):
+    # link to that document instead of extracting it again.
+    t0 = time.monotonic()
+    original = _find_parsed_duplicate(supa, digest)
+    timings["dedupe_ms"] = _ms_since(t0)
+
+    # Every row carries the same keys: the bulk upsert sends one column list.
+    doc = {
+        "status": "uploaded",
+        "gcs_bucket": bucket,
+        "gcs_path": object_name,
+        "storage_bucket": bucket,
+        "storage_path": object_name,
+        "attachment_filename": name,
+        "created_at": _utc_now(),
+        "source": "mailbox",
+        "source_mailbox": mailbox,
+        "source_message_id": msg_id,
+        "duplicate_of_document_id": None,
+        "llm_calls_avoided": 0,
+    }
+    if original:
+        doc.update({
+            "status": "duplicate",
+            "duplicate_of_document_id": str(original["document_id"]),
+            # one first-pass extraction per invoice, at least one
+            "llm_calls_avoided": max(1, int(original.get("invoice_count") or 0)),
+        })
+    return {"doc": doc, "timings": timings}
+
+
+def _upsert_documents(supa, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Insert new documents rows in one request; rows whose (gcs_bucket,
+    gcs_path) already exists are left alone and not returned.  Falls back to
+    row-by-row if the bulk request fails, so one bad row doesn't drop the rest.
+    """
+    if not docs:
+        return []
+    try:
+        res = (
+            supa.table(DOCS_TABLE)
+            .upsert(docs, on_conflict="gcs_bucket,gcs_path", ignore_duplicates=True)
+            .execute()
+        )
+        return res.data or []
+    except Exception as e:
+        print(f"bulk documents upsert failed ({len(docs)} rows), retrying per row: {e}", flush=True)
+    inserted: List[Dict[str, Any]] = []
+    for doc in docs:
+        try:
+            res = (
+                supa.table(DOCS_TABLE)
+                .upsert(doc, on_conflict="gcs_bucket,gcs_path", ignore_duplicates=True)
+                .execute()
+            )
+            inserted.extend(res.data or [])
+        except Exception as e:
+            print(f"documents upsert failed for {doc['gcs_path']}: {e}", flush=True)
+    return inserted
+
+
 @app.post("/jobs/pull_mailbox")
 def pull_mailbox(
     mailbox: str = Query(..., description="Mailbox email, e.g. invoices@baker-aviation.com"),
@@ -204,118 +397,150 @@ def pull_mailbox(
     max_messages: int = Query(25, ge=1, le=100),
 ):
     """
-    Pull recent emails + attachments from a mailbox and store PDFs to GCS.
-    Also inserts/updates a documents row per attachment.
+    Pull new emails + attachments from a mailbox and store PDFs to GCS.
+    Also inserts/updates a documents row per attachment.  An attachment
+    whose content was already parsed is stored as status=duplicate, linked
+    to that document, and not queued for parsing.
+
+    Incremental: messages come from a Graph delta query (mailbox_sync.py),
+    so an idle inbox costs one call.  lookback_minutes only bounds the first
+    sync (or a resync after the delta link expires); max_messages caps one
+    run and the rest follow on the next.  The delta position is saved only
+    when every attachment was stored, so failures are retried.
+
+    Pipelined: attachment lists, PDF downloads and uploads run on a pool of
+    INGEST_WORKERS, then all rows go to Supabase in one bulk upsert.
 
     This is intentionally conservative: only PDF attachments.
     """
+    t_start = time.monotonic()
+    timings: Dict[str, int] = {}
+
     token = _get_graph_token()
     supa = sb()
 
     since = datetime.now(timezone.utc) - timedelta(minutes=lookback_minutes)
-    # Graph wants UTC ISO. We’ll use createdDateTime filter on receivedDateTime.
+    # Window for the first sync / a resync only (receivedDateTime filter).
     since_iso = since.strftime("%Y-%m-%dT%H:%M:%SZ")
 
-    # List messages
-    # NOTE: This is a simplified approach. If you already have a "delta" flow,
-    # you can swap this out and keep the rest.
-    url = f"https://graph.microsoft.com/v1.0/users/{mailbox}/mailFolders/Inbox/messages"
-    payload = _graph_get(
-        url,
-        token,
-        params={
-            "$top": str(max_messages),
-            "$orderby": "receivedDateTime desc",
-            "$filter": f"receivedDateTime ge {since_iso}",
-            "$select": "id,subject,receivedDateTime,from",
-        },
-    )
+    # New or changed messages since the last saved delta link.
+    t0 = time.monotonic()
+    sync = MailboxSync(mailbox, "Inbox", consumer="invoice-ingest", select="id,subject,receivedDateTime,from,hasAttachments")
+    batch = sync.fetch(token, initial_since=since, max_messages=max_messages)
+    messages = batch.messages
+    timings["list_ms"] = _ms_since(t0)
 
-    messages = payload.get("value", [])
-    ingested = 0
     skipped = 0
     errors = 0
     error_samples: list = []
 
-    for msg in messages:
-        msg_id = msg["id"]
-
-        # List attachments
-        att_url = f"https://graph.microsoft.com/v1.0/users/{mailbox}/messages/{msg_id}/attachments"
-        atts = _graph_get(att_url, token, params={"$top": "50"}).get("value", [])
-
-        for att in atts:
-            name = att.get("name") or "attachment"
-            content_type = (att.get("contentType") or "").lower()
-
-            # only pdf
-            if not name.lower().endswith(".pdf") and "pdf" not in content_type:
-                skipped += 1
-                continue
-
-            # Download attachment bytes
-            att_id = att["id"]
-            # This endpoint returns raw bytes:
-            bytes_url = f"https://graph.microsoft.com/v1.0/users/{mailbox}/messages/{msg_id}/attachments/{att_id}/$value"
+    t0 = time.monotonic()
+    seen = _already_ingested(supa, [m["id"] for m in messages if m.get("hasAttachments")])
+    pending = [m["id"] for m in messages if m.get("hasAttachments")]
+    skipped += len(messages) - len(pending)
 
+    work: List[Tuple[str, Dict[str, Any]]] = []
+    with ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest") as pool:
+        listings = [(msg_id, pool.submit(_list_attachments, mailbox, token, msg_id)) for msg_id in pending]
+        for msg_id, fut in listings:
             try:
-                data = _graph_get_bytes(bytes_url, token)
-                if not data:
+                atts = fut.result()
+            except Exception as e:
+                errors += 1
+                error_samples.append({"msg_id": msg_id, "error": repr(e)})
+                print(f"pull_mailbox attachments error msg_id={msg_id}: {repr(e)}", flush=True)
+                continue
+            names = [att.get("name") or "attachment" for att in atts]
+            for att, name in zip(atts, names):
+                # only pdf
+                if not _is_pdf(att):
+                    skipped += 1
+                # already stored (a name used twice in one message is always refetched;
+                # the (gcs_bucket, gcs_path) upsert makes that a no-op)
+                elif (msg_id, name) in seen and names.count(name) == 1:
                     skipped += 1
-                    continue
-
-                digest = _sha256_hex(data)
-                object_name = f"{DEFAULT_PREFIX}/{digest}/{name}"
-
-                bucket = GCS_BUCKET
-                if not bucket:
-                    raise RuntimeError("Missing GCS_BUCKET env var")
-
-                _upload_to_gcs(bucket, object_name, data, content_type="application/pdf")
-
-                # Upsert into documents
-                # If you already have unique keys (e.g., by digest), align on that.
-                doc = {
-                    "status": "uploaded",
-                    "gcs_bucket": bucket,
-                    "gcs_path": object_name,
-                    "storage_bucket": bucket,
-                    "storage_path": object_name,
-                    "attachment_filename": name,
-                    "created_at": _utc_now(),
-                    "source": "mailbox",
-                    "source_mailbox": mailbox,
-                    "source_message_id": msg_id,
-                }
-
-                # Upsert on (gcs_bucket, gcs_path) unique constraint so
-                # re-ingesting the same PDF is a no-op.
-                result = (
-                    supa.table(DOCS_TABLE)
-                    .upsert(doc, on_conflict="gcs_bucket,gcs_path", ignore_duplicates=True)
-                    .execute()
-                )
-                if result.data:
-                    ingested += 1
                 else:
-                    skipped += 1  # already existed
-
+                    work.append((msg_id, att))
+    timings["attachments_ms"] = _ms_since(t0)
+
+    # Download + upload + dedupe lookup, INGEST_WORKERS at a time.
+    t0 = time.monotonic()
+    docs: List[Dict[str, Any]] = []
+    stage_totals = {"download_ms": 0, "upload_ms": 0, "dedupe_ms": 0}
+    with ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest") as pool:
+        futures = [
+            (msg_id, att, pool.submit(_store_attachment, supa, mailbox, token, msg_id, att))
+            for msg_id, att in work
+        ]
+        for msg_id, att, fut in futures:
+            name = att.get("name") or "attachment"
+            try:
+                out = fut.result()
             except Exception as e:
                 errors += 1
                 err_detail = getattr(e, "message", None) or getattr(e, "details", None) or str(e)
                 error_samples.append({"att": name, "error": repr(e), "detail": err_detail})
                 print(f"pull_mailbox error msg_id={msg_id} att={name}: {repr(e)} | detail={err_detail}", flush=True)
-
-    log_pipeline_run("invoice-ingest", items=ingested, message=f"messages={len(messages)} ingested={ingested} skipped={skipped}")
+                continue
+            for k, v in out["timings"].items():
+                stage_totals[k] += v
+            if out["doc"] is None:
+                skipped += 1
+            else:
+                docs.append(out["doc"])
+    timings["fetch_upload_ms"] = _ms_since(t0)
+    # Summed across workers (work done, not wall time).
+    timings.update({f"{k[:-3]}_total_ms": v for k, v in stage_totals.items()})
+
+    # One row per object: the same attachment can appear in two messages.
+    by_path = {d["gcs_path"]: d for d in docs}
+    skipped += len(docs) - len(by_path)
+
+    # Upsert on (gcs_bucket, gcs_path) unique constraint so
+    # re-ingesting the same PDF is a no-op.
+    t0 = time.monotonic()
+    inserted = _upsert_documents(supa, list(by_path.values()))
+    timings["upsert_ms"] = _ms_since(t0)
+    skipped += len(by_path) - len(inserted)  # already existed
+
+    new_ids = [r.get("id") for r in inserted if r.get("status") != "duplicate"]
+    dup_rows = [r for r in inserted if r.get("status") == "duplicate"]
+    ingested = len(new_ids)
+    deduped = len(dup_rows)
+    llm_calls_avoided = sum(int(r.get("llm_calls_avoided") or 0) for r in dup_rows)
+
+    t0 = time.monotonic()
+    if new_ids:
+        with ThreadPoolExecutor(max_workers=min(INGEST_WORKERS, len(new_ids))) as pool:
+            list(pool.map(_enqueue_parse, new_ids))
+    timings["enqueue_ms"] = _ms_since(t0)
+
+    if not errors:
+        batch.commit()
+    timings["total_ms"] = _ms_since(t_start)
+
+    log_pipeline_run(
+        "invoice-ingest",
+        items=ingested,
+        message=(
+            f"messages={len(messages)} ingested={ingested} skipped={skipped} "
+            f"deduped={deduped} llm_calls_avoided={llm_calls_avoided}"
+        ),
+        duration_ms=timings["total_ms"],
+    )
     return {
         "ok": True,
         "mailbox": mailbox,
         "since": since_iso,
         "messages": len(messages),
+        "sync": batch.summary(),
         "ingested": ingested,
         "skipped": skipped,
+        "deduped": deduped,
+        "llm_calls_avoided": llm_calls_avoided,
         "errors": errors,
         "error_samples": error_samples[:3],
+        "timings": timings,
     }
 
 
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+batch_extract.py
+
+Offline (batch) first-pass extraction for backfills.
+
+  collect    plan each document exactly like process_pdf (split / sections),
+             but make no model calls; write one JSONL request per uncached
+             first-pass prompt.  custom_id is the extraction cache key.
+  submit     hand the JSONL to a backend: the OpenAI Batch API, or a local
+             file-based stand-in (runs the requests itself when polled).
+  reconcile  load finished results into the extraction cache, then run the
+             normal pipeline per document.  The first pass hits the cache;
+             post-fixes, rescue, vision (scans), normalize_rows and the Supa
+             upserts run exactly as in a live parse.
+
+CLI:
+  python batch_extract.py collect  --out_dir /tmp/batch1 a.pdf b.pdf ...
+  python batch_extract.py submit   --out_dir /tmp/batch1 [--backend local]
+  python batch_extract.py status   --out_dir /tmp/batch1
+  python batch_extract.py reconcile --out_dir /tmp/batch1
+
+The service runs the same steps from /jobs/batch_extract/* (see main.py).
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from extract_invoice import PROMPT_VERSION, is_scanned_text, normal_request_body
+from extraction_cache import ExtractionCache, sha256_hex
+from pdf_document import PdfDocument
+from pipeline import InvoicePipeline
+from process_pdf import Supa, detect_invoice_ids, maybe_statement_gate, plan_parts
+
+BATCH_ENDPOINT = "/v1/responses"
+BATCH_LOCAL_DIR = os.getenv("BATCH_LOCAL_DIR", "/tmp/invoice_batches")
+
+
+@dataclass
+class BatchDocument:
+    pdf_path: str = ""
+    document_id: Optional[str] = None
+    gcs_bucket: str = ""
+    gcs_path: str = ""
+    request_count: int = 0
+    skipped_cached: int = 0
+    skipped_scan: int = 0
+
+
+@dataclass
+class BatchManifest:
+    model: str
+    prompt_version: str = PROMPT_VERSION
+    backend: Optional[str] = None
+    batch_id: Optional[str] = None
+    request_count: int = 0
+    documents: List[BatchDocument] = field(default_factory=list)
+
+    def to_json(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_json(cls, d: Dict[str, Any]) -> "BatchManifest":
+        docs = [BatchDocument(**x) for x in d.get("documents") or []]
+        return cls(**{**d, "documents": docs})
+
+
+# ---------------------------
+# Collect
+# ---------------------------
+
+def first_pass_key(pipeline, text: str) -> str:
+    """Same key extract_one_pdf uses for the first pass."""
+    return ExtractionCache.make_key(
+        kind="normal",
+        model=pipeline.model,
+        schema_hash=sha256_hex(pipeline.schema_bundle),
+        prompt_version=PROMPT_VERSION,
+        text=text,
+    )
+
+
+def collect_document(
+    pipeline, pdf_path: Path, work_dir: Path, pdf_doc: Optional[PdfDocument] = None,
+) -> Tuple[List[Dict[str, Any]], BatchDocument]:
+    """Batch request lines for one PDF (uncached, non-scan parts only).  pdf_doc: already loaded in memory."""
+    if pdf_doc is None:
+        pdf_doc = pipeline.open_document(pdf_path)
+    text = pdf_doc.text()
+    invoice_ids = detect_invoice_ids(text)
+    maybe_statement, _ = maybe_statement_gate(text, invoice_ids)
+    plan = plan_parts(pipeline, pdf_path, work_dir, pdf_doc, text, invoice_ids, maybe_statement)
+
+    info = BatchDocument(pdf_path=str(pdf_path))
+    lines: List[Dict[str, Any]] = []
+    for job in plan.jobs:
+        part_text = job.text if job.text is not None else PdfDocument.open(job.source_path).text()
+        if is_scanned_text(part_text):
+            info.skipped_scan += 1  # vision runs synchronously at reconcile
+            continue
+        key = first_pass_key(pipeline, part_text)
+        if pipeline.cache is not None and pipeline.cache.get(key) is not None:
+            info.skipped_cached += 1
+            continue
+        lines.append({
+            "custom_id": key,
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": normal_request_body(pipeline.model, pipeline.schema_bundle, part_text),
+        })
+    info.request_count = len(lines)
+    return lines, info
+
+
+def write_requests(lines: List[Dict[str, Any]], path: Path) -> int:
+    """Write JSONL, de-duplicated by custom_id (identical sections across documents)."""
+    seen = set()
+    n = 0
+    with path.open("w", encoding="utf-8") as f:
+        for line in lines:
+            if line["custom_id"] in seen:
+                continue
+            seen.add(line["custom_id"])
+            f.write(json.dumps(line) + "\n")
+            n += 1
+    return n
+
+
+# ---------------------------
+# Backends
+# ---------------------------
+
+class BatchBackend(ABC):
+    """submit a JSONL file, poll it, read OpenAI-format output lines."""
+
+    name = "base"
+
+    @abstractmethod
+    def submit(self, jsonl_path: Path) -> str:
+        ...
+
+    @abstractmethod
+    def status(self, batch_id: str) -> str:
+        """One of: pending, completed, failed."""
+
+    @abstractmethod
+    def results(self, batch_id: str) -> Iterator[Dict[str, Any]]:
+        ...
+
+
+class OpenAIBatchBackend(BatchBackend):
+    name = "openai"
+
+    def __init__(self, client) -> None:
+        self.client = client
+
+    def submit(self, jsonl_path: Path) -> str:
+        with jsonl_path.open("rb") as f:
+            up = self.client.files.create(file=f, purpose="batch")
+        b = self.client.batches.create(
+            input_file_id=up.id, endpoint=BATCH_ENDPOINT, completion_window="24h",
+        )
+        return b.id
+
+    def status(self, batch_id: str) -> str:
+        b = self.client.batches.retrieve(batch_id)
+        if b.status == "completed":
+            return "completed"
+        # An expired batch still returns the requests that finished.
+        if b.status == "expired" and getattr(b, "output_file_id", None):
+            return "completed"
+        if b.status in {"failed", "expired", "cancelled", "cancelling"}:
+            return "failed"
+        return "pending"
+
+    def results(self, batch_id: str) -> Iterator[Dict[str, Any]]:
+        b = self.client.batches.retrieve(batch_id)
+        if not getattr(b, "output_file_id", None):
+            return
+        content = self.client.files.content(b.output_file_id).text
+        for raw in content.splitlines():
+            if raw.strip():
+                yield json.loads(raw)
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    File-based stand-in: <root>/<batch_id>/input.jsonl -> output.jsonl.
+    With a client, the first status() poll executes the requests one by one
+    (point OPENAI_BASE_URL at scripts/fake_openai.py for tests).
+    """
+
+    name = "local"
+
+    def __init__(self, root: str = BATCH_LOCAL_DIR, client=None) -> None:
+        self.root = Path(root)
+        self.client = client
+
+    def _dir(self, batch_id: str) -> Path:
+        return self.root / batch_id
+
+    def submit(self, jsonl_path: Path) -> str:
+        batch_id = f"local_{uuid.uuid4().hex[:12]}"
+        d = self._dir(batch_id)
+        d.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(jsonl_path, d / "input.jsonl")
+        return batch_id
+
+    def run(self, batch_id: str) -> int:
+        if self.client is None:
+            raise RuntimeError("LocalBatchBackend.run requires a client")
+        d = self._dir(batch_id)
+        tmp = d / "output.jsonl.part"
+        n = 0
+        with (d / "input.jsonl").open(encoding="utf-8") as src, tmp.open("w", encoding="utf-8") as out:
+            for raw in src:
+                if not raw.strip():
+                    continue
+                req = json.loads(raw)
+                row: Dict[str, Any] = {"custom_id": req["custom_id"], "response": None, "error": None}
+                try:
+                    resp = self.client.responses.create(**req["body"])
+                    row["response"] = {"status_code": 200, "body": resp.model_dump()}
+                except Exception as e:
+                    row["error"] = {"message": str(e)}
+                out.write(json.dumps(row) + "\n")
+                n += 1
+        tmp.rename(d / "output.jsonl")
+        return n
+
+    def status(self, batch_id: str) -> str:
+        d = self._dir(batch_id)
+        if not (d / "input.jsonl").exists():
+            return "failed"
+        if not (d / "output.jsonl").exists() and self.client is not None:
+            self.run(batch_id)
+        return "completed" if (d / "output.jsonl").exists() else "pending"
+
+    def results(self, batch_id: str) -> Iterator[Dict[str, Any]]:
+        out = self._dir(batch_id) / "output.jsonl"
+        if not out.exists():
+            return
+        with out.open(encoding="utf-8") as f:
+            for raw in f:
+                if raw.strip():
+                    yield json.loads(raw)
+
+
+def make_backend(name: str, client=None) -> BatchBackend:
+    if name == "openai":
+        return OpenAIBatchBackend(client)
+    if name == "local":
+        return LocalBatchBackend(client=client)
+    raise ValueError(f"Unknown batch backend: {name}")
+
+
+# ---------------------------
+# Reconcile
+# ---------------------------
+
+def _response_text(body: Dict[str, Any]) -> str:
+    ot = body.get("output_text")
+    if isinstance(ot, str) and ot.strip():
+        return ot
+    for item in body.get("output") or []:
+        for c in item.get("content") or []:
+            if c.get("type") == "output_text" and c.get("text"):
+                return c["text"]
+    raise ValueError("no output_text in response body")
+
+
+def load_results(pipeline, backend: BatchBackend, batch_id: str) -> Dict[str, int]:
+    """Put every successful batch result into the extraction cache."""
+    if pipeline.cache is None:
+        raise RuntimeError("Batch reconcile needs the extraction cache (EXTRACTION_CACHE=1)")
+
+    counts = {"loaded": 0, "failed": 0}
+    for line in backend.results(batch_id):
+        resp = line.get("response") or {}
+        if resp.get("status_code") != 200:
+            counts["failed"] += 1
+            continue
+        try:
+            data = json.loads(_response_text(resp.get("body") or {}))
+        except Exception:
+            counts["failed"] += 1
+            continue
+        pipeline.cache.put(
+            line["custom_id"], data,
+            kind="normal", model=pipeline.model, prompt_version=PROMPT_VERSION,
+        )
+        counts["loaded"] += 1
+    return counts
+
+
+# ---------------------------
+# CLI
+# ---------------------------
+
+def _manifest_path(out_dir: Path) -> Path:
+    return out_dir / "batch_manifest.json"
+
+
+def _load_manifest(out_dir: Path) -> BatchManifest:
+    return BatchManifest.from_json(json.loads(_manifest_path(out_dir).read_text(encoding="utf-8")))
+
+
+def _save_manifest(out_dir: Path, m: BatchManifest) -> None:
+    _manifest_path(out_dir).write_text(json.dumps(m.to_json(), indent=2), encoding="utf-8")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("command", choices=["collect", "submit", "status", "reconcile"])
+    ap.add_argument("pdfs", nargs="*")
+    ap.add_argument("--out_dir", required=True, help="Holds requests.jsonl + batch_manifest.json")
+    ap.add_argument("--backend", default=os.getenv("BATCH_BACKEND", "openai"), choices=["openai", "local"])
+    ap.add_argument("--schema", default="schemas/invoice.schema.json")
+    ap.add_argument("--model", default="gpt-4o-mini")
+    ap.add_argument("--no_rescue", action="store_true")
+    ap.add_argument("--gcs_bucket", default="unknown")
+    ap.add_argument("--source_system", default="gcs")
+    args = ap.parse_intermixed_args()
+
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    supa = None
+    if args.command == "reconcile":
+        supa_url = os.getenv("SUPABASE_URL")
+        supa_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+        if not supa_url or not supa_key:
+            raise RuntimeError("Set SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY.")
+        supa = Supa(supa_url, supa_key)
+
+    pipeline = InvoicePipeline(supa, schema_path=args.schema, model=args.model, rescue=not args.no_rescue)
+
+    if args.command == "collect":
+        manifest = BatchManifest(model=pipeline.model)
+        lines: List[Dict[str, Any]] = []
+        for pdf in args.pdfs:
+            with tempfile.TemporaryDirectory() as td:
+                doc_lines, info = collect_document(pipeline, Path(pdf), Path(td))
+            info.gcs_bucket = args.gcs_bucket
+            info.gcs_path = Path(pdf).name
+            manifest.documents.append(info)
+            lines.extend(doc_lines)
+        manifest.request_count = write_requests(lines, out_dir / "requests.jsonl")
+        _save_manifest(out_dir, manifest)
+        print(json.dumps({"documents": len(manifest.documents), "requests": manifest.request_count}))
+        return
+
+    manifest = _load_manifest(out_dir)
+    backend = make_backend(manifest.backend or args.backend, client=pipeline.client)
+
+    if args.command == "submit":
+        manifest.backend = backend.name
+        manifest.batch_id = backend.submit(out_dir / "requests.jsonl")
+        _save_manifest(out_dir, manifest)
+        print(json.dumps({"backend": manifest.backend, "batch_id": manifest.batch_id}))
+        return
+
+    if not manifest.batch_id:
+        raise SystemExit("Batch not submitted yet")
+
+    status = backend.status(manifest.batch_id)
+    if args.command == "status":
+        print(json.dumps({"batch_id": manifest.batch_id, "status": status}))
+        return
+
+    if status != "completed":
+        raise SystemExit(f"Batch {manifest.batch_id} is {status}")
+
+    counts = load_results(pipeline, backend, manifest.batch_id)
+    print(json.dumps({"batch_id": manifest.batch_id, **counts}), flush=True)
+
+    for d in manifest.documents:
+        pdf_path = Path(d.pdf_path)
+        with tempfile.TemporaryDirectory() as td:
+            pipeline.process_pdf(
+                pdf_path,
+                Path(td),
+                gcs_bucket=d.gcs_bucket or args.gcs_bucket,
+                gcs_path=d.gcs_path or pdf_path.name,
+                source_system=args.source_system,
+            )
+        print(f"reconciled {pdf_path}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -22,40 +22,25 @@ Statement mode (auto-split multi-invoice PDFs):
 import argparse
 import json
 import os
+import random
 import re
+import time
 from collections import Counter
 from dataclasses import dataclass
 from decimal import Decimal
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List, Tuple, Optional
+from typing import Any, Callable, Dict, List, Tuple, Optional, TypeVar
 
 from dotenv import load_dotenv
 load_dotenv(".env")  # explicit path avoids python-dotenv find_dotenv() issues in some shells
 
 from openai import OpenAI
 
-try:
-    from pypdf import PdfReader, PdfWriter
-except ImportError:
-    PdfReader = None  # type: ignore
-    PdfWriter = None  # type: ignore
-
-
-# ============================================================
-# Money "unglue" fix
-# ============================================================
-
-# Fuel-style glue: 5-decimal unit price + 2-decimal tax + 2-decimal total
-_MONEY3 = re.compile(r"(\d+\.\d{5})(\d+\.\d{2})(\d+\.\d{2})")
-# Generic glue: two adjacent 2-decimal amounts, e.g. 15.91205.91
-_MONEY2 = re.compile(r"(\d+\.\d{2})(\d+\.\d{2})")
-
-
-def unglue_money_columns(text: str) -> str:
-    text = _MONEY3.sub(r"\1 \2 \3", text)
-    text = _MONEY2.sub(r"\1 \2", text)
-    return text
+from extraction_cache import ExtractionCache, cached_llm_call, sha256_hex
+from id_scanner import CHUNK_PAGE
+import page_render
+from pdf_document import PdfDocument, unglue_money_columns  # noqa: F401  (re-exported)
 
 
 # ============================================================
@@ -67,46 +52,9 @@ def read_pdf_text(path: str) -> str:
     Prefer pdfplumber for table-heavy invoices.
     Falls back to pypdf.
     Applies money-column unglue cleanup.
+    Page text is cached per document hash (see pdf_document.py).
     """
-    # Try pdfplumber first (best for columns/tables)
-    try:
-        import pdfplumber  # type: ignore
-
-        parts = []
-        with pdfplumber.open(path) as pdf:
-            for i, page in enumerate(pdf.pages):
-                text = page.extract_text(layout=True) or ""
-                parts.append(f"\n\n--- PAGE {i+1} ---\n{text}")
-
-        text = "\n".join(parts).strip()
-        return unglue_money_columns(text)
-
-    except Exception:
-        # Fallback to pypdf
-        if PdfReader is None:
-            raise RuntimeError("No PDF extraction backend available (install pdfplumber or pypdf).")
-
-        reader = PdfReader(path)
-        parts = []
-        for i, page in enumerate(reader.pages):
-            text = page.extract_text() or ""
-            parts.append(f"\n\n--- PAGE {i+1} ---\n{text}")
-
-        text = "\n".join(parts).strip()
-        return unglue_money_columns(text)
-
-
-def pdf_to_images(path: str, dpi: int = 200) -> List[str]:
-    """Convert PDF pages to base64-encoded PNGs for Vision API."""
-    from pdf2image import convert_from_path
-    import base64, io
-    images = convert_from_path(path, dpi=dpi)
-    result = []
-    for img in images:
-        buf = io.BytesIO()
-        img.save(buf, format="PNG")
-        result.append(base64.b64encode(buf.getvalue()).decode())
-    return result
+    return PdfDocument.open(path).text()
 
 
 def read_pdf_pages_text(path: str) -> List[str]:
@@ -114,18 +62,7 @@ def read_pdf_pages_text(path: str) -> List[str]:
     Returns a list of per-page extracted text (unglued), without the --- PAGE --- headers.
     Uses pdfplumber if available; otherwise pypdf.
     """
-    try:
-        import pdfplumber  # type: ignore
-        out: List[str] = []
-        with pdfplumber.open(path) as pdf:
-            for page in pdf.pages:
-                out.append(unglue_money_columns(page.extract_text(layout=True) or ""))
-        return out
-    except Exception:
-        if PdfReader is None:
-            raise RuntimeError("No PDF extraction backend available (install pdfplumber or pypdf).")
-        r = PdfReader(path)
-        return [unglue_money_columns((pg.extract_text() or "")) for pg in r.pages]
+    return PdfDocument.open(path).layout_pages()
 
 
 # ============================================================
@@ -188,6 +125,45 @@ def _extract_text_from_response(resp: Any) -> str:
         return str(resp)
 
 
+# 429 handling on top of the SDK's own short retries.  Statement parts are
+# extracted concurrently, so a burst can outlast the SDK's 2 quick retries.
+LLM_RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", "5"))
+LLM_BACKOFF_BASE_S = float(os.getenv("LLM_BACKOFF_BASE_S", "2.0"))
+LLM_BACKOFF_MAX_S = float(os.getenv("LLM_BACKOFF_MAX_S", "60.0"))
+
+T = TypeVar("T")
+
+
+def _retry_after_s(err: Exception) -> Optional[float]:
+    """Server-suggested wait from a 429 (retry-after-ms / retry-after seconds)."""
+    headers = getattr(getattr(err, "response", None), "headers", None) or {}
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        val = headers.get(name)
+        if val is None:
+            continue
+        try:
+            return max(0.0, float(val) * scale)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def _with_rate_limit_backoff(call: Callable[[], T]) -> T:
+    attempt = 0
+    while True:
+        try:
+            return call()
+        except Exception as e:
+            if getattr(e, "status_code", None) != 429 or attempt >= LLM_RATE_LIMIT_RETRIES:
+                raise
+            delay = _retry_after_s(e)
+            if delay is None:
+                delay = min(LLM_BACKOFF_MAX_S, LLM_BACKOFF_BASE_S * (2 ** attempt)) * random.uniform(0.5, 1.0)
+            attempt += 1
+            print(f"[llm] rate limited (429); retry {attempt}/{LLM_RATE_LIMIT_RETRIES} in {delay:.1f}s", flush=True)
+            time.sleep(delay)
+
+
 def llm_extract_json(client: OpenAI, model: str, messages: List[dict], schema_bundle: Dict[str, Any]) -> Dict[str, Any]:
     """
     Try new SDK signature first; if not supported, fall back to legacy.
@@ -195,22 +171,22 @@ def llm_extract_json(client: OpenAI, model: str, messages: List[dict], schema_bu
     """
     # New style
     try:
-        resp = client.responses.create(
+        resp = _with_rate_limit_backoff(lambda: client.responses.create(
             model=model,
             input=messages,
             response_format=_schema_format_new(schema_bundle),
-        )
+        ))
         parsed = getattr(resp, "output_parsed", None)
         if isinstance(parsed, dict):
             return parsed
         return json.loads(_extract_text_from_response(resp))
     except TypeError:
         # Legacy style
-        resp = client.responses.create(
+        resp = _with_rate_limit_backoff(lambda: client.responses.create(
             model=model,
             input=messages,
             text={"format": _schema_format_legacy(schema_bundle)},
-        )
+        ))
         return json.loads(_extract_text_from_response(resp))
 
 
@@ -221,7 +197,7 @@ def llm_extract_json_vision(
     Vision-capable extraction using chat completions API with structured output.
     Used for scanned/image-only PDFs where text extraction yields nothing.
     """
-    resp = client.chat.completions.create(
+    resp = _with_rate_limit_backoff(lambda: client.chat.completions.create(
         model=model,
         messages=messages,
         response_format={
@@ -233,7 +209,7 @@ def llm_extract_json_vision(
             },
         },
         max_tokens=4096,
-    )
+    ))
     return json.loads(resp.choices[0].message.content)
 
 
@@ -702,6 +678,10 @@ def infer_airport_code(data: Dict[str, Any], pdf_text: str) -> Dict[str, Any]:
 # Prompt Builders
 # ============================================================
 
+# Part of every extraction cache key.  Bump whenever a build_*_messages
+# function (or the vision DPI) changes what is sent to the model.
+PROMPT_VERSION = "2026-10-16.1"
+
 def build_normal_messages(pdf_text: str) -> List[dict]:
     system = (
         "You extract structured invoice data from text.\n"
@@ -790,16 +770,32 @@ def build_normal_messages(pdf_text: str) -> List[dict]:
     return [{"role": "system", "content": system}, {"role": "user", "content": user}]
 
 
-def build_vision_messages(image_b64_list: List[str]) -> List[dict]:
-    """Build messages for vision-based extraction of scanned PDFs."""
+def build_vision_messages(
+    image_urls: List[str], page_start: int = 1, total_pages: Optional[int] = None,
+) -> List[dict]:
+    """
+    Build messages for vision-based extraction of scanned PDFs.
+    `image_urls` are data URLs (page_render.RenderedPage.data_url).  When the
+    pages are one batch of a longer document, say which pages they are so
+    the model doesn't invent totals printed on other pages.
+    """
     system = build_normal_messages("")  # grab the system prompt
     system_text = system[0]["content"]
 
-    content: List[dict] = [{"type": "text", "text": "Extract the invoice fields from this scanned document:"}]
-    for b64 in image_b64_list:
+    intro = "Extract the invoice fields from this scanned document:"
+    page_end = page_start + len(image_urls) - 1
+    if total_pages is not None and len(image_urls) < total_pages:
+        intro = (
+            f"These are pages {page_start}-{page_end} of a {total_pages}-page scanned document; "
+            "the other pages are extracted separately. Extract the invoice fields and every line item "
+            "visible on these pages. Leave totals null unless they are printed on these pages."
+        )
+
+    content: List[dict] = [{"type": "text", "text": intro}]
+    for url in image_urls:
         content.append({
             "type": "image_url",
-            "image_url": {"url": f"data:image/png;base64,{b64}", "detail": "high"},
+            "image_url": {"url": url, "detail": "high"},
         })
 
     return [
@@ -808,6 +804,43 @@ def build_vision_messages(image_b64_list: List[str]) -> List[dict]:
     ]
 
 
+def merge_vision_batches(parts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Combine per-batch vision extractions of one document (in page order).
+    Header fields come from the first batch that has them, totals from the
+    last (they are printed at the end), line items and warnings are joined.
+    """
+    if len(parts) == 1:
+        return parts[0]
+
+    merged: Dict[str, Any] = {}
+    for key in ("invoice_number", "invoice_date", "due_date", "tail_number", "airport_code", "currency"):
+        merged[key] = next((p.get(key) for p in parts if p.get(key)), None)
+
+    vendor: Dict[str, Any] = {}
+    for p in parts:
+        for k, v in (p.get("vendor") or {}).items():
+            if vendor.get(k) is None:
+                vendor[k] = v
+    merged["vendor"] = vendor
+
+    totals: Dict[str, Any] = {}
+    for p in parts:
+        for k, v in (p.get("totals") or {}).items():
+            if v is not None or k not in totals:
+                totals[k] = v
+    merged["totals"] = totals
+
+    merged["line_items"] = [li for p in parts for li in (p.get("line_items") or [])]
+    warnings: List[Any] = []
+    for p in parts:
+        for w in p.get("warnings") or []:
+            if w not in warnings:
+                warnings.append(w)
+    merged["warnings"] = warnings + [f"VISION_MERGED_{len(parts)}_CALLS"]
+    return merged
+
+
 def build_rescue_messages(pdf_text: str, first_pass: Dict[str, Any], reason: str) -> List[dict]:
     totals_in_doc = extract_total_lines(pdf_text)
     final_total_hint = str(totals_in_doc[-1]) if totals_in_doc else None
@@ -894,30 +927,22 @@ class SplitChunk:
         return self.page_end - self.page_start + 1
 
 
-_INVOICE_ID_PATTERNS: List[re.Pattern] = [
-    re.compile(r"\bRef Number\s+([A-Z0-9\-]+)\b", re.IGNORECASE),
-    re.compile(r"\bInvoice\s+([A-Z0-9\-]+)\b", re.IGNORECASE),
-    re.compile(r"\bInvoice\s*No\.?:?\s*([A-Z0-9\-]+)\b", re.IGNORECASE),
-    re.compile(r"\bCREDIT MEMO NUMBER:\s*([A-Z0-9\-]+)\b", re.IGNORECASE),
-    re.compile(r"\bCredit Memo No\.?:?\s*([A-Z0-9\-]+)\b", re.IGNORECASE),
-]
+# Page ID rules, in priority order: id_scanner.CHUNK_ID_KINDS (Ref Number,
+# Invoice, Invoice No, CREDIT MEMO NUMBER, Credit Memo No).
 
 _BAD_ID = re.compile(r"^(?:PAGE|DATE|CUSTOMER|TOTAL|USD|NUMBER|NUMBERS|INVOICE|PERIOD|DETAIL|SUMMARY|REPORT|BALANCE|STATEMENT)$", re.IGNORECASE)
 
 
 def extract_invoice_id_from_page(page_text: str) -> Optional[str]:
-    t = page_text or ""
-    for pat in _INVOICE_ID_PATTERNS:
-        m = pat.search(t)
-        if m:
-            cand = (m.group(1) or "").strip()
-            cand = cand.replace("–", "-").replace("—", "-")
-            cand = re.sub(r"[^\w\-]", "", cand)
-            if not cand:
-                continue
-            if _BAD_ID.match(cand):
-                continue
-            return cand
+    for m in CHUNK_PAGE.firsts(page_text):
+        cand = (m.value or "").strip()
+        cand = cand.replace("–", "-").replace("—", "-")
+        cand = re.sub(r"[^\w\-]", "", cand)
+        if not cand:
+            continue
+        if _BAD_ID.match(cand):
+            continue
+        return cand
     return None
 
 
@@ -966,22 +991,33 @@ def split_statement_into_chunks(pages_text: List[str]) -> List[SplitChunk]:
     return chunks
 
 
-def write_split_pdf(in_pdf: str, chunk: SplitChunk, out_pdf: str) -> None:
-    if PdfReader is None or PdfWriter is None:
-        raise RuntimeError("Splitting requires pypdf (pip install pypdf).")
-    r = PdfReader(in_pdf)
-    w = PdfWriter()
-    for p in range(chunk.page_start - 1, chunk.page_end):
-        w.add_page(r.pages[p])
-    os.makedirs(os.path.dirname(out_pdf), exist_ok=True)
-    with open(out_pdf, "wb") as f:
-        w.write(f)
+def write_split_pdf(in_pdf: str, chunk: SplitChunk, out_pdf: str, doc: Optional[PdfDocument] = None) -> None:
+    """Pass `doc` when writing several chunks of one file so it is parsed once."""
+    (doc or PdfDocument.open(in_pdf)).subset(range(chunk.page_start - 1, chunk.page_end)).write(out_pdf)
 
 
 # ============================================================
 # Core extraction pipeline (single PDF)
 # ============================================================
 
+def is_scanned_text(pdf_text: str) -> bool:
+    """Scanned/image-only PDF: very little extractable text -> vision path."""
+    stripped = re.sub(r"---\s*PAGE\s+\d+\s*---", "", pdf_text).strip()
+    return len(stripped) < 50
+
+
+def normal_request_body(model: str, schema_bundle: Dict[str, Any], pdf_text: str) -> Dict[str, Any]:
+    """Responses API body for the first-pass extraction (what batch mode submits)."""
+    return {
+        "model": model,
+        "input": build_normal_messages(pdf_text),
+        "text": {"format": _schema_format_legacy(schema_bundle)},
+    }
+
+class _NoPageImages(Exception):
+    """A scanned PDF rendered no page images; raised so the result isn't cached."""
+
+
 def extract_one_pdf(
     client: OpenAI,
     schema_bundle: Dict[str, Any],
@@ -989,28 +1025,56 @@ def extract_one_pdf(
     model: str,
     rescue: bool,
     pdf_text: Optional[str] = None,
+    cache: Optional[ExtractionCache] = None,
+    bypass_cache: bool = False,
 ) -> Dict[str, Any]:
+    """
+    With `cache`, raw model output is looked up by input content first;
+    the deterministic post-fixes below always run.
+    """
     if pdf_text is None:
         pdf_text = read_pdf_text(pdf_path)
 
-    # Detect scanned/image-only PDF: very little extractable text
-    stripped = re.sub(r"---\s*PAGE\s+\d+\s*---", "", pdf_text).strip()
-    is_scan = len(stripped) < 50
+    cache_args: Dict[str, Any] = {
+        "schema_hash": sha256_hex(schema_bundle) if cache is not None else "",
+        "prompt_version": PROMPT_VERSION,
+        "bypass": bypass_cache,
+    }
+
+    is_scan = is_scanned_text(pdf_text)
 
     if is_scan:
-        # Vision path: convert PDF to images, send to GPT-4o
-        images = pdf_to_images(pdf_path)
-        if not images:
+        # Vision path: render pages (in parallel, VISION_PAGES_PER_CALL at a
+        # time) and send each batch to GPT-4o; batches are merged in page order.
+        def _vision() -> Dict[str, Any]:
+            doc = PdfDocument.open(pdf_path)
+            parts: List[Dict[str, Any]] = []
+            for batch in page_render.iter_page_batches(pdf_path, doc=doc):
+                messages = build_vision_messages(
+                    [p.data_url for p in batch], page_start=batch[0].page_no, total_pages=doc.page_count,
+                )
+                parts.append(llm_extract_json_vision(
+                    client=client, model="gpt-4o", messages=messages, schema_bundle=schema_bundle,
+                ))
+            if not parts:
+                raise _NoPageImages(pdf_path)
+            return merge_vision_batches(parts)
+
+        # Keyed on the file bytes: the rendered pages are a pure function of
+        # them and the render settings.
+        try:
+            data = cached_llm_call(
+                cache, _vision, kind="vision", model="gpt-4o",
+                text=sha256_hex(Path(pdf_path).read_bytes()) if cache is not None else "",
+                extra=page_render.settings(), **cache_args,
+            )
+        except _NoPageImages:
             return normalize_extraction({
                 "vendor": None, "invoice_number": None, "invoice_date": None,
                 "due_date": None, "airport_code": None, "tail_number": None,
                 "totals": {"subtotal": None, "tax": None, "total_amount": None},
                 "line_items": [], "warnings": ["SCAN_EMPTY_IMAGES"],
             })
-        messages = build_vision_messages(images)
-        data = llm_extract_json_vision(
-            client=client, model="gpt-4o", messages=messages, schema_bundle=schema_bundle,
-        )
         data = normalize_extraction(data)
         # Deterministic post-processing still runs (gracefully handles empty pdf_text)
         data = apply_invoice_number_override(data, pdf_text)
@@ -1023,11 +1087,15 @@ def extract_one_pdf(
     else:
         # Standard text-based path
         # 1) First pass extraction
-        data1 = llm_extract_json(
-            client=client,
-            model=model,
-            messages=build_normal_messages(pdf_text),
-            schema_bundle=schema_bundle,
+        data1 = cached_llm_call(
+            cache,
+            lambda: llm_extract_json(
+                client=client,
+                model=model,
+                messages=build_normal_messages(pdf_text),
+                schema_bundle=schema_bundle,
+            ),
+            kind="normal", model=model, text=pdf_text, **cache_args,
         )
         data1 = normalize_extraction(data1)
         data1 = apply_invoice_number_override(data1, pdf_text)
@@ -1042,11 +1110,15 @@ def extract_one_pdf(
         if rescue:
             do_rescue, reason = should_rescue(data1, pdf_text)
             if do_rescue:
-                data2 = llm_extract_json(
-                    client=client,
-                    model=model,
-                    messages=build_rescue_messages(pdf_text, data1, reason),
-                    schema_bundle=schema_bundle,
+                data2 = cached_llm_call(
+                    cache,
+                    lambda: llm_extract_json(
+                        client=client,
+                        model=model,
+                        messages=build_rescue_messages(pdf_text, data1, reason),
+                        schema_bundle=schema_bundle,
+                    ),
+                    kind="rescue", model=model, text=pdf_text, extra=[data1, reason], **cache_args,
                 )
                 data2 = normalize_extraction(data2)
                 data2 = apply_invoice_number_override(data2, pdf_text)
@@ -1158,11 +1230,11 @@ def main() -> None:
         raise SystemExit("Normal mode requires --pdf, --text_file, or repair mode flags")
 
     if args.out_dir:
-        pages_text = read_pdf_pages_text(args.pdf)
-        chunks = split_statement_into_chunks(pages_text)
+        doc = PdfDocument.open(args.pdf)
+        chunks = split_statement_into_chunks(doc.layout_pages())
 
         if not chunks:
-            data = extract_one_pdf(client, schema_bundle, args.pdf, args.model, args.rescue)
+            data = extract_one_pdf(client, schema_bundle, args.pdf, args.model, args.rescue, pdf_text=doc.text())
             os.makedirs(args.out_dir, exist_ok=True)
             out_path = os.path.join(args.out_dir, "invoice.json")
             write_json(out_path, data)
@@ -1176,9 +1248,10 @@ def main() -> None:
         manifest_rows: List[Dict[str, Any]] = []
         for ch in chunks:
             out_pdf = os.path.join(split_dir, f"{ch.invoice_id}.pdf")
-            write_split_pdf(args.pdf, ch, out_pdf)
+            part = doc.subset(range(ch.page_start - 1, ch.page_end))
+            part.write(out_pdf)
 
-            data = extract_one_pdf(client, schema_bundle, out_pdf, args.model, args.rescue)
+            data = extract_one_pdf(client, schema_bundle, out_pdf, args.model, args.rescue, pdf_text=part.text())
 
             out_json = os.path.join(args.out_dir, f"{ch.invoice_id}.json")
             write_json(out_json, data)
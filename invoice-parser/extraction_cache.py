@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+extraction_cache.py
+
+Content-addressed cache of raw LLM extractions.
+
+Key = sha256 over (prompt version, pass kind, model, schema hash, sha256 of
+the normalized input text, optional extra input such as the first-pass
+result for a rescue).  The value is the model's JSON *before* deterministic
+post-fixes, so a hit skips the API call and the post-fixes re-run on top.
+Reparsing after a post-processing fix therefore costs no API spend.
+
+Two layers:
+  - in-process LRU (EXTRACTION_CACHE_MEM_ENTRIES, default 512)
+  - Supabase table extraction_cache (persistent across instances), pruned
+    to EXTRACTION_CACHE_MAX_ROWS via prune_extraction_cache()
+
+Env:
+  EXTRACTION_CACHE=0         disable entirely
+  EXTRACTION_CACHE_BYPASS=1  never read (still refreshes entries)
+"""
+
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+CACHE_TABLE = "extraction_cache"
+
+CACHE_ENABLED = os.getenv("EXTRACTION_CACHE", "1") not in {"0", "false", "False", "no", "NO"}
+CACHE_BYPASS = os.getenv("EXTRACTION_CACHE_BYPASS", "0") in {"1", "true", "True", "yes", "YES"}
+MEM_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MEM_ENTRIES", "512"))
+MAX_ROWS = int(os.getenv("EXTRACTION_CACHE_MAX_ROWS", "50000"))
+PRUNE_EVERY_WRITES = 200
+
+_BLANK_RUNS = re.compile(r"\n{3,}")
+
+
+def normalize_text(text: str) -> str:
+    """Whitespace-only normalization: line endings, trailing spaces, blank-line runs."""
+    t = (text or "").replace("\r\n", "\n").replace("\r", "\n")
+    t = "\n".join(line.rstrip() for line in t.split("\n"))
+    return _BLANK_RUNS.sub("\n\n", t).strip()
+
+
+def sha256_hex(data: Any) -> str:
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    elif not isinstance(data, (bytes, bytearray)):
+        data = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+class ExtractionCache:
+    """Thread-safe; one instance per process (owned by InvoicePipeline)."""
+
+    def __init__(self, supa=None, *, mem_entries: int = MEM_ENTRIES, max_rows: int = MAX_ROWS) -> None:
+        self.supa = supa
+        self.mem_entries = mem_entries
+        self.max_rows = max_rows
+        self._mem: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits_mem": 0, "hits_db": 0, "misses": 0, "bypassed": 0, "writes": 0, "errors": 0}
+
+    @staticmethod
+    def make_key(
+        *,
+        kind: str,
+        model: str,
+        schema_hash: str,
+        prompt_version: str,
+        text: str,
+        extra: Any = None,
+    ) -> str:
+        parts = [prompt_version, kind, model, schema_hash, sha256_hex(normalize_text(text))]
+        if extra is not None:
+            parts.append(sha256_hex(extra))
+        return sha256_hex("|".join(parts))
+
+    def _bump(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._stats)
+            out["mem_entries"] = len(self._mem)
+        lookups = out["hits_mem"] + out["hits_db"] + out["misses"]
+        out["hit_rate"] = round((out["hits_mem"] + out["hits_db"]) / lookups, 4) if lookups else None
+        out["persistent"] = self.supa is not None
+        return out
+
+    # ---------------------------
+    # Lookups
+    # ---------------------------
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            val = self._mem.get(key)
+            if val is not None:
+                self._mem.move_to_end(key)
+                self._stats["hits_mem"] += 1
+                return copy.deepcopy(val)
+
+        val = self._db_get(key)
+        if val is not None:
+            self._bump("hits_db")
+            self._mem_put(key, val)
+            return copy.deepcopy(val)
+
+        self._bump("misses")
+        return None
+
+    def put(self, key: str, value: Dict[str, Any], *, kind: str, model: str, prompt_version: str) -> None:
+        self._mem_put(key, copy.deepcopy(value))
+        self._db_put(key, value, kind=kind, model=model, prompt_version=prompt_version)
+
+    def _mem_put(self, key: str, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._mem[key] = value
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.mem_entries:
+                self._mem.popitem(last=False)
+
+    # ---------------------------
+    # Supabase layer (best-effort)
+    # ---------------------------
+
+    def _db_get(self, key: str) -> Optional[Dict[str, Any]]:
+        if self.supa is None:
+            return None
+        try:
+            rows = self.supa._rest(
+                "GET",
+                CACHE_TABLE,
+                params={"select": "response", "cache_key": f"eq.{key}", "limit": "1"},
+            )
+        except Exception as e:
+            self._bump("errors")
+            print(f"[extraction_cache] read failed: {e}", flush=True)
+            return None
+        if rows and isinstance(rows[0].get("response"), dict):
+            return rows[0]["response"]
+        return None
+
+    def _db_put(self, key: str, value: Dict[str, Any], *, kind: str, model: str, prompt_version: str) -> None:
+        if self.supa is None:
+            return
+        try:
+            self.supa._rest(
+                "POST",
+                CACHE_TABLE,
+                params={"on_conflict": "cache_key"},
+                json_body={
+                    "cache_key": key,
+                    "kind": kind,
+                    "model": model,
+                    "prompt_version": prompt_version,
+                    "response": value,
+                },
+                prefer="resolution=merge-duplicates,return=minimal",
+            )
+        except Exception as e:
+            self._bump("errors")
+            print(f"[extraction_cache] write failed: {e}", flush=True)
+            return
+
+        with self._lock:
+            self._stats["writes"] += 1
+            prune = self._stats["writes"] % PRUNE_EVERY_WRITES == 0
+        if prune:
+            try:
+                self.supa._rest("POST", "rpc/prune_extraction_cache", json_body={"max_rows": self.max_rows})
+            except Exception as e:
+                print(f"[extraction_cache] prune failed: {e}", flush=True)
+
+
+def cached_llm_call(
+    cache: Optional[ExtractionCache],
+    call,
+    *,
+    kind: str,
+    model: str,
+    schema_hash: str,
+    prompt_version: str,
+    text: str,
+    extra: Any = None,
+    bypass: bool = False,
+) -> Dict[str, Any]:
+    """Return the cached raw extraction for these inputs, or call the model and store it."""
+    if cache is None:
+        return call()
+
+    key = cache.make_key(
+        kind=kind, model=model, schema_hash=schema_hash,
+        prompt_version=prompt_version, text=text, extra=extra,
+    )
+    if bypass or CACHE_BYPASS:
+        cache._bump("bypassed")
+    else:
+        hit = cache.get(key)
+        if hit is not None:
+            return hit
+
+    data = call()
+    cache.put(key, data, kind=kind, model=model, prompt_version=prompt_version)
+    return data
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+id_scanner.py
+
+Shared scanner for invoice-ID and section-boundary tokens.
+
+Every pattern the splitters use (World Fuel invoice numbers, fuel tickets,
+Ref Number / Invoice / Credit Memo labels, INV codes, Avfuel receipt rows,
+airport fuel lines) is a named rule.  Rules that start with a keyword are
+grouped into families by that keyword.  A Scanner compiles one anchor
+regex (an alternation of the family keywords) and makes a single pass
+over the text with it; at each anchor only that family's rules are tried,
+anchored, with rule.match().  Rules without a keyword head (line-start
+rules) run as their own finditer.
+
+scan() returns typed tokens with offsets.  For each rule the tokens are
+exactly what rule.finditer(text) yields (same starts, same values,
+overlaps within a rule dropped the same way), so callers keep their
+priority and de-duplication logic unchanged.  test_id_scanner.py checks
+this against the per-regex implementations it replaced.
+
+Results for document-sized texts are memoized per (scanner, text):
+detect_invoice_ids and split_text_into_sections on the same statement
+text share one scan.  Per-page lookups that only want the first usable ID
+use Scanner.firsts(), which searches rule by rule and stops early.
+
+  toks = scan(text)                         # DOCUMENT scanner
+  first(toks, "wf_invoice")                 # first World Fuel invoice number
+  [t.value for t in of_kind(toks, "ref_number")]
+  next(PAGE.firsts(page_text), None)
+"""
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+
+class Token(NamedTuple):
+    kind: str
+    value: Optional[str]  # capture group 1, or the whole match for rules without groups
+    start: int            # start of the full rule match
+    end: int
+
+
+# ---------------------------
+# Rules (kind -> pattern, flags, family)
+# ---------------------------
+
+# Family anchors (lead, rest): every match of a family's rules starts where
+# its anchor matches, and no anchor can start inside another, so one pass
+# over the alternation finds every candidate start.  The lead is a
+# case-sensitive character class so the combined anchor starts with a plain
+# charset and the regex engine can skip to candidate characters on its own;
+# it must list every character the rule's first letter matches under re.I
+# (U+0130/U+0131 fold to "i").
+FAMILIES: Dict[str, Tuple[str, str]] = {
+    "digits": (r"\d", r"\d{7,}-"),
+    "fuel_ticket": (r"Ff", r"(?i:UEL\s+TICKET)"),
+    "inv_code": (r"Ii\u0130\u0131", r"(?i:NV\d)"),
+    "invoice": (r"Ii\u0130\u0131", r"(?i:NVOICE)"),
+    "ref": (r"Rr", r"(?i:EF)"),
+    "credit_memo": (r"Cc", r"(?i:REDIT\s+MEMO)"),
+}
+
+RULES: Dict[str, Tuple[str, int, Optional[str]]] = {
+    # World Fuel invoice numbers: 8+ digits hyphen 4-5 digits (e.g. 27379628-21101)
+    "wf_invoice": (r"\b(\d{8,}-\d{4,5})\b", 0, "digits"),
+    "fuel_ticket": (r"\bFUEL\s+TICKET\s+(\d{4,})\b", re.I, "fuel_ticket"),
+    # World Fuel fuel ticket: header on one line, number on next line
+    # (a date like 16-MAR-2026 may precede the number)
+    "fuel_ticket_next_line": (
+        r"FUEL\s+TICKET\b[^\n]*\n\s*(?:\d{1,2}-[A-Z]{3}-\d{4}\s+)?(\d{5,7})\b", re.I, "fuel_ticket",
+    ),
+    "inv_code": (r"\b(INV\d{6,})\b", re.I, "inv_code"),
+
+    # Statement ID detection (process_pdf.detect_invoice_ids)
+    "ref_number": (r"\bRef Number\s+([A-Z0-9-]{6,})\b", re.I, "ref"),
+    "invoice": (r"\bInvoice\s+(?:No\.?|#|Number)?\s*([A-Z0-9-]{3,})\b", re.I, "invoice"),
+    "credit_memo": (r"\bCredit Memo No\.?:\s*([A-Z0-9-]{3,})\b", re.I, "credit_memo"),
+
+    # Section boundaries (process_pdf.split_text_into_sections)
+    "section_ref_number": (r"\bRef Number\s+([A-Z0-9][A-Z0-9-]*)\b", re.I, "ref"),
+    "section_invoice": (r"\bInvoice\s+(?:No\.?|#|Number)\s*:?\s*([A-Z0-9][A-Z0-9-]{2,})\b", re.I, "invoice"),
+    "section_credit_memo": (
+        r"\bCredit Memo\s+(?:No\.?|#|Number)\s*:?\s*([A-Z0-9][A-Z0-9-]{2,})\b", re.I, "credit_memo",
+    ),
+
+    # Avfuel activity invoices: receipt rows and the master REF NO
+    "receipt_line": (r"^\s{0,20}(\d{7,9})\b", re.M, None),
+    "master_ref": (r"REF\s+(?:NO|NUMBER)\s*:?\s*(\d+)", re.I, "ref"),
+
+    # Airport stops in consolidated fuel statements (process_pdf._subsplit_by_airport)
+    # Leading: "OSU1 JET FUEL ...", "MSN IP ...", "YIP-AVFLIGHT", "APF JET FUEL"
+    "airport_lead": (
+        r"^([A-Z0-9]{3,4})[\s\-]+"
+        r"(?:JET[\s-]*(?:FUEL|A)|AVGAS|100LL|FUEL\b|IP[\s\-]|FSII|FLOW[\s-]*FEE|INTO[\s-]*PLANE|AVFLIGHT)",
+        re.I | re.M,
+        None,
+    ),
+    # Trailing: "THRU PUT - YIP", "FLOW FEE YIP", "FSII - APF"
+    "airport_trail": (
+        r"(?:THRU\s*PUT|FLOW\s*FEE|FSII|INTO[\s-]*PLANE|FUEL\s*TAX|EXCISE\s*TAX|"
+        r"KEROSENE|LUST\s*TAX|SUPERFUND|STORAGE\s*(?:TK\s*)?FEE|PROTECTION|WATER\s*QUALITY)"
+        r"\s*[\-]?\s*([A-Z]{3})\b",
+        re.I | re.M,
+        None,
+    ),
+
+    # Per-page IDs (split_statement.page_invoice_id)
+    "page_ref_number": (r"\bRef Number\s+([A-Z0-9-]+)\b", re.I, "ref"),
+    "page_invoice": (r"\bInvoice\s+(?:No\.?|Number)?\s*[:#]?\s*([A-Z0-9-]+)\b", re.I, "invoice"),
+    "page_credit_memo": (r"\bCredit Memo No\.?\s*[:#]?\s*([A-Z0-9-]+)\b", re.I, "credit_memo"),
+
+    # Per-page IDs (extract_invoice.extract_invoice_id_from_page)
+    "chunk_invoice": (r"\bInvoice\s+([A-Z0-9\-]+)\b", re.I, "invoice"),
+    "chunk_invoice_no": (r"\bInvoice\s*No\.?:?\s*([A-Z0-9\-]+)\b", re.I, "invoice"),
+    "chunk_credit_memo_number": (r"\bCREDIT MEMO NUMBER:\s*([A-Z0-9\-]+)\b", re.I, "credit_memo"),
+    "chunk_credit_memo": (r"\bCredit Memo No\.?:?\s*([A-Z0-9\-]+)\b", re.I, "credit_memo"),
+}
+
+# Caller rule lists, in each caller's priority order.
+INVOICE_ID_KINDS = (
+    "wf_invoice", "fuel_ticket", "fuel_ticket_next_line", "ref_number", "invoice", "credit_memo", "inv_code",
+)
+SECTION_KINDS = (
+    "wf_invoice", "fuel_ticket", "section_ref_number", "section_invoice", "section_credit_memo", "inv_code",
+)
+AVFUEL_KINDS = ("receipt_line", "master_ref")
+PAGE_ID_KINDS = (
+    "wf_invoice", "fuel_ticket", "fuel_ticket_next_line", "page_ref_number", "page_credit_memo", "page_invoice",
+)
+CHUNK_ID_KINDS = (
+    "page_ref_number", "chunk_invoice", "chunk_invoice_no", "chunk_credit_memo_number", "chunk_credit_memo",
+)
+
+
+# ---------------------------
+# Scanner
+# ---------------------------
+
+class Scanner:
+    """A set of rules: one anchor pass for keyword rules, finditer for the rest.  Thread-safe."""
+
+    def __init__(self, name: str, kinds: Iterable[str]) -> None:
+        self.name = name
+        self.kinds: Tuple[str, ...] = tuple(dict.fromkeys(kinds))
+        families: Dict[str, List[Tuple[str, Callable, bool]]] = {}
+        self._direct: List[Tuple[str, "re.Pattern[str]"]] = []
+        self._searches: List[Tuple[str, Callable, bool]] = []
+        for kind in self.kinds:
+            pat, flags, family = RULES[kind]
+            rx = re.compile(pat, flags)
+            self._searches.append((kind, rx.search, bool(rx.groups)))
+            if family is None:
+                self._direct.append((kind, rx))
+            else:
+                families.setdefault(family, []).append((kind, rx.match, bool(rx.groups)))
+        self._families = {f: tuple(rules) for f, rules in families.items()}
+        self._anchor = None
+        if families:
+            leads = "".join(dict.fromkeys(FAMILIES[f][0] for f in families))
+            alts = "|".join(f"(?<=[{FAMILIES[f][0]}])(?P<{f}>){FAMILIES[f][1]}" for f in families)
+            self._anchor = re.compile(f"[{leads}](?:{alts})")
+
+    def scan(self, text: str) -> List[Token]:
+        """All tokens, in text order."""
+        text = text or ""
+        tokens: List[Token] = []
+        add = tokens.append
+        if self._anchor is not None:
+            families = self._families
+            last_end: Dict[str, int] = dict.fromkeys(self.kinds, 0)
+            for a in self._anchor.finditer(text):
+                pos = a.start()
+                for kind, match, grouped in families[a.lastgroup]:
+                    # Same as per-rule finditer: a match may not start inside the previous one.
+                    if pos < last_end[kind]:
+                        continue
+                    m = match(text, pos)
+                    if m is not None:
+                        end = last_end[kind] = m.end()
+                        add(Token(kind, m.group(1) if grouped else m.group(0), pos, end))
+        if self._direct:
+            for kind, rx in self._direct:
+                grouped = bool(rx.groups)
+                for m in rx.finditer(text):
+                    add(Token(kind, m.group(1) if grouped else m.group(0), m.start(), m.end()))
+            if self._anchor is not None or len(self._direct) > 1:
+                tokens.sort(key=_token_start)
+        return tokens
+
+    def firsts(self, text: str) -> Iterator[Token]:
+        """First token of each rule, lazily, in `kinds` order.
+
+        For per-page lookups that stop at the first usable ID: a full scan
+        of a short page costs more than a few early-exit searches.
+        """
+        text = text or ""
+        for kind, search, grouped in self._searches:
+            m = search(text)
+            if m is not None:
+                yield Token(kind, m.group(1) if grouped else m.group(0), m.start(), m.end())
+
+
+def _token_start(t: Token) -> int:
+    return t.start
+
+
+DOCUMENT = Scanner("document", INVOICE_ID_KINDS + SECTION_KINDS)
+AVFUEL = Scanner("avfuel", AVFUEL_KINDS)
+AIRPORT_LEAD = Scanner("airport_lead", ("airport_lead",))
+AIRPORT_TRAIL = Scanner("airport_trail", ("airport_trail",))
+PAGE = Scanner("page", PAGE_ID_KINDS)
+CHUNK_PAGE = Scanner("chunk_page", CHUNK_ID_KINDS)
+
+
+# ---------------------------
+# Memoized scans
+# ---------------------------
+
+SCAN_CACHE_ENTRIES = 256
+# Shorter texts (sections, pages) are cheaper to rescan than to hash.
+SCAN_CACHE_MIN_CHARS = 4096
+
+_scan_cache: "OrderedDict[Tuple[str, str], Tuple[Token, ...]]" = OrderedDict()
+_scan_lock = threading.Lock()
+
+
+def scan(text: str, scanner: Scanner = DOCUMENT) -> Tuple[Token, ...]:
+    text = text or ""
+    if len(text) < SCAN_CACHE_MIN_CHARS:
+        return tuple(scanner.scan(text))
+    key = (scanner.name, hashlib.sha1(text.encode("utf-8", "surrogatepass")).hexdigest())
+    with _scan_lock:
+        hit = _scan_cache.get(key)
+        if hit is not None:
+            _scan_cache.move_to_end(key)
+            return hit
+    toks = tuple(scanner.scan(text))
+    with _scan_lock:
+        _scan_cache[key] = toks
+        while len(_scan_cache) > SCAN_CACHE_ENTRIES:
+            _scan_cache.popitem(last=False)
+    return toks
+
+
+def of_kind(tokens: Iterable[Token], kind: str) -> List[Token]:
+    return [t for t in tokens if t.kind == kind]
+
+
+def by_kind(tokens: Iterable[Token], kinds: Sequence[str]) -> List[Token]:
+    """Tokens grouped rule by rule (in `kinds` order), text order within a rule."""
+    groups: Dict[str, List[Token]] = {k: [] for k in kinds}
+    for t in tokens:
+        g = groups.get(t.kind)
+        if g is not None:
+            g.append(t)
+    return [t for k in kinds for t in groups[k]]
+
+
+def first(tokens: Iterable[Token], kind: str) -> Optional[Token]:
+    for t in tokens:
+        if t.kind == kind:
+            return t
+    return None
+
+
+def line_start(text: str, pos: int) -> int:
+    i = text.rfind("\n", 0, pos)
+    return 0 if i < 0 else i + 1
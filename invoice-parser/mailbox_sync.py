@@ -0,0 +1,211 @@
+"""
+Shared incremental mailbox sync over Microsoft Graph delta queries.
+
+Instead of re-listing a folder with a receivedDateTime window on every run,
+MailboxSync follows /users/{mailbox}/mailFolders/{folder}/messages/delta
+and keeps the returned link per (mailbox, folder, consumer) in the
+graph_delta_links table (invoice-dashboard migration
+20261016_graph_delta_links.sql).  A run against an idle folder is one Graph
+call that returns nothing.
+
+  sync = MailboxSync(mailbox, "Inbox", consumer="invoice-ingest",
+                     select="id,subject,receivedDateTime,hasAttachments")
+  batch = sync.fetch(token, initial_since=now - timedelta(days=1), max_messages=50)
+  for msg in batch.messages:       # new or changed since the last commit
+      handle(msg)
+  batch.commit()                   # persist the link only once handled
+
+The consumer name keeps separate state for callers that sync the same folder
+with different $select (the link encodes the query).  The first sync, or a
+resync after Graph expires the link (410 / SyncStateNotFound), starts from
+initial_since.  When max_messages stops a round early the page link is
+stored instead of the delta link, so the next run carries on from there.
+
+Changed messages (read flag, category) come back too; callers must be
+idempotent, as they already are for re-listed messages.  Removed messages
+are dropped.
+
+Env:
+  SUPABASE_URL / SUPABASE_SERVICE_ROLE_KEY
+  GRAPH_DELTA_PAGE_SIZE   messages per delta page (default 50)
+"""
+
+import os
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from urllib.parse import quote
+
+import requests
+
+GRAPH_DELTA_PAGE_SIZE = int(os.getenv("GRAPH_DELTA_PAGE_SIZE", "50"))
+
+GRAPH_BASE = "https://graph.microsoft.com/v1.0"
+DELTA_TABLE = "graph_delta_links"
+
+
+class DeltaExpired(Exception):
+    """The stored delta/page link is no longer valid; a full resync is needed."""
+
+
+def _utc_now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+@dataclass
+class SyncBatch:
+    """Messages from one fetch(); commit() saves the position after them."""
+    sync: "MailboxSync"
+    messages: List[Dict[str, Any]]
+    link: Optional[str]
+    resynced: bool = False
+    complete: bool = True  # False: stopped at max_messages, more pages waiting
+    graph_calls: int = 0
+    removed: int = 0
+
+    def commit(self) -> None:
+        if self.link:
+            self.sync.save_link(self.link)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "messages": len(self.messages), "removed": self.removed, "graph_calls": self.graph_calls,
+            "resynced": self.resynced, "complete": self.complete,
+        }
+
+
+class MailboxSync:
+    """Delta state for one mailbox folder and consumer.  One per call site; not shared across threads."""
+
+    def __init__(
+        self,
+        mailbox: str,
+        folder: str = "Inbox",
+        *,
+        consumer: str,
+        select: str = "id,subject,receivedDateTime",
+        url: Optional[str] = None,
+        key: Optional[str] = None,
+        timeout: float = 30,
+    ) -> None:
+        url = (url or os.environ.get("SUPABASE_URL", "")).strip().rstrip("/")
+        key = (key or os.environ.get("SUPABASE_SERVICE_ROLE_KEY", "")).strip()
+        if not url or not key:
+            raise RuntimeError("Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY env var")
+        self.mailbox = mailbox
+        self.folder = folder
+        self.consumer = consumer
+        self.select = select
+        self.timeout = timeout
+        self.rest_base = f"{url}/rest/v1"
+        self.db = requests.Session()
+        self.db.headers.update({
+            "apikey": key,
+            "Authorization": f"Bearer {key}",
+            "Content-Type": "application/json",
+        })
+        self.graph = requests.Session()
+
+    # ---- persisted state ----
+
+    def _key_params(self) -> Dict[str, str]:
+        return {
+            "mailbox": f"eq.{self.mailbox}",
+            "folder": f"eq.{self.folder}",
+            "consumer": f"eq.{self.consumer}",
+        }
+
+    def load_link(self) -> Optional[str]:
+        r = self.db.get(
+            f"{self.rest_base}/{DELTA_TABLE}",
+            params={**self._key_params(), "select": "delta_link", "limit": "1"},
+            timeout=self.timeout,
+        )
+        if r.status_code >= 300:
+            raise RuntimeError(f"{DELTA_TABLE} read failed {r.status_code}: {(r.text or '')[:500]}")
+        rows = r.json() or []
+        return rows[0].get("delta_link") if rows else None
+
+    def save_link(self, link: str) -> None:
+        r = self.db.post(
+            f"{self.rest_base}/{DELTA_TABLE}",
+            params={"on_conflict": "mailbox,folder,consumer"},
+            json={
+                "mailbox": self.mailbox, "folder": self.folder, "consumer": self.consumer,
+                "delta_link": link, "updated_at": _utc_now(),
+            },
+            headers={"Prefer": "resolution=merge-duplicates,return=minimal"},
+            timeout=self.timeout,
+        )
+        if r.status_code >= 300:
+            raise RuntimeError(f"{DELTA_TABLE} write failed {r.status_code}: {(r.text or '')[:500]}")
+
+    def reset(self) -> None:
+        """Forget the stored link: the next fetch() is a full resync."""
+        self.db.delete(f"{self.rest_base}/{DELTA_TABLE}", params=self._key_params(), timeout=self.timeout)
+
+    # ---- Graph ----
+
+    def _initial_url(self, initial_since: Optional[datetime]) -> str:
+        mbox = quote(self.mailbox, safe="@._-")
+        url = f"{GRAPH_BASE}/users/{mbox}/mailFolders/{quote(self.folder, safe='')}/messages/delta?$select={self.select}"
+        if initial_since is not None:
+            since_iso = initial_since.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+            url += f"&$filter=receivedDateTime ge {since_iso}"
+        return url
+
+    def _get(self, url: str, token: str) -> Dict[str, Any]:
+        r = self.graph.get(
+            url,
+            headers={"Authorization": f"Bearer {token}", "Prefer": f"odata.maxpagesize={GRAPH_DELTA_PAGE_SIZE}"},
+            timeout=self.timeout,
+        )
+        if r.status_code == 410 or (r.status_code == 400 and "SyncStateNotFound" in (r.text or "")):
+            raise DeltaExpired((r.text or "")[:300])
+        r.raise_for_status()
+        return r.json()
+
+    def _walk(self, start: str, token: str, max_messages: Optional[int], batch: SyncBatch) -> None:
+        url: Optional[str] = start
+        while url:
+            page = self._get(url, token)
+            batch.graph_calls += 1
+            for msg in page.get("value", []):
+                if "@removed" in msg:
+                    batch.removed += 1
+                else:
+                    batch.messages.append(msg)
+            delta_link = page.get("@odata.deltaLink")
+            next_link = page.get("@odata.nextLink")
+            if delta_link:
+                batch.link, batch.complete = delta_link, True
+                return
+            batch.link = next_link
+            if max_messages is not None and len(batch.messages) >= max_messages:
+                batch.complete = False
+                return
+            url = next_link
+
+    def fetch(
+        self,
+        token: str,
+        *,
+        initial_since: Optional[datetime] = None,
+        max_messages: Optional[int] = None,
+    ) -> SyncBatch:
+        """
+        New and changed messages since the last commit() (Graph's order).
+        Stops after the page that reaches max_messages (a round is never cut
+        mid-page, so nothing is skipped).
+        """
+        batch = SyncBatch(self, [], None)
+        link = self.load_link()
+        if link:
+            try:
+                self._walk(link, token, max_messages, batch)
+                return batch
+            except DeltaExpired as e:
+                print(f"[mailbox_sync] {self.mailbox}/{self.folder} ({self.consumer}) delta expired, resyncing: {e}", flush=True)
+                batch = SyncBatch(self, [], None, resynced=True, graph_calls=batch.graph_calls)
+        self._walk(self._initial_url(initial_since), token, max_messages, batch)
+        return batch
@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 import os
-import subprocess
+import threading
 import traceback
 import tempfile
+from contextlib import contextmanager
+from dataclasses import asdict
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import google.auth
 import requests as _requests
+from google.api_core.exceptions import NotFound
 from google.auth.transport.requests import Request as AuthRequest
 from google.auth.iam import Signer
 from google.cloud import storage
@@ -26,11 +29,15 @@ SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
 DOCUMENTS_TABLE = os.environ.get("DOCUMENTS_TABLE", "documents")
 
-# Optional controls passed through to process_pdf.py
+# Extraction controls for the in-process pipeline
 SCHEMA_PATH = os.environ.get("INVOICE_SCHEMA", "schemas/invoice.schema.json")
 MODEL_NAME = os.environ.get("EXTRACTION_MODEL", "gpt-4o-mini")
 NO_RESCUE = os.environ.get("NO_RESCUE", "0") in {"1", "true", "True", "yes", "YES"}
 
+# Offline batch extraction (see batch_extract.py): "openai" or "local" (tests)
+BATCH_BACKEND = os.environ.get("BATCH_BACKEND", "openai")
+BATCHES_TABLE = "extraction_batches"
+
 if not SUPABASE_URL or not SUPABASE_KEY:
     raise RuntimeError("Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY")
 
@@ -57,6 +64,13 @@ def log_pipeline_run(
         print(f"[log_pipeline_run] {pipeline}: {e}", flush=True)
 
 from auth_middleware import add_auth_middleware
+from batch_extract import collect_document, load_results, make_backend, write_requests
+from extract_invoice import PROMPT_VERSION
+from job_queue import Consumer, JobQueue
+from parse_worker import ParseWorkerPool
+from pipeline import InvoicePipeline
+from pdf_document import PdfDocument
+from process_pdf import WRITE_ARTIFACTS, Supa, utc_now_iso
 
 app = FastAPI(title="invoice-parser", version=os.environ.get("APP_VERSION", "0.2.0"))
 add_auth_middleware(app)
@@ -65,22 +79,66 @@ app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
 
-def run_cmd(cmd):
-    r = subprocess.run(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-    )
-    if r.returncode != 0:
-        raise RuntimeError(
-            "COMMAND FAILED\n"
-            f"cmd={' '.join(cmd)}\n"
-            f"exit_code={r.returncode}\n"
-            f"stdout:\n{r.stdout}\n"
-            f"stderr:\n{r.stderr}\n"
-        )
-    return r.stdout
+# One pipeline per instance: schema bundle, OpenAI client and the Supa
+# REST client are reused across requests instead of per-document subprocesses.
+_pipeline: Optional[InvoicePipeline] = None
+_pipeline_lock = threading.Lock()
+
+
+def _get_pipeline() -> InvoicePipeline:
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = InvoicePipeline(
+                    Supa(SUPABASE_URL, SUPABASE_KEY),
+                    schema_path=SCHEMA_PATH,
+                    model=MODEL_NAME,
+                    rescue=not NO_RESCUE,
+                )
+    return _pipeline
+
+
+_storage_client: Optional[storage.Client] = None
+_storage_lock = threading.Lock()
+
+
+def _get_storage_client() -> storage.Client:
+    global _storage_client
+    if _storage_client is None:
+        with _storage_lock:
+            if _storage_client is None:
+                _storage_client = storage.Client()
+    return _storage_client
+
+
+def _download_gcs_pdf(gcs_bucket: str, gcs_path: str) -> PdfDocument:
+    """
+    Load gs://bucket/path into memory with a single GET (no exists() probe,
+    no local file); the parser reads the bytes directly.
+    """
+    blob = _get_storage_client().bucket(gcs_bucket).blob(gcs_path)
+    try:
+        data = blob.download_as_bytes()
+    except NotFound:
+        raise RuntimeError(f"GCS object not found: gs://{gcs_bucket}/{gcs_path}")
+    return PdfDocument.from_bytes(data, f"gs://{gcs_bucket}/{gcs_path}")
+
+
+@contextmanager
+def _workdir(prefix: str) -> Iterator[Path]:
+    """
+    Scratch space for one parse (part PDFs the vision path needs).  Removed
+    on exit; kept and logged when WRITE_PARSE_ARTIFACTS asks for the
+    intermediate files.
+    """
+    if WRITE_ARTIFACTS:
+        workdir = Path(tempfile.mkdtemp(prefix=prefix))
+        print(f"[parse] artifacts kept in {workdir}", flush=True)
+        yield workdir
+        return
+    with tempfile.TemporaryDirectory(prefix=prefix) as td:
+        yield Path(td)
 
 
 SIGNED_URL_EXP_MINUTES = int(os.environ.get("SIGNED_URL_EXP_MINUTES", "2880"))  # 2 days
@@ -137,7 +195,15 @@ def _get_gcs_signed_url(gcs_bucket: str, gcs_path: str) -> Optional[str]:
 
 @app.get("/health")
 def health():
-    return {"ok": True}
+    out: Dict[str, Any] = {"ok": True}
+    if _pipeline is not None:
+        out["extraction_cache"] = _pipeline.cache_stats()
+        if _pipeline.supa is not None:
+            out["supabase"] = _pipeline.supa.stats()
+    if _parse_pool is not None:
+        out["parse_workers"] = _parse_pool.stats()
+    out["parse_queue"] = parse_consumer.stats()
+    return out
 
 
 @app.get("/api/invoices/{document_id}/pdf-url")
@@ -159,32 +225,18 @@ def api_invoice_pdf_url(document_id: str) -> Dict[str, Any]:
     return {"ok": True, "signed_pdf_url": signed_pdf_url}
 
 
-@app.post("/jobs/parse_document")
-def parse_document(document_id: str):
+# Cleared whenever a parse finishes (see parse_worker.py).
+_LEASE_CLEARED = {"lease_owner": None, "lease_expires_at": None}
+
+
+def _parse_claimed(doc: Dict[str, Any], force_extract: bool = False) -> None:
     """
-    Cloud Run entrypoint:
-    - Lookup document in Supabase (documents table)
-    - Download PDF from GCS
-    - Run process_pdf.py (extract + validate + persist)
+    Download and run the in-process pipeline for a documents row already in
+    'processing'; marks it parsed (lease cleared), or failed and re-raises.
+    Thread-safe: status writes go through the pipeline's pooled Supa client.
     """
+    document_id = str(doc["id"])
     try:
-        # mark processing
-        supa.table(DOCUMENTS_TABLE).update(
-            {"status": "processing"}
-        ).eq("id", document_id).execute()
-
-        # fetch document record (need gcs_bucket + gcs_path)
-        doc_res = (
-            supa.table(DOCUMENTS_TABLE)
-            .select("id,gcs_bucket,gcs_path")
-            .eq("id", document_id)
-            .limit(1)
-            .execute()
-        )
-        if not doc_res.data:
-            raise RuntimeError(f"Document not found: {document_id}")
-
-        doc = doc_res.data[0]
         gcs_bucket = doc.get("gcs_bucket")
         gcs_path = doc.get("gcs_path")
 
@@ -194,82 +246,42 @@ def parse_document(document_id: str):
                 f"(gcs_bucket={gcs_bucket}, gcs_path={gcs_path})"
             )
 
-        # create temp work dir
-        workdir = Path(tempfile.mkdtemp(prefix=f"parse_{document_id}_"))
-        local_pdf = workdir / Path(gcs_path).name
-        out_dir = workdir / "out"
-        out_dir.mkdir(parents=True, exist_ok=True)
-
-        # download from GCS using official client (no gsutil needed)
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(gcs_bucket)
-        blob = bucket.blob(gcs_path)
-        
-        if not blob.exists(storage_client):
-            raise RuntimeError(f"GCS object not found: gs://{gcs_bucket}/{gcs_path}")
-        
-        blob.download_to_filename(str(local_pdf))
-
-        # run the end-to-end processor (extract + validate + persist)
-        cmd = [
-            "python3",
-            "process_pdf.py",
-            "--pdf", str(local_pdf),
-            "--out_dir", str(out_dir),
-            "--schema", SCHEMA_PATH,
-            "--model", MODEL_NAME,
-            "--gcs_bucket", str(gcs_bucket),
-            "--gcs_path", str(gcs_path),
-            "--source_system", "gcs",
-        ]
-        if NO_RESCUE:
-            cmd.append("--no_rescue")
-
-        run_cmd(cmd)
+        pipeline = _get_pipeline()
+        with _download_gcs_pdf(gcs_bucket, gcs_path) as pdf_doc, _workdir(f"parse_{document_id}_") as workdir:
+            # run the end-to-end processor (extract + validate + persist)
+            pipeline.process_pdf(
+                workdir / Path(gcs_path).name,
+                workdir / "out",
+                gcs_bucket=str(gcs_bucket),
+                gcs_path=str(gcs_path),
+                source_system="gcs",
+                bypass_cache=force_extract,
+                doc=pdf_doc,
+            )
 
         # mark complete
-        supa.table(DOCUMENTS_TABLE).update(
-            {"status": "parsed"}
-        ).eq("id", document_id).execute()
-
-        return {"ok": True, "document_id": document_id}
+        pipeline.supa.update_document(document_id, {"status": "parsed", "claim_attempts": 0, **_LEASE_CLEARED})
 
     except Exception as e:
-        err = f"{str(e)}\n\nTRACEBACK:\n{traceback.format_exc()}"
-        # mark failed
-        try:
-            supa.table(DOCUMENTS_TABLE).update(
-                {
-                    "status": "failed",
-                    "parse_error": err
-                }
-            ).eq("id", document_id).execute()
-        except Exception:
-            # if Supabase update fails, still raise the original error
-            pass
-
-        print(f"parse_document error: {err}", flush=True)
-        raise HTTPException(status_code=500, detail="parse_document failed")
+        _mark_failed(document_id, e)
+        raise
 
 
-@app.post("/jobs/reparse")
-def reparse_document(document_id: str):
-    """
-    Re-parse a specific document: clears old parsed data and runs extraction again.
-    Used to fix categorization, airport codes, or other extraction issues.
-    """
-    # Verify document exists
-    doc_res = (
-        supa.table(DOCUMENTS_TABLE)
-        .select("id,gcs_bucket,gcs_path,status")
-        .eq("id", document_id)
-        .limit(1)
-        .execute()
-    )
-    if not doc_res.data:
-        raise HTTPException(status_code=404, detail=f"Document not found: {document_id}")
+def _mark_failed(document_id: str, e: Exception) -> None:
+    err = f"{str(e)}\n\nTRACEBACK:\n{traceback.format_exc()}"
+    try:
+        _get_pipeline().supa.update_document(
+            document_id, {"status": "failed", "parse_error": err, **_LEASE_CLEARED},
+        )
+    except Exception:
+        # if Supabase update fails, still raise the original error
+        pass
+    print(f"parse_document error: {err}", flush=True)
 
-    # Delete existing parsed data for this document
+
+def _reparse_claimed(doc: Dict[str, Any], force_extract: bool = False) -> None:
+    """_parse_claimed, after deleting the document's parsed invoices, line items and alerts."""
+    document_id = str(doc["id"])
     try:
         # Get parsed_invoice IDs to clean up line items
         pi_res = (
@@ -299,18 +311,95 @@ def reparse_document(document_id: str):
     except Exception as e:
         print(f"reparse cleanup warning: {e}", flush=True)
 
-    # Reset document status to uploaded so parse_document picks it up
+    _parse_claimed(doc, force_extract=force_extract)
+
+
+# /jobs/parse_document and /jobs/reparse take a document from any status but
+# 'processing' (leased to a worker) and 'batch_pending' (reserved by a batch).
+_DIRECT_PARSE_STATUSES = ("uploaded", "failed", "parsed", "done", "duplicate")
+
+
+def _not_claimable(document_id: str) -> HTTPException:
+    res = (
+        supa.table(DOCUMENTS_TABLE)
+        .select("id,status")
+        .eq("id", document_id)
+        .limit(1)
+        .execute()
+    )
+    if not res.data:
+        return HTTPException(status_code=404, detail=f"Document not found: {document_id}")
+    return HTTPException(
+        status_code=409,
+        detail=f"Document {document_id} is {res.data[0].get('status')}; not claimable",
+    )
+
+
+@app.post("/jobs/parse_document")
+def parse_document(document_id: str, force_extract: bool = False):
+    """
+    Cloud Run entrypoint:
+    - Lease the document (parse_worker.py), so a crash leaves it to be
+      released instead of stuck in 'processing'
+    - Download PDF from GCS
+    - Run the in-process pipeline (extract + validate + persist)
+
+    force_extract=true skips the extraction cache (fresh LLM calls).
+    """
+    try:
+        claimed = _get_parse_pool().parse_one(
+            document_id,
+            from_status=_DIRECT_PARSE_STATUSES,
+            parse_fn=lambda doc: _parse_claimed(doc, force_extract=force_extract),
+        )
+    except Exception:
+        raise HTTPException(status_code=500, detail="parse_document failed")
+    if not claimed:
+        raise _not_claimable(document_id)
+
+    return {"ok": True, "document_id": document_id}
+
+
+def _reparse(document_id: str, *, force_extract: bool, from_status: Tuple[str, ...]) -> None:
+    """Lease the document from from_status, clear its parsed data and parse it again."""
+    # An explicit reparse starts with a fresh set of claim attempts.
     supa.table(DOCUMENTS_TABLE).update(
-        {"status": "uploaded", "parse_error": None}
-    ).eq("id", document_id).execute()
+        {"claim_attempts": 0, "parse_error": None}
+    ).eq("id", document_id).in_("status", list(from_status)).execute()
 
-    # Run parse
-    result = parse_document(document_id=document_id)
+    claimed = _get_parse_pool().parse_one(
+        document_id,
+        from_status=from_status,
+        parse_fn=lambda doc: _reparse_claimed(doc, force_extract=force_extract),
+    )
+    if not claimed:
+        raise _not_claimable(document_id)
+
+
+@app.post("/jobs/reparse")
+def reparse_document(document_id: str, force_extract: bool = False):
+    """
+    Re-parse a specific document: clears old parsed data and runs extraction again.
+    Used to fix categorization, airport codes, or other extraction issues.
+    The document is leased for the whole reparse, so nothing else parses it
+    meanwhile.
+
+    Cached model output is reused (post-fixes re-run) unless force_extract=true.
+    """
+    try:
+        _reparse(document_id, force_extract=force_extract, from_status=_DIRECT_PARSE_STATUSES)
+    except HTTPException:
+        raise
+    except Exception:
+        raise HTTPException(status_code=500, detail="reparse failed")
     return {"ok": True, "document_id": document_id, "reparse": True}
 
 
 @app.post("/jobs/reparse_empty")
-def reparse_empty(limit: int = Query(50, ge=1, le=200)):
+def reparse_empty(
+    limit: int = Query(50, ge=1, le=200),
+    force_extract: bool = Query(False),
+):
     """
     Find parsed invoices with null vendor_name AND null total (empty extraction),
     then reparse them in batch.  Used for backfilling after parser fixes.
@@ -334,7 +423,7 @@ def reparse_empty(limit: int = Query(50, ge=1, le=200)):
     results = []
     for did in doc_ids:
         try:
-            reparse_document(document_id=did)
+            reparse_document(document_id=did, force_extract=force_extract)
             reparsed += 1
             results.append({"document_id": did, "status": "reparsed"})
         except Exception as e:
@@ -351,60 +440,315 @@ def reparse_empty(limit: int = Query(50, ge=1, le=200)):
     }
 
 
+# Leased worker pool for parse_next (see parse_worker.py), created on first use.
+_parse_pool: Optional[ParseWorkerPool] = None
+
+
+def _get_parse_pool() -> ParseWorkerPool:
+    global _parse_pool
+    if _parse_pool is None:
+        pipeline = _get_pipeline()
+        with _pipeline_lock:
+            if _parse_pool is None:
+                _parse_pool = ParseWorkerPool(pipeline.supa, _parse_claimed)
+    return _parse_pool
+
+
+# ---------------------------
+# Job queue (see job_queue.py): "parse" jobs from invoice-ingest in,
+# "alerts" jobs for invoice-alerts out.
+# ---------------------------
+
+QUEUE_CONSUMER = os.environ.get("QUEUE_CONSUMER", "0") in {"1", "true", "True", "yes", "YES"}
+
+parse_queue = JobQueue("parse", url=SUPABASE_URL, key=SUPABASE_KEY)
+alerts_queue = JobQueue("alerts", url=SUPABASE_URL, key=SUPABASE_KEY)
+
+
+def handle_parse_job(payload: Dict[str, Any]) -> None:
+    """Parse one queued document, then hand it to invoice-alerts.  Raises to retry."""
+    document_id = str(payload["document_id"])
+    if not _get_parse_pool().parse_one(document_id):
+        print(f"[parse queue] {document_id} not claimable (parsed or leased elsewhere); skipping", flush=True)
+        return
+    alerts_queue.enqueue({"document_id": document_id}, dedupe_key=document_id)
+
+
+parse_consumer = Consumer(parse_queue, handle_parse_job)
+
+
+@app.on_event("startup")
+def _start_queue_consumer() -> None:
+    # Long-running consumer; needs an instance that keeps CPU outside
+    # requests (Cloud Run --no-cpu-throttling, min instances >= 1).
+    if QUEUE_CONSUMER:
+        parse_consumer.start()
+
+
+@app.post("/jobs/drain_queue")
+def drain_queue(
+    max_jobs: int = Query(20, ge=1, le=200),
+    max_seconds: int = Query(240, ge=10, le=3000),
+):
+    """One bounded pass over the "parse" queue (scheduler-driven fallback to QUEUE_CONSUMER=1)."""
+    return parse_consumer.drain(max_jobs=max_jobs, max_seconds=max_seconds)
+
+
 @app.post("/jobs/parse_next")
 def parse_next(
     limit: int = Query(10, ge=1, le=50),
     status: str = Query("uploaded"),
 ):
     """
-    Batch endpoint: claims up to `limit` documents with the given status,
-    parses each via parse_document, and returns a summary.
+    Batch endpoint: claims up to `limit` documents with the given status in
+    one leased claim, parses them on the worker pool (PARSE_WORKERS at a
+    time), and returns a summary.  Documents whose lease went stale (crashed
+    instance) are released by the claim.
     This is what the Cloud Scheduler 'invoice-parse-next' job calls.
     """
-    # Select candidates
-    res = (
+    return _get_parse_pool().run_once(limit=limit, status=status)
+
+
+# ---------------------------
+# Offline batch extraction (backfills)
+# ---------------------------
+
+@app.post("/jobs/batch_extract/submit")
+def batch_extract_submit(
+    limit: int = Query(200, ge=1, le=2000),
+    select: str = Query("empty", pattern="^(empty|status)$"),
+    status: str = Query("uploaded"),
+    document_ids: Optional[str] = Query(None, description="Comma-separated ids; overrides select"),
+):
+    """
+    Collect first-pass prompts for many documents and submit them as one
+    batch.  No model calls here; /jobs/batch_extract/reconcile finishes the
+    documents once the batch completes.  Submitted documents are held in
+    status batch_pending until then, so live parsing skips them.
+
+    select=empty  -> documents with empty parsed invoices (like reparse_empty)
+    select=status -> documents with the given status
+    """
+    if document_ids:
+        doc_ids = [d.strip() for d in document_ids.split(",") if d.strip()][:limit]
+    elif select == "empty":
+        pi_res = (
+            supa.table("parsed_invoices")
+            .select("document_id")
+            .is_("vendor_name", "null")
+            .is_("total", "null")
+            .limit(limit)
+            .execute()
+        )
+        doc_ids = list({r["document_id"] for r in (pi_res.data or []) if r.get("document_id")})
+    else:
+        res = (
+            supa.table(DOCUMENTS_TABLE)
+            .select("id")
+            .eq("status", status)
+            .order("created_at", desc=False)
+            .limit(limit)
+            .execute()
+        )
+        doc_ids = [r["id"] for r in (res.data or []) if r.get("id")]
+
+    if not doc_ids:
+        return {"ok": True, "documents": 0, "requests": 0}
+
+    docs_res = (
         supa.table(DOCUMENTS_TABLE)
-        .select("id")
-        .eq("status", status)
-        .order("created_at", desc=False)
-        .limit(limit)
+        .select("id,gcs_bucket,gcs_path,status")
+        .in_("id", doc_ids)
         .execute()
     )
-    candidate_ids = [r["id"] for r in (res.data or []) if r.get("id")]
-    if not candidate_ids:
-        return {"claimed": 0, "parsed": 0, "failed": 0, "results": []}
+    prior_status = {d["id"]: d.get("status") or "uploaded" for d in docs_res.data or []}
+    if not prior_status:
+        return {"ok": True, "documents": 0, "requests": 0}
+
+    # Reserve the documents so parse_next and the parse queue leave them to
+    # reconcile.  Ones being parsed live, or already out in another batch,
+    # are skipped.
+    reserved_res = (
+        supa.table(DOCUMENTS_TABLE)
+        .update({"status": "batch_pending"})
+        .in_("id", list(prior_status))
+        .filter("status", "not.in", "(processing,batch_pending)")
+        .execute()
+    )
+    reserved = {r["id"] for r in (reserved_res.data or [])}
+
+    pipeline = _get_pipeline()
+    lines: List[Dict[str, Any]] = []
+    documents: List[Dict[str, Any]] = []
+    errors: List[Dict[str, Any]] = []
+    released: List[Dict[str, Any]] = []
+
+    with tempfile.TemporaryDirectory(prefix="batch_collect_") as td:
+        for doc in docs_res.data or []:
+            did = doc["id"]
+            if did not in reserved:
+                errors.append({"document_id": did, "error": "busy (processing or in another batch)"})
+                continue
+            try:
+                workdir = Path(td) / did
+                workdir.mkdir(parents=True, exist_ok=True)
+                gcs_path = doc.get("gcs_path") or ""
+                with _download_gcs_pdf(doc.get("gcs_bucket") or "", gcs_path) as pdf_doc:
+                    doc_lines, info = collect_document(pipeline, workdir / Path(gcs_path).name, workdir / "out", pdf_doc)
+            except Exception as e:
+                errors.append({"document_id": did, "error": str(e)[:300]})
+                released.append({"document_id": did, "prior_status": prior_status[did]})
+                continue
+            info.document_id = did
+            info.pdf_path = ""
+            info.gcs_bucket = doc.get("gcs_bucket") or ""
+            info.gcs_path = doc.get("gcs_path") or ""
+            documents.append({**asdict(info), "prior_status": prior_status[did]})
+            lines.extend(doc_lines)
+        _release_batch_documents(released)
+
+        jsonl = Path(td) / "requests.jsonl"
+        request_count = write_requests(lines, jsonl)
+
+        backend_batch_id = None
+        batch_status = "loaded"  # nothing to wait for: every prompt already cached
+        if request_count:
+            backend = make_backend(BATCH_BACKEND, client=pipeline.client)
+            try:
+                backend_batch_id = backend.submit(jsonl)
+            except Exception:
+                _release_batch_documents(documents)
+                raise
+            batch_status = "submitted"
+
+    row = {
+        "backend": BATCH_BACKEND,
+        "backend_batch_id": backend_batch_id,
+        "status": batch_status,
+        "model": pipeline.model,
+        "prompt_version": PROMPT_VERSION,
+        "request_count": request_count,
+        "documents": documents,
+        "reconciled_count": 0,
+    }
+    ins = supa.table(BATCHES_TABLE).insert(row).execute()
+    batch_row_id = (ins.data or [{}])[0].get("id")
+
+    log_pipeline_run(
+        "batch-extract-submit",
+        status="ok" if not errors else "error",
+        message=f"{len(documents)} docs, {request_count} requests, {len(errors)} collect errors",
+        items=request_count,
+    )
+    return {
+        "ok": True,
+        "batch": batch_row_id,
+        "backend_batch_id": backend_batch_id,
+        "status": batch_status,
+        "documents": len(documents),
+        "requests": request_count,
+        "errors": errors,
+    }
+
 
-    # Atomically claim each: only succeeds if status hasn't changed
-    claimed_ids = []
-    for did in candidate_ids:
+def _release_batch_documents(documents: List[Dict[str, Any]]) -> None:
+    """Put documents still reserved by a batch back to their status before submit."""
+    by_status: Dict[str, List[str]] = {}
+    for d in documents:
+        by_status.setdefault(d.get("prior_status") or "uploaded", []).append(d["document_id"])
+    for status, ids in by_status.items():
         try:
-            updated = (
+            (
                 supa.table(DOCUMENTS_TABLE)
-                .update({"status": "processing"})
-                .eq("id", did)
-                .eq("status", status)
+                .update({"status": status})
+                .in_("id", ids)
+                .eq("status", "batch_pending")
                 .execute()
             )
-            if updated.data:
-                claimed_ids.append(did)
-        except Exception:
-            pass
-
-    parsed = 0
-    failed = 0
-    results = []
-    for did in claimed_ids:
-        try:
-            parse_document(document_id=did)
-            results.append({"document_id": did, "ok": True})
-            parsed += 1
         except Exception as e:
-            results.append({"document_id": did, "ok": False, "error": str(e)[:300]})
-            failed += 1
+            print(f"batch release failed for {len(ids)} documents: {e}", flush=True)
 
-    return {
-        "claimed": len(claimed_ids),
-        "parsed": parsed,
-        "failed": failed,
-        "results": results,
-    }
\ No newline at end of file
+
+@app.post("/jobs/batch_extract/reconcile")
+def batch_extract_reconcile(limit: int = Query(25, ge=1, le=200)):
+    """
+    Poll open batches.  Completed results go into the extraction cache, then
+    up to `limit` documents are re-parsed through the normal pipeline (first
+    pass served from cache; rescue/vision still live).  Safe to call on a
+    schedule: progress is tracked in extraction_batches.reconciled_count.
+    """
+    res = (
+        supa.table(BATCHES_TABLE)
+        .select("*")
+        .in_("status", ["submitted", "loaded"])
+        .order("created_at", desc=False)
+        .limit(20)
+        .execute()
+    )
+
+    pipeline = _get_pipeline()
+    budget = limit
+    summary: List[Dict[str, Any]] = []
+
+    for row in res.data or []:
+        bid = row["id"]
+        entry: Dict[str, Any] = {"batch": bid, "status": row["status"]}
+
+        if row["status"] == "submitted":
+            backend = make_backend(row.get("backend") or BATCH_BACKEND, client=pipeline.client)
+            st = backend.status(row["backend_batch_id"])
+            if st == "pending":
+                entry["status"] = "pending"
+                summary.append(entry)
+                continue
+            if st == "failed":
+                supa.table(BATCHES_TABLE).update({
+                    "status": "failed", "completed_at": utc_now_iso(),
+                }).eq("id", bid).execute()
+                _release_batch_documents(row.get("documents") or [])
+                entry["status"] = "failed"
+                summary.append(entry)
+                continue
+
+            counts = load_results(pipeline, backend, row["backend_batch_id"])
+            supa.table(BATCHES_TABLE).update({
+                "status": "loaded",
+                "loaded_count": counts["loaded"],
+                "failed_count": counts["failed"],
+                "completed_at": utc_now_iso(),
+            }).eq("id", bid).execute()
+            entry.update(status="loaded", **counts)
+
+        docs = row.get("documents") or []
+        done = int(row.get("reconciled_count") or 0)
+        todo = docs[done:done + budget]
+        reparsed = failed = 0
+        for d in todo:
+            try:
+                # Leased straight from batch_pending: the document never
+                # passes through 'uploaded', where live parsing could claim it.
+                _reparse(d["document_id"], force_extract=False, from_status=("batch_pending",))
+                reparsed += 1
+            except Exception as e:
+                failed += 1
+                print(f"batch reconcile failed for {d.get('document_id')}: {e}", flush=True)
+                _release_batch_documents([d])
+            # Progress per document, so a request timeout mid-batch loses at
+            # most the document in flight.
+            done += 1
+            supa.table(BATCHES_TABLE).update({"reconciled_count": done}).eq("id", bid).execute()
+        budget -= len(todo)
+
+        if done >= len(docs):
+            supa.table(BATCHES_TABLE).update({
+                "status": "reconciled", "reconciled_at": utc_now_iso(),
+            }).eq("id", bid).execute()
+
+        entry.update(reparsed=reparsed, failed=failed, reconciled=done, documents=len(docs))
+        if done >= len(docs):
+            entry["status"] = "reconciled"
+        summary.append(entry)
+        if budget <= 0:
+            break
+
+    return {"ok": True, "batches": summary}
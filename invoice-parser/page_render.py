@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+page_render.py
+
+Render scanned PDF pages for the vision path.
+
+Each page is rendered on its own (pdftoppm via pdf2image, one page per
+call) on a small thread pool, so pages render in parallel and only the
+pages of the current batch are ever decoded at once.
+
+  - DPI is picked per page from its size: gpt-4o (detail=high) fits an
+    image into 2048x2048 and then scales the short side down to 768 px, so
+    pixels beyond that are discarded server-side.  A letter page lands at
+    ~90 DPI instead of a fixed 200.
+  - Pages with no real colour are converted to grayscale.
+  - Pages are encoded as JPEG (or WebP) and stepped down in quality, then
+    size, until they fit VISION_PAGE_MAX_BYTES.
+
+Documents longer than VISION_PAGES_PER_CALL pages are handed out in batches
+by iter_page_batches(); extract_invoice merges the per-batch results.
+
+  for batch in iter_page_batches("scan.pdf"):
+      urls = [p.data_url for p in batch]
+
+Env:
+  VISION_RENDER_WORKERS   pages rendered in parallel (default 4)
+  VISION_MAX_DPI          upper bound on render DPI (default 200)
+  VISION_SHORT_SIDE_PX / VISION_LONG_SIDE_PX  target size (default 768 / 2048)
+  VISION_IMAGE_FORMAT     JPEG or WEBP (default JPEG)
+  VISION_PAGE_MAX_BYTES   per-page encoded budget (default 350000)
+  VISION_PAGES_PER_CALL   pages per vision request (default 8)
+"""
+
+import base64
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from pdf_document import PdfDocument
+
+RENDER_WORKERS = max(1, int(os.getenv("VISION_RENDER_WORKERS", "4")))
+MAX_DPI = int(os.getenv("VISION_MAX_DPI", "200"))
+MIN_DPI = 50
+SHORT_SIDE_PX = int(os.getenv("VISION_SHORT_SIDE_PX", "768"))
+LONG_SIDE_PX = int(os.getenv("VISION_LONG_SIDE_PX", "2048"))
+IMAGE_FORMAT = os.getenv("VISION_IMAGE_FORMAT", "JPEG").upper()
+PAGE_MAX_BYTES = int(os.getenv("VISION_PAGE_MAX_BYTES", "350000"))
+PAGES_PER_CALL = max(1, int(os.getenv("VISION_PAGES_PER_CALL", "8")))
+
+# Quality ladder tried before shrinking; each shrink step scales by _SHRINK.
+_QUALITIES = (85, 70, 55, 40)
+_SHRINK = 0.8
+_MIN_SHORT_SIDE_PX = 384
+
+# Mean per-pixel channel spread (0-255) below which a page counts as gray.
+_GRAY_SPREAD = 6.0
+
+_MIME = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+@dataclass
+class RenderedPage:
+    page_no: int      # 1-based, within the rendered file
+    mime: str
+    data: bytes
+    width: int
+    height: int
+    dpi: int
+    grayscale: bool
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime};base64,{base64.b64encode(self.data).decode()}"
+
+
+def settings() -> Dict[str, Any]:
+    """Everything that changes the rendered bytes (part of the vision cache key)."""
+    return {
+        "max_dpi": MAX_DPI, "short_px": SHORT_SIDE_PX, "long_px": LONG_SIDE_PX,
+        "format": IMAGE_FORMAT, "max_bytes": PAGE_MAX_BYTES, "per_call": PAGES_PER_CALL,
+    }
+
+
+def page_dpi(width_pt: float, height_pt: float) -> int:
+    """Lowest DPI that still fills the model's effective resolution for this page."""
+    short_in = max(1.0, min(width_pt, height_pt)) / 72.0
+    long_in = max(1.0, max(width_pt, height_pt)) / 72.0
+    dpi = min(MAX_DPI, SHORT_SIDE_PX / short_in, LONG_SIDE_PX / long_in)
+    return int(max(MIN_DPI, dpi))
+
+
+def _is_grayscale(img: Any) -> bool:
+    from PIL import ImageChops, ImageStat
+
+    thumb = img.convert("RGB")
+    thumb.thumbnail((96, 96))
+    r, g, b = thumb.split()
+    spread = ImageChops.lighter(ImageChops.lighter(ImageChops.difference(r, g), ImageChops.difference(g, b)),
+                                ImageChops.difference(r, b))
+    return ImageStat.Stat(spread).mean[0] < _GRAY_SPREAD
+
+
+def _encode(img: Any, fmt: str, quality: int) -> bytes:
+    buf = io.BytesIO()
+    if fmt == "WEBP":
+        img.save(buf, format=fmt, quality=quality, method=4)
+    else:
+        img.save(buf, format=fmt, quality=quality, optimize=True)
+    return buf.getvalue()
+
+
+def encode_page(img: Any, max_bytes: int = PAGE_MAX_BYTES, fmt: str = IMAGE_FORMAT) -> Tuple[bytes, Any]:
+    """(bytes, image) for the best quality/size step that fits max_bytes (or the smallest tried)."""
+    from PIL import Image
+
+    while True:
+        for q in _QUALITIES:
+            data = _encode(img, fmt, q)
+            if len(data) <= max_bytes:
+                return data, img
+        w, h = img.size
+        if min(w, h) * _SHRINK < _MIN_SHORT_SIDE_PX:
+            return data, img
+        img = img.resize((int(w * _SHRINK), int(h * _SHRINK)), Image.LANCZOS)
+
+
+def render_page(pdf_path: Union[str, Path], page_no: int, dpi: int) -> RenderedPage:
+    from pdf2image import convert_from_path
+
+    fmt = IMAGE_FORMAT if IMAGE_FORMAT in _MIME else "JPEG"
+    img = convert_from_path(str(pdf_path), dpi=dpi, first_page=page_no, last_page=page_no, thread_count=1)[0]
+    gray = _is_grayscale(img)
+    img = img.convert("L" if gray else "RGB")
+    data, img = encode_page(img, fmt=fmt)
+    return RenderedPage(page_no, _MIME[fmt], data, img.width, img.height, dpi, gray)
+
+
+def render_pages(
+    pdf_path: Union[str, Path],
+    page_nos: Sequence[int],
+    doc: Optional[PdfDocument] = None,
+    workers: int = RENDER_WORKERS,
+) -> List[RenderedPage]:
+    """Render the given 1-based pages in parallel; results in page order."""
+    doc = doc or PdfDocument.open(pdf_path)
+    dpis = [page_dpi(*doc.page_size_pt(n - 1)) for n in page_nos]
+    if workers <= 1 or len(page_nos) <= 1:
+        return [render_page(pdf_path, n, d) for n, d in zip(page_nos, dpis)]
+    with ThreadPoolExecutor(max_workers=min(workers, len(page_nos))) as ex:
+        return list(ex.map(lambda nd: render_page(pdf_path, *nd), zip(page_nos, dpis)))
+
+
+def iter_page_batches(
+    pdf_path: Union[str, Path],
+    doc: Optional[PdfDocument] = None,
+    per_call: int = PAGES_PER_CALL,
+    workers: int = RENDER_WORKERS,
+) -> Iterator[List[RenderedPage]]:
+    """Render per_call pages at a time; the next batch renders only when asked for."""
+    doc = doc or PdfDocument.open(pdf_path)
+    total = doc.page_count
+    for start in range(1, total + 1, per_call):
+        yield render_pages(pdf_path, range(start, min(total + 1, start + per_call)), doc=doc, workers=workers)
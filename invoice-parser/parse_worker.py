@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+parse_worker.py
+
+Leased, concurrent document parsing for /jobs/parse_next.
+
+A ParseWorkerPool claims a batch of documents with one claim_documents RPC
+(FOR UPDATE SKIP LOCKED, lease expiry stamped per row), parses them on a
+bounded thread pool and, while any are in flight, renews their leases from
+a heartbeat thread.  If the instance dies mid-batch the leases lapse and
+the next claim (from any instance) puts those documents back to
+'uploaded' -- or 'failed' after PARSE_MAX_ATTEMPTS claims -- instead of
+leaving them in 'processing'.
+
+Each document is still parsed by the caller's parse function (download +
+InvoicePipeline.process_pdf + status update), which is responsible for
+setting the final status and clearing the lease.  Per-document LLM calls
+already back off on 429s, so throughput grows with PARSE_WORKERS until the
+model rate limit is the bottleneck.
+
+  pool = ParseWorkerPool(supa, parse_fn)
+  summary = pool.run_once(limit=20)
+  pool.parse_one(document_id)           # one queued document (job_queue "parse")
+
+Env:
+  PARSE_WORKERS       documents parsed concurrently (default 4)
+  PARSE_LEASE_S       lease length, renewed every third of it (default 600)
+  PARSE_MAX_ATTEMPTS  claims before a stale document is marked failed (default 3)
+"""
+
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+PARSE_WORKERS = max(1, int(os.getenv("PARSE_WORKERS", "4")))
+PARSE_LEASE_S = int(os.getenv("PARSE_LEASE_S", "600"))
+PARSE_MAX_ATTEMPTS = int(os.getenv("PARSE_MAX_ATTEMPTS", "3"))
+
+# parse_one() may take a document from these; 'failed' lets a queued retry
+# re-run a document whose previous attempt failed.
+CLAIMABLE_STATUSES = ("uploaded", "failed")
+
+
+def lease_owner_id() -> str:
+    """host:pid:random -- unique per pool, readable in the documents table."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class _Heartbeat(threading.Thread):
+    """Renews leases on the in-flight set every lease_s / 3 for the life of the process."""
+
+    def __init__(self, pool: "ParseWorkerPool") -> None:
+        super().__init__(name="parse-lease-heartbeat", daemon=True)
+        self.pool = pool
+
+    def run(self) -> None:
+        interval = max(1.0, self.pool.lease_s / 3.0)
+        while True:
+            time.sleep(interval)
+            self.pool.heartbeat()
+
+
+class ParseWorkerPool:
+    """One per instance; run_once() may be called from concurrent requests."""
+
+    def __init__(
+        self,
+        supa: Any,
+        parse_fn: Callable[[Dict[str, Any]], None],
+        *,
+        workers: int = PARSE_WORKERS,
+        lease_s: int = PARSE_LEASE_S,
+        max_attempts: int = PARSE_MAX_ATTEMPTS,
+    ) -> None:
+        self.supa = supa
+        self.parse_fn = parse_fn
+        self.workers = workers
+        self.lease_s = lease_s
+        self.max_attempts = max_attempts
+        self.owner = lease_owner_id()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="parse-worker")
+        self._lock = threading.Lock()
+        self._in_flight: Set[str] = set()
+        self._heartbeat: Any = None
+        self._stats = {"claimed": 0, "parsed": 0, "failed": 0, "leases_lost": 0, "heartbeat_errors": 0}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "in_flight": len(self._in_flight), "workers": self.workers, "owner": self.owner}
+
+    def heartbeat(self) -> None:
+        with self._lock:
+            ids = list(self._in_flight)
+        if not ids:
+            return
+        try:
+            held = set(self.supa.heartbeat_document_leases(self.owner, ids, lease_s=self.lease_s))
+        except Exception as e:
+            with self._lock:
+                self._stats["heartbeat_errors"] += 1
+            print(f"[parse_worker] heartbeat failed: {e}", flush=True)
+            return
+        lost = [d for d in ids if d not in held]
+        if lost:
+            # Finished between the snapshot and the RPC, or reclaimed after a
+            # missed heartbeat; the parse keeps running either way.
+            with self._lock:
+                lost = [d for d in lost if d in self._in_flight]
+                self._stats["leases_lost"] += len(lost)
+            if lost:
+                print(f"[parse_worker] lease lost for {lost}", flush=True)
+
+    def _start_heartbeat(self) -> None:
+        with self._lock:
+            if self._heartbeat is None:
+                self._heartbeat = _Heartbeat(self)
+                self._heartbeat.start()
+
+    def _run_one(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        did = str(doc["id"])
+        try:
+            self.parse_fn(doc)
+            ok, err = True, None
+        except Exception as e:
+            ok, err = False, str(e)[:300]
+        with self._lock:
+            self._in_flight.discard(did)
+            self._stats["parsed" if ok else "failed"] += 1
+        out: Dict[str, Any] = {"document_id": did, "ok": ok}
+        if err is not None:
+            out["error"] = err
+        return out
+
+    def parse_one(
+        self,
+        document_id: str,
+        from_status: Tuple[str, ...] = CLAIMABLE_STATUSES,
+        parse_fn: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ) -> bool:
+        """
+        Lease and parse one named document on the calling thread (the job
+        queue consumer, /jobs/parse_document, reparses).  False if it isn't
+        claimable -- already processing under another lease, or not in
+        from_status.  parse_fn overrides the pool's for this document.
+        Parse errors propagate.
+        """
+        doc = self.supa.claim_document(
+            document_id, self.owner, lease_s=self.lease_s, from_status=from_status, max_attempts=self.max_attempts,
+        )
+        if doc is None:
+            return False
+        did = str(doc["id"])
+        with self._lock:
+            self._in_flight.add(did)
+            self._stats["claimed"] += 1
+        self._start_heartbeat()
+        try:
+            (parse_fn or self.parse_fn)(doc)
+        except Exception:
+            with self._lock:
+                self._stats["failed"] += 1
+            raise
+        else:
+            with self._lock:
+                self._stats["parsed"] += 1
+        finally:
+            with self._lock:
+                self._in_flight.discard(did)
+        return True
+
+    def run_once(self, limit: int, status: str = "uploaded") -> Dict[str, Any]:
+        """Claim up to `limit` documents, parse them on the pool, return a summary."""
+        claimed = self.supa.claim_documents(
+            self.owner, limit=limit, status=status, lease_s=self.lease_s, max_attempts=self.max_attempts,
+        )
+        if not claimed:
+            return {"claimed": 0, "parsed": 0, "failed": 0, "results": []}
+
+        with self._lock:
+            self._in_flight.update(str(d["id"]) for d in claimed)
+            self._stats["claimed"] += len(claimed)
+        self._start_heartbeat()
+
+        results: List[Dict[str, Any]] = list(self._executor.map(self._run_one, claimed))
+        parsed = sum(1 for r in results if r["ok"])
+        return {
+            "claimed": len(claimed),
+            "parsed": parsed,
+            "failed": len(results) - parsed,
+            "results": results,
+        }
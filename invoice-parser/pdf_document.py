@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+pdf_document.py
+
+Parse a PDF once, share page text everywhere.
+
+A PdfDocument wraps the PDF bytes and extracts each page at most once:
+
+  - layout text: pdfplumber extract_text(layout=True) + money unglue
+                 (falls back to pypdf per page when pdfplumber is missing/fails)
+  - plain text:  pypdf extract_text(), untouched (what split_statement matches on)
+
+Page text lives in a process-wide LRU keyed by (document sha256, kind, page
+index), so the statement gate, the page splitter, the text splitter and
+per-part extraction all read the same strings.  Split parts are page views
+of the parent (doc.subset(pages)) and never re-open the file.
+
+  doc = PdfDocument.open("statement.pdf")
+  text = doc.text()                    # same format as read_pdf_text()
+  part = doc.subset(range(3, 7))
+  part.text()                          # pages renumbered from 1, like a split PDF
+  part.write("/tmp/part.pdf")
+"""
+
+import hashlib
+import io
+import os
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:
+    PdfReader = None  # type: ignore
+    PdfWriter = None  # type: ignore
+
+
+# ============================================================
+# Money "unglue" fix
+# ============================================================
+
+# Fuel-style glue: 5-decimal unit price + 2-decimal tax + 2-decimal total
+_MONEY3 = re.compile(r"(\d+\.\d{5})(\d+\.\d{2})(\d+\.\d{2})")
+# Generic glue: two adjacent 2-decimal amounts, e.g. 15.91205.91
+_MONEY2 = re.compile(r"(\d+\.\d{2})(\d+\.\d{2})")
+
+
+def unglue_money_columns(text: str) -> str:
+    text = _MONEY3.sub(r"\1 \2 \3", text)
+    text = _MONEY2.sub(r"\1 \2", text)
+    return text
+
+
+# ============================================================
+# Page text cache
+# ============================================================
+
+PAGE_CACHE_MAX_PAGES = int(os.getenv("PDF_PAGE_CACHE_PAGES", "2000"))
+
+_page_cache: "OrderedDict[Tuple[str, str, int], str]" = OrderedDict()
+_page_cache_lock = threading.Lock()
+_page_cache_stats = {"hits": 0, "misses": 0}
+
+
+def _cache_get(key: Tuple[str, str, int]) -> Optional[str]:
+    with _page_cache_lock:
+        val = _page_cache.get(key)
+        if val is None:
+            _page_cache_stats["misses"] += 1
+            return None
+        _page_cache.move_to_end(key)
+        _page_cache_stats["hits"] += 1
+        return val
+
+
+def _cache_put(key: Tuple[str, str, int], val: str) -> None:
+    with _page_cache_lock:
+        _page_cache[key] = val
+        _page_cache.move_to_end(key)
+        while len(_page_cache) > PAGE_CACHE_MAX_PAGES:
+            _page_cache.popitem(last=False)
+
+
+def page_cache_stats() -> Dict[str, int]:
+    with _page_cache_lock:
+        return {**_page_cache_stats, "pages": len(_page_cache), "max_pages": PAGE_CACHE_MAX_PAGES}
+
+
+# ============================================================
+# Document
+# ============================================================
+
+def _release_plumber_page(page: Any) -> None:
+    """
+    Drop pdfplumber's parsed objects for a page.  The text is cached above;
+    without this every page's chars/layout stay alive until the file closes.
+    """
+    release = getattr(page, "close", None) or getattr(page, "flush_cache", None)
+    if release is not None:
+        try:
+            release()
+        except Exception:
+            pass
+
+
+class _PdfSource:
+    """The underlying file: bytes, hash and lazily-opened parsers (one per file)."""
+
+    def __init__(self, data: bytes, name: str) -> None:
+        self.data = data
+        self.name = name
+        self.sha256 = hashlib.sha256(data).hexdigest()
+        self.lock = threading.Lock()
+        self._reader: Any = None
+        self._plumber: Any = None
+        self._plumber_failed = False
+
+    def reader(self) -> Any:
+        if self._reader is None:
+            if PdfReader is None:
+                raise RuntimeError("No PDF extraction backend available (install pdfplumber or pypdf).")
+            self._reader = PdfReader(io.BytesIO(self.data))
+        return self._reader
+
+    def plumber(self) -> Any:
+        if self._plumber is None and not self._plumber_failed:
+            try:
+                import pdfplumber  # type: ignore
+                self._plumber = pdfplumber.open(io.BytesIO(self.data))
+            except Exception:
+                self._plumber_failed = True
+        return self._plumber
+
+    def page_count(self) -> int:
+        pl = self.plumber()
+        if pl is not None:
+            return len(pl.pages)
+        return len(self.reader().pages)
+
+    def close(self) -> None:
+        if self._plumber is not None:
+            try:
+                self._plumber.close()
+            except Exception:
+                pass
+            self._plumber = None
+
+
+class PdfDocument:
+    """
+    A PDF (or a page view of one).  Page indexes passed to methods are
+    relative to the view; the cache is keyed on the parent's absolute index.
+    """
+
+    def __init__(self, source: _PdfSource, pages: Optional[List[int]] = None) -> None:
+        self._src = source
+        self._pages = pages
+
+    @classmethod
+    def open(cls, path: Union[str, Path]) -> "PdfDocument":
+        p = Path(path)
+        return cls(_PdfSource(p.read_bytes(), str(p)))
+
+    @classmethod
+    def from_bytes(cls, data: bytes, name: str = "<bytes>") -> "PdfDocument":
+        return cls(_PdfSource(data, name))
+
+    def __enter__(self) -> "PdfDocument":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Release parser handles.  Cached page text stays available."""
+        with self._src.lock:
+            self._src.close()
+
+    # ---------------------------
+    # Identity / shape
+    # ---------------------------
+
+    @property
+    def sha256(self) -> str:
+        """Hash of the underlying file bytes (same for every view)."""
+        return self._src.sha256
+
+    @property
+    def name(self) -> str:
+        return self._src.name
+
+    @property
+    def data(self) -> bytes:
+        return self._src.data
+
+    @property
+    def page_indexes(self) -> List[int]:
+        """Absolute page indexes (0-based) in the underlying file."""
+        if self._pages is None:
+            with self._src.lock:
+                self._pages = list(range(self._src.page_count()))
+        return self._pages
+
+    @property
+    def page_count(self) -> int:
+        return len(self.page_indexes)
+
+    def page_size_pt(self, i: int) -> Tuple[float, float]:
+        """(width, height) of page i's crop box in points, as pdftoppm renders it."""
+        abs_idx = self.page_indexes[i]
+        with self._src.lock:
+            box = self._src.reader().pages[abs_idx].cropbox
+        return float(box.width), float(box.height)
+
+    def subset(self, pages: Iterable[int]) -> "PdfDocument":
+        """View over some pages of this document (indexes relative to this view)."""
+        base = self.page_indexes
+        return PdfDocument(self._src, [base[i] for i in pages])
+
+    # ---------------------------
+    # Page text
+    # ---------------------------
+
+    def plain_page(self, i: int) -> str:
+        """pypdf text for page i, no cleanup."""
+        return self._page_text("plain", self.page_indexes[i])
+
+    def layout_page(self, i: int) -> str:
+        """pdfplumber layout text for page i, money columns unglued."""
+        return self._page_text("layout", self.page_indexes[i])
+
+    def plain_pages(self) -> List[str]:
+        return [self.plain_page(i) for i in range(self.page_count)]
+
+    def layout_pages(self) -> List[str]:
+        return [self.layout_page(i) for i in range(self.page_count)]
+
+    def text(self) -> str:
+        """Layout text with --- PAGE n --- headers (n counted within this view)."""
+        parts = [f"\n\n--- PAGE {n} ---\n{t}" for n, t in enumerate(self.layout_pages(), start=1)]
+        return "\n".join(parts).strip()
+
+    def _page_text(self, kind: str, abs_idx: int) -> str:
+        key = (self._src.sha256, kind, abs_idx)
+        cached = _cache_get(key)
+        if cached is not None:
+            return cached
+
+        with self._src.lock:
+            if kind == "layout":
+                text = None
+                pl = self._src.plumber()
+                if pl is not None:
+                    try:
+                        page = pl.pages[abs_idx]
+                        try:
+                            text = page.extract_text(layout=True) or ""
+                        finally:
+                            _release_plumber_page(page)
+                    except Exception:
+                        text = None
+                if text is None:
+                    text = self._src.reader().pages[abs_idx].extract_text() or ""
+                text = unglue_money_columns(text)
+            else:
+                text = self._src.reader().pages[abs_idx].extract_text() or ""
+
+        _cache_put(key, text)
+        return text
+
+    # ---------------------------
+    # Output
+    # ---------------------------
+
+    def write(self, out_path: Union[str, Path]) -> None:
+        """Write this view's pages as a standalone PDF."""
+        if PdfWriter is None:
+            raise RuntimeError("Splitting requires pypdf (pip install pypdf).")
+        w = PdfWriter()
+        with self._src.lock:
+            r = self._src.reader()
+            for p in self.page_indexes:
+                w.add_page(r.pages[p])
+        os.makedirs(os.path.dirname(str(out_path)) or ".", exist_ok=True)
+        with open(out_path, "wb") as f:
+            w.write(f)
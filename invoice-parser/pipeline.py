@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+pipeline.py
+
+In-process extraction engine.
+
+Holds the long-lived pieces of the parser (schema bundle, OpenAI client,
+Supabase REST client) so a document runs split -> extract -> validate ->
+persist inside one interpreter instead of spawning python3 per stage.
+
+Used by:
+  - main.py (/jobs/parse_document, /jobs/parse_next, /jobs/reparse*)
+  - process_pdf.py CLI
+
+The standalone scripts (extract_invoice.py, split_statement.py,
+validate_invoice.py) still work on their own and call the same functions.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar
+
+from openai import OpenAI
+
+import split_statement
+from extract_invoice import extract_one_pdf, load_json
+from extraction_cache import CACHE_ENABLED, ExtractionCache
+from pdf_document import PdfDocument
+from process_pdf import WRITE_ARTIFACTS, Supa, process_one_pdf
+from validate_invoice import validate
+
+
+DEFAULT_SCHEMA_PATH = "schemas/invoice.schema.json"
+DEFAULT_MODEL = "gpt-4o-mini"
+
+# Max per-part extractions in flight per process (each holds 1-2 LLM calls).
+EXTRACT_CONCURRENCY = int(os.getenv("EXTRACT_CONCURRENCY", "6"))
+
+T = TypeVar("T")
+
+
+class InvoicePipeline:
+    """
+    One instance per process.  Safe to share across requests: the schema
+    bundle is read-only and the OpenAI client is created once, lazily.
+    """
+
+    def __init__(
+        self,
+        supa: Optional[Supa],
+        *,
+        schema_path: str = DEFAULT_SCHEMA_PATH,
+        model: str = DEFAULT_MODEL,
+        rescue: bool = True,
+        client: Optional[OpenAI] = None,
+        extract_concurrency: int = EXTRACT_CONCURRENCY,
+        cache: Optional[ExtractionCache] = None,
+    ) -> None:
+        self.supa = supa
+        self.schema_path = schema_path
+        self.schema_bundle: Dict[str, Any] = load_json(schema_path)
+        self.model = model
+        self.rescue = rescue
+        self._client = client
+        self._init_lock = threading.Lock()
+        self.extract_concurrency = max(1, extract_concurrency)
+        self._pool: Optional[ThreadPoolExecutor] = None
+        if cache is None and CACHE_ENABLED:
+            cache = ExtractionCache(supa)
+        self.cache = cache
+
+    @classmethod
+    def from_env(cls, **overrides: Any) -> "InvoicePipeline":
+        supa_url = os.getenv("SUPABASE_URL")
+        supa_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+        if not supa_url or not supa_key:
+            raise RuntimeError("Set SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY.")
+
+        kwargs: Dict[str, Any] = {
+            "schema_path": os.getenv("INVOICE_SCHEMA", DEFAULT_SCHEMA_PATH),
+            "model": os.getenv("EXTRACTION_MODEL", DEFAULT_MODEL),
+            "rescue": os.getenv("NO_RESCUE", "0") not in {"1", "true", "True", "yes", "YES"},
+        }
+        kwargs.update(overrides)
+        return cls(Supa(supa_url, supa_key), **kwargs)
+
+    # ---------------------------
+    # Shared clients
+    # ---------------------------
+
+    @property
+    def client(self) -> OpenAI:
+        if self._client is None:
+            with self._init_lock:
+                if self._client is None:
+                    k = os.getenv("OPENAI_API_KEY", "")
+                    if not k or k.strip() in {"***", "REPLACE_ME"}:
+                        raise RuntimeError(
+                            "OPENAI_API_KEY is missing or is a placeholder. "
+                            "Set a real key via .env or environment variable."
+                        )
+                    self._client = OpenAI()
+        return self._client
+
+    def _extract_pool(self) -> ThreadPoolExecutor:
+        # Shared by every document in the process, so the in-flight limit
+        # holds across concurrent requests too.
+        if self._pool is None:
+            with self._init_lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(
+                        max_workers=self.extract_concurrency, thread_name_prefix="extract",
+                    )
+        return self._pool
+
+    # ---------------------------
+    # Stages
+    # ---------------------------
+
+    def open_document(self, pdf_path: Path) -> PdfDocument:
+        """Parse-once handle; page text is shared by every later stage."""
+        return PdfDocument.open(pdf_path)
+
+    def split(
+        self, pdf_path: Path, out_dir: Path, doc: Optional[PdfDocument] = None, *, write_pdfs: bool = True,
+    ) -> List[Dict[str, Any]]:
+        """Page-level statement split; writes one PDF per detected invoice unless write_pdfs=False."""
+        return split_statement.write_groups(str(pdf_path), str(out_dir), doc=doc, write_pdfs=write_pdfs)
+
+    def extract_pdf(
+        self, pdf_path: Path, pdf_text: Optional[str] = None, *, bypass_cache: bool = False,
+    ) -> Dict[str, Any]:
+        return extract_one_pdf(
+            self.client, self.schema_bundle, str(pdf_path), self.model, self.rescue,
+            pdf_text=pdf_text, cache=self.cache, bypass_cache=bypass_cache,
+        )
+
+    def extract_text(self, text: str, source_path: Path, *, bypass_cache: bool = False) -> Dict[str, Any]:
+        """Extract from pre-split text (text-section statements)."""
+        return extract_one_pdf(
+            self.client, self.schema_bundle, str(source_path), self.model, self.rescue,
+            pdf_text=text, cache=self.cache, bypass_cache=bypass_cache,
+        )
+
+    def cache_stats(self) -> Optional[Dict[str, Any]]:
+        return self.cache.stats() if self.cache is not None else None
+
+    def validate(self, raw: Dict[str, Any]) -> Dict[str, Any]:
+        return validate(raw)
+
+    def map_ordered(self, fns: List[Callable[[], T]]) -> Iterator[T]:
+        """
+        Run fns on the extraction pool, yielding results in input order as
+        soon as each is ready.  An exception is raised at its position; work
+        not yet started is cancelled when the caller stops iterating.
+        """
+        if len(fns) <= 1 or self.extract_concurrency <= 1:
+            for fn in fns:
+                yield fn()
+            return
+
+        futures = [self._extract_pool().submit(fn) for fn in fns]
+        try:
+            for f in futures:
+                yield f.result()
+        finally:
+            for f in futures:
+                f.cancel()
+
+    # ---------------------------
+    # End-to-end
+    # ---------------------------
+
+    def process_pdf(
+        self,
+        pdf_path: Path,
+        out_dir: Path,
+        *,
+        gcs_bucket: str,
+        gcs_path: str,
+        source_system: str = "gcs",
+        bypass_cache: bool = False,
+        doc: Optional[PdfDocument] = None,
+        write_artifacts: bool = WRITE_ARTIFACTS,
+    ) -> None:
+        """doc: the PDF already loaded in memory; pdf_path then only names it."""
+        if self.supa is None:
+            raise RuntimeError("InvoicePipeline.process_pdf requires a Supa client")
+        process_one_pdf(
+            self,
+            pdf_path,
+            out_dir,
+            gcs_bucket=gcs_bucket,
+            gcs_path=gcs_path,
+            source_system=source_system,
+            bypass_cache=bypass_cache,
+            pdf_doc=doc,
+            write_artifacts=write_artifacts,
+        )
@@ -28,6 +28,14 @@ Also required for extraction:
 Optional:
   EXTRACTION_VERSION
   PARSER_VERSION (defaults to EXTRACTION_VERSION or "0.1.0")
+  EXTRACT_CONCURRENCY (per-part LLM extractions in flight, default 6)
+  EXTRACTION_CACHE / EXTRACTION_CACHE_BYPASS (see extraction_cache.py)
+  LLM_RATE_LIMIT_RETRIES / LLM_BACKOFF_BASE_S / LLM_BACKOFF_MAX_S (429 backoff)
+  SUPABASE_POOL_SIZE / SUPABASE_HTTP_RETRIES / SUPABASE_TIMEOUT_S / SUPABASE_SLOW_MS
+  WRITE_PART_PDFS (1 = write every split part PDF; default only parts that need the vision path)
+  WRITE_PARSE_ARTIFACTS (1 = write per-part JSON, section text, split manifest and manifest.json
+    to out_dir for debugging; the CLI always writes them)
+  VISION_RENDER_WORKERS / VISION_PAGES_PER_CALL / VISION_PAGE_MAX_BYTES (see page_render.py)
 """
 
 import argparse
@@ -35,15 +43,23 @@ import hashlib
 import json
 import os
 import re
-import subprocess
-from dataclasses import dataclass
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from extract_invoice import read_pdf_text
+from extract_invoice import is_scanned_text
+from id_scanner import (
+    AIRPORT_LEAD, AIRPORT_TRAIL, AVFUEL, INVOICE_ID_KINDS, SECTION_KINDS, by_kind, first, line_start, of_kind, scan,
+)
+from pdf_document import PdfDocument
 
 
 # ---------------------------
@@ -69,12 +85,6 @@ def sha256_file(path: Path) -> str:
             h.update(chunk)
     return h.hexdigest()
 
-def run(cmd: List[str]) -> None:
-    subprocess.check_call(cmd)
-
-def load_json_file(p: Path) -> Dict[str, Any]:
-    return json.loads(p.read_text(encoding="utf-8"))
-
 def write_manifest(out_dir: Path, payload: Dict[str, Any]) -> Path:
     p = out_dir / "manifest.json"
     p.write_text(json.dumps(payload, indent=2), encoding="utf-8")
@@ -105,18 +115,6 @@ def scrub_obj(x):
 # Invoice ID detection (statement heuristic)
 # ---------------------------
 
-INV_PATTERNS = [
-    # World Fuel invoice numbers: 8+ digits hyphen 4-5 digits (e.g. 27379628-21101)
-    re.compile(r"\b(\d{8,}-\d{4,5})\b"),
-    re.compile(r"\bFUEL\s+TICKET\s+(\d{4,})\b", re.I),
-    # World Fuel fuel ticket: header on one line, number on next line
-    re.compile(r"FUEL\s+TICKET\b[^\n]*\n\s*(?:\d{1,2}-[A-Z]{3}-\d{4}\s+)?(\d{5,7})\b", re.I),
-    re.compile(r"\bRef Number\s+([A-Z0-9-]{6,})\b", re.I),
-    re.compile(r"\bInvoice\s+(?:No\.?|#|Number)?\s*([A-Z0-9-]{3,})\b", re.I),
-    re.compile(r"\bCredit Memo No\.?:\s*([A-Z0-9-]{3,})\b", re.I),
-    re.compile(r"\bINV\d{6,}\b", re.I),
-]
-
 # IDs that are clearly column headers / labels, not real invoice numbers
 _BAD_INV_ID = re.compile(
     r"^(?:PAGE|DATE|CUSTOMER|TOTAL|USD|AMOUNT|NUMBER|NUMBERS|THE|AND|FOR|"
@@ -136,28 +134,26 @@ def _is_cc_invoice(text: str, match_start: int) -> bool:
     return bool(_CC_INVOICE_RE.search(text[lookback:match_start + 8]))
 
 def detect_invoice_ids(text: str) -> List[str]:
+    text = text or ""
+    toks = scan(text)
     ids = set()
-    for pat in INV_PATTERNS:
-        for m in pat.finditer(text or ""):
-            val = m.group(1) if m.groups() else m.group(0)
-            if _BAD_INV_ID.match(val):
-                continue
-            if _is_cc_invoice(text, m.start()):
-                continue
-            ids.add(val)
+    for t in by_kind(toks, INVOICE_ID_KINDS):
+        if _BAD_INV_ID.match(t.value):
+            continue
+        if _is_cc_invoice(text, t.start):
+            continue
+        ids.add(t.value)
 
     # For Avfuel activity invoices, also detect receipt numbers (7-9 digit
     # integers at the start of table rows) so they appear in detected_invoice_ids.
-    if is_avfuel_activity_invoice(text or ""):
-        master_ref = None
-        m_ref = _MASTER_REF_RE.search(text or "")
-        if m_ref:
-            master_ref = m_ref.group(1)
-        for m in _RECEIPT_LINE_RE.finditer(text or ""):
-            receipt_no = m.group(1)
-            if master_ref and receipt_no == master_ref:
+    if is_avfuel_activity_invoice(text):
+        avfuel = scan(text, AVFUEL)
+        m_ref = first(avfuel, "master_ref")
+        master_ref = m_ref.value if m_ref else None
+        for t in of_kind(avfuel, "receipt_line"):
+            if master_ref and t.value == master_ref:
                 continue
-            ids.add(receipt_no)
+            ids.add(t.value)
 
     return sorted(ids)
 
@@ -180,18 +176,9 @@ def maybe_statement_gate(text: str, invoice_ids: List[str]) -> Tuple[bool, int]:
 # Text-based statement splitting (handles multi-invoice-per-page)
 # ---------------------------
 
-_SECTION_BOUNDARY_PATTERNS = [
-    # World Fuel invoice numbers: 8+ digits hyphen 4-5 digits (e.g. 27379628-21101)
-    re.compile(r"\b(\d{8,}-\d{4,5})\b"),
-    re.compile(r"\bFUEL\s+TICKET\s+(\d{4,})\b", re.I),
-    # NOTE: WF multiline fuel ticket pattern intentionally excluded here —
-    # it creates duplicate section boundaries alongside the invoice number pattern.
-    # It's only needed in INV_PATTERNS (for ID count) and split_statement.py (page ID).
-    re.compile(r"\bRef Number\s+([A-Z0-9][A-Z0-9-]*)\b", re.I),
-    re.compile(r"\bInvoice\s+(?:No\.?|#|Number)\s*:?\s*([A-Z0-9][A-Z0-9-]{2,})\b", re.I),
-    re.compile(r"\bCredit Memo\s+(?:No\.?|#|Number)\s*:?\s*([A-Z0-9][A-Z0-9-]{2,})\b", re.I),
-    re.compile(r"\b(INV\d{6,})\b", re.I),
-]
+# Boundary patterns: id_scanner.SECTION_KINDS.  The World Fuel multiline
+# fuel ticket rule is intentionally excluded there; it creates duplicate
+# section boundaries alongside the invoice number pattern.
 
 # IDs that are clearly not invoice numbers
 _BAD_SECTION_ID = re.compile(
@@ -312,21 +299,19 @@ def split_text_into_sections(text: str) -> List[Tuple[str, str]]:
     Returns list of (invoice_id, text_section) tuples.
     Returns empty list if fewer than 2 distinct invoices found.
     """
+    text = text or ""
     matches: List[Tuple[int, str]] = []
-    for pat in _SECTION_BOUNDARY_PATTERNS:
-        for m in pat.finditer(text or ""):
-            inv_id = (m.group(1) if m.groups() else m.group(0)).strip()
-            if not inv_id or len(inv_id) < 3:
-                continue
-            if _BAD_SECTION_ID.match(inv_id):
-                continue
-            # Skip "CC Invoice #:" matches — credit card transaction numbers
-            if _is_cc_invoice(text, m.start()):
-                continue
-            # Find start of the line containing this match
-            line_start = text.rfind("\n", 0, m.start())
-            line_start = 0 if line_start < 0 else line_start + 1
-            matches.append((line_start, inv_id))
+    for t in by_kind(scan(text), SECTION_KINDS):
+        inv_id = t.value.strip()
+        if not inv_id or len(inv_id) < 3:
+            continue
+        if _BAD_SECTION_ID.match(inv_id):
+            continue
+        # Skip "CC Invoice #:" matches — credit card transaction numbers
+        if _is_cc_invoice(text, t.start):
+            continue
+        # Boundary is the start of the line containing this match
+        matches.append((line_start(text, t.start), inv_id))
 
     if not matches:
         return []
@@ -359,22 +344,8 @@ def split_text_into_sections(text: str) -> List[Tuple[str, str]]:
 # Airport-based sub-splitting for consolidated fuel statements
 # ---------------------------
 
-# Matches lines like "OSU1 JET FUEL ...", "MSN IP ...", "STS FSII ..."
-# Also matches codes with dashes (e.g. "YIP-AVFLIGHT", "APF JET FUEL")
-_AIRPORT_FUEL_RE = re.compile(
-    r"^([A-Z0-9]{3,4})[\s\-]+"
-    r"(?:JET[\s-]*(?:FUEL|A)|AVGAS|100LL|FUEL\b|IP[\s\-]|FSII|FLOW[\s-]*FEE|INTO[\s-]*PLANE|AVFLIGHT)",
-    re.I | re.M,
-)
-
-# Trailing airport codes: "THRU PUT - YIP", "FLOW FEE YIP", "FSII - APF"
-_TRAILING_AIRPORT_RE = re.compile(
-    r"(?:THRU\s*PUT|FLOW\s*FEE|FSII|INTO[\s-]*PLANE|FUEL\s*TAX|EXCISE\s*TAX|"
-    r"KEROSENE|LUST\s*TAX|SUPERFUND|STORAGE\s*(?:TK\s*)?FEE|PROTECTION|WATER\s*QUALITY)"
-    r"\s*[\-]?\s*([A-Z]{3})\b",
-    re.I | re.M,
-)
-
+# Leading ("YIP JET FUEL") and trailing ("FLOW FEE YIP") airport code
+# rules live in id_scanner (airport_lead / airport_trail).
 
 def _subsplit_by_airport(section_text: str, parent_id: str) -> List[Tuple[str, str]]:
     """
@@ -387,22 +358,12 @@ def _subsplit_by_airport(section_text: str, parent_id: str) -> List[Tuple[str, s
     Returns list of (composite_id, text_section) tuples.
     Returns empty list if fewer than 2 distinct airports found.
     """
-    matches: List[Tuple[int, str]] = []
+    section_text = section_text or ""
 
     # Pass 1: leading airport codes (e.g. "YIP JET FUEL", "APF-AVFLIGHT")
-    for m in _AIRPORT_FUEL_RE.finditer(section_text or ""):
-        code = m.group(1).upper()
-        line_start = section_text.rfind("\n", 0, m.start())
-        line_start = 0 if line_start < 0 else line_start + 1
-        matches.append((line_start, code))
-
     # Pass 2: trailing airport codes (e.g. "THRU PUT - YIP", "FLOW FEE APF")
-    if not matches:
-        for m in _TRAILING_AIRPORT_RE.finditer(section_text or ""):
-            code = m.group(1).upper()
-            line_start = section_text.rfind("\n", 0, m.start())
-            line_start = 0 if line_start < 0 else line_start + 1
-            matches.append((line_start, code))
+    hits = scan(section_text, AIRPORT_LEAD) or scan(section_text, AIRPORT_TRAIL)
+    matches: List[Tuple[int, str]] = [(line_start(section_text, t.start), t.value.upper()) for t in hits]
 
     if not matches:
         return []
@@ -462,62 +423,129 @@ def normalize_date_to_iso(date_str: Optional[str]) -> Optional[str]:
 
 
 # ---------------------------
-# Validation runner
+# Supabase REST client (pooled requests.Session)
 # ---------------------------
 
-def validate_json(path: Path) -> Dict[str, Any]:
-    out = subprocess.check_output(["python3", "validate_invoice.py", "--infile", str(path)], text=True)
-    return json.loads(out)
+SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", "16"))
+SUPABASE_HTTP_RETRIES = int(os.getenv("SUPABASE_HTTP_RETRIES", "3"))
+SUPABASE_TIMEOUT_S = float(os.getenv("SUPABASE_TIMEOUT_S", "120"))
+SUPABASE_SLOW_MS = int(os.getenv("SUPABASE_SLOW_MS", "2000"))
+BULK_CHUNK_ROWS = 500
+PERSIST_CHUNK_INVOICES = 100
+
+# Retried on 502/503/504 and dropped connections.  POST is left out (inserts
+# are not idempotent); urllib3 still retries it when the connection failed
+# before the request was sent.
+_RETRY_METHODS = frozenset({"GET", "HEAD", "PATCH", "DELETE"})
+
+
+def _make_session(key: str, *, pool_size: int, retries: int) -> requests.Session:
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=0.5,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=_RETRY_METHODS,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    s = requests.Session()
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    s.headers.update({
+        "apikey": key,
+        "Authorization": f"Bearer {key}",
+        "Content-Type": "application/json",
+    })
+    return s
+
 
+def _chunks(rows: List[Any], size: int = BULK_CHUNK_ROWS):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
 
-# ---------------------------
-# Supabase REST client (requests-only)
-# ---------------------------
 
 @dataclass
 class Supa:
+    """
+    One keep-alive connection pool per instance (thread-safe; extraction
+    workers share it for cache reads).  Every call's latency is recorded
+    per "METHOD table" and exposed by stats().
+    """
     url: str
     key: str
+    pool_size: int = SUPABASE_POOL_SIZE
+    retries: int = SUPABASE_HTTP_RETRIES
+    timeout: float = SUPABASE_TIMEOUT_S
+    session: requests.Session = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.session = _make_session(self.key, pool_size=self.pool_size, retries=self.retries)
+        self._stats_lock = threading.Lock()
+        self._latency: Dict[str, Dict[str, Any]] = {}
+
+    def close(self) -> None:
+        self.session.close()
+
+    # ---------------------------
+    # Transport + latency
+    # ---------------------------
+
+    def _send(self, method: str, endpoint: str, *, params, json_body, prefer: str, label: str) -> requests.Response:
+        headers = {"Prefer": prefer} if prefer else None
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            resp = self.session.request(
+                method, endpoint, params=params, json=json_body, headers=headers, timeout=self.timeout,
+            )
+            ok = resp.status_code < 300
+            return resp
+        finally:
+            self._record(label, (time.perf_counter() - t0) * 1000.0, ok)
+
+    def _record(self, label: str, ms: float, ok: bool) -> None:
+        with self._stats_lock:
+            s = self._latency.get(label)
+            if s is None:
+                s = self._latency[label] = {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0,
+                                            "recent_ms": deque(maxlen=200)}
+            s["calls"] += 1
+            s["errors"] += 0 if ok else 1
+            s["total_ms"] += ms
+            s["max_ms"] = max(s["max_ms"], ms)
+            s["recent_ms"].append(ms)
+        if ms >= SUPABASE_SLOW_MS:
+            print(f"[supa] slow {label}: {ms:.0f}ms", flush=True)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-endpoint call counts and latency (avg/max overall, p50/p95 over the last 200)."""
+        out: Dict[str, Dict[str, Any]] = {}
+        with self._stats_lock:
+            for label, s in self._latency.items():
+                recent = sorted(s["recent_ms"])
+                out[label] = {
+                    "calls": s["calls"],
+                    "errors": s["errors"],
+                    "avg_ms": round(s["total_ms"] / s["calls"], 1),
+                    "max_ms": round(s["max_ms"], 1),
+                    "p50_ms": round(recent[len(recent) // 2], 1),
+                    "p95_ms": round(recent[min(len(recent) - 1, int(len(recent) * 0.95))], 1),
+                }
+        return out
 
     def _rest(self, method: str, table: str, *, params=None, json_body=None, prefer: str = ""):
-        base = self.url.rstrip("/")
-        headers = {
-            "apikey": self.key,
-            "Authorization": f"Bearer {self.key}",
-            "Content-Type": "application/json",
-        }
-        if prefer:
-            headers["Prefer"] = prefer
-        endpoint = f"{base}/rest/v1/{table}"
-        resp = requests.request(method, endpoint, params=params, json=json_body, headers=headers, timeout=120)
+        endpoint = f"{self.url.rstrip('/')}/rest/v1/{table}"
+        label = f"{method} {table}"
+        resp = self._send(method, endpoint, params=params, json_body=json_body, prefer=prefer, label=label)
 
         if resp.status_code >= 300:
             # Treat business-unique duplicates as handled (do not crash worker)
             if resp.status_code == 409 and "parsed_invoices_business_unique" in (resp.text or ""):
                 raise DuplicateInvoiceError(resp.text)
-            # DB trigger on parsed_invoices auto-creates invoice_alerts rows;
-            # when splitting produces multiple invoices per document, the
-            # trigger hits a unique constraint on (rule_id, document_id).
-            # Safe to retry the upsert after clearing the conflicting alert.
-            if resp.status_code == 409 and "invoice_alerts_unique_rule_doc" in (resp.text or ""):
-                # Delete the conflicting alert and retry once
-                try:
-                    import json as _json
-                    err = _json.loads(resp.text)
-                    # Extract document_id from the error details
-                    self._rest("DELETE", "invoice_alerts", params={
-                        "document_id": f"eq.{json_body.get('document_id', '')}",
-                    }, prefer="return=minimal")
-                except Exception:
-                    pass
-                # Retry the original request
-                resp2 = requests.request(method, endpoint, params=params, json=json_body, headers=headers, timeout=120)
-                if resp2.status_code < 300:
-                    if resp2.text.strip():
-                        return resp2.json()
-                    return None
-                # If retry also fails, fall through to raise
-                resp = resp2
             raise RuntimeError(f"Supabase REST error {resp.status_code}: {resp.text}")
 
         if resp.text.strip():
@@ -544,6 +572,33 @@ class Supa:
             prefer="return=minimal",
         )
 
+    # Leased document claims (see migrations/20261016_document_claim_leases.sql)
+    def claim_documents(
+        self, owner: str, *, limit: int, status: str, lease_s: int, max_attempts: int,
+    ) -> List[Dict[str, Any]]:
+        """Claim up to `limit` documents for `owner`; returns [{id, gcs_bucket, gcs_path}] oldest first."""
+        return self._rest("POST", "rpc/claim_documents", json_body={
+            "p_owner": owner, "p_limit": limit, "p_status": status,
+            "p_lease_seconds": lease_s, "p_max_attempts": max_attempts,
+        }) or []
+
+    def claim_document(
+        self, doc_id: str, owner: str, *, lease_s: int, from_status: Tuple[str, ...], max_attempts: int,
+    ) -> Optional[Dict[str, Any]]:
+        """Lease one document if its status is in from_status; returns {id, gcs_bucket, gcs_path} or None."""
+        rows = self._rest("POST", "rpc/claim_document", json_body={
+            "p_id": str(doc_id), "p_owner": owner, "p_from_status": list(from_status),
+            "p_lease_seconds": lease_s, "p_max_attempts": max_attempts,
+        }) or []
+        return rows[0] if rows else None
+
+    def heartbeat_document_leases(self, owner: str, doc_ids: List[str], *, lease_s: int) -> List[str]:
+        """Extend owner's leases; returns the ids it still holds."""
+        data = self._rest("POST", "rpc/heartbeat_document_leases", json_body={
+            "p_owner": owner, "p_ids": [str(d) for d in doc_ids], "p_lease_seconds": lease_s,
+        }) or []
+        return [str(r.get("heartbeat_document_leases") if isinstance(r, dict) else r) for r in data]
+
     def insert_invoice_error(self, row: Dict[str, Any]) -> None:
         self._rest(
             "POST",
@@ -552,32 +607,32 @@ class Supa:
             prefer="return=minimal",
         )
 
-    # parsed_invoices: upsert by (document_id, source_invoice_id, parser_version)
-    def upsert_parsed_invoice(self, row: Dict[str, Any]) -> Dict[str, Any]:
-        data = self._rest(
-            "POST",
-            "parsed_invoices",
-            params={"on_conflict": "document_id,source_invoice_id,parser_version", "select": "*"},
-            json_body=row,
-            prefer="resolution=merge-duplicates,return=representation",
-        )
-        return data[0]
+    def insert_invoice_errors(self, rows: List[Dict[str, Any]]) -> None:
+        for chunk in _chunks(rows):
+            self._rest("POST", "invoice_errors", json_body=chunk, prefer="return=minimal")
 
-    # parsed_line_items: replace by parsed_invoice_id
-    def replace_line_items(self, parsed_invoice_id: str, items: List[Dict[str, Any]]) -> None:
-        self._rest(
-            "DELETE",
-            "parsed_line_items",
-            params={"parsed_invoice_id": f"eq.{parsed_invoice_id}"},
-            prefer="return=minimal",
-        )
-        if items:
-            self._rest(
-                "POST",
-                "parsed_line_items",
-                json_body=items,
-                prefer="return=minimal",
-            )
+    # parsed_invoices + parsed_line_items: one transactional RPC per chunk
+    # (see migrations/20261016_persist_parsed_invoices.sql)
+    def persist_invoices(self, entries: List[Tuple[Dict[str, Any], List[Dict[str, Any]]]]) -> List["InvoiceWrite"]:
+        """
+        For each (inv_row, li_rows), in order: clear is_latest, upsert the
+        invoice on (document_id, source_invoice_id, parser_version) and
+        replace its line items.  Returns one InvoiceWrite per entry.
+        """
+        out: List[InvoiceWrite] = []
+        for chunk in _chunks(entries, PERSIST_CHUNK_INVOICES):
+            payload = [{"invoice": inv_row, "line_items": li_rows} for inv_row, li_rows in chunk]
+            data = self._rest("POST", "rpc/persist_parsed_invoices", json_body={"p_invoices": payload}) or []
+            if len(data) != len(chunk):
+                raise RuntimeError(f"persist_parsed_invoices returned {len(data)} results for {len(chunk)} invoices")
+            out.extend(InvoiceWrite(r.get("id"), bool(r.get("business_duplicate"))) for r in data)
+        return out
+
+    def persist_invoice(self, inv_row: Dict[str, Any], li_rows: List[Dict[str, Any]]) -> "InvoiceWrite":
+        return self.persist_invoices([(inv_row, li_rows)])[0]
+
+    def invoice_batch(self, document_id: str) -> "InvoiceWriteBatch":
+        return InvoiceWriteBatch(self, document_id)
 
     def find_existing_business_unique(
         self,
@@ -608,11 +663,14 @@ class Supa:
         total: Optional[float],
         within_days: int = 3,
         limit: int = 3,
+        exclude_ids: Optional[Iterable[str]] = None,
     ) -> List[Dict[str, Any]]:
         """
         Looks for "similar" invoices:
         - same vendor_name (exact)
         - same invoice_number OR (same date-window and same total)
+        Rows in exclude_ids are filtered out in the query, so they don't use
+        up the limit.
         """
         vn = (vendor_name or "").strip()
         if not vn or vn in {",", "/", "-"} or len(vn) < 3:
@@ -624,6 +682,9 @@ class Supa:
             "order": "created_at.desc",
             "limit": str(limit),
         }
+        excluded = sorted({str(i) for i in exclude_ids or () if i})
+        if excluded:
+            base_params["id"] = f"not.in.({','.join(excluded)})"
 
         # Case A: exact invoice_number match
         invno = (invoice_number or "").strip()
@@ -660,6 +721,40 @@ class Supa:
         return []
 
 
+@dataclass
+class InvoiceWrite:
+    """Outcome of one InvoiceWriteBatch.add()."""
+    parsed_invoice_id: Optional[str]
+    business_duplicate: bool = False
+
+
+class InvoiceWriteBatch:
+    """
+    Unit of work for one document's parsed invoices.  add() queues rows;
+    flush() persists them through persist_parsed_invoices (one transaction
+    per PERSIST_CHUNK_INVOICES invoices, entries applied in add order) and
+    returns one InvoiceWrite per add(), in order.
+    """
+
+    def __init__(self, supa: Supa, document_id: str) -> None:
+        self.supa = supa
+        self.document_id = document_id
+        self._rows: List[Tuple[Dict[str, Any], List[Dict[str, Any]]]] = []
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def add(self, inv_row: Dict[str, Any], li_rows: List[Dict[str, Any]]) -> int:
+        self._rows.append((inv_row, li_rows))
+        return len(self._rows) - 1
+
+    def flush(self) -> List[InvoiceWrite]:
+        if not self._rows:
+            return []
+        rows, self._rows = self._rows, []
+        return self.supa.persist_invoices(rows)
+
+
 # ---------------------------
 # Mapping extracted JSON -> DB rows
 # ---------------------------
@@ -985,70 +1080,219 @@ def normalize_rows(
     return inv_row, li_rows
 
 # ---------------------------
-# Core processing
+# Per-invoice extract + persist
 # ---------------------------
 
-def _clear_latest_for_logical_invoice(supa: Supa, *, document_id: str, source_invoice_id: str) -> None:
-    # Clear "latest" for this logical invoice before setting it true again.
+@dataclass
+class _PartJob:
+    """One invoice inside a document (a split part, a text section, or the whole PDF)."""
+    invoice_id: str
+    out_json: Optional[Path]          # None: extraction JSON not written (artifacts off)
+    source_invoice_id: Optional[str]  # None: derive from the extraction (single mode)
+    artifact: Dict[str, str]          # manifest pointer: {"pdf": ...} or {"source_text": ...}
+    source_path: Path                 # PDF (or section .txt) handed to the extractor
+    text: Optional[str]               # pre-extracted text; None = read source_path
+    part_doc: Optional[PdfDocument] = None  # page view source_path is written from, on first use
+
+
+def _ensure_source_file(job: _PartJob) -> None:
+    """Write a part's source file only when the extractor will open it (scanned text -> vision)."""
+    if job.source_path.exists():
+        return
+    if job.text is not None and not is_scanned_text(job.text):
+        return
+    if job.part_doc is not None:
+        job.part_doc.write(job.source_path)
+    elif job.text is not None:
+        job.source_path.parent.mkdir(parents=True, exist_ok=True)
+        job.source_path.write_text(job.text, encoding="utf-8")
+
+
+def _extract_part(pipeline, job: _PartJob, bypass_cache: bool = False) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """LLM extraction + validation.  No Supabase writes: safe to run on a worker thread."""
+    _ensure_source_file(job)
+    raw = pipeline.extract_pdf(job.source_path, pdf_text=job.text, bypass_cache=bypass_cache)
+    raw["invoice_date"] = normalize_date_to_iso(raw.get("invoice_date"))
+    raw = scrub_obj(raw)
+    if job.out_json is not None:
+        job.out_json.write_text(json.dumps(raw, indent=2), encoding="utf-8")
+
+    v = pipeline.validate(raw)
+    v = scrub_obj(v)
+    return raw, v
+
+
+@dataclass
+class _PreparedPart:
+    """An extracted invoice mapped to DB rows, waiting for the document's batch flush."""
+    job: _PartJob
+    validation: Dict[str, Any]
+    source_invoice_id: str
+    inv_row: Dict[str, Any]
+    li_rows: List[Dict[str, Any]]
+
+
+def _prepare_part(
+    job: _PartJob,
+    raw: Dict[str, Any],
+    v: Dict[str, Any],
+    *,
+    document_id: str,
+    parser_version: str,
+    model: str,
+    fallback_id: str,
+) -> _PreparedPart:
+    source_invoice_id = job.source_invoice_id
+    if source_invoice_id is None:
+        source_invoice_id = compute_source_invoice_id(raw, fallback=fallback_id)
+
+    inv_row, li_rows = normalize_rows(
+        raw,
+        document_id=document_id,
+        parser_version=parser_version,
+        model=model,
+        validation=v,
+        source_invoice_id=source_invoice_id,
+    )
+    return _PreparedPart(job, v, source_invoice_id, scrub_obj(inv_row), scrub_obj(li_rows))
+
+
+def _finish_part(
+    supa: Supa,
+    part: _PreparedPart,
+    write: InvoiceWrite,
+    *,
+    document_id: str,
+    later_ids: set,
+) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    """Duplicate lookups after the flush; returns (manifest entry, invoice_errors row or None)."""
+    inv_row = part.inv_row
+    v = part.validation
+    parsed_invoice_id = write.parsed_invoice_id
+    soft_dupes: List[Dict[str, Any]] = []
+    dup_of: Optional[str] = None
+
+    if write.business_duplicate:
+        # Business duplicate: link to the existing invoice; do NOT fail the document
+        existing = None
+        try:
+            existing = supa.find_existing_business_unique(
+                vendor_name=str(inv_row.get("vendor_name") or ""),
+                invoice_number=str(inv_row.get("invoice_number") or ""),
+                total_amount=float(inv_row.get("total_amount") or inv_row.get("total") or 0),
+            )
+        except Exception:
+            existing = None
+
+        if existing:
+            parsed_invoice_id = existing.get("id")
+            dup_of = parsed_invoice_id
+
+    # Soft duplicate detection (best-effort).  Invoices later in this batch
+    # were not written yet in a row-by-row run, so they don't count.
     try:
-        supa._rest(
-            "PATCH",
-            "parsed_invoices",
-            params={
-                "document_id": f"eq.{document_id}",
-                "source_invoice_id": f"eq.{source_invoice_id}",
-                "is_latest": "eq.true",
-            },
-            json_body={"is_latest": False},
-            prefer="return=minimal",
+        soft_dupes = supa.find_soft_duplicate(
+            vendor_name=inv_row.get("vendor_name"),
+            invoice_date=inv_row.get("invoice_date"),
+            invoice_number=inv_row.get("invoice_number"),
+            total=float(inv_row.get("total") or 0) if inv_row.get("total") is not None else None,
+            exclude_ids=later_ids,
         )
+        soft_dupes = [d for d in soft_dupes if d.get("id") != parsed_invoice_id]
     except Exception:
-        pass
+        soft_dupes = []
 
+    err_row = None
+    if parsed_invoice_id and (not v.get("validation_pass")):
+        err_row = {
+            "document_id": document_id,
+            "parsed_invoice_id": parsed_invoice_id,
+            "stage": "validate",
+            "error_code": "VALIDATION_FAILED",
+            "message": "Invoice failed validation",
+            "details": v,
+        }
 
-def process_one_pdf(
+    entry = {
+        "invoice_id": part.job.invoice_id,
+        "json": str(part.job.out_json) if part.job.out_json is not None else None,
+        **part.job.artifact,
+        "validation": v,
+        "parsed_invoice_id": parsed_invoice_id,
+        "source_invoice_id": part.source_invoice_id,
+        "business_duplicate_of": dup_of,
+        "soft_duplicates": soft_dupes[:3],
+    }
+    return entry, err_row
+
+
+def _persist_parts(
     supa: Supa,
-    pdf_path: Path,
-    out_dir: Path,
+    parts: List[_PreparedPart],
     *,
-    schema: str,
-    model: str,
-    rescue: bool,
-    gcs_bucket: str,
-    gcs_path: str,
-    source_system: str,
-) -> None:
-    out_dir.mkdir(parents=True, exist_ok=True)
+    document_id: str,
+) -> List[Dict[str, Any]]:
+    """Write a document's invoices as one batch and return their manifest entries, in order."""
+    batch = supa.invoice_batch(document_id)
+    for part in parts:
+        batch.add(part.inv_row, part.li_rows)
+    writes = batch.flush()
 
-    text = read_pdf_text(str(pdf_path))
-    invoice_ids = detect_invoice_ids(text)
-    maybe_statement, page_count = maybe_statement_gate(text, invoice_ids)
+    outputs: List[Dict[str, Any]] = []
+    err_rows: List[Dict[str, Any]] = []
+    for i, (part, write) in enumerate(zip(parts, writes)):
+        later_ids = {w.parsed_invoice_id for w in writes[i + 1:]} - {write.parsed_invoice_id}
+        entry, err_row = _finish_part(supa, part, write, document_id=document_id, later_ids=later_ids)
+        outputs.append(entry)
+        if err_row:
+            err_rows.append(err_row)
+    supa.insert_invoice_errors(err_rows)
+    return outputs
 
-    parser_version = os.getenv("PARSER_VERSION") or os.getenv("EXTRACTION_VERSION") or "0.1.0"
 
-    doc_row = {
-        "source_system": source_system,
-        "gcs_bucket": gcs_bucket,
-        "gcs_path": gcs_path,
-        "document_hash": sha256_file(pdf_path),
-        "status": "processing",
-        "processing_started_at": utc_now_iso(),
-        "mode": "unknown",
-        "page_count": page_count,
-        "detected_invoice_ids": invoice_ids,
-    }
-    doc_row = scrub_obj(doc_row)
-    doc = supa.upsert_documents(doc_row)
-    document_id = doc["id"]
+# Write every split part PDF up front (debugging); otherwise only the parts
+# that go to the vision path get one.
+WRITE_PART_PDFS = os.getenv("WRITE_PART_PDFS", "0") in {"1", "true", "True", "yes", "YES"}
 
-    outputs: List[Dict[str, Any]] = []
-    mode = "single"
+# Intermediate files (per-part JSON, section text, split manifest,
+# manifest.json) are debugging aids: the service keeps everything it needs
+# in memory and in Supabase, so they are only written when asked for.
+WRITE_ARTIFACTS = os.getenv("WRITE_PARSE_ARTIFACTS", "0") in {"1", "true", "True", "yes", "YES"}
+
+
+@dataclass
+class PartPlan:
+    """How a document will be extracted: mode plus one job per invoice, in persist order."""
+    mode: str
+    did_split: bool
+    jobs: List[_PartJob]
+    split_error: Optional[str] = None
 
+
+def plan_parts(
+    pipeline,
+    pdf_path: Path,
+    out_dir: Path,
+    pdf_doc: PdfDocument,
+    text: str,
+    invoice_ids: List[str],
+    maybe_statement: bool,
+    *,
+    write_artifacts: bool = WRITE_ARTIFACTS,
+) -> PartPlan:
+    """
+    Decide single vs statement and build the extraction jobs.  No model
+    calls and no Supabase writes, so batch collection can reuse it.
+    Source files (part PDFs, section text, the PDF itself) are written
+    lazily by the job that needs them; write_artifacts adds the debugging
+    outputs.
+    """
     split_dir = out_dir / f"split_{pdf_path.stem}"
     split_manifest = out_dir / f"{pdf_path.stem}.split_manifest.json"
 
     did_split = False
-    part_pdfs: List[Path] = []
+    split_error: Optional[str] = None
+    part_pages: Dict[str, range] = {}
 
     # ── Vendor-specific split suppression ──────────────────────────
     # Some vendors (e.g. Vector PLANEPASS) produce multi-page PDFs that
@@ -1065,23 +1309,17 @@ def process_one_pdf(
     if maybe_statement and not suppress_pdf_split:
         split_dir.mkdir(parents=True, exist_ok=True)
         try:
-            run([
-                "python3", "split_statement.py",
-                "--pdf", str(pdf_path),
-                "--out_dir", str(split_dir),
-                "--manifest", str(split_manifest),
-            ])
-            part_pdfs = sorted(split_dir.glob("*.pdf"))
-            did_split = len(part_pdfs) >= 2
+            # Parts carry their page text; a part PDF is only needed for the
+            # vision path, so by default it is written on first use.
+            split_rows = pipeline.split(pdf_path, split_dir, doc=pdf_doc, write_pdfs=WRITE_PART_PDFS)
+            if write_artifacts:
+                split_manifest.write_text(json.dumps(split_rows, indent=2), encoding="utf-8")
+            # Repeated invoice ids share a filename; the last group wins, as on disk.
+            for r in split_rows:
+                part_pages[Path(r["out_pdf"]).name] = range(r["page_start"] - 1, r["page_end"])
+            did_split = len(part_pages) >= 2
         except Exception as e:
-            supa.insert_invoice_error({
-                "document_id": document_id,
-                "parsed_invoice_id": None,
-                "stage": "split",
-                "error_code": "SPLIT_FAILED",
-                "message": str(e),
-                "details": {"pdf": str(pdf_path)},
-            })
+            split_error = str(e)
             did_split = False
 
     # Avfuel activity invoice splitting (highest priority for tabular format):
@@ -1120,11 +1358,127 @@ def process_one_pdf(
         if len(airport_sections) >= 2:
             text_sections = airport_sections
 
+    jobs: List[_PartJob] = []
+    if did_split:
+        for name in sorted(part_pages):
+            part_pdf = split_dir / name
+            part_doc = pdf_doc.subset(part_pages[name])
+            jobs.append(_PartJob(
+                invoice_id=part_pdf.stem,
+                out_json=out_dir / f"{part_pdf.stem}.json" if write_artifacts else None,
+                # Statement-safe stable logical invoice id
+                source_invoice_id=part_pdf.stem,
+                artifact={"pdf": str(part_pdf)},
+                source_path=part_pdf,
+                text=part_doc.text(),
+                part_doc=part_doc,
+            ))
+        return PartPlan("statement", True, jobs, split_error)
+
+    if len(text_sections) >= 2:
+        # Text-based statement splitting: extract each invoice section
+        # independently using the pre-extracted text. This handles
+        # multi-invoice-per-page PDFs (e.g. World Fuel consolidated
+        # statements) that page-level splitting cannot split.
+        for inv_id, section_text in text_sections:
+            safe_id = re.sub(r"[^A-Za-z0-9._-]+", "_", inv_id or "UNKNOWN")
+            text_file = out_dir / f"section_{safe_id}.txt"
+            if write_artifacts:
+                text_file.write_text(section_text, encoding="utf-8")
+            jobs.append(_PartJob(
+                invoice_id=inv_id,
+                out_json=out_dir / f"{safe_id}.json" if write_artifacts else None,
+                source_invoice_id=inv_id,
+                artifact={"source_text": str(text_file)},
+                source_path=text_file,
+                text=section_text,
+            ))
+        return PartPlan("statement", False, jobs, split_error)
+
+    jobs.append(_PartJob(
+        invoice_id=pdf_path.stem,
+        out_json=out_dir / f"{pdf_path.stem}.json" if write_artifacts else None,
+        source_invoice_id=None,
+        artifact={"pdf": str(pdf_path)},
+        # pdf_path may only name an in-memory document (pdf_doc); it is
+        # written there if the vision path needs a file.
+        source_path=pdf_path,
+        text=text,
+        part_doc=pdf_doc,
+    ))
+    return PartPlan("single", False, jobs, split_error)
+
+
+def process_one_pdf(
+    pipeline,
+    pdf_path: Path,
+    out_dir: Path,
+    *,
+    gcs_bucket: str,
+    gcs_path: str,
+    source_system: str,
+    bypass_cache: bool = False,
+    pdf_doc: Optional[PdfDocument] = None,
+    write_artifacts: bool = WRITE_ARTIFACTS,
+) -> None:
+    """
+    Run one PDF end to end.  `pipeline` is a pipeline.InvoicePipeline: it
+    owns the Supa client, OpenAI client and schema bundle, and every stage
+    runs in-process through it.  bypass_cache forces fresh LLM calls.
+
+    pdf_doc is the already-loaded document (e.g. downloaded into memory);
+    pdf_path then only names it and is written only if a vision extraction
+    needs the file.
+    """
+    supa: Supa = pipeline.supa
+    model = pipeline.model
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    if pdf_doc is None:
+        pdf_doc = pipeline.open_document(pdf_path)
+    text = pdf_doc.text()
+    invoice_ids = detect_invoice_ids(text)
+    maybe_statement, page_count = maybe_statement_gate(text, invoice_ids)
+
+    parser_version = os.getenv("PARSER_VERSION") or os.getenv("EXTRACTION_VERSION") or "0.1.0"
+
+    doc_row = {
+        "source_system": source_system,
+        "gcs_bucket": gcs_bucket,
+        "gcs_path": gcs_path,
+        "document_hash": pdf_doc.sha256,
+        "status": "processing",
+        "processing_started_at": utc_now_iso(),
+        "mode": "unknown",
+        "page_count": page_count,
+        "detected_invoice_ids": invoice_ids,
+    }
+    doc_row = scrub_obj(doc_row)
+    doc = supa.upsert_documents(doc_row)
+    document_id = doc["id"]
+
+    outputs: List[Dict[str, Any]] = []
+
+    plan = plan_parts(
+        pipeline, pdf_path, out_dir, pdf_doc, text, invoice_ids, maybe_statement, write_artifacts=write_artifacts,
+    )
+    mode = plan.mode
+    if plan.split_error is not None:
+        supa.insert_invoice_error({
+            "document_id": document_id,
+            "parsed_invoice_id": None,
+            "stage": "split",
+            "error_code": "SPLIT_FAILED",
+            "message": plan.split_error,
+            "details": {"pdf": str(pdf_path)},
+        })
+
     # Clear stale alerts before re-parsing — a DB trigger on parsed_invoices
     # auto-creates alert rows keyed on (rule_id, document_id). When splitting
     # produces multiple parsed_invoices per document, the second insert would
     # hit a unique constraint if stale alerts from a previous parse remain.
-    if did_split or len(text_sections) >= 2:
+    if len(plan.jobs) >= 2:
         try:
             supa._rest(
                 "DELETE",
@@ -1136,329 +1490,20 @@ def process_one_pdf(
             pass  # best-effort; alerts table may not exist in all envs
 
     try:
-        if did_split:
-            mode = "statement"
-            for part_pdf in part_pdfs:
-                out_json = out_dir / f"{part_pdf.stem}.json"
-
-                cmd = [
-                    "python3", "extract_invoice.py",
-                    "--pdf", str(part_pdf),
-                    "--out", str(out_json),
-                    "--schema", schema,
-                    "--model", model,
-                ]
-                if rescue:
-                    cmd.insert(2, "--rescue")
-                run(cmd)
-
-                raw = load_json_file(out_json)
-                raw["invoice_date"] = normalize_date_to_iso(raw.get("invoice_date"))
-                raw = scrub_obj(raw)
-                out_json.write_text(json.dumps(raw, indent=2), encoding="utf-8")
-
-                v = validate_json(out_json)
-                v = scrub_obj(v)
-
-                # Statement-safe stable logical invoice id
-                source_invoice_id = part_pdf.stem
-
-                inv_row, li_rows = normalize_rows(
-                    raw,
-                    document_id=document_id,
-                    parser_version=parser_version,
-                    model=model,
-                    validation=v,
-                    source_invoice_id=source_invoice_id,
-                )
-
-                inv_row = scrub_obj(inv_row)
-                li_rows = scrub_obj(li_rows)
-
-                # Clear latest for this logical invoice (prevents is_latest unique collisions)
-                _clear_latest_for_logical_invoice(
-                    supa,
-                    document_id=document_id,
-                    source_invoice_id=str(inv_row.get("source_invoice_id") or source_invoice_id),
-                )
-
-                parsed_invoice_id: Optional[str] = None
-                soft_dupes: List[Dict[str, Any]] = []
-                dup_of: Optional[str] = None
-
-                try:
-                    inv = supa.upsert_parsed_invoice(inv_row)
-                    parsed_invoice_id = inv["id"]
-
-                    for r in li_rows:
-                        r["parsed_invoice_id"] = parsed_invoice_id
-                    supa.replace_line_items(parsed_invoice_id, li_rows)
-
-                except DuplicateInvoiceError:
-                    # Business duplicate: fetch the existing invoice and record it; do NOT fail the statement
-                    existing = None
-                    try:
-                        existing = supa.find_existing_business_unique(
-                            vendor_name=str(inv_row.get("vendor_name") or ""),
-                            invoice_number=str(inv_row.get("invoice_number") or ""),
-                            total_amount=float(inv_row.get("total_amount") or inv_row.get("total") or 0),
-                        )
-                    except Exception:
-                        existing = None
-
-                    if existing:
-                        parsed_invoice_id = existing.get("id")
-                        dup_of = parsed_invoice_id
-
-                # Soft duplicate detection (best-effort) – skip if vendor is junk
-                try:
-                    soft_dupes = supa.find_soft_duplicate(
-                        vendor_name=inv_row.get("vendor_name"),
-                        invoice_date=inv_row.get("invoice_date"),
-                        invoice_number=inv_row.get("invoice_number"),
-                        total=float(inv_row.get("total") or 0) if inv_row.get("total") is not None else None,
-                    )
-                    if parsed_invoice_id:
-                        soft_dupes = [d for d in soft_dupes if d.get("id") != parsed_invoice_id]
-                except Exception:
-                    soft_dupes = []
-
-                outputs.append({
-                    "invoice_id": part_pdf.stem,
-                    "json": str(out_json),
-                    "pdf": str(part_pdf),
-                    "validation": v,
-                    "parsed_invoice_id": parsed_invoice_id,
-                    "source_invoice_id": source_invoice_id,
-                    "business_duplicate_of": dup_of,
-                    "soft_duplicates": soft_dupes[:3],
-                })
-
-                if parsed_invoice_id and (not v.get("validation_pass")):
-                    supa.insert_invoice_error({
-                        "document_id": document_id,
-                        "parsed_invoice_id": parsed_invoice_id,
-                        "stage": "validate",
-                        "error_code": "VALIDATION_FAILED",
-                        "message": "Invoice failed validation",
-                        "details": v,
-                    })
-
-        elif len(text_sections) >= 2:
-            # ----------------------------------------------------------
-            # Text-based statement splitting: extract each invoice section
-            # independently using the pre-extracted text. This handles
-            # multi-invoice-per-page PDFs (e.g. World Fuel consolidated
-            # statements) that page-level splitting cannot split.
-            # ----------------------------------------------------------
-            mode = "statement"
-            for inv_id, section_text in text_sections:
-                safe_id = re.sub(r"[^A-Za-z0-9._-]+", "_", inv_id or "UNKNOWN")
-                text_file = out_dir / f"section_{safe_id}.txt"
-                text_file.write_text(section_text, encoding="utf-8")
-                out_json = out_dir / f"{safe_id}.json"
-
-                cmd = [
-                    "python3", "extract_invoice.py",
-                    "--text_file", str(text_file),
-                    "--out", str(out_json),
-                    "--schema", schema,
-                    "--model", model,
-                ]
-                if rescue:
-                    cmd.insert(2, "--rescue")
-                run(cmd)
-
-                raw = load_json_file(out_json)
-                raw["invoice_date"] = normalize_date_to_iso(raw.get("invoice_date"))
-                raw = scrub_obj(raw)
-                out_json.write_text(json.dumps(raw, indent=2), encoding="utf-8")
-
-                v = validate_json(out_json)
-                v = scrub_obj(v)
-
-                source_invoice_id = inv_id
-
-                inv_row, li_rows = normalize_rows(
-                    raw,
-                    document_id=document_id,
-                    parser_version=parser_version,
-                    model=model,
-                    validation=v,
-                    source_invoice_id=source_invoice_id,
-                )
-
-                inv_row = scrub_obj(inv_row)
-                li_rows = scrub_obj(li_rows)
-
-                _clear_latest_for_logical_invoice(
-                    supa,
-                    document_id=document_id,
-                    source_invoice_id=str(inv_row.get("source_invoice_id") or source_invoice_id),
-                )
-
-                parsed_invoice_id: Optional[str] = None
-                soft_dupes: List[Dict[str, Any]] = []
-                dup_of: Optional[str] = None
-
-                try:
-                    inv = supa.upsert_parsed_invoice(inv_row)
-                    parsed_invoice_id = inv["id"]
-
-                    for r in li_rows:
-                        r["parsed_invoice_id"] = parsed_invoice_id
-                    supa.replace_line_items(parsed_invoice_id, li_rows)
-
-                except DuplicateInvoiceError:
-                    existing = None
-                    try:
-                        existing = supa.find_existing_business_unique(
-                            vendor_name=str(inv_row.get("vendor_name") or ""),
-                            invoice_number=str(inv_row.get("invoice_number") or ""),
-                            total_amount=float(inv_row.get("total_amount") or inv_row.get("total") or 0),
-                        )
-                    except Exception:
-                        existing = None
-
-                    if existing:
-                        parsed_invoice_id = existing.get("id")
-                        dup_of = parsed_invoice_id
-
-                try:
-                    soft_dupes = supa.find_soft_duplicate(
-                        vendor_name=inv_row.get("vendor_name"),
-                        invoice_date=inv_row.get("invoice_date"),
-                        invoice_number=inv_row.get("invoice_number"),
-                        total=float(inv_row.get("total") or 0) if inv_row.get("total") is not None else None,
-                    )
-                    if parsed_invoice_id:
-                        soft_dupes = [d for d in soft_dupes if d.get("id") != parsed_invoice_id]
-                except Exception:
-                    soft_dupes = []
-
-                outputs.append({
-                    "invoice_id": inv_id,
-                    "json": str(out_json),
-                    "source_text": str(text_file),
-                    "validation": v,
-                    "parsed_invoice_id": parsed_invoice_id,
-                    "source_invoice_id": source_invoice_id,
-                    "business_duplicate_of": dup_of,
-                    "soft_duplicates": soft_dupes[:3],
-                })
-
-                if parsed_invoice_id and (not v.get("validation_pass")):
-                    supa.insert_invoice_error({
-                        "document_id": document_id,
-                        "parsed_invoice_id": parsed_invoice_id,
-                        "stage": "validate",
-                        "error_code": "VALIDATION_FAILED",
-                        "message": "Invoice failed validation",
-                        "details": v,
-                    })
-
-        else:
-            out_json = out_dir / f"{pdf_path.stem}.json"
-            cmd = [
-                "python3", "extract_invoice.py",
-                "--pdf", str(pdf_path),
-                "--out", str(out_json),
-                "--schema", schema,
-                "--model", model,
-            ]
-            if rescue:
-                cmd.insert(2, "--rescue")
-            run(cmd)
-
-            raw = load_json_file(out_json)
-            raw["invoice_date"] = normalize_date_to_iso(raw.get("invoice_date"))
-            raw = scrub_obj(raw)
-            out_json.write_text(json.dumps(raw, indent=2), encoding="utf-8")
-
-            v = validate_json(out_json)
-            v = scrub_obj(v)
-
-            source_invoice_id = compute_source_invoice_id(raw, fallback=pdf_path.stem)
-
-            inv_row, li_rows = normalize_rows(
-                raw,
+        # Extract concurrently, then write the document's invoices as one
+        # batch (plan order kept, so duplicate handling matches a serial run).
+        results = pipeline.map_ordered([lambda j=j: _extract_part(pipeline, j, bypass_cache) for j in plan.jobs])
+        parts = [
+            _prepare_part(
+                job, raw, v,
                 document_id=document_id,
                 parser_version=parser_version,
                 model=model,
-                validation=v,
-                source_invoice_id=source_invoice_id,
-            )
-
-            inv_row = scrub_obj(inv_row)
-            li_rows = scrub_obj(li_rows)
-
-            _clear_latest_for_logical_invoice(
-                supa,
-                document_id=document_id,
-                source_invoice_id=str(inv_row.get("source_invoice_id") or source_invoice_id),
+                fallback_id=pdf_path.stem,
             )
-
-            parsed_invoice_id: Optional[str] = None
-            soft_dupes: List[Dict[str, Any]] = []
-            dup_of: Optional[str] = None
-
-            try:
-                inv = supa.upsert_parsed_invoice(inv_row)
-                parsed_invoice_id = inv["id"]
-
-                for r in li_rows:
-                    r["parsed_invoice_id"] = parsed_invoice_id
-                supa.replace_line_items(parsed_invoice_id, li_rows)
-
-            except DuplicateInvoiceError:
-                # Business duplicate: treat as success and link to existing record (best-effort)
-                existing = None
-                try:
-                    existing = supa.find_existing_business_unique(
-                        vendor_name=str(inv_row.get("vendor_name") or ""),
-                        invoice_number=str(inv_row.get("invoice_number") or ""),
-                        total_amount=float(inv_row.get("total_amount") or inv_row.get("total") or 0),
-                    )
-                except Exception:
-                    existing = None
-
-                if existing:
-                    parsed_invoice_id = existing.get("id")
-                    dup_of = parsed_invoice_id
-
-            # Soft duplicate detection (best-effort)
-            try:
-                soft_dupes = supa.find_soft_duplicate(
-                    vendor_name=inv_row.get("vendor_name"),
-                    invoice_date=inv_row.get("invoice_date"),
-                    invoice_number=inv_row.get("invoice_number"),
-                    total=float(inv_row.get("total") or 0) if inv_row.get("total") is not None else None,
-                )
-                if parsed_invoice_id:
-                    soft_dupes = [d for d in soft_dupes if d.get("id") != parsed_invoice_id]
-            except Exception:
-                soft_dupes = []
-
-            outputs.append({
-                "invoice_id": pdf_path.stem,
-                "json": str(out_json),
-                "pdf": str(pdf_path),
-                "validation": v,
-                "parsed_invoice_id": parsed_invoice_id,
-                "source_invoice_id": source_invoice_id,
-                "business_duplicate_of": dup_of,
-                "soft_duplicates": soft_dupes[:3],
-            })
-
-            if parsed_invoice_id and (not v.get("validation_pass")):
-                supa.insert_invoice_error({
-                    "document_id": document_id,
-                    "parsed_invoice_id": parsed_invoice_id,
-                    "stage": "validate",
-                    "error_code": "VALIDATION_FAILED",
-                    "message": "Invoice failed validation",
-                    "details": v,
-                })
+            for job, (raw, v) in zip(plan.jobs, results)
+        ]
+        outputs = _persist_parts(supa, parts, document_id=document_id)
 
         manifest_payload = {
             "input_pdf": str(pdf_path),
@@ -1467,7 +1512,8 @@ def process_one_pdf(
             "detected_invoice_ids": invoice_ids[:50],
             "outputs": outputs,
         }
-        write_manifest(out_dir, scrub_obj(manifest_payload))
+        if write_artifacts:
+            write_manifest(out_dir, scrub_obj(manifest_payload))
 
         needs_review = any(o.get("validation", {}).get("validation_pass") is False for o in outputs)
 
@@ -1517,6 +1563,7 @@ def main():
     ap.add_argument("--gcs_bucket", default="unknown")
     ap.add_argument("--gcs_path", default="")
     ap.add_argument("--source_system", default="gcs")
+    ap.add_argument("--force_extract", action="store_true", help="Ignore cached extractions (still refreshes them)")
     args = ap.parse_args()
 
     supa_url = os.getenv("SUPABASE_URL")
@@ -1524,23 +1571,29 @@ def main():
     if not supa_url or not supa_key:
         raise RuntimeError("Set SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY.")
 
-    supa = Supa(supa_url, supa_key)
+    # Imported here: pipeline imports this module.
+    from pipeline import InvoicePipeline
+
+    pipeline = InvoicePipeline(
+        Supa(supa_url, supa_key),
+        schema_path=args.schema,
+        model=args.model,
+        rescue=not args.no_rescue,
+    )
 
     pdf_path = Path(args.pdf)
     out_dir = Path(args.out_dir)
 
     gcs_path = args.gcs_path or pdf_path.name
 
-    process_one_pdf(
-        supa,
+    pipeline.process_pdf(
         pdf_path,
         out_dir,
-        schema=args.schema,
-        model=args.model,
-        rescue=not args.no_rescue,
         gcs_bucket=args.gcs_bucket,
         gcs_path=gcs_path,
         source_system=args.source_system,
+        bypass_cache=args.force_extract,
+        write_artifacts=True,
     )
 
 
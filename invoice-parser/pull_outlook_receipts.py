@@ -1,16 +1,24 @@
+import base64
 import os
 import requests
 import msal
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+
+from mailbox_sync import MailboxSync
 
 # ===== CONFIG =====
 CLIENT_ID = os.getenv("MS_CLIENT_ID", "")
 CLIENT_SECRET = os.getenv("MS_CLIENT_SECRET", "")
 TENANT_ID = os.getenv("MS_TENANT_ID", "")
+# App-only tokens can't use /me: name the mailbox to read.
+MAILBOX = os.getenv("RECEIPTS_MAILBOX", "")
 
 SAVE_DIR = "./outlook_receipts"
 os.makedirs(SAVE_DIR, exist_ok=True)
 
+if not MAILBOX:
+    raise Exception("Set RECEIPTS_MAILBOX")
+
 # ===== AUTH =====
 AUTHORITY = f"https://login.microsoftonline.com/{TENANT_ID}"
 SCOPES = ["https://graph.microsoft.com/.default"]
@@ -31,46 +39,38 @@ headers = {
     "Authorization": f"Bearer {token['access_token']}"
 }
 
-# ===== GET LAST 6 MONTHS EMAILS =====
-six_months_ago = (datetime.utcnow() - timedelta(days=180)).isoformat() + "Z"
-
-query = (
-    f"https://graph.microsoft.com/v1.0/me/messages?"
-    f"$filter=receivedDateTime ge {six_months_ago} "
-    f"and hasAttachments eq true"
-    f"&$select=id,subject,receivedDateTime,from"
-    f"&$top=100"
-)
+# ===== GET NEW EMAILS (first run: last 6 months) =====
+# Delta sync (mailbox_sync.py): later runs only see messages that arrived
+# or changed since the last one.
+six_months_ago = datetime.now(timezone.utc) - timedelta(days=180)
 
 print("Pulling emails...")
 
-while query:
-    res = requests.get(query, headers=headers)
-    data = res.json()
-
-    for message in data.get("value", []):
-        msg_id = message["id"]
-        subject = message.get("subject", "no_subject")
+sync = MailboxSync(MAILBOX, "Inbox", consumer="pull_outlook_receipts", select="id,subject,receivedDateTime,from,hasAttachments")
+batch = sync.fetch(token["access_token"], initial_since=six_months_ago)
 
-        attach_url = f"https://graph.microsoft.com/v1.0/me/messages/{msg_id}/attachments"
-        attach_res = requests.get(attach_url, headers=headers)
-        attachments = attach_res.json().get("value", [])
+for message in batch.messages:
+    if not message.get("hasAttachments"):
+        continue
+    msg_id = message["id"]
+    subject = message.get("subject", "no_subject")
 
-        for att in attachments:
-            if att["@odata.type"] == "#microsoft.graph.fileAttachment":
-                name = att["name"]
-                if name.lower().endswith(".pdf"):
-                    content = att["contentBytes"]
-                    file_path = os.path.join(SAVE_DIR, name)
+    attach_url = f"https://graph.microsoft.com/v1.0/users/{MAILBOX}/messages/{msg_id}/attachments"
+    attach_res = requests.get(attach_url, headers=headers)
+    attachments = attach_res.json().get("value", [])
 
-                    with open(file_path, "wb") as f:
-                        f.write(
-                            requests.utils.unquote_to_bytes(content)
-                        )
+    for att in attachments:
+        if att["@odata.type"] == "#microsoft.graph.fileAttachment":
+            name = att["name"]
+            if name.lower().endswith(".pdf"):
+                content = att["contentBytes"]
+                file_path = os.path.join(SAVE_DIR, name)
 
-                    print("Saved:", name)
+                with open(file_path, "wb") as f:
+                    f.write(base64.b64decode(content))
 
-    query = data.get("@odata.nextLink")
+                print("Saved:", name)
 
-print("Done.")
+batch.commit()
 
+print("Done.", batch.summary())
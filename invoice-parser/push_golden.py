@@ -31,13 +31,23 @@ async def parse_doc(document_id: str):
         r.raise_for_status()
         return r.json()
 
-async def main(folder: str):
+async def submit_batch(document_ids):
+    """Queue documents for offline batch extraction instead of parsing inline."""
+    parser_base = os.environ["PARSER_BASE_URL"].rstrip("/")
+    url = f"{parser_base}/jobs/batch_extract/submit"
+    async with httpx.AsyncClient(timeout=900) as client:
+        r = await client.post(url, params={"document_ids": ",".join(document_ids), "limit": len(document_ids)})
+        r.raise_for_status()
+        return r.json()
+
+async def main(folder: str, batch: bool = False):
     supa = create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_SERVICE_ROLE_KEY"])
 
     p = pathlib.Path(folder)
     files = [f for f in p.glob("**/*") if f.is_file() and f.suffix.lower() in ALLOWED_EXTS]
 
     print(f"Found {len(files)} files")
+    doc_ids = []
 
     for f in files:
         content = f.read_bytes()
@@ -77,6 +87,10 @@ async def main(folder: str):
 
         print(f"{'Inserted' if inserted else 'Exists'}: {f.name} -> {doc_id}")
 
+        if batch:
+            doc_ids.append(doc_id)
+            continue
+
         # Parse
         try:
             out = await parse_doc(doc_id)
@@ -86,7 +100,13 @@ async def main(folder: str):
             supa.table("documents").update({"status": "failed", "parse_error": str(e)}).eq("id", doc_id).execute()
             print(f"Parse FAIL: {f.name}: {e}")
 
+    if batch and doc_ids:
+        out = await submit_batch(doc_ids)
+        print(f"Batch submitted: {out.get('batch')} ({out.get('requests')} requests); "
+              f"finish with /jobs/batch_extract/reconcile")
+
 if __name__ == "__main__":
     import sys
-    folder = sys.argv[1] if len(sys.argv) > 1 else "golden_pdfs"
-    asyncio.run(main(folder))
+    args = [a for a in sys.argv[1:] if a != "--batch"]
+    folder = args[0] if args else "golden_pdfs"
+    asyncio.run(main(folder, batch="--batch" in sys.argv[1:]))
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+bench_pipeline.py
+
+Wall-time comparison: legacy subprocess chain vs in-process InvoicePipeline.
+
+Both modes run split -> extract -> validate on the same PDFs against a
+local fake OpenAI server (scripts/fake_openai.py), so the numbers measure
+interpreter/import/temp-file overhead rather than model latency.  Nothing
+is written to Supabase.
+
+  cd invoice-parser
+  python scripts/bench_pipeline.py path/to/statements/*.pdf
+  python scripts/bench_pipeline.py --latency_ms 500 --repeat 3 a.pdf b.pdf
+  python scripts/bench_pipeline.py --skip_legacy --latency_ms 1500 --concurrency 6 statement.pdf
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+HERE = Path(__file__).resolve().parent
+PARSER_DIR = HERE.parent
+sys.path.insert(0, str(PARSER_DIR))
+sys.path.insert(0, str(HERE))
+
+from fake_openai import start_fake_openai  # noqa: E402
+
+
+def run_legacy(pdf: Path, work: Path, schema: str, model: str, rescue: bool) -> int:
+    """Mirror of the old process_pdf.py: one python3 per stage / per part."""
+    split_dir = work / "split"
+    split_dir.mkdir(parents=True, exist_ok=True)
+    subprocess.check_call(
+        ["python3", "split_statement.py", "--pdf", str(pdf), "--out_dir", str(split_dir),
+         "--manifest", str(work / "split_manifest.json")],
+        cwd=PARSER_DIR, stdout=subprocess.DEVNULL,
+    )
+    parts = sorted(split_dir.glob("*.pdf"))
+    if len(parts) < 2:
+        parts = [pdf]
+
+    for part in parts:
+        out_json = work / f"{part.stem}.json"
+        cmd = ["python3", "extract_invoice.py", "--pdf", str(part), "--out", str(out_json),
+               "--schema", schema, "--model", model]
+        if rescue:
+            cmd.insert(2, "--rescue")
+        subprocess.check_call(cmd, cwd=PARSER_DIR, stdout=subprocess.DEVNULL)
+        subprocess.check_output(["python3", "validate_invoice.py", "--infile", str(out_json)],
+                                cwd=PARSER_DIR, text=True)
+    return len(parts)
+
+
+def run_inprocess(pipeline, pdf: Path, work: Path) -> int:
+    split_dir = work / "split"
+    split_dir.mkdir(parents=True, exist_ok=True)
+    doc = pipeline.open_document(pdf)
+    rows = pipeline.split(pdf, split_dir, doc=doc)
+    if len(rows) < 2:
+        parts = [(pdf, doc)]
+    else:
+        parts = [(Path(r["out_pdf"]), doc.subset(range(r["page_start"] - 1, r["page_end"]))) for r in rows]
+
+    fns = [lambda p=part, d=part_doc: pipeline.validate(pipeline.extract_pdf(p, pdf_text=d.text()))
+           for part, part_doc in parts]
+    for _ in pipeline.map_ordered(fns):
+        pass
+    return len(parts)
+
+
+def _fmt(samples: List[float]) -> str:
+    samples = sorted(samples)
+    mid = samples[len(samples) // 2]
+    return f"median={mid:7.3f}s  min={samples[0]:7.3f}s  max={samples[-1]:7.3f}s"
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("pdfs", nargs="+")
+    ap.add_argument("--repeat", type=int, default=1)
+    ap.add_argument("--latency_ms", type=int, default=0, help="Artificial model latency in the fake server")
+    ap.add_argument("--schema", default="schemas/invoice.schema.json")
+    ap.add_argument("--model", default="gpt-4o-mini")
+    ap.add_argument("--no_rescue", action="store_true")
+    ap.add_argument("--skip_legacy", action="store_true")
+    ap.add_argument("--concurrency", type=int, default=1, help="In-process per-part extraction concurrency")
+    args = ap.parse_args()
+
+    server, base_url = start_fake_openai(latency_ms=args.latency_ms)
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "bench-fake-key")
+    os.chdir(PARSER_DIR)
+
+    pdfs = [Path(p).resolve() for p in args.pdfs]
+    rescue = not args.no_rescue
+    timings: Dict[str, List[float]] = {"legacy": [], "inprocess": []}
+    parts_total = 0
+
+    # Import cost is paid once per process in the new engine; count it.
+    t0 = time.perf_counter()
+    from pipeline import InvoicePipeline
+    pipeline = InvoicePipeline(
+        None, schema_path=args.schema, model=args.model, rescue=rescue, extract_concurrency=args.concurrency,
+    )
+    startup = time.perf_counter() - t0
+
+    for _ in range(args.repeat):
+        for pdf in pdfs:
+            if not args.skip_legacy:
+                with tempfile.TemporaryDirectory() as td:
+                    t = time.perf_counter()
+                    run_legacy(pdf, Path(td), args.schema, args.model, rescue)
+                    timings["legacy"].append(time.perf_counter() - t)
+
+            with tempfile.TemporaryDirectory() as td:
+                t = time.perf_counter()
+                parts_total += run_inprocess(pipeline, pdf, Path(td))
+                timings["inprocess"].append(time.perf_counter() - t)
+
+    server.shutdown()
+
+    print(f"documents={len(pdfs)} repeat={args.repeat} parts={parts_total} "
+          f"latency_ms={args.latency_ms} concurrency={args.concurrency}")
+    print(f"in-process startup (imports + schema load): {startup:.3f}s")
+    for mode, samples in timings.items():
+        if samples:
+            print(f"{mode:>10} per document: {_fmt(samples)}")
+    if timings["legacy"] and timings["inprocess"]:
+        legacy = sum(timings["legacy"])
+        inproc = sum(timings["inprocess"]) + startup
+        print(json.dumps({
+            "legacy_total_s": round(legacy, 3),
+            "inprocess_total_s": round(inproc, 3),
+            "speedup": round(legacy / inproc, 2) if inproc else None,
+        }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+bench_scanner.py
+
+Microbenchmark: id_scanner token stream vs the per-regex detection it
+replaced (frozen copies in test_id_scanner.py) on synthetic World Fuel
+statement texts.
+
+"statement" runs what process_pdf does on one document's text:
+detect_invoice_ids, split_text_into_sections, an airport sub-split per
+section and the full-text airport fallback.  "pages" runs both page-ID
+functions over every page.  The scan memo is cleared before each new-path
+run so every timing includes the scan itself.
+
+  cd invoice-parser
+  python scripts/bench_scanner.py
+  python scripts/bench_scanner.py --invoices 50 500 2000 --repeat 5
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+import id_scanner  # noqa: E402
+import test_id_scanner as legacy  # noqa: E402
+from extract_invoice import extract_invoice_id_from_page  # noqa: E402
+from process_pdf import _subsplit_by_airport, detect_invoice_ids, split_text_into_sections  # noqa: E402
+from split_statement import page_invoice_id  # noqa: E402
+
+
+def statement_legacy(text: str) -> None:
+    legacy.legacy_detect_invoice_ids(text)
+    for inv_id, section in legacy.legacy_split_text_into_sections(text):
+        legacy.legacy_subsplit_by_airport(section, inv_id)
+    legacy.legacy_subsplit_by_airport(text, "doc")
+
+
+def statement_scanner(text: str) -> None:
+    id_scanner._scan_cache.clear()
+    detect_invoice_ids(text)
+    for inv_id, section in split_text_into_sections(text):
+        _subsplit_by_airport(section, inv_id)
+    _subsplit_by_airport(text, "doc")
+
+
+def pages_legacy(pages: List[str]) -> None:
+    for p in pages:
+        legacy.legacy_page_invoice_id(p)
+        legacy.legacy_extract_invoice_id_from_page(p)
+
+
+def pages_scanner(pages: List[str]) -> None:
+    id_scanner._scan_cache.clear()
+    for p in pages:
+        page_invoice_id(p)
+        extract_invoice_id_from_page(p)
+
+
+def best_of(fn: Callable[[], None], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--invoices", type=int, nargs="+", default=[20, 200, 1000])
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    print(f"{'invoices':>8} {'chars':>9} {'case':>10} {'legacy_ms':>10} {'scanner_ms':>11} {'speedup':>8}")
+    for n in args.invoices:
+        text = legacy.make_statement_text(n, seed=n)
+        pages = text.split("\n--- PAGE ")
+        cases = [
+            ("statement", lambda: statement_legacy(text), lambda: statement_scanner(text)),
+            ("pages", lambda: pages_legacy(pages), lambda: pages_scanner(pages)),
+        ]
+        for name, old, new in cases:
+            t_old = best_of(old, args.repeat)
+            t_new = best_of(new, args.repeat)
+            print(f"{n:>8} {len(text):>9} {name:>10} {t_old * 1000:>10.1f} {t_new * 1000:>11.1f} {t_old / t_new:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
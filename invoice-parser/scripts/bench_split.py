@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+bench_split.py
+
+Wall time and peak Python memory (tracemalloc) of the page-level statement
+split on real PDFs:
+
+  eager   split_pdf_by_invoice, then one part PDF per group (the old
+          write_groups: every group computed before the first write)
+  stream  iter_write_groups: each part PDF written as its group closes
+  text    iter_write_groups(write_pdfs=False): page groups only, which is
+          all plan_parts needs unless a part goes to the vision path
+
+Each run opens the file fresh and clears the page-text cache, so text
+extraction is included.  Time and peak come from separate runs.
+--with_text also builds every part's layout text (what plan_parts hands
+the extractor).
+
+  cd invoice-parser
+  python scripts/bench_split.py statement.pdf
+  python scripts/bench_split.py --repeat 3 --with_text a.pdf b.pdf
+"""
+
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, Tuple
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+import pdf_document  # noqa: E402
+import split_statement  # noqa: E402
+from pdf_document import PdfDocument  # noqa: E402
+
+
+def run_eager(pdf: Path, out_dir: str, with_text: bool) -> int:
+    doc = PdfDocument.open(pdf)
+    groups = split_statement.split_pdf_by_invoice(str(pdf), doc=doc)
+    for g in groups:
+        safe_id = re.sub(r"[^A-Za-z0-9._-]+", "_", g["invoice_id"] or "UNKNOWN")
+        part = doc.subset(g["pages"])
+        part.write(os.path.join(out_dir, f"{safe_id}.pdf"))
+        if with_text:
+            part.text()
+    return len(groups)
+
+
+def run_stream(pdf: Path, out_dir: str, with_text: bool, write_pdfs: bool) -> int:
+    doc = PdfDocument.open(pdf)
+    n = 0
+    for row in split_statement.iter_write_groups(doc, out_dir, write_pdfs=write_pdfs):
+        if with_text:
+            doc.subset(range(row["page_start"] - 1, row["page_end"])).text()
+        n += 1
+    return n
+
+
+def _fresh_run(fn: Callable[[str], int]) -> int:
+    with pdf_document._page_cache_lock:
+        pdf_document._page_cache.clear()
+    with tempfile.TemporaryDirectory() as td:
+        return fn(td)
+
+
+def measure(fn: Callable[[str], int]) -> Tuple[float, int, int]:
+    """(seconds, peak bytes, parts).  Timed untraced; tracemalloc slows pypdf several-fold."""
+    t = time.perf_counter()
+    parts = _fresh_run(fn)
+    elapsed = time.perf_counter() - t
+    tracemalloc.start()
+    _fresh_run(fn)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, parts
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("pdfs", nargs="+")
+    ap.add_argument("--repeat", type=int, default=1)
+    ap.add_argument("--with_text", action="store_true", help="Also build each part's layout text")
+    args = ap.parse_args()
+
+    modes: Dict[str, Callable[[Path, str], int]] = {
+        "eager": lambda p, d: run_eager(p, d, args.with_text),
+        "stream": lambda p, d: run_stream(p, d, args.with_text, write_pdfs=True),
+        "text": lambda p, d: run_stream(p, d, args.with_text, write_pdfs=False),
+    }
+
+    print(f"{'pdf':<28} {'pages':>5} {'parts':>5} {'mode':>7} {'seconds':>8} {'peak_mb':>8}")
+    for pdf in (Path(p).resolve() for p in args.pdfs):
+        pages = PdfDocument.open(pdf).page_count
+        for mode, fn in modes.items():
+            best_s, best_peak, parts = float("inf"), 0, 0
+            for _ in range(args.repeat):
+                s, peak, parts = measure(lambda d: fn(pdf, d))
+                best_s = min(best_s, s)
+                best_peak = max(best_peak, peak)
+            print(f"{pdf.name[-28:]:<28} {pages:>5} {parts:>5} {mode:>7} {best_s:>8.3f} {best_peak / 1e6:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
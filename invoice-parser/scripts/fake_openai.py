@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+fake_openai.py
+
+Tiny stand-in for the OpenAI HTTP API used by the parser benchmarks.
+Answers POST /v1/responses and POST /v1/chat/completions with a canned
+invoice extraction, after an optional artificial latency.
+
+  python scripts/fake_openai.py --port 8765 --latency_ms 800
+  OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=fake python process_pdf.py ...
+
+Can also be started in-process with start_fake_openai().
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+
+CANNED_EXTRACTION: Dict[str, Any] = {
+    "vendor": {"name": "Benchmark Fuel Co", "raw_name": "Benchmark Fuel Co", "fuel_vendor": None},
+    "invoice_number": "BENCH-0001",
+    "invoice_date": "2026-03-10",
+    "due_date": None,
+    "tail_number": "N100BK",
+    "airport_code": "TEB",
+    "currency": "USD",
+    "totals": {
+        "subtotal": 1000.0,
+        "sales_tax": None,
+        "fuel_tax": None,
+        "handling_fee": None,
+        "total_amount": 1000.0,
+        "amount_paid": None,
+        "payment_method": None,
+    },
+    "line_items": [
+        {
+            "description": "Jet A",
+            "category": "fuel",
+            "quantity": 200.0,
+            "uom": "USG",
+            "unit_price": 5.0,
+            "tax": None,
+            "total": 1000.0,
+        }
+    ],
+    "warnings": [],
+}
+
+
+def _responses_body(text: str) -> Dict[str, Any]:
+    return {
+        "id": "resp_fake",
+        "object": "response",
+        "created_at": int(time.time()),
+        "status": "completed",
+        "model": "fake",
+        "output": [
+            {
+                "type": "message",
+                "id": "msg_fake",
+                "role": "assistant",
+                "status": "completed",
+                "content": [{"type": "output_text", "text": text, "annotations": []}],
+            }
+        ],
+        "parallel_tool_calls": False,
+        "tool_choice": "auto",
+        "tools": [],
+    }
+
+
+def _chat_body(text: str) -> Dict[str, Any]:
+    return {
+        "id": "chatcmpl_fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": "fake",
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": text},
+            }
+        ],
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    latency_s: float = 0.0
+    rate_limit_every: int = 0
+    _counter = 0
+    _lock = threading.Lock()
+
+    def log_message(self, *args: Any) -> None:  # keep benchmark output clean
+        return
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+
+        with _Handler._lock:
+            _Handler._counter += 1
+            n = _Handler._counter
+
+        if self.rate_limit_every and n % self.rate_limit_every == 0:
+            self._send(429, {"error": {"message": "Rate limit reached", "type": "requests"}}, {"retry-after-ms": "200"})
+            return
+
+        if self.latency_s:
+            time.sleep(self.latency_s)
+
+        text = json.dumps(CANNED_EXTRACTION)
+        if self.path.rstrip("/").endswith("/responses"):
+            self._send(200, _responses_body(text))
+        elif self.path.rstrip("/").endswith("/chat/completions"):
+            self._send(200, _chat_body(text))
+        else:
+            self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+
+    def _send(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_fake_openai(
+    port: int = 0,
+    *,
+    latency_ms: int = 0,
+    rate_limit_every: int = 0,
+) -> Tuple[ThreadingHTTPServer, str]:
+    """Start the fake server on a daemon thread. Returns (server, base_url)."""
+    handler = type(
+        "FakeOpenAIHandler",
+        (_Handler,),
+        {"latency_s": latency_ms / 1000.0, "rate_limit_every": rate_limit_every},
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, real_port = server.server_address[:2]
+    return server, f"http://{host}:{real_port}/v1"
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency_ms", type=int, default=0)
+    ap.add_argument("--rate_limit_every", type=int, default=0, help="Return 429 on every Nth request (0 = never)")
+    args = ap.parse_args()
+
+    server, base_url = start_fake_openai(
+        args.port, latency_ms=args.latency_ms, rate_limit_every=args.rate_limit_every,
+    )
+    print(f"fake OpenAI listening on {base_url}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,12 @@
 #!/usr/bin/env python3
 import argparse, os, re, json
-from typing import List, Dict, Any, Optional
-from pypdf import PdfReader, PdfWriter
+from typing import List, Dict, Any, Iterator, Optional
+from id_scanner import PAGE
+from pdf_document import PdfDocument
 
-REF_RE = re.compile(r"\bRef Number\s+([A-Z0-9-]+)\b", re.IGNORECASE)
-INV_RE = re.compile(r"\bInvoice\s+(?:No\.?|Number)?\s*[:#]?\s*([A-Z0-9-]+)\b", re.IGNORECASE)
-CREDIT_RE = re.compile(r"\bCredit Memo No\.?\s*[:#]?\s*([A-Z0-9-]+)\b", re.IGNORECASE)
-FUEL_TICKET_RE = re.compile(r"\bFUEL\s+TICKET\s+(\d{4,})\b", re.IGNORECASE)
-
-# World Fuel invoice numbers: 8+ digits hyphen 4-5 digits (e.g. 27379628-21101)
-WF_INV_RE = re.compile(r"\b(\d{8,}-\d{4,5})\b")
-
-# World Fuel fuel ticket: header "FUEL TICKET" on one line, number on next line
-# (pypdf may put them on the same or separate lines; date like 16-MAR-2026 may precede)
-WF_FUEL_TICKET_RE = re.compile(
-    r"FUEL\s+TICKET\b[^\n]*\n\s*(?:\d{1,2}-[A-Z]{3}-\d{4}\s+)?(\d{5,7})\b", re.IGNORECASE
-)
+# Page ID rules, in priority order: id_scanner.PAGE_ID_KINDS (World Fuel
+# invoice number, fuel ticket, next-line fuel ticket, Ref Number, Credit
+# Memo No, Invoice).
 
 # IDs that are clearly column headers / labels, not real invoice numbers
 _BAD_PAGE_ID = re.compile(
@@ -27,72 +18,74 @@ _BAD_PAGE_ID = re.compile(
 )
 
 def page_invoice_id(text: str) -> Optional[str]:
-    for rx in (WF_INV_RE, FUEL_TICKET_RE, WF_FUEL_TICKET_RE, REF_RE, CREDIT_RE, INV_RE):
-        m = rx.search(text or "")
-        if m:
-            val = m.group(1).strip()
-            if not _BAD_PAGE_ID.match(val):
-                return val
+    for t in PAGE.firsts(text):
+        val = t.value.strip()
+        if not _BAD_PAGE_ID.match(val):
+            return val
     return None
 
-def split_pdf_by_invoice(pdf_path: str) -> List[Dict[str, Any]]:
-    r = PdfReader(pdf_path)
-    groups: List[Dict[str, Any]] = []
+def iter_page_groups(doc: PdfDocument) -> Iterator[Dict[str, Any]]:
+    """Yield {"invoice_id", "pages"} groups in page order, each as soon as the next ID starts."""
     current_id = None
     current_pages: List[int] = []
 
-    for i, pg in enumerate(r.pages):
-        t = pg.extract_text() or ""
-        inv_id = page_invoice_id(t)
+    for i in range(doc.page_count):
+        inv_id = page_invoice_id(doc.plain_page(i))
 
         if inv_id and inv_id != current_id:
             if current_pages:
-                groups.append({"invoice_id": current_id or "UNKNOWN", "pages": current_pages})
+                yield {"invoice_id": current_id or "UNKNOWN", "pages": current_pages}
             current_id = inv_id
             current_pages = [i]
         else:
             current_pages.append(i)
 
     if current_pages:
-        groups.append({"invoice_id": current_id or "UNKNOWN", "pages": current_pages})
-    return groups
-
-def write_groups(pdf_path: str, out_dir: str) -> List[Dict[str, Any]]:
-    os.makedirs(out_dir, exist_ok=True)
-    r = PdfReader(pdf_path)
-    groups = split_pdf_by_invoice(pdf_path)
-    outputs = []
-
-    for g in groups:
+        yield {"invoice_id": current_id or "UNKNOWN", "pages": current_pages}
+
+def split_pdf_by_invoice(pdf_path: str, doc: Optional[PdfDocument] = None) -> List[Dict[str, Any]]:
+    return list(iter_page_groups(doc or PdfDocument.open(pdf_path)))
+
+def iter_write_groups(doc: PdfDocument, out_dir: str, write_pdfs: bool = True) -> Iterator[Dict[str, Any]]:
+    """
+    Stream groups as manifest rows.  Each part PDF is written when its group
+    closes, before the next page is read; with write_pdfs=False nothing is
+    written and out_pdf is where the part would go (doc.subset(pages).write()).
+    """
+    for g in iter_page_groups(doc):
         inv_id = g["invoice_id"]
         pages = g["pages"]
-        w = PdfWriter()
-        for p in pages:
-            w.add_page(r.pages[p])
 
         safe_id = re.sub(r"[^A-Za-z0-9._-]+", "_", inv_id or "UNKNOWN")
         out_pdf = os.path.join(out_dir, f"{safe_id}.pdf")
-        with open(out_pdf, "wb") as f:
-            w.write(f)
+        if write_pdfs:
+            doc.subset(pages).write(out_pdf)
 
-        outputs.append({
+        yield {
             "invoice_id": inv_id,
             "out_pdf": out_pdf,
             "page_start": pages[0] + 1,
             "page_end": pages[-1] + 1,
             "num_pages": len(pages),
-        })
+            "written": write_pdfs,
+        }
 
-    return outputs
+def write_groups(
+    pdf_path: str, out_dir: str, doc: Optional[PdfDocument] = None, write_pdfs: bool = True,
+) -> List[Dict[str, Any]]:
+    os.makedirs(out_dir, exist_ok=True)
+    doc = doc or PdfDocument.open(pdf_path)
+    return list(iter_write_groups(doc, out_dir, write_pdfs=write_pdfs))
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--pdf", required=True)
     ap.add_argument("--out_dir", default="./split_out")
     ap.add_argument("--manifest", default=None)
+    ap.add_argument("--no_pdfs", action="store_true", help="Only report page groups; don't write part PDFs")
     args = ap.parse_args()
 
-    res = write_groups(args.pdf, args.out_dir)
+    res = write_groups(args.pdf, args.out_dir, write_pdfs=not args.no_pdfs)
 
     if args.manifest:
         with open(args.manifest, "w", encoding="utf-8") as f:
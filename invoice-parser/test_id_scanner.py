@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Golden equivalence: id_scanner-backed detection vs the per-regex
+implementations it replaced (frozen copies below).
+
+  python test_id_scanner.py       # or: python -m pytest test_id_scanner.py
+"""
+
+import random
+import re
+from typing import List, Optional, Tuple
+
+import id_scanner
+import process_pdf
+import split_statement
+import extract_invoice
+
+
+# ============================================================
+# Frozen pre-scanner implementations
+# ============================================================
+
+_INV_PATTERNS = [
+    re.compile(r"\b(\d{8,}-\d{4,5})\b"),
+    re.compile(r"\bFUEL\s+TICKET\s+(\d{4,})\b", re.I),
+    re.compile(r"FUEL\s+TICKET\b[^\n]*\n\s*(?:\d{1,2}-[A-Z]{3}-\d{4}\s+)?(\d{5,7})\b", re.I),
+    re.compile(r"\bRef Number\s+([A-Z0-9-]{6,})\b", re.I),
+    re.compile(r"\bInvoice\s+(?:No\.?|#|Number)?\s*([A-Z0-9-]{3,})\b", re.I),
+    re.compile(r"\bCredit Memo No\.?:\s*([A-Z0-9-]{3,})\b", re.I),
+    re.compile(r"\bINV\d{6,}\b", re.I),
+]
+_SECTION_BOUNDARY_PATTERNS = [
+    re.compile(r"\b(\d{8,}-\d{4,5})\b"),
+    re.compile(r"\bFUEL\s+TICKET\s+(\d{4,})\b", re.I),
+    re.compile(r"\bRef Number\s+([A-Z0-9][A-Z0-9-]*)\b", re.I),
+    re.compile(r"\bInvoice\s+(?:No\.?|#|Number)\s*:?\s*([A-Z0-9][A-Z0-9-]{2,})\b", re.I),
+    re.compile(r"\bCredit Memo\s+(?:No\.?|#|Number)\s*:?\s*([A-Z0-9][A-Z0-9-]{2,})\b", re.I),
+    re.compile(r"\b(INV\d{6,})\b", re.I),
+]
+_RECEIPT_LINE_RE = re.compile(r"^\s{0,20}(\d{7,9})\b", re.MULTILINE)
+_MASTER_REF_RE = re.compile(r"REF\s+(?:NO|NUMBER)\s*:?\s*(\d+)", re.I)
+_AIRPORT_FUEL_RE = re.compile(
+    r"^([A-Z0-9]{3,4})[\s\-]+"
+    r"(?:JET[\s-]*(?:FUEL|A)|AVGAS|100LL|FUEL\b|IP[\s\-]|FSII|FLOW[\s-]*FEE|INTO[\s-]*PLANE|AVFLIGHT)",
+    re.I | re.M,
+)
+_TRAILING_AIRPORT_RE = re.compile(
+    r"(?:THRU\s*PUT|FLOW\s*FEE|FSII|INTO[\s-]*PLANE|FUEL\s*TAX|EXCISE\s*TAX|"
+    r"KEROSENE|LUST\s*TAX|SUPERFUND|STORAGE\s*(?:TK\s*)?FEE|PROTECTION|WATER\s*QUALITY)"
+    r"\s*[\-]?\s*([A-Z]{3})\b",
+    re.I | re.M,
+)
+_PAGE_PATTERNS = [
+    re.compile(r"\b(\d{8,}-\d{4,5})\b"),
+    re.compile(r"\bFUEL\s+TICKET\s+(\d{4,})\b", re.IGNORECASE),
+    re.compile(r"FUEL\s+TICKET\b[^\n]*\n\s*(?:\d{1,2}-[A-Z]{3}-\d{4}\s+)?(\d{5,7})\b", re.IGNORECASE),
+    re.compile(r"\bRef Number\s+([A-Z0-9-]+)\b", re.IGNORECASE),
+    re.compile(r"\bCredit Memo No\.?\s*[:#]?\s*([A-Z0-9-]+)\b", re.IGNORECASE),
+    re.compile(r"\bInvoice\s+(?:No\.?|Number)?\s*[:#]?\s*([A-Z0-9-]+)\b", re.IGNORECASE),
+]
+_CHUNK_PATTERNS = [
+    re.compile(r"\bRef Number\s+([A-Z0-9\-]+)\b", re.IGNORECASE),
+    re.compile(r"\bInvoice\s+([A-Z0-9\-]+)\b", re.IGNORECASE),
+    re.compile(r"\bInvoice\s*No\.?:?\s*([A-Z0-9\-]+)\b", re.IGNORECASE),
+    re.compile(r"\bCREDIT MEMO NUMBER:\s*([A-Z0-9\-]+)\b", re.IGNORECASE),
+    re.compile(r"\bCredit Memo No\.?:?\s*([A-Z0-9\-]+)\b", re.IGNORECASE),
+]
+_BAD_CHUNK_ID = re.compile(
+    r"^(?:PAGE|DATE|CUSTOMER|TOTAL|USD|NUMBER|NUMBERS|INVOICE|PERIOD|DETAIL|SUMMARY|REPORT|BALANCE|STATEMENT)$",
+    re.IGNORECASE,
+)
+
+
+def legacy_detect_invoice_ids(text: str) -> List[str]:
+    ids = set()
+    for pat in _INV_PATTERNS:
+        for m in pat.finditer(text or ""):
+            val = m.group(1) if m.groups() else m.group(0)
+            if process_pdf._BAD_INV_ID.match(val):
+                continue
+            if process_pdf._is_cc_invoice(text, m.start()):
+                continue
+            ids.add(val)
+    if process_pdf.is_avfuel_activity_invoice(text or ""):
+        master_ref = None
+        m_ref = _MASTER_REF_RE.search(text or "")
+        if m_ref:
+            master_ref = m_ref.group(1)
+        for m in _RECEIPT_LINE_RE.finditer(text or ""):
+            if master_ref and m.group(1) == master_ref:
+                continue
+            ids.add(m.group(1))
+    return sorted(ids)
+
+
+def _line_start(text: str, pos: int) -> int:
+    i = text.rfind("\n", 0, pos)
+    return 0 if i < 0 else i + 1
+
+
+def legacy_split_text_into_sections(text: str) -> List[Tuple[str, str]]:
+    matches: List[Tuple[int, str]] = []
+    for pat in _SECTION_BOUNDARY_PATTERNS:
+        for m in pat.finditer(text or ""):
+            inv_id = (m.group(1) if m.groups() else m.group(0)).strip()
+            if not inv_id or len(inv_id) < 3:
+                continue
+            if process_pdf._BAD_SECTION_ID.match(inv_id):
+                continue
+            if process_pdf._is_cc_invoice(text, m.start()):
+                continue
+            matches.append((_line_start(text, m.start()), inv_id))
+    if not matches:
+        return []
+    matches.sort(key=lambda x: x[0])
+    deduped = [matches[0]]
+    for pos, inv_id in matches[1:]:
+        if inv_id != deduped[-1][1]:
+            deduped.append((pos, inv_id))
+    if len(deduped) < 2:
+        return []
+    sections = []
+    for i, (pos, inv_id) in enumerate(deduped):
+        end_pos = deduped[i + 1][0] if i + 1 < len(deduped) else len(text)
+        section_text = text[pos:end_pos].strip()
+        if section_text:
+            sections.append((inv_id, section_text))
+    return sections
+
+
+def legacy_subsplit_by_airport(section_text: str, parent_id: str) -> List[Tuple[str, str]]:
+    matches: List[Tuple[int, str]] = []
+    for m in _AIRPORT_FUEL_RE.finditer(section_text or ""):
+        matches.append((_line_start(section_text, m.start()), m.group(1).upper()))
+    if not matches:
+        for m in _TRAILING_AIRPORT_RE.finditer(section_text or ""):
+            matches.append((_line_start(section_text, m.start()), m.group(1).upper()))
+    if not matches:
+        return []
+    matches.sort(key=lambda x: x[0])
+    deduped = [matches[0]]
+    for pos, code in matches[1:]:
+        if code != deduped[-1][1]:
+            deduped.append((pos, code))
+    if len({code for _, code in deduped}) < 2:
+        return []
+    sections = []
+    for i, (pos, code) in enumerate(deduped):
+        end_pos = deduped[i + 1][0] if i + 1 < len(deduped) else len(section_text)
+        chunk = section_text[pos:end_pos].strip()
+        if chunk:
+            sections.append((f"{parent_id}_{code}", chunk))
+    return sections
+
+
+def legacy_page_invoice_id(text: str) -> Optional[str]:
+    for rx in _PAGE_PATTERNS:
+        m = rx.search(text or "")
+        if m:
+            val = m.group(1).strip()
+            if not split_statement._BAD_PAGE_ID.match(val):
+                return val
+    return None
+
+
+def legacy_extract_invoice_id_from_page(page_text: str) -> Optional[str]:
+    t = page_text or ""
+    for pat in _CHUNK_PATTERNS:
+        m = pat.search(t)
+        if m:
+            cand = (m.group(1) or "").strip()
+            cand = cand.replace("–", "-").replace("—", "-")
+            cand = re.sub(r"[^\w\-]", "", cand)
+            if not cand:
+                continue
+            if _BAD_CHUNK_ID.match(cand):
+                continue
+            return cand
+    return None
+
+
+# ============================================================
+# Corpus
+# ============================================================
+
+_FRAGMENTS = [
+    "WORLD FUEL SERVICES\nINVOICE\n",
+    "Invoice No: {wf}\n",
+    "Invoice # {alnum}\n",
+    "Invoice Number {alnum}\n",
+    "Invoice {alnum}\n",
+    "Invoice Date 16-MAR-2026\n",
+    "Invoice\nTotal\n",
+    "CC Invoice #: {num7}\n",
+    "Ref Number {alnum}\n",
+    "Ref Number    {wf}\n",
+    "Credit Memo No.: {alnum}\n",
+    "Credit Memo Number {alnum}\n",
+    "CREDIT MEMO NUMBER: {alnum}\n",
+    "FUEL TICKET {num7}\n",
+    "FUEL TICKET DATE\n16-MAR-2026 {num6}\n",
+    "FUEL TICKET\n   {num6} KTEB\n",
+    "{wf}  {wf}\n",
+    "INV{num7}\n",
+    "inv{num7} inv{num7}\n",
+    "AVFUEL CORPORATION ACTIVITY INVOICE\nREF NO: {num8}\n",
+    "   {num8}  KAPF  JET-A  412.0  5.12345  2109.26\n",
+    "   0{num8}  KAPF  JET-A\n",
+    "BILLING SUMMARY\n",
+    "{apt} JET FUEL 412.0 5.12345 2,109.26\n",
+    "{apt}-AVFLIGHT 1 150.00\n",
+    "{apt} IP - INTO PLANE FEE 25.00\n",
+    "THRU PUT - {apt3}\n",
+    "FLOW FEE {apt3} 12.00\n",
+    "FSII - {apt3}\n",
+    "STORAGE TK FEE {apt3}\n",
+    "Page 1 of 3\n--- PAGE 2 ---\n",
+    "TOTAL USD 1,234.56\n",
+    "Invoice PAGE\nInvoice DATE\nRef Number TOTAL\n",
+    "Invoice – {alnum}\n",
+    "  \n\n",
+]
+
+_AIRPORTS = ["KTEB", "KAPF", "YIP", "APF", "OSU1", "MSN", "STS", "KVNY", "PBI"]
+
+
+def _fill(fragment: str, rng: random.Random) -> str:
+    def num(n: int) -> str:
+        return "".join(rng.choice("0123456789") for _ in range(n))
+
+    return fragment.format(
+        wf=f"{num(8)}-{num(rng.choice([4, 5]))}",
+        alnum=rng.choice(["", "A", "WF-"]) + num(rng.choice([2, 4, 6, 9])) + rng.choice(["", "-01", "B"]),
+        num6=num(6), num7=num(7), num8=num(8),
+        apt=rng.choice(_AIRPORTS), apt3=rng.choice(["YIP", "APF", "PBI", "TEB"]),
+    )
+
+
+def random_text(rng: random.Random, n_fragments: int) -> str:
+    return "".join(_fill(rng.choice(_FRAGMENTS), rng) for _ in range(n_fragments))
+
+
+def make_statement_text(n_invoices: int, seed: int = 0) -> str:
+    """World Fuel style consolidated statement: one block per invoice, airports, noise."""
+    rng = random.Random(seed)
+    parts = ["WORLD FUEL SERVICES\nCUSTOMER STATEMENT\n"]
+    for i in range(n_invoices):
+        parts.append(f"\n--- PAGE {i + 1} ---\n")
+        parts.append(f"Invoice No: {27379628 + i}-{21100 + i}\nInvoice Date 16-MAR-2026\n")
+        parts.append(f"Ref Number {rng.randint(100000, 999999)}\n")
+        for _ in range(rng.randint(1, 3)):
+            parts.append(_fill("{apt} JET FUEL 412.0 5.12345 2,109.26\n", rng))
+            parts.append(_fill("FLOW FEE {apt3} 12.00\n", rng))
+        parts.append(random_text(rng, 6))
+        parts.append("TOTAL USD 2,121.26\n" * 3)
+    return "".join(parts)
+
+
+def corpus() -> List[str]:
+    rng = random.Random(20261016)
+    texts = ["", "Invoice", "Invoice ABC", "\n".join(_FRAGMENTS)]
+    texts += [random_text(rng, rng.randint(1, 40)) for _ in range(600)]
+    texts += [make_statement_text(n, seed=n) for n in (2, 5, 20)]
+    return texts
+
+
+# ============================================================
+# Tests
+# ============================================================
+
+def test_detect_invoice_ids() -> None:
+    for t in corpus():
+        assert process_pdf.detect_invoice_ids(t) == legacy_detect_invoice_ids(t), t
+
+
+def test_split_text_into_sections() -> None:
+    for t in corpus():
+        assert process_pdf.split_text_into_sections(t) == legacy_split_text_into_sections(t), t
+
+
+def test_subsplit_by_airport() -> None:
+    for t in corpus():
+        assert process_pdf._subsplit_by_airport(t, "P") == legacy_subsplit_by_airport(t, "P"), t
+
+
+def test_page_invoice_id() -> None:
+    for t in corpus():
+        assert split_statement.page_invoice_id(t) == legacy_page_invoice_id(t), t
+
+
+def test_extract_invoice_id_from_page() -> None:
+    for t in corpus():
+        assert extract_invoice.extract_invoice_id_from_page(t) == legacy_extract_invoice_id_from_page(t), t
+
+
+def test_tokens_match_finditer() -> None:
+    scanners = (
+        id_scanner.DOCUMENT, id_scanner.AVFUEL, id_scanner.AIRPORT_LEAD, id_scanner.AIRPORT_TRAIL,
+        id_scanner.PAGE, id_scanner.CHUNK_PAGE,
+    )
+    for t in corpus():
+        for sc in scanners:
+            toks = sc.scan(t)
+            for kind in sc.kinds:
+                pat, flags, _ = id_scanner.RULES[kind]
+                rx = re.compile(pat, flags)
+                want = [(m.start(), m.end(), m.group(1) if rx.groups else m.group(0)) for m in rx.finditer(t)]
+                got = [(k.start, k.end, k.value) for k in toks if k.kind == kind]
+                assert got == want, (sc.name, kind, t)
+
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_") and callable(fn):
+            fn()
+            print(f"{name}: ok")
@@ -2,6 +2,7 @@ import os
 import base64
 import hashlib
 import urllib.parse
+from datetime import datetime, timedelta, timezone
 from typing import Any, Dict, List, Optional
 
 import requests
@@ -13,6 +14,8 @@ from slowapi.util import get_remote_address
 
 from supa import sb, log_pipeline_run
 from auth_middleware import add_auth_middleware
+from mailbox_sync import MailboxSync
+from token_cache import all_stats as token_cache_stats, graph_token_cache
 
 app = FastAPI()
 add_auth_middleware(app)
@@ -30,6 +33,10 @@ JOB_PREFIX = os.getenv("JOB_PREFIX", "job-apps")
 APPS_TABLE = os.getenv("APPS_TABLE", "job_applications")
 FILES_TABLE = os.getenv("FILES_TABLE", "job_application_files")
 
+# How far back the first inbox sync (or a resync after the Graph delta link
+# expires) looks; later runs only see new/changed messages.
+INITIAL_SYNC_DAYS = int(os.getenv("INITIAL_SYNC_DAYS", "14"))
+
 INBOX_KEYWORDS = [
     s.strip().lower()
     for s in os.getenv(
@@ -73,23 +80,11 @@ def _get_supa():
 
 
 def _get_graph_token() -> str:
+    # Cached per instance and refreshed ahead of expiry (token_cache.py).
     tenant = _require_env("MS_TENANT_ID")
     client_id = _require_env("MS_CLIENT_ID")
     client_secret = _require_env("MS_CLIENT_SECRET")
-
-    r = requests.post(
-        f"https://login.microsoftonline.com/{tenant}/oauth2/v2.0/token",
-        headers={"Content-Type": "application/x-www-form-urlencoded"},
-        data={
-            "client_id": client_id,
-            "client_secret": client_secret,
-            "grant_type": "client_credentials",
-            "scope": "https://graph.microsoft.com/.default",
-        },
-        timeout=30,
-    )
-    r.raise_for_status()
-    return r.json()["access_token"]
+    return graph_token_cache(tenant, client_id, client_secret).get()
 
 
 def _graph_get(url: str, token: str, params: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
@@ -110,16 +105,12 @@ def _graph_get(url: str, token: str, params: Optional[Dict[str, str]] = None) ->
     return r.json()
 
 
-def _graph_list_inbox_messages(mailbox: str, token: str, top: int) -> List[Dict[str, Any]]:
-    mbox = _u(mailbox)
-    url = f"https://graph.microsoft.com/v1.0/users/{mbox}/mailFolders/Inbox/messages"
-    params = {
-        "$top": str(top),
-        "$select": "id,subject,receivedDateTime,hasAttachments",
-        "$orderby": "receivedDateTime desc",
-    }
-    data = _graph_get(url, token, params=params)
-    return data.get("value", [])
+def _inbox_sync(mailbox: str, role_bucket: str) -> MailboxSync:
+    """Delta sync of the inbox; state kept per role bucket (see mailbox_sync.py)."""
+    return MailboxSync(
+        mailbox, "Inbox", consumer=f"job-ingest:{role_bucket}",
+        select="id,subject,receivedDateTime,hasAttachments",
+    )
 
 
 def _graph_list_attachments(mailbox: str, token: str, message_id: str) -> List[Dict[str, Any]]:
@@ -329,7 +320,7 @@ def _file_exists(supa, gcs_key: str) -> bool:
 
 @app.get("/_health")
 def health():
-    return {"ok": True}
+    return {"ok": True, "token_cache": token_cache_stats()}
 
 
 @app.post("/jobs/pull_applicants")
@@ -343,8 +334,13 @@ def pull_applicants(
     token = _get_graph_token()
     supa = _get_supa()
 
-    msgs = _graph_list_inbox_messages(mailbox, token, max_messages)
-    msgs = [m for m in msgs if _looks_like_app(m)]
+    # New or changed inbox messages since the last run.
+    batch = _inbox_sync(mailbox, role_bucket).fetch(
+        token,
+        initial_since=datetime.now(timezone.utc) - timedelta(days=INITIAL_SYNC_DAYS),
+        max_messages=max_messages,
+    )
+    msgs = [m for m in batch.messages if _looks_like_app(m)]
 
     storage_client = storage.Client()
     bucket = storage_client.bucket(bucket_name)
@@ -485,11 +481,22 @@ def pull_applicants(
         processed += 1
         results.append({"message_id": mid, "application_id": app_id, "uploaded": uploaded_files})
 
+    # Advance the delta position only when nothing failed, so failed
+    # messages come back on the next run (inserts are idempotent).
+    failed = [
+        r for r in results
+        if "failed" in str(r.get("status", ""))
+        or any("failed" in str(f.get("status", "")) for f in r.get("uploaded") or [])
+    ]
+    if not failed:
+        batch.commit()
+
     log_pipeline_run("job-ingest", items=processed, message=f"matched={len(msgs)} processed={processed}")
     return {
         "ok": True,
         "mode": "inbox_readonly",
         "matched": len(msgs),
         "processed": processed,
+        "sync": batch.summary(),
         "results": results,
     }
\ No newline at end of file
@@ -18,6 +18,8 @@ from slowapi.util import get_remote_address
 
 from supa import sb, log_pipeline_run
 from auth_middleware import add_auth_middleware
+from mailbox_sync import MailboxSync
+from token_cache import all_stats as token_cache_stats, graph_token_cache, token_cache
 
 app = FastAPI()
 add_auth_middleware(app)
@@ -583,41 +585,29 @@ def _pick_dates(*sources: dict) -> Optional[Dict[str, Optional[str]]]:
     return result
 
 
-# ─── NMS bearer token cache (module-level, refreshed when expired) ────────────
+# ─── NMS bearer token cache (token_cache.py, refreshed ahead of expiry) ───────
+
+def _fetch_nms_token() -> Tuple[str, int]:
+    """client_credentials POST to NMS; (token, expires_in)."""
+    if not FAA_CLIENT_ID or not FAA_CLIENT_SECRET:
+        raise RuntimeError("FAA_CLIENT_ID / FAA_CLIENT_SECRET not configured")
+    r = requests.post(
+        NMS_AUTH_URL,
+        data={"grant_type": "client_credentials"},
+        auth=(FAA_CLIENT_ID, FAA_CLIENT_SECRET),
+        timeout=(5, 10),  # (connect, read) — prevents indefinite hang
+    )
+    r.raise_for_status()
+    data = r.json()
+    return data["access_token"], int(data.get("expires_in", 1799))
 
-import time as _time
 
-_nms_token_cache: Dict[str, Any] = {"token": None, "expires_at": 0.0}
-_nms_token_lock = threading.Lock()
+_nms_tokens = token_cache("faa-nms", _fetch_nms_token)
 
 
 def _get_nms_token() -> str:
-    """Fetch (or return cached) NMS bearer token using client_credentials flow.
-    Thread-safe: only one thread fetches a new token at a time."""
-    now = _time.time()
-    if _nms_token_cache["token"] and now < _nms_token_cache["expires_at"] - 60:
-        return _nms_token_cache["token"]
-    with _nms_token_lock:
-        # Re-check inside lock — another thread may have refreshed already
-        now = _time.time()
-        if _nms_token_cache["token"] and now < _nms_token_cache["expires_at"] - 60:
-            return _nms_token_cache["token"]
-        if not FAA_CLIENT_ID or not FAA_CLIENT_SECRET:
-            raise RuntimeError("FAA_CLIENT_ID / FAA_CLIENT_SECRET not configured")
-        r = requests.post(
-            NMS_AUTH_URL,
-            data={"grant_type": "client_credentials"},
-            auth=(FAA_CLIENT_ID, FAA_CLIENT_SECRET),
-            timeout=(5, 10),  # (connect, read) — prevents indefinite hang
-        )
-        r.raise_for_status()
-        data = r.json()
-        token = data["access_token"]
-        expires_in = int(data.get("expires_in", 1799))
-        _nms_token_cache["token"] = token
-        _nms_token_cache["expires_at"] = now + expires_in
-        print(f"NMS token refreshed, expires in {expires_in}s", flush=True)
-        return token
+    """Cached NMS bearer token.  Thread-safe: only one thread fetches a new token at a time."""
+    return _nms_tokens.get()
 
 
 # ─── Helpers ──────────────────────────────────────────────────────────────────
@@ -628,15 +618,8 @@ def _utc_now() -> str:
 
 
 def _get_graph_token() -> str:
-    url = f"https://login.microsoftonline.com/{MS_TENANT_ID}/oauth2/v2.0/token"
-    r = requests.post(url, data={
-        "client_id": MS_CLIENT_ID,
-        "client_secret": MS_CLIENT_SECRET,
-        "grant_type": "client_credentials",
-        "scope": "https://graph.microsoft.com/.default",
-    }, timeout=20)
-    r.raise_for_status()
-    return r.json()["access_token"]
+    # Cached per instance and refreshed ahead of expiry (token_cache.py).
+    return graph_token_cache(MS_TENANT_ID, MS_CLIENT_ID, MS_CLIENT_SECRET).get()
 
 
 def _graph_get(url: str, token: str, params: Dict = None) -> Dict:
@@ -789,7 +772,7 @@ def _parse_flight_fields(component) -> Tuple[Optional[str], Optional[str], Optio
 
 @app.get("/healthz")
 def healthz():
-    return {"ok": True, "service": "ops-monitor", "ts": _utc_now()}
+    return {"ok": True, "service": "ops-monitor", "ts": _utc_now(), "token_cache": token_cache_stats()}
 
 
 # ─── GET /api/vans  (Samsara live vehicle locations) ──────────────────────────
@@ -1806,24 +1789,21 @@ def pull_edct(
 ):
     """
     Pull EDCT / ground delay emails from the ForeFlight mailbox and store alerts.
+
+    Incremental via a Graph delta query (mailbox_sync.py): only new or
+    changed messages are fetched; lookback_minutes bounds the first sync or
+    a resync after the delta link expires.
     """
     token = _get_graph_token()
     supa = sb()
 
     since = datetime.now(timezone.utc) - timedelta(minutes=lookback_minutes)
-    since_iso = since.strftime("%Y-%m-%dT%H:%M:%SZ")
-
-    url = f"https://graph.microsoft.com/v1.0/users/{FOREFLIGHT_MAILBOX}/mailFolders/Inbox/messages"
-    payload = _graph_get(url, token, params={
-        "$top": str(max_messages),
-        "$orderby": "receivedDateTime desc",
-        "$filter": f"receivedDateTime ge {since_iso}",
-        "$select": "id,subject,receivedDateTime,body",
-    })
+    sync = MailboxSync(FOREFLIGHT_MAILBOX, "Inbox", consumer="ops-monitor:edct", select="id,subject,receivedDateTime,body")
+    batch = sync.fetch(token, initial_since=since, max_messages=max_messages)
 
     ingested = skipped = errors = 0
 
-    for msg in payload.get("value", []):
+    for msg in batch.messages:
         subject = msg.get("subject", "") or ""
         msg_id = msg["id"]
 
@@ -1857,8 +1837,12 @@ def pull_edct(
             errors += 1
             print(f"pull_edct error msg_id={msg_id}: {repr(e)}", flush=True)
 
+    # Keep the old position on errors so those messages are retried (upserts are idempotent).
+    if not errors:
+        batch.commit()
+
     log_pipeline_run("edct-pull", items=ingested, message=f"ingested={ingested} skipped={skipped}")
-    return {"ok": True, "ingested": ingested, "skipped": skipped, "errors": errors}
+    return {"ok": True, "ingested": ingested, "skipped": skipped, "errors": errors, "sync": batch.summary()}
 
 
 _TZ_OFFSETS = {
@@ -2641,9 +2625,9 @@ def debug_notam_token():
         return {"ok": False, "error": "FAA_CLIENT_ID or FAA_CLIENT_SECRET not set"}
     try:
         # Force a fresh fetch (bypass cache) so we always hit the network
-        _nms_token_cache["token"] = None
+        _nms_tokens.invalidate()
         token = _get_nms_token()
-        expires_in = int(_nms_token_cache["expires_at"] - _time.time())
+        expires_in = _nms_tokens.expires_in()
         return {"ok": True, "token_prefix": token[:8] + "...", "expires_in_s": expires_in}
     except Exception as e:
         return {"ok": False, "error": repr(e)}
@@ -2659,7 +2643,7 @@ def debug_notam_test(airport: str = Query("KJFK")):
     # --- NMS API test (direct, no fallback) ---
     nms_result: Dict[str, Any] = {"ok": False}
     try:
-        _nms_token_cache["token"] = None  # force fresh token
+        _nms_tokens.invalidate()  # force fresh token
         token = _get_nms_token()
         nms_result["token_ok"] = True
         nms_result["auth_url"] = NMS_AUTH_URL
@@ -6,6 +6,14 @@ REGION="${REGION:-us-central1}"
 SERVICE_NAME="${SERVICE_NAME:-invoice-alerts}"
 SOURCE_DIR="${SOURCE_DIR:-./invoice-alerts}"
 
+# QUEUE_CONSUMER=1 runs the job_queue consumer in the service, which needs
+# CPU outside requests.
+QUEUE_CONSUMER="${QUEUE_CONSUMER:-0}"
+QUEUE_FLAGS=()
+if [ "${QUEUE_CONSUMER}" = "1" ]; then
+  QUEUE_FLAGS=(--no-cpu-throttling)
+fi
+
 echo "Deploying ${SERVICE_NAME} from ${SOURCE_DIR} to ${REGION} (project: ${PROJECT_ID})..."
 
 gcloud run deploy "${SERVICE_NAME}" \
@@ -19,6 +27,8 @@ gcloud run deploy "${SERVICE_NAME}" \
   --timeout 300 \
   --min-instances 1 \
   --max-instances 20 \
+  --set-env-vars "QUEUE_CONSUMER=${QUEUE_CONSUMER}" \
+  ${QUEUE_FLAGS[@]+"${QUEUE_FLAGS[@]}"} \
   --set-secrets "SUPABASE_URL=SUPABASE_URL:latest,SUPABASE_SERVICE_ROLE_KEY=SUPABASE_SERVICE_ROLE_KEY:latest,SLACK_WEBHOOK_URL=SLACK_WEBHOOK_URL:latest" \
   --update-annotations "run.googleapis.com/startup-cpu-boost=true"
 
@@ -7,6 +7,14 @@ REGION="${REGION:-us-central1}"
 SERVICE_NAME="${SERVICE_NAME:-invoice-parser}"
 SOURCE_DIR="${SOURCE_DIR:-./invoice-parser}"
 
+# QUEUE_CONSUMER=1 runs the job_queue consumer in the service, which needs
+# CPU outside requests.
+QUEUE_CONSUMER="${QUEUE_CONSUMER:-0}"
+QUEUE_FLAGS=()
+if [ "${QUEUE_CONSUMER}" = "1" ]; then
+  QUEUE_FLAGS=(--no-cpu-throttling --min-instances 1)
+fi
+
 echo "Deploying ${SERVICE_NAME} from ${SOURCE_DIR} to ${REGION} (project: ${PROJECT_ID})..."
 
 # ---- Deploy ----
@@ -18,6 +26,8 @@ gcloud run deploy "${SERVICE_NAME}" \
   --no-allow-unauthenticated \
   --cpu 1 \
   --memory 1Gi \
+  --set-env-vars "QUEUE_CONSUMER=${QUEUE_CONSUMER}" \
+  ${QUEUE_FLAGS[@]+"${QUEUE_FLAGS[@]}"} \
   --set-secrets "OPENAI_API_KEY=OPENAI_API_KEY:latest,SUPABASE_URL=SUPABASE_URL:latest,SUPABASE_SERVICE_ROLE_KEY=SUPABASE_SERVICE_ROLE_KEY:latest"
 
 echo "✅ Deployment complete."
\ No newline at end of file
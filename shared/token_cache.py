@@ -0,0 +1,179 @@
+"""
+Shared OAuth client-credentials token cache.
+
+Each scheduled job used to POST to the identity provider for a fresh token
+on every invocation (200-500 ms).  A TokenCache keeps the token with its
+expiry for the life of the instance.  It refreshes the token ahead of expiry
+on a background thread, so callers on a request path or a
+ThreadPoolExecutor get the cached token without waiting.  Only one fetch is
+ever in flight.
+
+  graph = graph_token_cache(tenant, client_id, client_secret)   # memoized per tenant/client
+  token = graph.get()
+
+  nms = token_cache("faa-nms", client_credentials_fetcher(url, {}, auth=(id, secret)))
+  nms.get(); nms.invalidate(); nms.stats()
+
+stats() (and all_stats() for every cache in the process) reports hits,
+misses (caller had to wait for a fetch), background refreshes and errors.
+
+Env:
+  TOKEN_REFRESH_MARGIN_S   refresh this long before expiry (default 300)
+  TOKEN_EXPIRY_SKEW_S      treat a token as expired this long early (default 30)
+"""
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import requests
+
+TOKEN_REFRESH_MARGIN_S = int(os.getenv("TOKEN_REFRESH_MARGIN_S", "300"))
+TOKEN_EXPIRY_SKEW_S = int(os.getenv("TOKEN_EXPIRY_SKEW_S", "30"))
+
+# fetch() -> (access_token, expires_in_seconds)
+Fetcher = Callable[[], Tuple[str, int]]
+
+_registry: Dict[str, "TokenCache"] = {}
+_registry_lock = threading.Lock()
+
+
+def client_credentials_fetcher(
+    token_url: str,
+    data: Dict[str, str],
+    *,
+    auth: Optional[Tuple[str, str]] = None,
+    timeout: Any = 20,
+) -> Fetcher:
+    """A Fetcher for a plain client_credentials POST returning access_token / expires_in."""
+    def fetch() -> Tuple[str, int]:
+        r = requests.post(token_url, data={"grant_type": "client_credentials", **data}, auth=auth, timeout=timeout)
+        r.raise_for_status()
+        body = r.json()
+        return body["access_token"], int(body.get("expires_in", 3599))
+    return fetch
+
+
+class TokenCache:
+    """One token source.  Thread-safe."""
+
+    def __init__(
+        self,
+        name: str,
+        fetch: Fetcher,
+        *,
+        refresh_margin_s: int = TOKEN_REFRESH_MARGIN_S,
+        expiry_skew_s: int = TOKEN_EXPIRY_SKEW_S,
+    ) -> None:
+        self.name = name
+        self._fetch = fetch
+        self.refresh_margin_s = refresh_margin_s
+        self.expiry_skew_s = expiry_skew_s
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()        # guards token + stats
+        self._fetch_lock = threading.Lock()  # single-flight fetch
+        self._refresher: Optional[threading.Thread] = None
+        self._stats = {"hits": 0, "misses": 0, "refreshes": 0, "background_refreshes": 0, "errors": 0}
+
+    def _usable(self, now: float) -> bool:
+        return self._token is not None and now < self._expires_at - self.expiry_skew_s
+
+    def _refresh(self, background: bool) -> str:
+        with self._fetch_lock:
+            # Another thread may have refreshed while this one waited.
+            with self._lock:
+                if self._usable(time.time()) and (
+                    not background or time.time() < self._expires_at - self.refresh_margin_s
+                ):
+                    return self._token  # type: ignore[return-value]
+            try:
+                token, expires_in = self._fetch()
+            except Exception:
+                with self._lock:
+                    self._stats["errors"] += 1
+                raise
+            with self._lock:
+                self._token = token
+                self._expires_at = time.time() + expires_in
+                self._stats["refreshes"] += 1
+                if background:
+                    self._stats["background_refreshes"] += 1
+        print(f"[token_cache] {self.name} refreshed, expires in {expires_in}s", flush=True)
+        self._start_refresher()
+        return token
+
+    def _start_refresher(self) -> None:
+        with self._lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._refresher = threading.Thread(target=self._refresh_loop, name=f"token-refresh-{self.name}", daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self) -> None:
+        """Sleep until the refresh window, refresh, repeat; back off on errors until the token lapses."""
+        while True:
+            with self._lock:
+                wait_s = self._expires_at - self.refresh_margin_s - time.time()
+            if wait_s > 0:
+                time.sleep(wait_s)
+            try:
+                self._refresh(background=True)
+            except Exception as e:
+                print(f"[token_cache] {self.name} background refresh failed: {e}", flush=True)
+                with self._lock:
+                    lapsed = not self._usable(time.time())
+                if lapsed:
+                    return  # next get() fetches synchronously and restarts the loop
+                time.sleep(min(30.0, max(1.0, self.refresh_margin_s / 10)))
+
+    def get(self) -> str:
+        with self._lock:
+            if self._usable(time.time()):
+                self._stats["hits"] += 1
+                return self._token  # type: ignore[return-value]
+            self._stats["misses"] += 1
+        return self._refresh(background=False)
+
+    def invalidate(self) -> None:
+        """Drop the cached token: the next get() fetches a new one."""
+        with self._lock:
+            self._token = None
+            self._expires_at = 0.0
+
+    def expires_in(self) -> int:
+        with self._lock:
+            return max(0, int(self._expires_at - time.time())) if self._token else 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "cached": self._token is not None, "expires_in_s": max(0, int(self._expires_at - time.time()))}
+
+
+def token_cache(name: str, fetch: Fetcher) -> TokenCache:
+    """The process-wide cache called `name`, created with `fetch` on first use."""
+    with _registry_lock:
+        cache = _registry.get(name)
+        if cache is None:
+            cache = _registry[name] = TokenCache(name, fetch)
+        return cache
+
+
+def graph_token_cache(tenant: str, client_id: str, client_secret: str) -> TokenCache:
+    """The process-wide Microsoft Graph app-only token cache for this tenant/client."""
+    return token_cache(f"graph:{tenant}:{client_id}", client_credentials_fetcher(
+        f"https://login.microsoftonline.com/{tenant}/oauth2/v2.0/token",
+        {
+            "client_id": client_id,
+            "client_secret": client_secret,
+            "scope": "https://graph.microsoft.com/.default",
+        },
+    ))
+
+
+def all_stats() -> Dict[str, Dict[str, Any]]:
+    """stats() for every cache in this process, for /health."""
+    with _registry_lock:
+        caches = list(_registry.values())
+    return {c.name: c.stats() for c in caches}